@@ -0,0 +1,173 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+import asyncio
+import math
+import time
+from metrics import REGISTRY, MetricsRegistry
+
+PRIORITY_LANE = "priority"
+STANDARD_LANE = "standard"
+LANES = (PRIORITY_LANE, STANDARD_LANE)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of queued."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded admission queue in front of the agent.
+
+    At most ``max_concurrency`` requests run at once. Further requests wait in
+    a per-lane FIFO queue; a free slot always goes to the priority lane first
+    (requests that can be answered from the answer cache). A request is rejected
+    right away when its lane's queue is full, and rejected when it waited longer
+    than ``max_wait_seconds``, so callers get a fast 429 instead of a timeout.
+
+    All methods must be called from the same event loop.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_queue_depth: int = 16,
+        max_wait_seconds: float = 5.0,
+        priority_queue_depth: Optional[int] = None,
+        registry: MetricsRegistry = REGISTRY
+    ):
+        """Initialize the controller.
+
+        Args:
+            max_concurrency: Number of requests processed at the same time
+            max_queue_depth: Maximum number of waiting requests in the standard lane
+            max_wait_seconds: Maximum time a request waits for a slot
+            priority_queue_depth: Maximum number of waiting priority requests (default max_queue_depth)
+            registry: Registry the queue metrics are exported to
+        """
+        self.max_concurrency = max_concurrency
+        self.max_wait_seconds = max_wait_seconds
+        self.max_queue_depth = {
+            PRIORITY_LANE: priority_queue_depth if priority_queue_depth is not None else max_queue_depth,
+            STANDARD_LANE: max_queue_depth
+        }
+        self._active = 0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        # Moving average of the time a request holds a slot, used for Retry-After
+        self._service_seconds = 1.0
+
+        self._queue_depth = registry.gauge("admission_queue_depth", "Requests waiting for an agent slot")
+        self._active_gauge = registry.gauge("admission_active_requests", "Requests currently holding an agent slot")
+        self._wait_time = registry.histogram("admission_wait_seconds", "Time requests waited for an agent slot")
+        self._service_time = registry.histogram("admission_service_seconds", "Time requests held an agent slot")
+        self._admitted = registry.counter("admission_admitted_total", "Requests admitted to the agent")
+        self._rejected = registry.counter("admission_rejected_total", "Requests shed with 429")
+        self._update_gauges()
+
+    def queue_depth(self, lane: Optional[str] = None) -> int:
+        """Return the number of waiting requests in a lane (or all lanes)."""
+        lanes = [lane] if lane else LANES
+        return sum(len(self._waiters[name]) for name in lanes)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def retry_after(self) -> int:
+        """Estimate in whole seconds when a slot is likely to be free again."""
+        backlog = self.queue_depth() + 1
+        return max(1, math.ceil(self._service_seconds * backlog / self.max_concurrency))
+
+    def _update_gauges(self) -> None:
+        for lane in LANES:
+            self._queue_depth.set(len(self._waiters[lane]), {'lane': lane})
+        self._active_gauge.set(self._active)
+
+    def _reject(self, lane: str, reason: str) -> AdmissionRejected:
+        self._rejected.inc(labels={'lane': lane, 'reason': reason})
+        return AdmissionRejected(reason, self.retry_after())
+
+    def _has_waiters_ahead(self, lane: str) -> bool:
+        if lane == PRIORITY_LANE:
+            return bool(self._waiters[PRIORITY_LANE])
+        return self.queue_depth() > 0
+
+    def _release(self) -> None:
+        self._active -= 1
+        # Hand the slot to the oldest waiter, priority lane first
+        for lane in LANES:
+            waiters = self._waiters[lane]
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    self._active += 1
+                    waiter.set_result(True)
+                    self._update_gauges()
+                    return
+        self._update_gauges()
+
+    async def _acquire(self, lane: str, max_wait: float) -> float:
+        start = time.monotonic()
+        if self._active < self.max_concurrency and not self._has_waiters_ahead(lane):
+            self._active += 1
+            self._update_gauges()
+            return 0.0
+        if len(self._waiters[lane]) >= self.max_queue_depth[lane]:
+            raise self._reject(lane, "queue_full")
+        if max_wait <= 0:
+            raise self._reject(lane, "wait_timeout")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(waiter)
+        self._update_gauges()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as the wait ended
+                if isinstance(e, asyncio.CancelledError):
+                    self._release()
+                    raise
+            else:
+                waiter.cancel()
+                if waiter in self._waiters[lane]:
+                    self._waiters[lane].remove(waiter)
+                self._update_gauges()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                raise self._reject(lane, "wait_timeout")
+        return time.monotonic() - start
+
+    @asynccontextmanager
+    async def admit(self, lane: str = STANDARD_LANE, max_wait: Optional[float] = None) -> AsyncIterator[float]:
+        """Wait for an agent slot and hold it for the duration of the block.
+
+        Args:
+            lane: PRIORITY_LANE or STANDARD_LANE
+            max_wait: Maximum wait in seconds, capped at max_wait_seconds
+
+        Yields:
+            Time in seconds the request waited for its slot
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait timed out
+        """
+        if lane not in self._waiters:
+            raise ValueError(f"Unknown admission lane: {lane}")
+        wait_limit = self.max_wait_seconds if max_wait is None else min(max_wait, self.max_wait_seconds)
+        waited = await self._acquire(lane, wait_limit)
+        self._wait_time.observe(waited, {'lane': lane})
+        self._admitted.inc(labels={'lane': lane})
+        start = time.monotonic()
+        try:
+            yield waited
+        finally:
+            service_seconds = time.monotonic() - start
+            self._service_time.observe(service_seconds, {'lane': lane})
+            if lane == STANDARD_LANE:
+                self._service_seconds = 0.2 * service_seconds + 0.8 * self._service_seconds
+            self._release()
@@ -1,18 +1,59 @@
-from vector_store_manager import VectorStoreManager
+from vector_store_manager import VECTOR_SIZE, VectorStoreManager, ingest_version_filters
 from llama_index.core import Settings
 from llama_index.core.tools import QueryEngineTool, ToolMetadata
 from llama_index.core.agent import ReActAgent
-from llama_index.llms.openai import OpenAI
-from llama_index.core.llms import ChatMessage, MessageRole
-from prompts import context, fblDocQuery_discription, system_prompt
+from llama_index.core.callbacks import CallbackManager
+from prompts import context, fblDocQuery_discription, system_prompt, warmup_questions
 from document_processor import DocumentProcessor
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.postprocessor import MetadataReplacementPostProcessor
 from llama_index.core.response_synthesizers import get_response_synthesizer
 from llama_index.core import VectorStoreIndex
+from llama_index.core.query_engine import RetrieverQueryEngine
+from retrievers import VectorStoreRetriever
+from multi_query import MultiQueryRetriever
+from extractive_answer import ExtractiveAnswerer
+from tool_cache import OBSERVATION_CACHE, RETRIEVAL_CACHE, CachedRetriever, MemoizedQueryEngineTool, TTLCache, normalize_tool_input
+from speculative_retrieval import SpeculativeRetrieval, SpeculativeRetriever
+from sentence_window import ParentDeduplicationPostprocessor, WINDOW_METADATA_KEY
+from answer_cache import AnswerCache, normalize_question, top_logged_questions
+from deadline import (
+    Deadline,
+    DeadlineAwareOpenAI,
+    DeadlineCallbackHandler,
+    DeadlineExceeded,
+    StepTimeEstimator,
+    deadline_scope,
+    run_agent_with_deadline,
+)
+from tracing import TraceCallbackHandler, get_current_trace
+from index_snapshot import import_snapshot
+from prompt_layout import StablePrefixReActChatFormatter
+from ingestion_worker import SUCCEEDED, IndexState, IngestionWorker, LiveIndex
+from mock_models import MockEmbedding, MockReActLLM
+import json
 import os
+import time
+from contextlib import nullcontext
 from dotenv import load_dotenv
 
+def get_warmup_questions():
+    """Return the configured warm-up questions plus the most frequent logged questions"""
+    questions = warmup_questions
+    warmup_file = os.getenv("WARMUP_QUESTIONS_FILE")
+    if warmup_file and os.path.exists(warmup_file):
+        with open(warmup_file, "r") as f:
+            questions = json.load(f)
+
+    top_n = int(os.getenv("WARMUP_TOP_N", "0"))
+    questions = questions + top_logged_questions(top_n, os.getenv("QUERY_LOG_PATH", "query_log.jsonl"))
+
+    # Drop questions that only differ in spelling
+    unique_questions = {}
+    for question in questions:
+        unique_questions.setdefault(normalize_question(question), question)
+    return list(unique_questions.values())
+
 def setup_agent():
     """Set up and return the ReAct agent with all necessary components"""
     load_dotenv()
@@ -28,6 +69,11 @@ def setup_agent():
     # Check if any required variables are missing
     missing_vars = [var for var, value in required_vars.items() if not value]
     
+    # Every LLM call, tool call, retrieval and embedding checks the deadline of the current
+    # request and is recorded in the request's trace
+    callback_manager = CallbackManager([DeadlineCallbackHandler(), TraceCallbackHandler()])
+    Settings.callback_manager = callback_manager
+
     # Initialize VectorStoreManager - handle both cloud and local options
     if "QDRANT_URL" in missing_vars or "QDRANT_API_KEY" in missing_vars:
         print("Using local Qdrant instance as cloud credentials are missing")
@@ -43,89 +89,332 @@ def setup_agent():
             llama_cloud_api_key=required_vars["LLAMA_CLOUD_API_KEY"]
         )
     
+    # Load tests and traffic replay run the full request path without any OpenAI call
+    mock_models = os.getenv("MOCK_MODELS", "false").lower() == "true"
+    if mock_models:
+        print("Using mock LLM and embedding model (MOCK_MODELS=true)")
+        vector_manager.embed_model = MockEmbedding(
+            dimensions=VECTOR_SIZE,
+            latency_seconds=float(os.getenv("MOCK_EMBEDDING_LATENCY_SECONDS", "0.05"))
+        )
+    vector_manager.embed_model.callback_manager = callback_manager
+
+    # Cold start from a snapshot instead of parsing and embedding every document again
+    snapshot_path = os.getenv("INDEX_SNAPSHOT_PATH")
+    if snapshot_path and os.path.exists(snapshot_path):
+        if vector_manager.client.count(vector_manager.collection_name, exact=True).count == 0:
+            print(f"Collection is empty, importing snapshot {snapshot_path}")
+            import_snapshot(vector_manager, snapshot_path)
+
     # Initialize DocumentProcessor
     doc_processor = DocumentProcessor(vector_manager)
-    
-    # Process any new documents
-    if not doc_processor.process_documents():
-        print("Warning: Some documents failed to process")
-    
-    # Use the storage context from vector_manager
-    storage_context = vector_manager.storage_context
 
     # Set up LLM and configure settings
-    llm = OpenAI(model="gpt-4o-mini", temperature=0.3)
+    if mock_models:
+        llm = MockReActLLM(
+            latency_seconds=float(os.getenv("MOCK_LLM_LATENCY_SECONDS", "1.0")),
+            callback_manager=callback_manager
+        )
+    else:
+        llm = DeadlineAwareOpenAI(model="gpt-4o-mini", temperature=0.3, callback_manager=callback_manager)
     Settings.llm = llm
     Settings.chunk_size = 2048  # Increased chunk size for better context
     Settings.chunk_overlap = 220  # Increased overlap to maintain context between chunks
     Settings.num_output = 2048  # Increase max output tokens
     
-    # Create index using vector_manager's create_index method
-    # First get all documents to create the index
-    documents = doc_processor.get_all_documents()
-    index = vector_manager.create_index(documents)
-    
-    # Configure query engine with better retrieval and response synthesis
-    query_engine = index.as_query_engine(similarity_top_k=8)
-
-    tools = [
-        QueryEngineTool(
-            query_engine=query_engine,
-            metadata=ToolMetadata(
-                name="fblDocQuery",
-                description=fblDocQuery_discription,
+    # Number of retrieved chunks (or sentence window units); tune with retrieval_eval.py
+    similarity_top_k = int(os.getenv("SIMILARITY_TOP_K", "16" if doc_processor.indexing_mode == "sentence_window" else "8"))
+
+    if doc_processor.indexing_mode == "sentence_window":
+        # Small-to-big retrieval: match sentence/bullet units, then expand each to its parent
+        # chunk once. Units carry their window in the payload, so no index rebuild is needed.
+        node_postprocessors = [
+            ParentDeduplicationPostprocessor(),
+            MetadataReplacementPostProcessor(target_metadata_key=WINDOW_METADATA_KEY)
+        ]
+    else:
+        node_postprocessors = []
+
+    # Variants of the search terms are searched concurrently within one tool call and fused,
+    # instead of one agent round trip per variant
+    multi_query = os.getenv("MULTI_QUERY_ENABLED", "true").lower() == "true"
+    max_query_variants = int(os.getenv("MULTI_QUERY_MAX_VARIANTS", "4"))
+
+    # Repeated tool inputs reuse the retrieved nodes and the synthesized observation of the same
+    # ingestion version; both caches are shared by the index states built after each ingestion
+    tool_cache_enabled = os.getenv("TOOL_CACHE_ENABLED", "true").lower() == "true"
+    retrieval_cache = TTLCache(
+        RETRIEVAL_CACHE,
+        max_entries=int(os.getenv("TOOL_CACHE_RETRIEVAL_MAX_ENTRIES", "256")),
+        ttl_seconds=float(os.getenv("TOOL_CACHE_RETRIEVAL_TTL_SECONDS", "3600"))
+    )
+    observation_cache = TTLCache(
+        OBSERVATION_CACHE,
+        max_entries=int(os.getenv("TOOL_CACHE_OBSERVATION_MAX_ENTRIES", "1024")),
+        ttl_seconds=float(os.getenv("TOOL_CACHE_OBSERVATION_TTL_SECONDS", "600"))
+    )
+
+    # The question is retrieved while the agent plans its first step; the first tool call
+    # takes that result when its input is close to the question
+    speculative_retrieval = None
+    if os.getenv("SPECULATIVE_RETRIEVAL_ENABLED", "true").lower() == "true":
+        speculative_retrieval = SpeculativeRetrieval(
+            min_similarity=float(os.getenv("SPECULATIVE_MIN_SIMILARITY", "0.7")),
+            max_workers=int(os.getenv("SPECULATIVE_RETRIEVAL_WORKERS", "8"))
+        )
+
+    def build_retriever(retriever, version):
+        if multi_query:
+            retriever = MultiQueryRetriever(
+                retriever,
+                vector_manager.embed_model,
+                similarity_top_k=similarity_top_k,
+                max_variants=max_query_variants,
+                callback_manager=callback_manager
+            )
+        if tool_cache_enabled:
+            retriever = CachedRetriever(retriever, retrieval_cache, version, callback_manager=callback_manager)
+        # Above the retrieval cache, so a speculation is only cached under the question itself
+        if speculative_retrieval is not None:
+            retriever = SpeculativeRetriever(retriever, speculative_retrieval, version, callback_manager=callback_manager)
+        return retriever
+
+    def build_index_state(version):
+        """Build the query engines and tools over the chunks of ingestion versions up to ``version``"""
+        if doc_processor.indexing_mode == "sentence_window":
+            query_engine = RetrieverQueryEngine(
+                retriever=build_retriever(VectorStoreRetriever(
+                    vector_manager,
+                    similarity_top_k=similarity_top_k,
+                    max_ingest_version=version,
+                    callback_manager=callback_manager
+                ), version),
+                response_synthesizer=get_response_synthesizer(llm=llm),
+                node_postprocessors=node_postprocessors
+            )
+        elif vector_manager.router is not None:
+            # Shards are searched through the router, the llama-index vector store only sees the main collection
+            query_engine = RetrieverQueryEngine.from_args(
+                build_retriever(VectorStoreRetriever(
+                    vector_manager,
+                    similarity_top_k=similarity_top_k,
+                    max_ingest_version=version,
+                    callback_manager=callback_manager
+                ), version),
+                llm=llm
+            )
+        else:
+            # Create index using vector_manager's create_index method
+            # First get all documents to create the index
+            documents = doc_processor.get_all_documents()
+            index = vector_manager.create_index(documents)
+
+            # Configure query engine with better retrieval and response synthesis
+            query_engine = RetrieverQueryEngine.from_args(
+                build_retriever(index.as_retriever(
+                    similarity_top_k=similarity_top_k,
+                    filters=ingest_version_filters(version)
+                ), version),
+                llm=llm
+            )
+
+        # Security class questions only search chunks tagged as security class definitions
+        security_query_engine = RetrieverQueryEngine.from_args(
+            VectorStoreRetriever(
+                vector_manager,
+                similarity_top_k=8,
+                content_types=["security_class_definition"],
+                max_ingest_version=version,
+                callback_manager=callback_manager
             ),
-        ),
-    ]
+            llm=llm,
+            node_postprocessors=node_postprocessors
+        )
+
+        metadata = ToolMetadata(
+            name="fblDocQuery",
+            description=fblDocQuery_discription,
+        )
+        if tool_cache_enabled:
+            tool = MemoizedQueryEngineTool(query_engine, metadata, observation_cache, version)
+        else:
+            tool = QueryEngineTool(query_engine=query_engine, metadata=metadata)
+        tools = [tool]
+        return IndexState(version, tools, security_query_engine)
+
+    # Serve what is already ingested; new documents are ingested in the background and
+    # the query engines are swapped to the new ingestion version once it is published
+    live_index = LiveIndex(build_index_state(vector_manager.published_ingest_version))
+
+    def swap_index():
+        live_index.swap(build_index_state(vector_manager.published_ingest_version))
+
+    # Registered before the answer cache, so the warm-up runs against the new state
+    doc_processor.ingest_listeners.append(swap_index)
+
+    ingestion_worker = IngestionWorker(
+        doc_processor,
+        vector_manager,
+        poll_interval=float(os.getenv("INGEST_WATCH_INTERVAL", "10"))
+    )
+    background_ingestion = os.getenv("INGESTION_WORKER_ENABLED", "true").lower() == "true"
+    if not background_ingestion:
+        # Process any new documents before serving
+        if ingestion_worker.run_now(trigger="startup").status != SUCCEEDED:
+            print("Warning: Some documents failed to process")
 
     # Create and return the agent with proper system prompt and error handling
     try:
-        # Format system prompt properly
-        system_message = ChatMessage(role=MessageRole.SYSTEM, content=system_prompt)
-        user_message = ChatMessage(role=MessageRole.USER, content=context)
-        
-        agent = ReActAgent.from_tools(
-            tools, 
-            llm=llm,
-            verbose=True,
-            system_message=system_message,
-            context=context,
-            max_iterations=10
-        )
-        
-        # Add a custom query method with error handling
-        original_query = agent.query
+        # System prompt, context and tool descriptions form one static system message that is
+        # byte-identical across requests, so the provider can serve it from its prompt cache
+        react_chat_formatter = StablePrefixReActChatFormatter.from_prompts(system_prompt, context)
+        prompt_prefix = react_chat_formatter.prefix_fingerprint(live_index.current.tools)
+
+        def build_agent(state=None):
+            state = state or live_index.current
+            return ReActAgent.from_tools(
+                state.tools, 
+                llm=llm,
+                verbose=True,
+                react_chat_formatter=react_chat_formatter,
+                max_iterations=10
+            )
+
+        agent = build_agent()
+        # Default and maximum time budget per request, below the 30s Cloudflare tunnel timeout
+        request_timeout = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "25"))
+        deadline_reserve = float(os.getenv("DEADLINE_RESERVE_SECONDS", "2"))
+        step_times = StepTimeEstimator()
+
+        def run_agent(query_str, state, deadline):
+            trace = get_current_trace()
+            if trace is not None:
+                trace.root.attributes['prompt_prefix'] = prompt_prefix
+                trace.root.attributes['ingest_version'] = state.version
+            # A fresh agent per request keeps the reasoning memory of concurrent requests apart
+            with speculate(query_str, state):
+                return run_agent_with_deadline(build_agent(state), query_str, deadline, step_times)
+
+        def speculate(query_str, state):
+            if speculative_retrieval is None:
+                return nullcontext()
+            # Nothing to gain when the first tool call is likely served from the tool caches
+            key = (state.version, normalize_tool_input(query_str))
+            if tool_cache_enabled and (observation_cache.contains(key) or retrieval_cache.contains(key)):
+                return nullcontext()
+            return speculative_retrieval.speculate(query_str, state.version)
+
+        def answer_query(query_fn, query_str, state, **kwargs):
+            # Check if this is a security class query
+            if "security class" in query_str.lower():
+                print(f"Security class query detected: {query_str}")
+                # Try to get a response using the query engine directly for security queries
+                try:
+                    # Search only security class chunks first, then the full collection
+                    response = state.security_query_engine.query(query_str)
+                    if not response.source_nodes:
+                        response = state.tools[0].query_engine.query(query_str)
+                    if response and response.source_nodes and str(response).strip():
+                        return str(response)
+                    else:
+                        # Return the standard security class response when no info is found
+                        return "I apologize, but I cannot find specific information about security classes in the available documentation. Could you please clarify what specific security-related information you're looking for?"
+                except DeadlineExceeded:
+                    raise
+                except Exception as sec_error:
+                    print(f"Error in direct security query: {sec_error}")
+                    # Return the standard security class response
+                    return "I apologize, but I cannot find specific information about security classes in the available documentation. Could you please clarify what specific security-related information you're looking for?"
+            
+            # For non-security queries, use the original agent query method
+            return query_fn(query_str, state, **kwargs)
+
+        # Precompute answers for frequent questions. The warm-up uses its own agents so it
+        # never shares memory with live requests, and it reruns whenever new content is ingested.
+        answer_cache = None
+        if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true":
+            answer_cache = AnswerCache(
+                answer_fn=lambda question: str(answer_query(
+                    lambda query_str, state: build_agent(state).query(query_str), question, live_index.current
+                )),
+                corpus_version_fn=doc_processor.get_corpus_version,
+                questions_fn=get_warmup_questions
+            )
+            doc_processor.ingest_listeners.append(answer_cache.on_corpus_changed)
         
-        def safe_query(query_str, **kwargs):
+        # List and quote questions whose top chunk clearly matches are answered with the passage itself
+        extractive_answerer = None
+        if os.getenv("EXTRACTIVE_ANSWERS_ENABLED", "true").lower() == "true":
+            extractive_answerer = ExtractiveAnswerer(
+                vector_manager,
+                min_confidence=float(os.getenv("EXTRACTIVE_MIN_CONFIDENCE", "0.8"))
+            )
+
+        def extractive_answer(query_str, state):
+            if extractive_answerer is None or "security class" in query_str.lower():
+                return None
             try:
-                # Check if this is a security class query
-                if "security class" in query_str.lower():
-                    print(f"Security class query detected: {query_str}")
-                    # Try to get a response using the query engine directly for security queries
-                    try:
-                        # Get the first tool which should be the query engine
-                        query_engine_tool = tools[0]
-                        query_engine = query_engine_tool.query_engine
-                        response = query_engine.query(query_str)
-                        if response and str(response).strip():
-                            return str(response)
-                        else:
-                            # Return the standard security class response when no info is found
-                            return "I apologize, but I cannot find specific information about security classes in the available documentation. Could you please clarify what specific security-related information you're looking for?"
-                    except Exception as sec_error:
-                        print(f"Error in direct security query: {sec_error}")
-                        # Return the standard security class response
-                        return "I apologize, but I cannot find specific information about security classes in the available documentation. Could you please clarify what specific security-related information you're looking for?"
-                
-                # For non-security queries, use the original agent query method
-                return original_query(query_str, **kwargs)
+                response = extractive_answerer.answer(query_str, max_ingest_version=state.version)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                print(f"Error in extractive answer: {e}")
+                return None
+            trace = get_current_trace()
+            if trace is not None:
+                trace.root.attributes['extractive'] = response is not None
+            return response
+
+        def safe_query(query_str, deadline=None):
+            if deadline is None:
+                deadline = Deadline(request_timeout, deadline_reserve)
+            try:
+                # Serve precomputed answers from memory without any LLM call
+                if answer_cache is not None:
+                    cached_answer = answer_cache.get(query_str)
+                    trace = get_current_trace()
+                    if trace is not None:
+                        trace.root.attributes['answer_cache_hit'] = cached_answer is not None
+                    if cached_answer is not None:
+                        return cached_answer
+                # The request keeps the index state it started with, even if a swap happens meanwhile
+                state = live_index.current
+                with deadline_scope(deadline):
+                    response = extractive_answer(query_str, state)
+                    if response is not None:
+                        return response
+                    start = time.perf_counter()
+                    response = answer_query(run_agent, query_str, state, deadline=deadline)
+                    if extractive_answerer is not None:
+                        extractive_answerer.record_agent_latency(time.perf_counter() - start)
+                    return response
+            except DeadlineExceeded as e:
+                print(f"Agent query stopped: {e}")
+                return "I apologize, but I could not answer your question in time. Please try a more specific question about the Flash Bootloader documentation."
             except Exception as e:
                 print(f"Error in agent query: {e}")
                 # Return a fallback response when the agent encounters an error
                 return "I apologize, but I encountered an error processing your query. Please try rephrasing your question or ask something else about the Flash Bootloader documentation."
+            finally:
+                deadline.close()
         
         # Replace the query method with our safe version
         agent.query = safe_query
+        agent.answer_cache = answer_cache
+        agent.doc_processor = doc_processor
+        agent.request_timeout = request_timeout
+        agent.deadline_reserve = deadline_reserve
+        agent.live_index = live_index
+        agent.tool_caches = {RETRIEVAL_CACHE: retrieval_cache, OBSERVATION_CACHE: observation_cache}
+        agent.ingestion_worker = ingestion_worker
+        agent.extractive_answerer = extractive_answerer
+        agent.speculative_retrieval = speculative_retrieval
+
+        if answer_cache is not None:
+            answer_cache.warm_async()
+        if background_ingestion:
+            ingestion_worker.start()
+            ingestion_worker.submit(trigger="startup")
         
         return agent
     except Exception as e:
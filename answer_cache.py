@@ -0,0 +1,203 @@
+from collections import Counter, deque
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import json
+import logging
+import os
+import re
+import threading
+import time
+from metrics import REGISTRY
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different spellings share a cache entry."""
+    return re.sub(r'\s+', ' ', question.strip().lower()).rstrip(' ?.!')
+
+
+def _query_logger(log_path: str, max_bytes: int, backup_count: int) -> logging.Logger:
+    """Return the logger writing the size-rotated query log at log_path."""
+    logger = logging.getLogger(f"query_log.{os.path.abspath(log_path)}")
+    if not logger.handlers:
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    return logger
+
+
+def log_query(
+    question: str,
+    log_path: str = "query_log.jsonl",
+    max_bytes: int = 5 * 1024 * 1024,
+    backup_count: int = 2
+) -> None:
+    """Append a question to the query log used to pick warm-up questions.
+
+    The log is rotated at max_bytes. Writes block, so call it off the event loop.
+    """
+    try:
+        _query_logger(log_path, max_bytes, backup_count).info(
+            json.dumps({'timestamp': time.time(), 'question': question})
+        )
+    except Exception as e:
+        print(f"Error writing query log: {e}")
+
+
+def top_logged_questions(n: int, log_path: str = "query_log.jsonl", window: int = 5000) -> List[str]:
+    """Return the n most frequent questions among the last ``window`` logged queries.
+
+    Args:
+        n: Number of questions to return
+        log_path: Path of the current JSONL query log; rotated files next to it are read as well
+        window: Number of most recent log entries to consider
+
+    Returns:
+        List of questions, most frequent first, in their most recent spelling
+    """
+    if n <= 0:
+        return []
+
+    # Rotated files end in .1 (newest) to .N (oldest); stream them oldest first, keeping the last lines
+    log_file = Path(log_path)
+    rotated = [path for path in log_file.parent.glob(log_file.name + ".*") if path.suffix[1:].isdigit()]
+    rotated.sort(key=lambda path: int(path.suffix[1:]), reverse=True)
+    lines = deque(maxlen=window)
+    for path in rotated + [log_file]:
+        if path.exists():
+            with open(path, "r") as f:
+                lines.extend(f)
+
+    counts = Counter()
+    spellings = {}
+    for line in lines:
+        try:
+            question = json.loads(line)['question']
+        except (ValueError, KeyError):
+            continue
+        key = normalize_question(question)
+        counts[key] += 1
+        spellings[key] = question
+    return [spellings[key] for key, _ in counts.most_common(n)]
+
+
+class AnswerCache:
+    """In-memory answers for frequent questions, precomputed in the background.
+
+    Every entry is tagged with the corpus version it was computed against. When
+    the corpus changes all entries are dropped and the warm-up runs again, so a
+    stale answer is never served.
+    """
+
+    def __init__(
+        self,
+        answer_fn: Callable[[str], str],
+        corpus_version_fn: Callable[[], str],
+        questions_fn: Callable[[], List[str]]
+    ):
+        """Initialize the cache.
+
+        Args:
+            answer_fn: Computes the answer for a question (the slow path, e.g. a dedicated agent)
+            corpus_version_fn: Returns an identifier that changes whenever the corpus changes
+            questions_fn: Returns the questions to warm up
+        """
+        self.answer_fn = answer_fn
+        self.corpus_version_fn = corpus_version_fn
+        self.questions_fn = questions_fn
+        self._entries: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._corpus_version = corpus_version_fn()
+        self._warmup_thread: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self._requests = REGISTRY.counter("answer_cache_requests_total", "Answer cache lookups by result")
+
+    def get(self, question: str) -> Optional[str]:
+        """Return the cached answer for a question, or None."""
+        with self._lock:
+            answer = self._entries.get(normalize_question(question))
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._requests.inc(labels={'result': "miss" if answer is None else "hit"})
+        return answer
+
+    def contains(self, question: str) -> bool:
+        """Return True if the question can be answered from the cache, without counting a hit."""
+        with self._lock:
+            return normalize_question(question) in self._entries
+
+    def put(self, question: str, answer: str, corpus_version: str) -> bool:
+        """Store an answer if it was computed against the current corpus version."""
+        with self._lock:
+            if corpus_version != self._corpus_version:
+                return False
+            self._entries[normalize_question(question)] = answer
+            return True
+
+    def invalidate(self) -> None:
+        """Drop all entries and adopt the current corpus version."""
+        with self._lock:
+            self._entries.clear()
+            self._corpus_version = self.corpus_version_fn()
+
+    def on_corpus_changed(self) -> None:
+        """Invalidate the cache and precompute the warm-up answers again."""
+        print("Corpus changed, invalidating answer cache")
+        self.invalidate()
+        self.warm_async()
+
+    def warm(self) -> int:
+        """Precompute answers for the warm-up questions.
+
+        Returns:
+            Number of answers stored
+        """
+        with self._lock:
+            corpus_version = self._corpus_version
+        stored = 0
+        for question in self.questions_fn():
+            with self._lock:
+                if corpus_version != self._corpus_version:
+                    # The corpus changed mid warm-up; a newer run takes over
+                    return stored
+                if normalize_question(question) in self._entries:
+                    continue
+            try:
+                start = time.perf_counter()
+                answer = self.answer_fn(question)
+                if answer and self.put(question, answer, corpus_version):
+                    stored += 1
+                    print(f"Warmed answer cache for '{question}' in {time.perf_counter() - start:.1f}s")
+            except Exception as e:
+                print(f"Error warming answer cache for '{question}': {e}")
+        return stored
+
+    def warm_async(self) -> threading.Thread:
+        """Run the warm-up in a background thread."""
+        thread = threading.Thread(target=self.warm, name="answer-cache-warmup", daemon=True)
+        thread.start()
+        self._warmup_thread = thread
+        return thread
+
+    def wait_for_warmup(self, timeout: Optional[float] = None) -> bool:
+        """Block until the running warm-up finishes; returns False on timeout."""
+        thread = self._warmup_thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def stats(self) -> Dict[str, object]:
+        """Return cache size and hit statistics."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'corpus_version': self._corpus_version,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -1,8 +1,24 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import FastAPI, HTTPException, Request, Header
+from fastapi import Response as HTTPResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+import asyncio
+import json
+import os
+import tempfile
+import time
 import uvicorn
 from agent_setup import setup_agent
+from answer_cache import log_query
+from deadline import Deadline
+from admission import AdmissionController, AdmissionRejected, PRIORITY_LANE, STANDARD_LANE
+from metrics import REGISTRY
+from index_snapshot import export_snapshot, snapshot_metadata
+from vector_store_manager import NON_CONTENT_METADATA_KEYS
+from tracing import RequestTrace, TraceStore, new_request_id, profile_current_thread, trace_scope, trace_span
+from traffic_capture import TrafficRecorder
 
 # Create API router
 from fastapi import APIRouter
@@ -24,36 +40,381 @@ def get_agent():
             raise HTTPException(status_code=500, detail=f"Failed to initialize agent: {str(e)}")
     return _agent
 
+# Bounded admission queue in front of the agent
+_admission = None
+
+def get_admission_controller():
+    global _admission
+    if _admission is None:
+        _admission = AdmissionController(
+            max_concurrency=int(os.getenv("ADMISSION_MAX_CONCURRENCY", "4")),
+            max_queue_depth=int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "16")),
+            max_wait_seconds=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "5")),
+            priority_queue_depth=int(os.getenv("ADMISSION_PRIORITY_QUEUE_DEPTH", "64"))
+        )
+    return _admission
+
+# Span trees of recent requests, looked up by the request ID returned in each response
+_trace_store = None
+
+def get_trace_store():
+    global _trace_store
+    if _trace_store is None:
+        _trace_store = TraceStore(
+            path=os.getenv("TRACE_PATH", "traces/traces.jsonl"),
+            max_bytes=int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024))),
+            backup_count=int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+        )
+    return _trace_store
+
+# Anonymised request log for replay, only when TRAFFIC_CAPTURE_PATH is set
+_traffic_recorder = None
+
+def get_traffic_recorder():
+    global _traffic_recorder
+    if _traffic_recorder is None and os.getenv("TRAFFIC_CAPTURE_PATH"):
+        _traffic_recorder = TrafficRecorder(
+            path=os.getenv("TRAFFIC_CAPTURE_PATH"),
+            salt=os.getenv("TRAFFIC_CAPTURE_SALT"),
+            max_bytes=int(os.getenv("TRAFFIC_CAPTURE_MAX_BYTES", str(50 * 1024 * 1024))),
+            backup_count=int(os.getenv("TRAFFIC_CAPTURE_BACKUP_COUNT", "10"))
+        )
+    return _traffic_recorder
+
+def write_trace_in_background(trace: RequestTrace):
+    """Append a finished trace to the trace file on a worker thread, without waiting for it"""
+    asyncio.get_running_loop().run_in_executor(None, get_trace_store().write, trace)
+
+def capture_request(endpoint: str, question: str, arrival: float, received: float, status: int, **kwargs):
+    """Add a request to the traffic capture, if enabled"""
+    try:
+        recorder = get_traffic_recorder()
+        if recorder is not None:
+            recorder.record(endpoint, question, arrival, time.perf_counter() - received, status, **kwargs)
+    except Exception as e:
+        print(f"Error capturing request: {e}")
+
+def answer_outcome(trace: RequestTrace, metadata: Dict[str, Any]) -> str:
+    """How an answer was produced: answer cache, extractive passage, partial or full agent run"""
+    if trace.root.attributes.get("answer_cache_hit"):
+        return "cache"
+    if metadata.get("extractive"):
+        return "extractive"
+    if metadata.get("partial"):
+        return "partial"
+    return "agent"
+
+def require_admin(x_admin_key: Optional[str]):
+    """Allow admin endpoints only with the key configured in ADMIN_API_KEY"""
+    admin_key = os.getenv("ADMIN_API_KEY")
+    if not admin_key:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set ADMIN_API_KEY to enable them")
+    if x_admin_key != admin_key:
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
 class Query(BaseModel):
     question: str
     conversation_id: Optional[str] = None
+    # Time budget in seconds; capped at the server's REQUEST_TIMEOUT_SECONDS
+    timeout_seconds: Optional[float] = Field(default=None, gt=0)
 
 class Response(BaseModel):
     answer: str
     conversation_id: Optional[str]
     error: Optional[str] = None
+    # True when the time budget ran out and the answer is based on incomplete research
+    partial: bool = False
+    # Use with GET /api/v1/traces/{request_id} to see what happened during the request
+    request_id: Optional[str] = None
+    # Sampling profiler report, only when requested with the X-Profile header
+    profile: Optional[Dict[str, Any]] = None
+    # LLM calls and prompt, cached and completion tokens spent on the request
+    usage: Optional[Dict[str, int]] = None
+    # True when the answer is a documentation passage returned without any LLM call
+    extractive: bool = False
+    # Locations of the passage of an extractive answer
+    citations: Optional[List[Dict[str, Any]]] = None
+
+class SearchRequest(BaseModel):
+    query: str = Field(min_length=1)
+    page: int = Field(default=1, ge=1)
+    page_size: int = Field(default=10, ge=1, le=50)
+    content_types: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
+    file_names: Optional[List[str]] = None
+
+class SearchResult(BaseModel):
+    id: str
+    text: str
+    score: float
+    file_name: Optional[str] = None
+    page_label: Optional[str] = None
+    section: Optional[str] = None
+    # Every location of a chunk collapsed by near-duplicate detection
+    sources: List[Dict[str, Any]] = []
+    # Parent chunk of a sentence window unit
+    window: Optional[str] = None
+    metadata: Dict[str, Any] = {}
+
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+    page: int
+    page_size: int
+    has_more: bool
+    # Ingestion version the search was run against
+    ingest_version: int
+    # Time spent embedding the query and searching (including result conversion), in milliseconds
+    timings: Dict[str, float]
+
+async def run_until_disconnected(request: Request, deadline: Deadline, func):
+    """Run a blocking call in a worker thread and cancel its deadline if the client disconnects"""
+    task = asyncio.create_task(asyncio.to_thread(func))
+    while not task.done():
+        await asyncio.wait({task}, timeout=0.25)
+        if not task.done() and await request.is_disconnected():
+            print("Client disconnected, cancelling request")
+            deadline.cancel()
+    return task.result()
 
 @app.post("/query", response_model=Response)
-async def query_documents(query: Query):
+async def query_documents(
+    query: Query,
+    request: Request,
+    http_response: HTTPResponse,
+    x_profile: Optional[str] = Header(default=None),
+    x_admin_key: Optional[str] = Header(default=None)
+):
+    arrival, received = time.time(), time.perf_counter()
+    status, outcome, lane = 200, None, None
+    request_id = new_request_id()
+    http_response.headers["X-Request-ID"] = request_id
+    trace = RequestTrace(request_id, question=query.question)
+    profile = (x_profile or "").lower() in ("1", "true", "yes")
     try:
+        # The profiler slows the request down and reveals code paths, so it is an admin feature
+        if profile:
+            require_admin(x_admin_key)
         # Get agent instance
         agent = get_agent()
-        # Get response from agent
-        response = agent.query(query.question)
+        # Record the question so frequent ones can be precomputed, if warm-up reads the log;
+        # not while traffic is captured, whose records must not hold plaintext questions
+        if int(os.getenv("WARMUP_TOP_N", "0")) > 0 and get_traffic_recorder() is None:
+            await asyncio.to_thread(
+                log_query,
+                query.question,
+                os.getenv("QUERY_LOG_PATH", "query_log.jsonl"),
+                int(os.getenv("QUERY_LOG_MAX_BYTES", str(5 * 1024 * 1024))),
+                int(os.getenv("QUERY_LOG_BACKUP_COUNT", "2"))
+            )
+        timeout = agent.request_timeout
+        if query.timeout_seconds is not None:
+            timeout = min(query.timeout_seconds, agent.request_timeout)
+        deadline = Deadline(timeout, min(agent.deadline_reserve, timeout / 4))
+        # Questions the answer cache can serve skip ahead of questions that need the agent
+        answer_cache = getattr(agent, "answer_cache", None)
+        lane = PRIORITY_LANE if answer_cache is not None and answer_cache.contains(query.question) else STANDARD_LANE
+        trace.root.attributes.update({'lane': lane, 'timeout_seconds': timeout})
+
+        def run_query():
+            with profile_current_thread(trace if profile else None):
+                with trace_span("agent"):
+                    return agent.query(query.question, deadline=deadline)
+
+        with trace_scope(trace):
+            # Time spent waiting for a slot counts against the request deadline
+            async with get_admission_controller().admit(lane, max_wait=deadline.remaining() - deadline.reserve_seconds) as waited:
+                trace.root.attributes['queue_wait_ms'] = round(waited * 1000, 2)
+                # Get response from agent
+                response = await run_until_disconnected(request, deadline, run_query)
         
         # Format the response
         formatted_response = format_response(response)
+        metadata = getattr(response, "metadata", None) or {}
+        trace.finish(status="ok", partial=bool(metadata.get("partial", False)))
+        outcome = answer_outcome(trace, metadata)
         
         return Response(
             answer=formatted_response,
             conversation_id=query.conversation_id,
-            error=None
+            error=None,
+            partial=bool(metadata.get("partial", False)),
+            request_id=request_id,
+            profile=trace.profile,
+            usage=trace.usage,
+            extractive=bool(metadata.get("extractive", False)),
+            citations=metadata.get("citations")
+        )
+    except AdmissionRejected as e:
+        status = 429
+        trace.finish(status="rejected", reason=e.reason)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server is busy ({e.reason}), please retry later",
+            headers={"Retry-After": str(e.retry_after), "X-Request-ID": request_id}
         )
+    except HTTPException as e:
+        status = e.status_code
+        trace.finish(status="error", error=str(e.detail))
+        raise
     except Exception as e:
+        status = 500
+        trace.finish(status="error", error=str(e))
         raise HTTPException(
             status_code=500,
-            detail=f"Error processing query: {str(e)}"
+            detail=f"Error processing query: {str(e)}",
+            headers={"X-Request-ID": request_id}
+        )
+    finally:
+        write_trace_in_background(trace)
+        capture_request(
+            "query", query.question, arrival, received, status,
+            conversation_id=query.conversation_id, outcome=outcome, lane=lane
+        )
+
+def to_search_result(node) -> SearchResult:
+    metadata = node.node.metadata or {}
+    page_label = metadata.get("page_label")
+    return SearchResult(
+        id=node.node.node_id,
+        text=node.node.get_content(),
+        score=node.score,
+        file_name=metadata.get("file_name"),
+        page_label=str(page_label) if page_label is not None else None,
+        section=metadata.get("section"),
+        sources=metadata.get("sources") or [],
+        window=metadata.get("window"),
+        metadata={key: value for key, value in metadata.items() if key not in NON_CONTENT_METADATA_KEYS}
+    )
+
+@app.post("/search", response_model=SearchResponse)
+async def search_passages(search: SearchRequest, http_response: HTTPResponse):
+    """Return ranked passages with their sources, without running the agent or any LLM call"""
+    arrival, received = time.time(), time.perf_counter()
+    agent = get_agent()
+    vector_manager = agent.doc_processor.vector_store_manager
+    ingest_version = agent.live_index.current.version
+
+    def run_search():
+        start = time.perf_counter()
+        query_embedding = vector_manager.embed_model.get_query_embedding(search.query)
+        embedded = time.perf_counter()
+        # One extra result tells whether there is a next page
+        nodes = vector_manager.search_nodes(
+            query_embedding,
+            top_k=search.page_size + 1,
+            content_types=search.content_types,
+            tags=search.tags,
+            file_names=search.file_names,
+            query_str=search.query,
+            max_ingest_version=ingest_version,
+            offset=(search.page - 1) * search.page_size
         )
+        results = [to_search_result(node) for node in nodes[:search.page_size]]
+        return results, len(nodes) > search.page_size, embedded - start, time.perf_counter() - embedded
+
+    try:
+        results, has_more, embed_seconds, search_seconds = await asyncio.to_thread(run_search)
+    except Exception as e:
+        capture_request("search", search.query, arrival, received, 500, page=search.page, page_size=search.page_size)
+        raise HTTPException(status_code=500, detail=f"Error searching documents: {str(e)}")
+    capture_request("search", search.query, arrival, received, 200, page=search.page, page_size=search.page_size)
+    timings = {
+        'embedding_ms': round(embed_seconds * 1000, 3),
+        'search_ms': round(search_seconds * 1000, 3),
+    }
+    http_response.headers["Server-Timing"] = f"embed;dur={timings['embedding_ms']}, search;dur={timings['search_ms']}"
+    return SearchResponse(
+        results=results,
+        page=search.page,
+        page_size=search.page_size,
+        has_more=has_more,
+        ingest_version=ingest_version,
+        timings=timings
+    )
+
+@app.get("/traces/{request_id}")
+async def get_trace(request_id: str, x_admin_key: Optional[str] = Header(None)):
+    """Return the span tree recorded for a request"""
+    # Traces hold the question and the tool inputs in plaintext
+    require_admin(x_admin_key)
+    trace = await asyncio.to_thread(get_trace_store().get, request_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"No trace found for request {request_id}")
+    return trace
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Export queue depth, wait time and other metrics in the Prometheus text format"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/snapshot")
+async def download_snapshot(x_admin_key: Optional[str] = Header(None)):
+    """Export the index as a snapshot file that a new node can import with INDEX_SNAPSHOT_PATH"""
+    require_admin(x_admin_key)
+    vector_manager = get_agent().doc_processor.vector_store_manager
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "fbl_rag.fblsnap")
+    await asyncio.to_thread(
+        export_snapshot, vector_manager, path, metadata=snapshot_metadata(vector_manager)
+    )
+
+    def cleanup():
+        os.remove(path)
+        os.rmdir(tmp_dir)
+
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        filename="fbl_rag.fblsnap",
+        background=BackgroundTask(cleanup)
+    )
+
+def get_ingestion_worker(x_admin_key: Optional[str]):
+    """Check the admin key and return the agent's background ingestion worker"""
+    require_admin(x_admin_key)
+    return get_agent().ingestion_worker
+
+def get_ingestion_job(x_admin_key: Optional[str], job_id: str):
+    job = get_ingestion_worker(x_admin_key).get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No ingestion job {job_id}")
+    return job
+
+@app.post("/admin/ingest", status_code=202)
+async def trigger_ingestion(x_admin_key: Optional[str] = Header(None)):
+    """Queue ingestion of new documents in data/; follow it with the job's events endpoint"""
+    job = get_ingestion_worker(x_admin_key).submit(trigger="admin")
+    return job.to_dict()
+
+@app.get("/admin/ingest/jobs")
+async def list_ingestion_jobs(x_admin_key: Optional[str] = Header(None)):
+    """Return recent ingestion jobs, most recent first, and the ingestion version being served"""
+    worker = get_ingestion_worker(x_admin_key)
+    return {
+        'live_version': get_agent().live_index.current.version,
+        'jobs': [job.to_dict() for job in worker.jobs()]
+    }
+
+@app.get("/admin/ingest/jobs/{job_id}")
+async def get_ingestion_job_status(job_id: str, x_admin_key: Optional[str] = Header(None)):
+    """Return the status and progress events of an ingestion job"""
+    return get_ingestion_job(x_admin_key, job_id).to_dict(include_events=True)
+
+@app.get("/admin/ingest/jobs/{job_id}/events")
+async def stream_ingestion_events(job_id: str, x_admin_key: Optional[str] = Header(None)):
+    """Stream the progress events of an ingestion job as NDJSON until it has finished"""
+    job = get_ingestion_job(x_admin_key, job_id)
+
+    async def events():
+        cursor, finished = 0, False
+        while not finished:
+            new_events, finished = await asyncio.to_thread(job.wait_for_events, cursor)
+            cursor += len(new_events)
+            for event in new_events:
+                yield json.dumps(event) + "\n"
+        yield json.dumps(job.to_dict()) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 def format_response(response):
     """Format the response from the agent"""
@@ -74,6 +435,8 @@ def format_response(response):
             if len(parts) > 1:
                 number, content = parts
                 formatted_lines.append(f"{number} {content}")
+            else:
+                formatted_lines.append(line)
         else:
             formatted_lines.append(line)
     
@@ -0,0 +1,194 @@
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import os
+import re
+import ahocorasick
+
+DEFAULT_RULES_PATH = Path(__file__).parent / "classification_rules.json"
+# Words of a multi-word keyword may be separated by a space or a line break
+KEYWORD_WORD_SEPARATORS = [' ', '\n']
+SECTION_PATH_SEPARATOR = ' > '
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+def _spellings(keyword: str) -> List[str]:
+    """Return the keyword with each space spelled as a space or as a line break."""
+    spellings = ['']
+    for i, word in enumerate(keyword.split(' ')):
+        separators = [''] if i == 0 else KEYWORD_WORD_SEPARATORS
+        spellings = [spelling + separator + word for spelling in spellings for separator in separators]
+    return spellings
+
+
+class ChunkClassifier:
+    """Classify chunks with rules loaded from a JSON config.
+
+    All keywords are compiled into one Aho-Corasick automaton, so each chunk is
+    scanned once however many keywords the taxonomy has; a keyword only counts
+    as a whole word. Regex rules are combined into a second pattern that only
+    runs when the rules define any. Text is lowercased before matching, so regex
+    rules should be written in lowercase. Section headers are tracked per
+    document and carried forward to the following chunks.
+    """
+
+    def __init__(self, rules_path: Optional[str] = None):
+        """Initialize the classifier from a rules file.
+
+        Args:
+            rules_path: Path to the JSON rules file, defaults to CLASSIFICATION_RULES_PATH
+                or classification_rules.json next to this module
+        """
+        rules_path = rules_path or os.getenv("CLASSIFICATION_RULES_PATH") or DEFAULT_RULES_PATH
+        with open(rules_path, "r") as f:
+            self._compile(json.load(f))
+
+    @classmethod
+    def from_rules(cls, rules: Dict[str, Any]) -> "ChunkClassifier":
+        """Create a classifier from an already loaded rules dict."""
+        classifier = cls.__new__(cls)
+        classifier._compile(rules)
+        return classifier
+
+    def _compile(self, rules: Dict[str, Any]) -> None:
+        """Compile the rules into the keyword automaton and the combined patterns."""
+        self.default_content_type = rules.get('default_content_type', 'general')
+        self.section_scan_lines = rules.get('section_scan_lines', 2)
+
+        # Rule order is the content_type priority, parents become extra tags
+        self.labels = []
+        self._parents = {}
+        self._keyword_labels = {}
+        pattern_groups = []
+        for rule in rules.get('rules', []):
+            label = rule['label']
+            self.labels.append(label)
+            if rule.get('parent'):
+                self._parents[label] = rule['parent']
+            for keyword in rule.get('keywords', []):
+                normalized = ' '.join(keyword.lower().split())
+                self._keyword_labels.setdefault(normalized, []).append(label)
+            for i, pattern in enumerate(rule.get('patterns', [])):
+                pattern_groups.append((f"r{len(self.labels) - 1}_{i}", label, pattern))
+        self._priority = {label: i for i, label in enumerate(self.labels)}
+        self._group_labels = {name: label for name, label, _ in pattern_groups}
+
+        # Each spelling of a keyword maps to its length and labels
+        self._automaton = None
+        if self._keyword_labels:
+            self._automaton = ahocorasick.Automaton()
+            for keyword, labels in self._keyword_labels.items():
+                for spelling in _spellings(keyword):
+                    self._automaton.add_word(spelling, (len(spelling), labels))
+            self._automaton.make_automaton()
+        self._pattern_regex = re.compile(
+            '|'.join(f"(?P<{name}>{pattern})" for name, _, pattern in pattern_groups)
+        ) if pattern_groups else None
+
+        section_patterns = rules.get('section_patterns', [])
+        self._section_regex = re.compile(
+            r'[ \t]*(?:' + '|'.join(f"(?:{p})" for p in section_patterns) + r')[ \t]*'
+        ) if section_patterns else None
+
+    def _tags_for(self, labels: set) -> List[str]:
+        """Return the matched labels plus all their parent labels."""
+        tags = set()
+        for label in labels:
+            while label and label not in tags:
+                tags.add(label)
+                label = self._parents.get(label)
+        return sorted(tags)
+
+    def _match_labels(self, texts: List[str]) -> List[set]:
+        """Return the matched labels per chunk."""
+        matched = [set() for _ in texts]
+        for labels, text in zip(matched, texts):
+            text = text.lower()
+            if self._automaton is not None:
+                for end, (length, keyword_labels) in self._automaton.iter(text):
+                    start = end - length + 1
+                    if start > 0 and _is_word_char(text[start - 1]):
+                        continue
+                    if end + 1 < len(text) and _is_word_char(text[end + 1]):
+                        continue
+                    labels.update(keyword_labels)
+            if self._pattern_regex is not None:
+                labels.update(self._group_labels[match.lastgroup] for match in self._pattern_regex.finditer(text))
+        return matched
+
+    def _detect_section(self, text: str) -> Optional[Tuple[int, str]]:
+        """Return (level, title) of a section header in the first lines of text."""
+        if not self._section_regex:
+            return None
+        # Match line by line: searching the whole head would try every position of long lines
+        for line in text.lstrip('\n').split('\n', self.section_scan_lines)[:self.section_scan_lines]:
+            match = self._section_regex.fullmatch(line)
+            if match:
+                break
+        else:
+            return None
+        line = match.group().strip()
+        if line.startswith('#'):
+            level = len(line) - len(line.lstrip('#'))
+            return level, line.lstrip('#').strip()
+        numbering = re.match(r'\d+(?:\.\d+)*', line)
+        level = numbering.group().count('.') + 1 if numbering else 1
+        return level, line
+
+    def classify(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Classify a single chunk; see classify_batch."""
+        return self.classify_batch([text], [metadata or {}])[0]
+
+    def classify_batch(
+        self,
+        texts: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        section_stack: Optional[List[Tuple[int, str]]] = None
+    ) -> List[Dict[str, Any]]:
+        """Classify a batch of chunks in document order.
+
+        Args:
+            texts: Chunk texts, consecutive chunks of a document in order
+            metadatas: Optional metadata per chunk; 'file_name' identifies the document
+                and an existing 'heading_path' takes precedence over detected headers
+            section_stack: Optional sections still open at the end of the previous batch
+                of the same document; it is updated in place
+
+        Returns:
+            List of dicts with 'content_type', 'tags', 'section' and 'section_path'
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        matched = self._match_labels(texts)
+
+        results = []
+        section_stack = section_stack if section_stack is not None else []
+        current_document = None
+        for text, metadata, labels in zip(texts, metadatas, matched):
+            document = metadata.get('file_name') or metadata.get('file_path')
+            if current_document is not None and document != current_document:
+                section_stack.clear()
+            current_document = document
+
+            heading_path = metadata.get('heading_path')
+            if heading_path:
+                titles = heading_path.split(SECTION_PATH_SEPARATOR)
+                section_stack[:] = [(level, title) for level, title in enumerate(titles, start=1)]
+            else:
+                header = self._detect_section(text)
+                if header:
+                    level, title = header
+                    while section_stack and section_stack[-1][0] >= level:
+                        section_stack.pop()
+                    section_stack.append((level, title))
+
+            content_type = min(labels, key=self._priority.get) if labels else self.default_content_type
+            results.append({
+                'content_type': content_type,
+                'tags': self._tags_for(labels),
+                'section': section_stack[-1][1] if section_stack else '',
+                'section_path': SECTION_PATH_SEPARATOR.join(title for _, title in section_stack)
+            })
+        return results
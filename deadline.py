@@ -0,0 +1,281 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import threading
+import time
+from llama_index.core.agent import AgentRunner
+from llama_index.core.agent.react.types import ObservationReasoningStep
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.callbacks.schema import CBEventType
+from llama_index.core.chat_engine.types import AgentChatResponse
+from llama_index.llms.openai import OpenAI
+from openai import OpenAI as SyncOpenAI
+from tracing import trace_span
+
+_current_deadline: ContextVar[Optional["Deadline"]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs out of time or its client went away."""
+
+
+class Deadline:
+    """Time budget of a single request.
+
+    The deadline is shared between the API handler and the worker thread that
+    runs the agent: the handler may cancel it when the client disconnects, and
+    the worker checks it between agent steps and before every LLM call, tool
+    call, retrieval and embedding.
+    """
+
+    def __init__(self, timeout_seconds: float, reserve_seconds: float = 2.0):
+        """Initialize the deadline.
+
+        Args:
+            timeout_seconds: Total time budget of the request
+            reserve_seconds: Time kept back to assemble and return an answer
+        """
+        self.timeout_seconds = timeout_seconds
+        self.reserve_seconds = reserve_seconds
+        self.expires_at = time.monotonic() + timeout_seconds
+        self._cancelled = threading.Event()
+        self._cancel_callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        # Per-request resources such as dedicated HTTP clients, keyed by owner
+        self.resources: Dict[Any, Any] = {}
+
+    def remaining(self) -> float:
+        """Return the remaining time in seconds (negative once expired)."""
+        return self.expires_at - time.monotonic()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def expired(self) -> bool:
+        """Return True if the deadline passed or the request was cancelled."""
+        return self.cancelled or self.remaining() <= 0
+
+    def cancel(self) -> None:
+        """Cancel the request and abort in-flight calls registered with on_cancel."""
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            callbacks = list(self._cancel_callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error cancelling request resource: {e}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        """Register a callback that aborts in-flight work when the request is cancelled.
+
+        The callback also runs when the request finishes normally and close() is called.
+        """
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def close(self) -> None:
+        """Release per-request resources once the request has finished."""
+        with self._lock:
+            callbacks = list(self._cancel_callbacks)
+            self._cancel_callbacks.clear()
+            self.resources.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error releasing request resource: {e}")
+
+    def check(self, stage: str = "request") -> None:
+        """Raise DeadlineExceeded if no time is left."""
+        if self.cancelled:
+            raise DeadlineExceeded(f"Request cancelled during {stage}")
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(f"Deadline of {self.timeout_seconds:.1f}s exceeded during {stage}")
+
+
+def get_current_deadline() -> Optional[Deadline]:
+    """Return the deadline of the request running in the current context."""
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """Make deadline the current deadline for the duration of the block."""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+class DeadlineCallbackHandler(BaseCallbackHandler):
+    """Stops LLM calls, tool calls, retrievals and embeddings once the current deadline is used up."""
+
+    CHECKED_EVENTS = {
+        CBEventType.LLM: "LLM call",
+        CBEventType.FUNCTION_CALL: "tool call",
+        CBEventType.RETRIEVE: "retrieval",
+        CBEventType.EMBEDDING: "embedding",
+        CBEventType.SYNTHESIZE: "synthesis",
+    }
+
+    def __init__(self):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any
+    ) -> str:
+        deadline = get_current_deadline()
+        if deadline is not None and event_type in self.CHECKED_EVENTS:
+            deadline.check(self.CHECKED_EVENTS[event_type])
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any
+    ) -> None:
+        pass
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[Dict[str, List[str]]] = None
+    ) -> None:
+        pass
+
+
+class DeadlineAwareOpenAI(OpenAI):
+    """OpenAI LLM whose calls never outlive the current request deadline.
+
+    Each request gets its own HTTP client, so cancelling the deadline (e.g. when
+    the client disconnects) closes the connection of the call in flight without
+    affecting other requests. The per-call timeout is the remaining budget.
+    """
+
+    def _get_client(self) -> SyncOpenAI:
+        deadline = get_current_deadline()
+        if deadline is None:
+            return super()._get_client()
+
+        client = deadline.resources.get(id(self))
+        if client is None:
+            credentials = self._get_credential_kwargs()
+            # Retries are left to the LLM retry decorator, which re-checks the deadline
+            credentials["max_retries"] = 0
+            client = SyncOpenAI(**credentials)
+            deadline.resources[id(self)] = client
+            deadline.on_cancel(client.close)
+        return client
+
+    def _get_model_kwargs(self, **kwargs: Any) -> Dict[str, Any]:
+        model_kwargs = super()._get_model_kwargs(**kwargs)
+        deadline = get_current_deadline()
+        if deadline is not None:
+            deadline.check("LLM call")
+            model_kwargs["timeout"] = max(0.1, min(deadline.remaining(), self.timeout))
+        return model_kwargs
+
+
+class StepTimeEstimator:
+    """Moving average of agent step durations, shared across requests.
+
+    Used to decide whether another reasoning step still fits into the remaining
+    budget of a request.
+    """
+
+    def __init__(self, initial_seconds: float = 4.0, smoothing: float = 0.3):
+        """Initialize the estimator.
+
+        Args:
+            initial_seconds: Estimate used until the first step was measured
+            smoothing: Weight of the newest measurement in the moving average
+        """
+        self.estimate = initial_seconds
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        """Add the duration of a finished step."""
+        with self._lock:
+            self.estimate = self.smoothing * seconds + (1 - self.smoothing) * self.estimate
+
+
+def partial_answer(reasoning_steps: List[Any]) -> Optional[str]:
+    """Return the most recent successful tool observation of an unfinished agent run."""
+    for step in reversed(reasoning_steps):
+        if isinstance(step, ObservationReasoningStep) and not step.observation.startswith("Error:"):
+            return step.observation
+    return None
+
+
+def run_agent_with_deadline(
+    agent: AgentRunner,
+    query_str: str,
+    deadline: Deadline,
+    step_times: StepTimeEstimator
+) -> AgentChatResponse:
+    """Run the agent step by step within the request deadline.
+
+    Before every step the remaining budget is compared with the expected step
+    duration. When the next step would not fit, or the deadline expires during a
+    step, the agent stops and the best partial answer gathered so far (the last
+    tool observation) is returned with ``metadata['partial']`` set.
+
+    Args:
+        agent: Agent with empty memory, not shared with other requests
+        query_str: User question
+        deadline: Deadline of the request
+        step_times: Shared estimator of agent step durations
+
+    Returns:
+        Final or partial agent response
+
+    Raises:
+        DeadlineExceeded: If the deadline expired before any usable observation
+    """
+    task = agent.create_task(query_str)
+    stop_reason = None
+    iteration = 0
+    try:
+        while True:
+            deadline.check("agent step")
+            if deadline.remaining() - deadline.reserve_seconds < step_times.estimate and \
+                    partial_answer(task.extra_state.get("current_reasoning", [])) is not None:
+                stop_reason = "time budget nearly used up"
+                break
+            iteration += 1
+            start = time.monotonic()
+            with trace_span("agent_step", iteration=iteration) as span:
+                step_output = agent.run_step(task.task_id)
+                if span is not None:
+                    span.attributes['is_last'] = step_output.is_last
+            step_times.record(time.monotonic() - start)
+            if step_output.is_last:
+                return agent.finalize_response(task.task_id, step_output=step_output)
+    except DeadlineExceeded as e:
+        stop_reason = str(e)
+
+    answer = partial_answer(task.extra_state.get("current_reasoning", []))
+    agent.delete_task(task.task_id)
+    if answer is None or deadline.cancelled:
+        raise DeadlineExceeded(stop_reason)
+    print(f"Returning partial answer: {stop_reason}")
+    return AgentChatResponse(response=answer, metadata={'partial': True, 'reason': stop_reason})
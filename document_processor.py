@@ -1,13 +1,38 @@
 from pathlib import Path
-from typing import List, Set
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+import hashlib
 import json
+import queue
+import threading
 from llama_index.core import Document
 from llama_parse import LlamaParse
 from llama_index.core import SimpleDirectoryReader
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.schema import MetadataMode
+from pypdf import PdfReader
 import os
-from vector_store_manager import VectorStoreManager
+from vector_store_manager import VECTOR_SIZE, VectorStoreManager
+from markdown_chunker import MarkdownChunker, chunk_stats
+from chunk_classifier import ChunkClassifier
+from sentence_window import build_sentence_window_documents
+from sqlite_store import IngestionLedger
+from near_duplicates import NearDuplicateDetector
+
+def get_text_splitter(chunking_strategy: str, chunk_size: int, chunk_overlap: int):
+    """Return the node parser for a chunking strategy ('markdown' or 'sentence')."""
+    if chunking_strategy == "markdown":
+        return MarkdownChunker(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap
+        )
+    return SentenceSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,  # Increased overlap for better context
+        include_metadata=True
+    )
+
+# Separator LlamaParse puts between pages; the default "\n---\n" is also how markdown writes a horizontal rule
+PAGE_SEPARATOR = "\n\n<!-- page break -->\n\n"
 
 class DocumentProcessor:
     def __init__(self, vector_store_manager: VectorStoreManager):
@@ -17,128 +42,350 @@ class DocumentProcessor:
             vector_store_manager (VectorStoreManager): Instance of VectorStoreManager
         """
         self.vector_store_manager = vector_store_manager
-        self.processed_files_path = Path("processed_files.json")
+        # Ingested files are recorded in the SQLite ledger (formerly processed_files.json)
+        self.ledger = IngestionLedger(vector_store_manager.database)
         self.data_dir = Path("./data")
         # We'll use the parser from vector_store_manager
         self.parser = vector_store_manager.parser
+        # 'markdown' splits along the LlamaParse heading structure, 'sentence' is the legacy splitter
+        self.chunking_strategy = os.getenv("CHUNKING_STRATEGY", "markdown").lower()
+        self.chunk_size = int(os.getenv("CHUNK_SIZE", "1024" if self.chunking_strategy == "markdown" else "512"))
+        self.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "32" if self.chunking_strategy == "markdown" else "150"))
+        # Rule-based content type and section tagging, configured in classification_rules.json
+        self.classifier = ChunkClassifier()
+        # 'chunk' embeds whole chunks, 'sentence_window' embeds sentences/bullets pointing to their parent chunk
+        self.indexing_mode = os.getenv("INDEXING_MODE", "chunk").lower()
+        # Near-duplicate chunks (boilerplate shared by several manuals) are stored once with all their sources
+        self.deduplicator = None
+        if os.getenv("DEDUP_ENABLED", "true").lower() == "true":
+            self.deduplicator = NearDuplicateDetector(
+                vector_store_manager.database,
+                threshold=float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+            )
+        self.last_dedup_stats = {}
+        # PDFs are parsed, split and embedded this many pages at a time (0 parses whole files at once),
+        # with up to INGEST_WINDOWS_IN_FLIGHT chunked windows waiting to be embedded
+        self.window_pages = int(os.getenv("INGEST_WINDOW_PAGES", "50"))
+        self.windows_in_flight = int(os.getenv("INGEST_WINDOWS_IN_FLIGHT", "2"))
+        # Called without arguments by the ingestion worker once a run that ingested new content is published
+        self.ingest_listeners: List[Callable[[], None]] = []
 
-    def _extract_section_header(self, text: str) -> str:
-        """Extract section header from text chunk."""
-        lines = text.split('\n')
-        for line in lines[:2]:  # Check first two lines
-            # Look for common section header patterns
-            if any(pattern in line.lower() for pattern in ['class', 'section', 'chapter']):
-                return line.strip()
-        return ''
-
-    def _identify_content_type(self, text: str) -> str:
-        """Identify the type of content in the chunk."""
-        text_lower = text.lower()
-        if 'security class' in text_lower:
-            return 'security_class_definition'
-        elif any(word in text_lower for word in ['example', 'usage']):
-            return 'example'
-        elif any(word in text_lower for word in ['warning', 'caution', 'note']):
-            return 'notice'
-        return 'general'
+    def _get_text_splitter(self):
+        """Return the node parser for the configured chunking strategy."""
+        return get_text_splitter(self.chunking_strategy, self.chunk_size, self.chunk_overlap)
 
     def get_processed_files(self) -> Set[str]:
         """Get the set of files that have already been processed"""
-        if self.processed_files_path.exists():
-            with open(self.processed_files_path, "r") as f:
-                return set(json.load(f))
-        return set()
+        return self.ledger.get_processed_files()
+
+    @staticmethod
+    def get_file_hash(file_path: str) -> str:
+        """Return the SHA-256 hash of a file's content"""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
 
-    def save_processed_files(self, processed_files: Set[str]) -> None:
-        """Save the set of processed files"""
-        with open(self.processed_files_path, "w") as f:
-            json.dump(list(processed_files), f)
+    def get_corpus_version(self) -> str:
+        """Return an identifier of the ingested corpus that changes whenever new content is ingested"""
+        # File hashes are included, so a file re-ingested with new content changes the version as well
+        processed_files = [[entry['path'], entry['file_hash']] for entry in self.ledger.entries()]
+        return hashlib.sha1(json.dumps(processed_files).encode("utf-8")).hexdigest()[:16]
 
     def get_new_documents(self) -> List[str]:
-        """Get paths of new documents that haven't been processed yet"""
-        processed_files = self.get_processed_files()
+        """Get paths of new documents and of processed documents whose content changed"""
+        ledger_hashes = {entry['path']: entry['file_hash'] for entry in self.ledger.entries()}
         
         # Get all PDF files in the data directory
-        current_files = {str(f.absolute()) for f in self.data_dir.glob("**/*.pdf")}
+        current_files = sorted(str(f.absolute()) for f in self.data_dir.glob("**/*.pdf"))
         
         # Find new files that haven't been processed
-        new_files = current_files - processed_files
+        new_files = [path for path in current_files if path not in ledger_hashes]
+        # Files replaced in place (same path, new content) are ingested again
+        changed_files = [
+            path for path in current_files
+            if ledger_hashes.get(path) and self.get_file_hash(path) != ledger_hashes[path]
+        ]
         
-        if not new_files:
+        if not new_files and not changed_files:
             print("No new documents to process")
             return []
         
-        print(f"Found {len(new_files)} new documents to process")
-        return list(new_files)
+        print(f"Found {len(new_files)} new and {len(changed_files)} changed documents to process")
+        return new_files + changed_files
 
-    def process_documents(self) -> bool:
+    def process_documents(self, progress: Optional[Callable[[str], None]] = None) -> bool:
         """
         Process new documents and add them to the vector store
+        Args:
+            progress: Optional callback receiving each progress message
         Returns:
             bool: True if processing was successful, False otherwise
         """
+        def report(message: str) -> None:
+            print(message)
+            if progress is not None:
+                progress(message)
+
         new_file_paths = self.get_new_documents()
         if not new_file_paths:
             return True
-
-        print("Processing new documents...")
         processed_files = self.get_processed_files()
+
+        report("Processing new documents...")
         success = True
+        dedup_totals = {'chunks': 0, 'collapsed_chunks': 0, 'points_saved': 0, 'bytes_saved': 0}
         
-        # Initialize text splitter with enhanced chunking strategy
-        text_splitter = SentenceSplitter(
-            chunk_size=512,
-            chunk_overlap=150,  # Increased overlap for better context
-            include_metadata=True
-        )
+        # Initialize text splitter for the configured chunking strategy
+        text_splitter = self._get_text_splitter()
 
         # Process each document individually with error handling
         for file_path in new_file_paths:
+            file_name = os.path.basename(file_path)
             try:
-                print(f"Processing document: {file_path}")
-                file_extractor = {".pdf": self.parser}
-                
-                # Process single document
-                reader = SimpleDirectoryReader(
-                    input_files=[file_path],  # Process just one file
-                    file_extractor=file_extractor,
-                    filename_as_id=True
-                )
-                documents = reader.load_data()
-                
-                # Split documents into smaller chunks while preserving metadata
-                processed_documents = []
-                for doc in documents:
-                    nodes = text_splitter.get_nodes_from_documents([doc])
-                    # Convert nodes back to documents while preserving metadata
-                    for node in nodes:
-                        # Enhance metadata with section and content type information
-                        enhanced_metadata = node.metadata.copy() if node.metadata else {}
-                        enhanced_metadata.update({
-                            'section': self._extract_section_header(node.text),
-                            'content_type': self._identify_content_type(node.text)
-                        })
-                        processed_documents.append(Document(text=node.text, metadata=enhanced_metadata))
-                
-                # Insert documents into the vector store
-                result = self.vector_store_manager.insert_documents(processed_documents)
-                
-                if result['failed_insertions'] > 0:
-                    print(f"Warning: {result['failed_insertions']} documents failed to insert for {file_path}")
+                report(f"Processing document: {file_path}")
+                replacing = file_path in processed_files
+                # Chunks of the previous version are deleted on publish, so nothing is collapsed into them
+                replaced_dedup_ids = (self.vector_store_manager.file_dedup_ids(file_name)
+                                      if replacing and self.deduplicator is not None else set())
+                inserted, failed = self._ingest_file(file_path, text_splitter, dedup_totals, report, replaced_dedup_ids)
+
+                if failed > 0:
+                    report(f"Warning: {failed} documents failed to insert for {file_path}")
                     success = False
+                    self._discard_file(file_name, report)
                 else:
-                    print(f"Successfully inserted {result['successful_insertions']} documents for {file_path}")
+                    report(f"Successfully inserted {inserted} documents for {file_path}")
                     # Only mark as processed if successful
-                    processed_files.add(file_path)
-                    self.save_processed_files(processed_files)
+                    self.ledger.record(file_path, self.get_file_hash(file_path), inserted)
+                    if replacing:
+                        # Its chunks of older ingestion runs are deleted once this run is published
+                        self.vector_store_manager.replace_file_on_publish(file_name)
+                        report(f"Points of the previous version of {file_path} are deleted on publish")
                     
             except Exception as e:
-                print(f"Error processing document {file_path}: {e}")
+                report(f"Error processing document {file_path}: {e}")
                 success = False
+                self._discard_file(file_name, report)
                 # Continue with next document
-        
+
+        if dedup_totals['collapsed_chunks']:
+            report(f"Near-duplicate detection collapsed {dedup_totals['collapsed_chunks']} of {dedup_totals['chunks']} "
+                   f"chunks: {dedup_totals['points_saved']} fewer points, "
+                   f"~{dedup_totals['bytes_saved'] / 1e6:.1f} MB smaller index")
+        self.last_dedup_stats = dedup_totals
         return success
 
+    def _discard_file(self, file_name: str, report: Callable[[str], None]) -> None:
+        """Drop what a failed file wrote in the pending ingestion run, so the run never publishes half a file."""
+        if self.vector_store_manager.pending_ingest_version is None:
+            return
+        try:
+            deleted = self.vector_store_manager.discard_file_points(file_name)
+            if deleted:
+                report(f"Discarded {deleted} points of {file_name}, it is ingested again on the next run")
+        except Exception as e:
+            report(f"Error discarding the points of {file_name}: {e}")
+
+    @staticmethod
+    def get_page_count(file_path: str) -> int:
+        """Return the number of pages of a PDF"""
+        return len(PdfReader(file_path).pages)
+
+    def parse_pages(self, file_path: str, first_page: int = 0, page_count: Optional[int] = None) -> List[Document]:
+        """Parse a range of pages of a PDF into one Document per page.
+
+        Args:
+            file_path: Path of the PDF
+            first_page: First page to parse, 0-based
+            page_count: Number of pages to parse, all remaining pages if None
+
+        Returns:
+            Page documents in order
+        """
+        # Pages are split on a separator that horizontal rules in the markdown cannot produce
+        update = {'page_separator': PAGE_SEPARATOR}
+        if page_count is not None:
+            update['target_pages'] = f"{first_page}-{first_page + page_count - 1}"
+        reader = SimpleDirectoryReader(
+            input_files=[file_path],  # Process just one file
+            file_extractor={".pdf": self.parser.model_copy(update=update)},
+            filename_as_id=True
+        )
+        return reader.load_data()
+
+    def read_page_windows(self, file_path: str) -> Iterator[List[Document]]:
+        """Yield the pages of a PDF in windows of ``window_pages`` pages.
+
+        The page count is read from the PDF up front, so the windows cover the whole
+        file whatever the parser returns. Pages get a 1-based ``page_label`` when the
+        parser sets none; when a window does not come back as one document per page,
+        its pages are labelled with the window's page range instead.
+        """
+        page_count = None
+        if self.window_pages > 0:
+            try:
+                page_count = self.get_page_count(file_path)
+            except Exception as e:
+                print(f"Could not read the page count of {file_path}, parsing it at once: {e}")
+        if page_count is None:
+            pages = self.parse_pages(file_path)
+            for number, page in enumerate(pages, start=1):
+                page.metadata.setdefault('page_label', str(number))
+            yield pages
+            return
+        for first_page in range(0, page_count, self.window_pages):
+            requested = min(self.window_pages, page_count - first_page)
+            pages = self.parse_pages(file_path, first_page, requested)
+            if len(pages) == requested:
+                labels = [str(number) for number in range(first_page + 1, first_page + requested + 1)]
+            else:
+                print(f"Parser returned {len(pages)} documents for pages {first_page + 1}-{first_page + requested} "
+                      f"of {file_path}")
+                labels = [f"{first_page + 1}-{first_page + requested}"] * len(pages)
+            for page, label in zip(pages, labels):
+                page.metadata.setdefault('page_label', label)
+            yield pages
+
+    def _chunk_windows(self, file_path: str, text_splitter) -> Iterator[Tuple[int, List[Document]]]:
+        """Parse, split and classify a PDF one page window at a time.
+
+        Yields:
+            Number of pages and chunk documents of each window
+        """
+        # Open headings and sections carry over from one window to the next
+        heading_stack, section_stack = [], []
+        for pages in self.read_page_windows(file_path):
+            if isinstance(text_splitter, MarkdownChunker):
+                nodes = text_splitter.get_nodes_from_documents(pages, heading_stack=heading_stack)
+            else:
+                nodes = text_splitter.get_nodes_from_documents(pages)
+            # Classify the window in one pass, carrying sections forward between chunks
+            classifications = self.classifier.classify_batch(
+                [node.text for node in nodes],
+                [node.metadata or {} for node in nodes],
+                section_stack=section_stack
+            )
+            chunks = []
+            for node, classification in zip(nodes, classifications):
+                # Enhance metadata with section and content type information
+                enhanced_metadata = node.metadata.copy() if node.metadata else {}
+                enhanced_metadata.update(classification)
+                chunks.append(Document(text=node.text, metadata=enhanced_metadata))
+            yield len(pages), chunks
+
+    def _pipelined_windows(self, file_path: str, text_splitter) -> Iterator[Tuple[int, List[Document]]]:
+        """Chunk the next page windows in a background thread while the current one is embedded.
+
+        At most ``windows_in_flight`` chunked windows wait in the queue, so memory
+        stays bounded by the window size whatever the length of the document.
+        """
+        windows: "queue.Queue" = queue.Queue(maxsize=max(self.windows_in_flight, 1))
+        stop = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    windows.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for window in self._chunk_windows(file_path, text_splitter):
+                    if not put(window):
+                        return
+                put(done)
+            except Exception as e:
+                put(e)
+
+        producer = threading.Thread(target=produce, name="ingest-parse", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = windows.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+
+    def _ingest_file(
+        self,
+        file_path: str,
+        text_splitter,
+        dedup_totals: Dict[str, int],
+        report,
+        replaced_dedup_ids: Optional[Set[str]] = None
+    ) -> Tuple[int, int]:
+        """Parse, split, deduplicate, embed and upsert a PDF one page window at a time.
+
+        Args:
+            file_path: Path of the PDF
+            text_splitter: Node parser of the chunking strategy
+            dedup_totals: Near-duplicate statistics of the run, updated in place
+            report: Progress callback
+            replaced_dedup_ids: dedup_ids of the stored chunks of the file's previous version
+
+        Returns:
+            Number of inserted and of failed chunks
+        """
+        inserted, failed, pages, windows = 0, 0, 0, 0
+        stats = {'chunks': 0, 'total_tokens': 0, 'max_tokens': 0}
+        for page_count, processed_documents in self._pipelined_windows(file_path, text_splitter):
+            windows += 1
+            pages += page_count
+            window_stats = chunk_stats([doc.text for doc in processed_documents])
+            stats['chunks'] += window_stats['chunks']
+            stats['total_tokens'] += window_stats['total_tokens']
+            stats['max_tokens'] = max(stats['max_tokens'], window_stats['max_tokens'])
+
+            stored_sources = {}
+            if self.deduplicator is not None:
+                all_chunks = processed_documents
+                processed_documents, stored_sources, dedup_stats = self.deduplicator.deduplicate(
+                    processed_documents, self.vector_store_manager.collection_for_metadata, replaced_dedup_ids
+                )
+                if dedup_stats['collapsed_chunks']:
+                    kept_ids = {id(doc) for doc in processed_documents}
+                    collapsed = [doc for doc in all_chunks if id(doc) not in kept_ids]
+                    points_saved = (len(build_sentence_window_documents(collapsed))
+                                    if self.indexing_mode == "sentence_window" else len(collapsed))
+                    dedup_totals['points_saved'] += points_saved
+                    dedup_totals['bytes_saved'] += points_saved * VECTOR_SIZE * 4 + dedup_stats['collapsed_chars']
+                    report(f"Collapsed {dedup_stats['collapsed_chunks']} near-duplicate chunks "
+                           f"({dedup_stats['collapsed_ratio']:.1%}) of window {windows} of {file_path}, "
+                           f"{points_saved} points not stored")
+                dedup_totals['chunks'] += dedup_stats['chunks']
+                dedup_totals['collapsed_chunks'] += dedup_stats['collapsed_chunks']
+
+            if self.indexing_mode == "sentence_window":
+                # Embed small units, the chunks become their parent windows
+                processed_documents = build_sentence_window_documents(processed_documents)
+
+            # Insert documents into the vector store
+            result = self.vector_store_manager.insert_documents(processed_documents)
+            inserted += result['successful_insertions']
+            failed += result['failed_insertions']
+            if result['failed_insertions'] == 0 and self.deduplicator is not None:
+                # Signatures are only kept for chunks that were stored
+                self.deduplicator.register()
+                for (collection_name, dedup_id), sources in stored_sources.items():
+                    self.vector_store_manager.add_chunk_sources(collection_name, dedup_id, sources)
+            report(f"Ingested page window {windows} of {file_path}: {pages} pages, {inserted} points so far")
+
+        report(f"Chunked {file_path} with '{self.chunking_strategy}' strategy: "
+               f"{stats['chunks']} chunks, {stats['total_tokens']} tokens "
+               f"(avg {stats['total_tokens'] // stats['chunks'] if stats['chunks'] else 0}, max {stats['max_tokens']})")
+        return inserted, failed
+
     def get_all_documents(self) -> List[Document]:
         """Get all processed documents from the vector store directly using the load_documents_from_store method."""
         try:
@@ -0,0 +1,271 @@
+"""Extractive answers for list and quote questions.
+
+The agent context asks for lists "exactly as they appear" and for exact
+quotes, so for those questions the LLM mostly copies a retrieved passage,
+taking several ReAct round trips to do so. ExtractiveAnswerer searches once
+and, when one of the top chunks contains a list or section whose heading and
+content cover the question, returns that passage verbatim with its citations and
+without any LLM call. Everything else, and every passage below the
+confidence threshold, goes to the agent as before.
+
+Confidence is the share of the question's content words found in the
+passage's heading (section title or the line introducing the list) and in
+the passage itself; quoted phrases of the question must appear verbatim.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import re
+import threading
+import time
+from llama_index.core.chat_engine.types import AgentChatResponse
+from llama_index.core.schema import NodeWithScore
+from metrics import REGISTRY
+from multi_query import QUOTED_PHRASE_PATTERN, keyword_variant
+
+# Questions asking for a list, the content of a section or a quote
+EXTRACTIVE_QUESTION_PATTERN = re.compile(
+    r"\b(?:list|lists|items?|includ(?:e|es|ed)|contents?|consists? of|contain(?:s|ed)?|enumerate|components|"
+    r"steps|exact(?:ly)?|verbatim|quote|section|chapter)\b",
+    re.IGNORECASE
+)
+# Bullet and numbered list items, as produced by LlamaParse
+LIST_ITEM_PATTERN = re.compile(r"^\s*(?:[-*•▪◦]|\d{1,2}[.)]|[a-z][.)])\s+\S")
+HEADING_PATTERN = re.compile(r"^\s*#{1,6}\s+(.+?)\s*#*\s*$")
+NOTE_PATTERN = re.compile(r"^\s*(?:\*\*)?(?:please )?(?:note|caution|important)\b", re.IGNORECASE)
+# Words that ask for the form of the answer rather than naming its content
+FORM_WORDS = {
+    "all", "chapter", "complete", "components", "contain", "contained", "contains", "content", "contents",
+    "document", "documentation", "enumerate", "exact", "exactly", "full", "include", "included", "includes",
+    "item", "items", "list", "lists", "mentioned", "named", "quote", "section", "steps", "verbatim",
+}
+MIN_LIST_ITEMS = 2
+# A passage without a list is only returned when the chunk is one short section
+SECTION_WEIGHT = 0.9
+
+
+def _stem(word: str) -> str:
+    return word[:6]
+
+
+def content_terms(text: str) -> List[str]:
+    """Return the stems of the content words of a question, in order and without repetitions."""
+    terms = {}
+    for word in keyword_variant(text).lower().split():
+        word = word.strip(".-/'")
+        if len(word) >= 3 and word not in FORM_WORDS:
+            terms.setdefault(_stem(word), None)
+    return list(terms)
+
+
+def _coverage(terms: List[str], text: str) -> float:
+    if not terms:
+        return 0.0
+    stems = {_stem(word) for word in re.findall(r"\w+", text.lower())}
+    return sum(term in stems for term in terms) / len(terms)
+
+
+def passage_candidates(text: str, section: str = "", max_chars: int = 2000) -> List[Tuple[str, str, bool]]:
+    """Split a chunk into passages that can be returned on their own.
+
+    Every list of at least two items becomes a passage together with the
+    line introducing it and the notes right after it. A chunk that is a
+    single short section is also a passage as a whole.
+
+    Args:
+        text: Chunk text (the parent window for sentence window units)
+        section: Section title from the chunk metadata
+        max_chars: Longest passage returned
+
+    Returns:
+        (heading, passage, is_list) tuples
+    """
+    lines = text.splitlines()
+    candidates = []
+    i = 0
+    while i < len(lines):
+        if not LIST_ITEM_PATTERN.match(lines[i]):
+            i += 1
+            continue
+        start, items, end = i, 0, i
+        # Items, their indented continuation lines and single blank lines between items
+        while i < len(lines) and (LIST_ITEM_PATTERN.match(lines[i]) or (lines[i].startswith((" ", "\t")) and lines[i].strip())
+                                  or (not lines[i].strip() and i + 1 < len(lines) and LIST_ITEM_PATTERN.match(lines[i + 1]))):
+            if LIST_ITEM_PATTERN.match(lines[i]):
+                items += 1
+            end = i
+            i += 1
+        if items < MIN_LIST_ITEMS:
+            continue
+        intro = start - 1
+        while intro >= 0 and not lines[intro].strip():
+            intro -= 1
+        note_end = end
+        while note_end + 1 < len(lines) and (not lines[note_end + 1].strip() or NOTE_PATTERN.match(lines[note_end + 1])):
+            if NOTE_PATTERN.match(lines[note_end + 1]):
+                end = note_end + 1
+            note_end += 1
+        heading_line = lines[intro] if intro >= 0 else ""
+        heading = HEADING_PATTERN.sub(r"\1", heading_line).strip()
+        passage = "\n".join(lines[intro if intro >= 0 else start:end + 1]).strip()
+        if len(passage) <= max_chars:
+            candidates.append((f"{section}\n{heading}".strip(), passage, True))
+
+    headings = [line for line in lines if HEADING_PATTERN.match(line)]
+    if len(headings) <= 1 and len(text) <= max_chars and text.strip():
+        title = HEADING_PATTERN.sub(r"\1", headings[0]).strip() if headings else ""
+        candidates.append((f"{section}\n{title}".strip(), text.strip(), False))
+    return candidates
+
+
+def citation_of(metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the locations of a chunk: every collapsed duplicate, or the chunk itself."""
+    sources = metadata.get('sources') or [{
+        field: metadata[field] for field in ('file_name', 'page_label', 'section') if metadata.get(field) not in (None, "")
+    }]
+    return [source for source in sources if source]
+
+
+def format_citations(citations: List[Dict[str, Any]]) -> str:
+    lines = []
+    for source in citations:
+        parts = [str(source.get('file_name', "unknown document"))]
+        if source.get('page_label') is not None:
+            parts.append(f"page {source['page_label']}")
+        if source.get('section'):
+            parts.append(f"section \"{source['section']}\"")
+        lines.append(", ".join(parts))
+    if len(lines) == 1:
+        return f"Source: {lines[0]}"
+    return "Sources:\n" + "\n".join(f"- {line}" for line in lines)
+
+
+class ExtractiveAnswerer:
+    """Answers list and quote questions with a retrieved passage when it clearly matches."""
+
+    def __init__(
+        self,
+        vector_manager: Any,
+        min_confidence: float = 0.8,
+        candidate_chunks: int = 3,
+        max_passage_chars: int = 2000
+    ):
+        """Initialize the answerer.
+
+        Args:
+            vector_manager: VectorStoreManager searched for the passage
+            min_confidence: Confidence from which the passage is returned instead of running the agent
+            candidate_chunks: Top retrieved chunks searched for the passage
+            max_passage_chars: Longest passage returned
+        """
+        self.vector_manager = vector_manager
+        self.min_confidence = min_confidence
+        self.candidate_chunks = candidate_chunks
+        self.max_passage_chars = max_passage_chars
+        self._lock = threading.Lock()
+        self._counts = {'served': 0, 'fallback': 0, 'skipped': 0}
+        self._agent_seconds: Optional[float] = None
+        self._saved_seconds = 0.0
+        self._answers = REGISTRY.counter(
+            "extractive_answers_total", "Questions by extractive answering result (served, fallback, skipped)"
+        )
+        self._ratio = REGISTRY.gauge("extractive_answer_ratio", "Share of agent-bound questions answered extractively")
+        self._saved = REGISTRY.counter(
+            "extractive_latency_saved_seconds_total", "Estimated agent time saved by extractive answers"
+        )
+        self._latency = REGISTRY.histogram(
+            "extractive_answer_seconds", "Time to search and extract a passage",
+            buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+        )
+
+    @staticmethod
+    def is_candidate(question: str) -> bool:
+        """True for questions asking for a list, a section or a quote."""
+        return bool(EXTRACTIVE_QUESTION_PATTERN.search(question) or QUOTED_PHRASE_PATTERN.search(question))
+
+    def extract(self, question: str, node: NodeWithScore) -> Optional[Dict[str, Any]]:
+        """Pick the passage of a chunk that best matches the question.
+
+        Args:
+            question: User question
+            node: Retrieved chunk
+
+        Returns:
+            Dict with 'passage', 'confidence' and 'citations', or None if the chunk has no passage
+        """
+        metadata = node.node.metadata or {}
+        text = metadata.get('window') or node.node.get_content()
+        terms = content_terms(question)
+        phrases = [phrase.lower() for phrase in QUOTED_PHRASE_PATTERN.findall(question)]
+        best = None
+        for heading, passage, is_list in passage_candidates(text, metadata.get('section') or "", self.max_passage_chars):
+            confidence = 0.6 * _coverage(terms, heading) + 0.4 * _coverage(terms, f"{heading}\n{passage}")
+            if not is_list:
+                confidence *= SECTION_WEIGHT
+            if any(phrase not in f"{heading}\n{passage}".lower() for phrase in phrases):
+                confidence *= 0.5
+            if best is None or confidence > best['confidence']:
+                best = {'passage': passage, 'confidence': round(confidence, 3), 'citations': citation_of(metadata)}
+        return best
+
+    def answer(self, question: str, max_ingest_version: Optional[int] = None) -> Optional[AgentChatResponse]:
+        """Return the matching passage with its citations, or None to fall back to the agent.
+
+        Args:
+            question: User question
+            max_ingest_version: Ingestion version of the index state serving the request
+
+        Returns:
+            Response with ``metadata['extractive']`` set, or None
+        """
+        if not self.is_candidate(question):
+            self._record('skipped')
+            return None
+        start = time.perf_counter()
+        query_embedding = self.vector_manager.embed_model.get_query_embedding(question)
+        nodes = self.vector_manager.search_nodes(
+            query_embedding, top_k=self.candidate_chunks, query_str=question, max_ingest_version=max_ingest_version
+        )
+        best, best_node = None, None
+        for node in nodes:
+            extracted = self.extract(question, node)
+            if extracted is not None and (best is None or extracted['confidence'] > best['confidence']):
+                best, best_node = extracted, node
+        elapsed = time.perf_counter() - start
+        self._latency.observe(elapsed)
+        if best is None or best['confidence'] < self.min_confidence:
+            self._record('fallback')
+            return None
+        self._record('served', elapsed)
+        return AgentChatResponse(
+            response=f"{best['passage']}\n\n{format_citations(best['citations'])}",
+            sources=[],
+            source_nodes=[best_node],
+            metadata={'extractive': True, 'confidence': best['confidence'], 'citations': best['citations']}
+        )
+
+    def record_agent_latency(self, seconds: float) -> None:
+        """Track the agent's answer time, the baseline of the latency saved."""
+        with self._lock:
+            self._agent_seconds = seconds if self._agent_seconds is None else 0.9 * self._agent_seconds + 0.1 * seconds
+
+    def _record(self, result: str, elapsed: float = 0.0) -> None:
+        saved = 0.0
+        with self._lock:
+            self._counts[result] += 1
+            if result == 'served' and self._agent_seconds is not None:
+                saved = max(self._agent_seconds - elapsed, 0.0)
+                self._saved_seconds += saved
+            ratio = self._counts['served'] / sum(self._counts.values())
+        self._answers.inc(labels={'result': result})
+        self._ratio.set(round(ratio, 4))
+        if saved:
+            self._saved.inc(saved)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(self._counts.values())
+            return {
+                **self._counts,
+                'served_ratio': round(self._counts['served'] / total, 3) if total else 0.0,
+                'agent_seconds': round(self._agent_seconds, 3) if self._agent_seconds is not None else None,
+                'latency_saved_seconds': round(self._saved_seconds, 3),
+            }
@@ -0,0 +1,449 @@
+"""Consistency check and compaction of the Qdrant collections.
+
+Pages through every collection and cross-checks each point against the
+ingestion ledger and the PDFs in ``data/``:
+
+- deleted_file: the point's file is no longer in the data directory; a chunk
+  that other files still present were collapsed into is kept for them instead
+  (its sources are pruned and it takes the location of the first remaining one)
+- incomplete_file: the file is in the data directory but not in the ledger,
+  so its ingestion failed part-way (it is ingested again on the next run)
+- exact_duplicate: same file, page, parent window and text as a kept point,
+  left over from re-runs with random point IDs
+- near_duplicate (optional): MinHash similarity with a kept chunk of the same
+  collection at or above the threshold; its source is merged into the kept chunk
+
+Points of an ingestion run that is still in progress are never touched, and
+the store is opened without publishing a run that looks interrupted. With
+``--delete`` the findings are deleted in batches, ledger entries of deleted
+files are removed, and the near-duplicate signatures of deleted chunks are
+dropped. Qdrant is then asked to vacuum the collections. The report shows the
+estimated memory reclaimed and the search latency before and after.
+
+Usage:
+    python index_maintenance.py                       # report only
+    python index_maintenance.py --delete --near-duplicates
+"""
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import time
+import numpy as np
+from qdrant_client.models import OptimizersConfigDiff, PointIdsList
+from near_duplicates import SOURCE_FIELDS, MinHasher, forget_signatures, lsh_bands
+from sqlite_store import IngestionLedger
+from vector_store_manager import (
+    INGEST_VERSION_METADATA_KEY,
+    VECTOR_SIZE,
+    VectorStoreManager,
+    chunk_identity,
+    chunk_point_id,
+)
+
+DELETED_FILE = "deleted_file"
+INCOMPLETE_FILE = "incomplete_file"
+EXACT_DUPLICATE = "exact_duplicate"
+NEAR_DUPLICATE = "near_duplicate"
+FINDINGS = [DELETED_FILE, INCOMPLETE_FILE, EXACT_DUPLICATE, NEAR_DUPLICATE]
+
+DELETE_BATCH_SIZE = 256
+# Shorter chunks (headings, single bullets) are never near duplicates, as at ingest time
+NEAR_DUPLICATE_MIN_WORDS = 8
+
+
+def point_fields(payload: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any]]:
+    """Return the kind, text and metadata of a point.
+
+    ``chunk`` points are written by VectorStoreManager.insert_documents with
+    the metadata nested under ``metadata``; ``node`` points are written by the
+    llama-index vector store with flat metadata and the node in ``_node_content``.
+    """
+    if "_node_content" in payload:
+        try:
+            text = json.loads(payload["_node_content"]).get("text", "")
+        except (TypeError, ValueError):
+            text = ""
+        return "node", text, payload
+    return "chunk", payload.get("text", ""), payload.get("metadata") or {}
+
+
+def scan_collection(client, collection_name: str, page_size: int = 256) -> Iterator[Any]:
+    """Yield every point of a collection with its payload, one scroll page at a time."""
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=page_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False
+        )
+        yield from records
+        if offset is None:
+            break
+
+
+def _source_of(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: metadata[field] for field in SOURCE_FIELDS if metadata.get(field) not in (None, "")}
+
+
+def _payload_bytes(payload: Dict[str, Any]) -> int:
+    return len(json.dumps(payload, default=str).encode("utf-8"))
+
+
+def check_collection(
+    vector_manager: VectorStoreManager,
+    collection_name: str,
+    data_files: Set[str],
+    ledger_files: Set[str],
+    near_duplicates: bool = False,
+    threshold: float = 0.95,
+    page_size: int = 256
+) -> Dict[str, Any]:
+    """Classify the points of one collection.
+
+    Args:
+        vector_manager: VectorStoreManager of the collections
+        collection_name: Collection to check
+        data_files: File names in the data directory
+        ledger_files: File names in the ingestion ledger
+        near_duplicates: Also look for near-duplicate chunks
+        threshold: Estimated Jaccard similarity from which chunks are near duplicates
+        page_size: Points per scroll request
+
+    Returns:
+        Point counts, findings (point ID, file name, payload size and the kept point for duplicates),
+        chunks of deleted files kept for their remaining sources, files with points,
+        and dedup_ids of kept and removed chunks
+    """
+    published = vector_manager.published_ingest_version
+    hasher = MinHasher()
+    bands, rows = lsh_bands(threshold, hasher.num_perm)
+    findings: Dict[str, List[Dict[str, Any]]] = {finding: [] for finding in FINDINGS}
+    rehomed: List[Dict[str, Any]] = []
+    identities: Dict[bytes, Tuple[str, bool]] = {}
+    buckets: Dict[Tuple[int, bytes], List[int]] = {}
+    signatures: List[Tuple[str, np.ndarray]] = []
+    files_with_points: Set[str] = set()
+    kept_dedup_ids: Set[str] = set()
+    removed_dedup_ids: Set[str] = set()
+    points, in_progress, without_file, payload_bytes = 0, 0, 0, 0
+
+    for record in scan_collection(vector_manager.client, collection_name, page_size):
+        points += 1
+        payload = record.payload or {}
+        kind, text, metadata = point_fields(payload)
+        size = _payload_bytes(payload)
+        payload_bytes += size
+        version = metadata.get(INGEST_VERSION_METADATA_KEY)
+        if version is not None and version > published:
+            # Written by a run that has not been published yet
+            in_progress += 1
+            continue
+
+        point_id = str(record.id)
+        file_name = metadata.get('file_name')
+        files_with_points.update(source['file_name'] for source in metadata.get('sources') or [] if source.get('file_name'))
+        finding = {
+            'id': point_id, 'file_name': file_name, 'bytes': size, 'dedup_id': metadata.get('dedup_id'),
+            'ref_doc_id': payload.get('ref_doc_id') if kind == "node" else None
+        }
+        if not file_name:
+            without_file += 1
+        elif file_name not in data_files:
+            remaining = [source for source in metadata.get('sources') or [] if source.get('file_name') in data_files]
+            if kind == "chunk" and remaining:
+                # Other files were collapsed into the chunk; it is only deleted with its last source.
+                # Its llama-index node is still deleted and built again from the moved chunk
+                rehomed.append({**finding, 'sources': remaining})
+                if metadata.get('dedup_id'):
+                    kept_dedup_ids.add(metadata['dedup_id'])
+                continue
+            findings[DELETED_FILE].append(finding)
+            continue
+        elif file_name not in ledger_files:
+            findings[INCOMPLETE_FILE].append(finding)
+            continue
+        if file_name:
+            files_with_points.add(file_name)
+
+        # Node points mirror chunk points for the llama-index engine, so only compare within a kind
+        identity = hashlib.sha1(f"{kind}\x1e{chunk_identity(text, metadata)}".encode("utf-8")).digest()
+        canonical = kind == "chunk" and point_id == chunk_point_id(text, metadata)
+        if identity in identities:
+            kept_id, kept_canonical = identities[identity]
+            if canonical and not kept_canonical:
+                # Keep the point with the deterministic ID, so the next ingestion overwrites it
+                identities[identity] = (point_id, True)
+                findings[EXACT_DUPLICATE].append({**finding, 'id': kept_id, 'kept_id': point_id})
+                for earlier in findings[EXACT_DUPLICATE] + findings[NEAR_DUPLICATE]:
+                    if earlier['kept_id'] == kept_id:
+                        earlier['kept_id'] = point_id
+                signatures = [(point_id if i == kept_id else i, signature) for i, signature in signatures]
+            else:
+                findings[EXACT_DUPLICATE].append({**finding, 'kept_id': kept_id})
+            continue
+        identities[identity] = (point_id, canonical)
+
+        if near_duplicates and kind == "chunk" and not metadata.get('parent_id') \
+                and len(text.split()) >= NEAR_DUPLICATE_MIN_WORDS:
+            signature = hasher.signature(text)
+            band_keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+            candidates = {i for key in band_keys for i in buckets.get(key, [])}
+            match = max(((hasher.similarity(signature, signatures[i][1]), i) for i in candidates), default=(0.0, None))
+            if match[1] is not None and match[0] >= threshold:
+                findings[NEAR_DUPLICATE].append({
+                    **finding, 'kept_id': signatures[match[1]][0], 'similarity': round(match[0], 3),
+                    'source': _source_of(metadata),
+                    'sources': metadata.get('sources') or []
+                })
+                continue
+            for key in band_keys:
+                buckets.setdefault(key, []).append(len(signatures))
+            signatures.append((point_id, signature))
+        if metadata.get('dedup_id'):
+            kept_dedup_ids.add(metadata['dedup_id'])
+
+    for finding in FINDINGS:
+        removed_dedup_ids.update(f['dedup_id'] for f in findings[finding] if f['dedup_id'])
+    return {
+        'collection': collection_name,
+        'points': points,
+        'in_progress': in_progress,
+        'without_file_name': without_file,
+        'avg_payload_bytes': round(payload_bytes / points) if points else 0,
+        'findings': findings,
+        'rehomed': rehomed,
+        'files_with_points': files_with_points,
+        'kept_dedup_ids': kept_dedup_ids,
+        'removed_dedup_ids': removed_dedup_ids - kept_dedup_ids,
+    }
+
+
+def sample_query_vectors(client, collection_name: str, exclude: Set[str], count: int = 50) -> List[List[float]]:
+    """Use the vectors of random kept points as search queries."""
+    ids = []
+    for record in scan_collection(client, collection_name):
+        if str(record.id) not in exclude:
+            ids.append(record.id)
+    ids = random.Random(0).sample(ids, min(count, len(ids)))
+    if not ids:
+        return []
+    return [record.vector for record in client.retrieve(collection_name, ids=ids, with_vectors=True)]
+
+
+def measure_search_latency(client, collection_name: str, vectors: List[List[float]], top_k: int = 8) -> Dict[str, float]:
+    """Search with each query vector and return p50 and p95 latency in milliseconds."""
+    latencies = []
+    for vector in vectors:
+        start = time.perf_counter()
+        client.search(collection_name=collection_name, query_vector=vector, limit=top_k, with_payload=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+    if not latencies:
+        return {'p50_ms': 0.0, 'p95_ms': 0.0}
+    p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+    return {'p50_ms': round(statistics.median(latencies), 3), 'p95_ms': round(p95, 3)}
+
+
+def optimize_collection(vector_manager: VectorStoreManager, collection_name: str, timeout: float = 300.0) -> str:
+    """Ask Qdrant to vacuum deleted points now and wait until the collection is green again.
+
+    The vacuum thresholds are lowered for the run and restored afterwards.
+    Local mode applies deletions immediately and has no optimizer.
+
+    Returns:
+        Final collection status
+    """
+    client = vector_manager.client
+    if not vector_manager.using_cloud:
+        return "local"
+    previous = client.get_collection(collection_name).config.optimizer_config
+    client.update_collection(
+        collection_name,
+        optimizers_config=OptimizersConfigDiff(deleted_threshold=0.0001, vacuum_min_vector_number=1)
+    )
+    deadline = time.time() + timeout
+    status = str(client.get_collection(collection_name).status)
+    while "green" not in status.lower() and time.time() < deadline:
+        time.sleep(1)
+        status = str(client.get_collection(collection_name).status)
+    client.update_collection(
+        collection_name,
+        optimizers_config=OptimizersConfigDiff(
+            deleted_threshold=previous.deleted_threshold,
+            vacuum_min_vector_number=previous.vacuum_min_vector_number
+        )
+    )
+    return status
+
+
+def _delete_points(client, collection_name: str, ids: List[str]) -> None:
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        client.delete(collection_name, points_selector=PointIdsList(points=ids[start:start + DELETE_BATCH_SIZE]), wait=True)
+
+
+def _merge_sources(client, collection_name: str, kept_id: str, sources: List[Dict[str, Any]]) -> None:
+    records = client.retrieve(collection_name, ids=[kept_id], with_payload=True)
+    if not records:
+        return
+    metadata = (records[0].payload or {}).get('metadata', {})
+    # Chunks stored without near-duplicate detection have no sources list yet
+    existing = metadata.get('sources') or [_source_of(metadata)]
+    merged = existing + [source for source in sources if source and source not in existing]
+    if merged != existing:
+        client.set_payload(collection_name, payload={'sources': merged}, points=[kept_id], key="metadata")
+
+
+def _rehome(client, collection_name: str, point_id: str, sources: List[Dict[str, Any]]) -> None:
+    """Keep only the remaining sources of a chunk and move it to the first of them."""
+    payload = {field: sources[0].get(field, "") for field in SOURCE_FIELDS}
+    payload['sources'] = sources
+    client.set_payload(collection_name, payload=payload, points=[point_id], key="metadata")
+
+
+def run_maintenance(
+    vector_manager: VectorStoreManager,
+    data_dir: str = "./data",
+    delete: bool = False,
+    near_duplicates: bool = False,
+    threshold: float = 0.95,
+    page_size: int = 256,
+    latency_queries: int = 50
+) -> Dict[str, Any]:
+    """Check every collection and, with ``delete``, remove the findings and compact.
+
+    Args:
+        vector_manager: VectorStoreManager of the collections
+        data_dir: Data directory with the source PDFs
+        delete: Delete the findings; otherwise only report them
+        near_duplicates: Also look for near-duplicate chunks
+        threshold: Near-duplicate similarity threshold
+        page_size: Points per scroll request
+        latency_queries: Searches per collection for the latency comparison
+
+    Returns:
+        Report with findings, ledger issues, reclaimed memory and search latency per collection
+    """
+    ledger = IngestionLedger(vector_manager.database)
+    data_files = {path.name for path in Path(data_dir).glob("**/*.pdf")}
+    ledger_entries = ledger.entries()
+    ledger_files = {Path(entry['path']).name for entry in ledger_entries}
+
+    report: Dict[str, Any] = {'deleted': delete, 'collections': []}
+    files_with_points: Set[str] = set()
+    for collection_name in vector_manager.collection_names():
+        result = check_collection(
+            vector_manager, collection_name, data_files, ledger_files, near_duplicates, threshold, page_size
+        )
+        files_with_points |= result.pop('files_with_points')
+        removed_ids = [f['id'] for finding in FINDINGS for f in result['findings'][finding]]
+        result['counts'] = {finding: len(result['findings'][finding]) for finding in FINDINGS}
+        result['removable_points'] = len(removed_ids)
+        result['rehomed_points'] = len(result['rehomed'])
+        result['reclaimable_bytes'] = sum(
+            VECTOR_SIZE * 4 + f['bytes'] for finding in FINDINGS for f in result['findings'][finding]
+        )
+
+        if delete:
+            for chunk in result['rehomed']:
+                _rehome(vector_manager.client, collection_name, chunk['id'], chunk['sources'])
+        if delete and removed_ids:
+            client = vector_manager.client
+            vectors = sample_query_vectors(client, collection_name, set(removed_ids), latency_queries)
+            result['latency_before'] = measure_search_latency(client, collection_name, vectors)
+            for duplicate in result['findings'][NEAR_DUPLICATE]:
+                _merge_sources(client, collection_name, duplicate['kept_id'],
+                               [duplicate['source']] + duplicate['sources'])
+            _delete_points(client, collection_name, removed_ids)
+            for finding in (DELETED_FILE, INCOMPLETE_FILE):
+                for ref_doc_id in {f['ref_doc_id'] for f in result['findings'][finding] if f['ref_doc_id']}:
+                    vector_manager.docstore.delete_ref_doc(ref_doc_id, raise_error=False)
+            # Otherwise new chunks would be collapsed into chunks that no longer exist
+            forget_signatures(vector_manager.database, result['removed_dedup_ids'])
+            result['optimizer_status'] = optimize_collection(vector_manager, collection_name)
+            result['latency_after'] = measure_search_latency(client, collection_name, vectors)
+            result['remaining_points'] = client.count(collection_name, exact=True).count
+        result['removed_dedup_ids'] = len(result['removed_dedup_ids'])
+        result['kept_dedup_ids'] = len(result['kept_dedup_ids'])
+        report['collections'].append(result)
+
+    # Ledger entries of deleted files keep a restored file from being ingested again, and ledger
+    # entries without any point (e.g. after the collection was recreated) hide the file from search
+    stale = [entry['path'] for entry in ledger_entries if Path(entry['path']).name not in data_files]
+    without_points = [entry['path'] for entry in ledger_entries
+                      if Path(entry['path']).name in data_files and Path(entry['path']).name not in files_with_points]
+    report['ledger'] = {'entries': len(ledger_entries), 'deleted_files': stale, 'without_points': without_points}
+    if delete:
+        for path in stale + without_points:
+            ledger.remove(path)
+    report['reclaimable_bytes'] = sum(c['reclaimable_bytes'] for c in report['collections'])
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = []
+    for collection in report['collections']:
+        counts = collection['counts']
+        lines.append(
+            f"{collection['collection']}: {collection['points']} points, "
+            + ", ".join(f"{counts[finding]} {finding.replace('_', ' ')}" for finding in FINDINGS)
+            + f", {collection['without_file_name']} without file name, {collection['in_progress']} in progress"
+        )
+        if collection['rehomed_points']:
+            verb = "moved" if report['deleted'] else "to move"
+            lines.append(f"  {collection['rehomed_points']} points of deleted files {verb} to the files still in their sources")
+        if collection.get('latency_before'):
+            before, after = collection['latency_before'], collection['latency_after']
+            lines.append(
+                f"  deleted {collection['removable_points']} points ({collection['remaining_points']} left, "
+                f"optimizer: {collection['optimizer_status']}), search p50 {before['p50_ms']} -> {after['p50_ms']} ms, "
+                f"p95 {before['p95_ms']} -> {after['p95_ms']} ms"
+            )
+    ledger = report['ledger']
+    lines.append(f"Ledger: {ledger['entries']} entries, {len(ledger['deleted_files'])} for deleted files, "
+                 f"{len(ledger['without_points'])} without points"
+                 + (" (removed, the files are ingested again)" if report['deleted'] and ledger['without_points'] else ""))
+    verb = "Reclaimed" if report['deleted'] else "Reclaimable"
+    lines.append(f"{verb}: ~{report['reclaimable_bytes'] / 1e6:.2f} MB of vectors and payloads")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the collections against the ledger and data/, and compact them")
+    parser.add_argument("--data-dir", default="./data")
+    parser.add_argument("--delete", action="store_true", help="Delete the findings and vacuum the collections")
+    parser.add_argument("--near-duplicates", action="store_true", help="Also find near-duplicate chunks")
+    parser.add_argument("--threshold", type=float, default=0.95, help="Near-duplicate similarity threshold")
+    parser.add_argument("--page-size", type=int, default=256)
+    parser.add_argument("--latency-queries", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    # The ingestion worker may be running: its unpublished points are neither published nor touched
+    if os.getenv("QDRANT_URL") and os.getenv("QDRANT_API_KEY"):
+        vector_manager = VectorStoreManager(qdrant_url=os.getenv("QDRANT_URL"), qdrant_api_key=os.getenv("QDRANT_API_KEY"),
+                                            publish_interrupted_run=False)
+    else:
+        vector_manager = VectorStoreManager(local_path="./qdrant_data", publish_interrupted_run=False)
+
+    report = run_maintenance(
+        vector_manager,
+        data_dir=args.data_dir,
+        delete=args.delete,
+        near_duplicates=args.near_duplicates,
+        threshold=args.threshold,
+        page_size=args.page_size,
+        latency_queries=args.latency_queries
+    )
+    print(json.dumps(report, indent=2, default=str) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""Export and import of the vector collection as a single snapshot file.
+
+A snapshot holds every point of the collection (vectors as one contiguous
+little-endian float32 array, payloads as JSON lines), the docstore/index
+store rows and the ingestion ledger, plus version metadata and SHA-256
+checksums. A new node that imports a snapshot is ready to serve without any
+LlamaParse or embedding call.
+
+Usage:
+    python index_snapshot.py export snapshots/fbl_rag.fblsnap
+    python index_snapshot.py verify snapshots/fbl_rag.fblsnap
+    python index_snapshot.py import snapshots/fbl_rag.fblsnap
+"""
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import time
+import numpy as np
+from qdrant_client.models import Distance, PointStruct, VectorParams
+from sqlite_store import IngestionLedger
+
+SNAPSHOT_MAGIC = b"FBLSNAP1"
+SNAPSHOT_FORMAT_VERSION = 1
+# Sections start at multiples of this so the vector block can be memory-mapped directly
+SECTION_ALIGNMENT = 64
+VECTOR_DTYPE = "<f4"
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot is corrupt or does not fit the target node."""
+
+
+def _sha256_file(path: str, offset: int = 0, length: Optional[int] = None, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(offset)
+        remaining = length
+        while remaining is None or remaining > 0:
+            block = f.read(block_size if remaining is None else min(block_size, remaining))
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest.hexdigest()
+
+
+def _align(offset: int) -> int:
+    return (offset + SECTION_ALIGNMENT - 1) // SECTION_ALIGNMENT * SECTION_ALIGNMENT
+
+
+def _relative_to(path: str, base: Path) -> str:
+    try:
+        return str(Path(path).resolve().relative_to(base.resolve()))
+    except ValueError:
+        return path
+
+
+def export_snapshot(
+    vector_manager,
+    output_path: str,
+    data_dir: str = "./data",
+    metadata: Optional[Dict[str, Any]] = None,
+    page_size: int = 1024
+) -> Dict[str, Any]:
+    """Write the collection, docstore and ingestion ledger to a snapshot file.
+
+    Points are read page by page and streamed to temporary section files, so
+    memory use does not grow with the collection.
+
+    Args:
+        vector_manager: VectorStoreManager of the collection to export
+        output_path: Snapshot file to write
+        data_dir: Data directory; ledger paths are stored relative to it
+        metadata: Extra version metadata, e.g. the corpus version and chunking settings
+        page_size: Points read per scroll request
+
+    Returns:
+        The snapshot header
+    """
+    start = time.perf_counter()
+    client = vector_manager.client
+    collection_info = client.get_collection(vector_manager.collection_name)
+    vectors_config = collection_info.config.params.vectors
+    vector_size = vectors_config.size
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=str(Path(output_path).parent))
+    vectors_path = os.path.join(tmp_dir, "vectors")
+    payloads_path = os.path.join(tmp_dir, "payloads")
+    count = 0
+    try:
+        with open(vectors_path, "wb") as vectors_file, open(payloads_path, "w") as payloads_file:
+            offset = None
+            while True:
+                records, offset = client.scroll(
+                    collection_name=vector_manager.collection_name,
+                    limit=page_size,
+                    offset=offset,
+                    with_payload=True,
+                    with_vectors=True
+                )
+                if records:
+                    vectors_file.write(np.asarray([r.vector for r in records], dtype=VECTOR_DTYPE).tobytes())
+                    for record in records:
+                        payloads_file.write(json.dumps({'id': record.id, 'payload': record.payload}) + "\n")
+                    count += len(records)
+                if offset is None:
+                    break
+
+        data_path = Path(data_dir)
+        ledger_entries = [
+            {**entry, 'path': _relative_to(entry['path'], data_path)}
+            for entry in IngestionLedger(vector_manager.database).entries()
+        ]
+        store = {'kv': vector_manager.database.dump_kv(), 'ledger': ledger_entries}
+        store_bytes = json.dumps(store).encode("utf-8")
+
+        sections = {
+            'vectors': (vectors_path, os.path.getsize(vectors_path)),
+            'payloads': (payloads_path, os.path.getsize(payloads_path)),
+        }
+        header = {
+            'format_version': SNAPSHOT_FORMAT_VERSION,
+            'created_at': time.time(),
+            'collection': vector_manager.collection_name,
+            'count': count,
+            'vector_size': vector_size,
+            'distance': str(vectors_config.distance.value if hasattr(vectors_config.distance, 'value')
+                            else vectors_config.distance),
+            'dtype': VECTOR_DTYPE,
+            'embedding_model': getattr(vector_manager.embed_model, 'model_name', None),
+            'ingest_version': int(vector_manager.database.get_meta("ingest_version") or 0),
+            **(metadata or {}),
+            'sections': {
+                'vectors': {'sha256': _sha256_file(vectors_path), 'length': sections['vectors'][1]},
+                'payloads': {'sha256': _sha256_file(payloads_path), 'length': sections['payloads'][1]},
+                'store': {'sha256': hashlib.sha256(store_bytes).hexdigest(), 'length': len(store_bytes)},
+            }
+        }
+
+        # Offsets depend on the header length, which depends on the offsets; reserve room for them
+        header['sections']['vectors']['offset'] = 0
+        header['sections']['payloads']['offset'] = 0
+        header['sections']['store']['offset'] = 0
+        header_length = len(json.dumps(header).encode("utf-8")) + 64
+        offset = _align(len(SNAPSHOT_MAGIC) + 8 + header_length)
+        for name in ('vectors', 'payloads', 'store'):
+            header['sections'][name]['offset'] = offset
+            offset = _align(offset + header['sections'][name]['length'])
+        header_bytes = json.dumps(header).encode("utf-8").ljust(header_length)
+
+        tmp_output = f"{output_path}.tmp"
+        with open(tmp_output, "wb") as out:
+            out.write(SNAPSHOT_MAGIC)
+            out.write(struct.pack("<Q", header_length))
+            out.write(header_bytes)
+            for name in ('vectors', 'payloads'):
+                out.write(b"\0" * (header['sections'][name]['offset'] - out.tell()))
+                with open(sections[name][0], "rb") as section_file:
+                    for block in iter(lambda: section_file.read(1 << 20), b""):
+                        out.write(block)
+            out.write(b"\0" * (header['sections']['store']['offset'] - out.tell()))
+            out.write(store_bytes)
+        # Replace atomically so readers never see a half-written snapshot
+        os.replace(tmp_output, output_path)
+    finally:
+        for path in (vectors_path, payloads_path):
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(tmp_dir)
+
+    print(f"Exported {count} points to {output_path} ({os.path.getsize(output_path) / 1e6:.1f} MB) "
+          f"in {time.perf_counter() - start:.2f}s")
+    return header
+
+
+def read_header(path: str) -> Dict[str, Any]:
+    """Read the header of a snapshot file."""
+    with open(path, "rb") as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise SnapshotError(f"{path} is not an index snapshot")
+        (header_length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_length).decode("utf-8").rstrip())
+    if header.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot format version {header.get('format_version')}")
+    return header
+
+
+def verify_snapshot(path: str) -> Dict[str, Any]:
+    """Check the checksums of all sections.
+
+    Returns:
+        The snapshot header
+
+    Raises:
+        SnapshotError: If a section does not match its checksum
+    """
+    header = read_header(path)
+    for name, section in header['sections'].items():
+        if _sha256_file(path, section['offset'], section['length']) != section['sha256']:
+            raise SnapshotError(f"Checksum mismatch in section '{name}' of {path}")
+    expected_vector_bytes = header['count'] * header['vector_size'] * np.dtype(header['dtype']).itemsize
+    if header['sections']['vectors']['length'] != expected_vector_bytes:
+        raise SnapshotError(f"Vector section of {path} does not hold {header['count']} vectors")
+    return header
+
+
+class SnapshotReader:
+    """Read-only view of a snapshot with memory-mapped vectors.
+
+    Vectors are not copied into memory; pages are loaded by the OS on demand,
+    so a node can search a snapshot right after opening it.
+    """
+
+    def __init__(self, path: str, verify: bool = True):
+        self.path = path
+        self.header = verify_snapshot(path) if verify else read_header(path)
+        section = self.header['sections']['vectors']
+        shape = (self.header['count'], self.header['vector_size'])
+        self.vectors = np.memmap(path, dtype=self.header['dtype'], mode="r", offset=section['offset'], shape=shape) \
+            if self.header['count'] else np.zeros(shape, dtype=self.header['dtype'])
+        self._payloads: Optional[List[Dict[str, Any]]] = None
+
+    def iter_payloads(self) -> Iterator[Dict[str, Any]]:
+        """Yield {'id', 'payload'} records in vector order."""
+        section = self.header['sections']['payloads']
+        with open(self.path, "rb") as f:
+            f.seek(section['offset'])
+            remaining = section['length']
+            while remaining > 0:
+                line = f.readline(remaining)
+                remaining -= len(line)
+                if line.strip():
+                    yield json.loads(line)
+
+    @property
+    def payloads(self) -> List[Dict[str, Any]]:
+        if self._payloads is None:
+            self._payloads = list(self.iter_payloads())
+        return self._payloads
+
+    def read_store(self) -> Dict[str, Any]:
+        section = self.header['sections']['store']
+        with open(self.path, "rb") as f:
+            f.seek(section['offset'])
+            return json.loads(f.read(section['length']).decode("utf-8"))
+
+    def search(self, query_embedding: List[float], top_k: int = 5) -> List[Tuple[float, Dict[str, Any]]]:
+        """Brute-force cosine search over the memory-mapped vectors."""
+        if not self.header['count']:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norms = np.linalg.norm(self.vectors, axis=1) * (np.linalg.norm(query) or 1.0)
+        scores = (self.vectors @ query) / np.where(norms == 0, 1.0, norms)
+        best = np.argsort(-scores)[:top_k]
+        return [(float(scores[i]), self.payloads[i]) for i in best]
+
+
+def import_snapshot(
+    vector_manager,
+    path: str,
+    data_dir: str = "./data",
+    batch_size: int = 2048,
+    parallel: int = 1,
+    recreate: bool = True,
+    force: bool = False
+) -> Dict[str, Any]:
+    """Bulk-load a snapshot into the collection, docstore and ingestion ledger.
+
+    Args:
+        vector_manager: VectorStoreManager of the target collection
+        path: Snapshot file
+        data_dir: Data directory the ledger paths are resolved against
+        batch_size: Points per upsert request
+        parallel: Number of parallel upload workers (Qdrant server only)
+        recreate: Drop and recreate the collection before loading
+        force: Import even if the snapshot was made with a different embedding model
+
+    Returns:
+        The snapshot header
+    """
+    start = time.perf_counter()
+    reader = SnapshotReader(path)
+    header = reader.header
+    model = getattr(vector_manager.embed_model, 'model_name', None)
+    if not force and header.get('embedding_model') and model and header['embedding_model'] != model:
+        raise SnapshotError(f"Snapshot was embedded with {header['embedding_model']}, this node uses {model}")
+
+    client = vector_manager.client
+    if recreate:
+        client.delete_collection(vector_manager.collection_name)
+        client.create_collection(
+            collection_name=vector_manager.collection_name,
+            vectors_config=VectorParams(size=header['vector_size'], distance=Distance(header['distance']))
+        )
+
+    def points() -> Iterator[PointStruct]:
+        for i, record in enumerate(reader.iter_payloads()):
+            yield PointStruct(id=record['id'], vector=reader.vectors[i].tolist(), payload=record['payload'])
+
+    client.upload_points(
+        collection_name=vector_manager.collection_name,
+        points=points(),
+        batch_size=batch_size,
+        parallel=parallel if vector_manager.using_cloud else 1,
+        wait=True
+    )
+
+    store = reader.read_store()
+    vector_manager.database.load_kv([tuple(row) for row in store['kv']])
+    data_path = Path(data_dir)
+    IngestionLedger(vector_manager.database).record_many([
+        {**entry, 'path': entry['path'] if os.path.isabs(entry['path'])
+         else str((data_path / entry['path']).absolute())}
+        for entry in store['ledger']
+    ])
+
+    if header.get('ingest_version'):
+        # Points carry the ingestion version they were written with, make them visible
+        vector_manager.publish_ingest_version(header['ingest_version'])
+
+    print(f"Imported {header['count']} points from {path} in {time.perf_counter() - start:.2f}s")
+    return header
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export, verify and import index snapshots")
+    parser.add_argument("command", choices=["export", "import", "verify", "info"])
+    parser.add_argument("path", help="Snapshot file")
+    parser.add_argument("--batch-size", type=int, default=2048)
+    parser.add_argument("--parallel", type=int, default=1)
+    parser.add_argument("--force", action="store_true", help="Import despite an embedding model mismatch")
+    args = parser.parse_args()
+
+    if args.command in ("verify", "info"):
+        header = verify_snapshot(args.path) if args.command == "verify" else read_header(args.path)
+        print(json.dumps(header, indent=2))
+        if args.command == "verify":
+            print("Checksums OK")
+        return
+
+    from dotenv import load_dotenv
+    from vector_store_manager import VectorStoreManager
+    load_dotenv()
+    if os.getenv("QDRANT_URL") and os.getenv("QDRANT_API_KEY"):
+        vector_manager = VectorStoreManager(qdrant_url=os.getenv("QDRANT_URL"), qdrant_api_key=os.getenv("QDRANT_API_KEY"))
+    else:
+        vector_manager = VectorStoreManager(local_path="./qdrant_data")
+
+    if args.command == "export":
+        export_snapshot(vector_manager, args.path, metadata=snapshot_metadata(vector_manager))
+    else:
+        import_snapshot(vector_manager, args.path, batch_size=args.batch_size, parallel=args.parallel, force=args.force)
+
+
+def snapshot_metadata(vector_manager) -> Dict[str, Any]:
+    """Version metadata recorded in a snapshot: corpus version and ingestion settings."""
+    processed_files = sorted(IngestionLedger(vector_manager.database).get_processed_files())
+    file_hashes = sorted(entry['file_hash'] or entry['path'] for entry in IngestionLedger(vector_manager.database).entries())
+    return {
+        'corpus_version': hashlib.sha1(json.dumps(file_hashes).encode("utf-8")).hexdigest()[:16],
+        'files': len(processed_files),
+        'chunking_strategy': os.getenv("CHUNKING_STRATEGY", "markdown"),
+        'indexing_mode': os.getenv("INDEXING_MODE", "chunk"),
+    }
+
+
+if __name__ == "__main__":
+    main()
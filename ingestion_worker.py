@@ -0,0 +1,283 @@
+"""Background ingestion of new documents while the API keeps serving.
+
+A single worker thread runs ingestion jobs one at a time. Jobs are submitted
+by the admin endpoint or by a polling watcher on the data directory, and a
+job that is still queued absorbs later submissions, so a burst of copied
+files results in one run.
+
+Every run writes its points with a new ingestion version (see
+VectorStoreManager.begin_ingest). Queries filter on the version of the index
+state they started with, and the points of a file that failed part-way are
+discarded before the run is published, so queries never see a half-ingested
+file. Once the run is published and the replaced points of changed files are
+deleted, the worker calls the ingest listeners of the document processor,
+which swap in the new state; requests already in flight keep the state they
+captured.
+"""
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import queue
+import threading
+import time
+import uuid
+from metrics import REGISTRY
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATUSES = (SUCCEEDED, FAILED)
+
+# Finished jobs kept for the admin endpoint
+MAX_JOB_HISTORY = 50
+
+
+class IngestionJob:
+    """One ingestion run with its status and a log of progress events."""
+
+    def __init__(self, trigger: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.trigger = trigger
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.ingest_version: Optional[int] = None
+        self.published = False
+        self.error: Optional[str] = None
+        self.events: List[Dict[str, Any]] = []
+        self._condition = threading.Condition()
+
+    def log(self, message: str) -> None:
+        """Append a progress event and wake up readers of the event stream."""
+        with self._condition:
+            self.events.append({'time': round(time.time(), 3), 'message': message})
+            self._condition.notify_all()
+
+    def set_status(self, status: str, error: Optional[str] = None) -> None:
+        with self._condition:
+            self.status = status
+            if status == RUNNING:
+                self.started_at = time.time()
+            elif status in FINISHED_STATUSES:
+                self.finished_at = time.time()
+            self.error = error
+            self.events.append({'time': round(time.time(), 3), 'status': status})
+            self._condition.notify_all()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def wait_for_events(self, cursor: int, timeout: float = 15.0) -> Tuple[List[Dict[str, Any]], bool]:
+        """Block until there are events after ``cursor`` or the job has finished.
+
+        Args:
+            cursor: Number of events the caller has already seen
+            timeout: Longest time to wait in seconds
+
+        Returns:
+            New events and whether the job has finished
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self.events) > cursor or self.finished, timeout=timeout)
+            return list(self.events[cursor:]), self.finished
+
+    def to_dict(self, include_events: bool = False) -> Dict[str, Any]:
+        result = {
+            'id': self.id,
+            'trigger': self.trigger,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'duration_s': round(self.finished_at - self.started_at, 3)
+            if self.started_at and self.finished_at else None,
+            'ingest_version': self.ingest_version,
+            'published': self.published,
+            'error': self.error,
+        }
+        if include_events:
+            result['events'] = list(self.events)
+        return result
+
+
+class IndexState:
+    """Query engines and tools built for one published ingestion version."""
+
+    def __init__(self, version: int, tools: List[Any], security_query_engine: Any = None):
+        self.version = version
+        self.tools = tools
+        self.security_query_engine = security_query_engine
+        self.created_at = time.time()
+
+
+class LiveIndex:
+    """Holds the current IndexState; requests read it once and keep it until they finish."""
+
+    def __init__(self, state: IndexState):
+        self._state = state
+        self._lock = threading.Lock()
+        self._version_gauge = REGISTRY.gauge("index_live_version", "Ingestion version served by the query engine")
+        self._version_gauge.set(state.version)
+
+    @property
+    def current(self) -> IndexState:
+        with self._lock:
+            return self._state
+
+    def swap(self, state: IndexState) -> IndexState:
+        """Serve a new state from the next request on and return the previous one."""
+        with self._lock:
+            previous, self._state = self._state, state
+        self._version_gauge.set(state.version)
+        print(f"Query engine swapped from ingestion version {previous.version} to {state.version}")
+        return previous
+
+
+class IngestionWorker:
+    """Runs DocumentProcessor.process_documents in a background thread."""
+
+    def __init__(self, doc_processor, vector_manager, poll_interval: float = 10.0):
+        """Initialize the worker.
+
+        Args:
+            doc_processor: DocumentProcessor that ingests the data directory
+            vector_manager: VectorStoreManager the processor writes to
+            poll_interval: Seconds between scans of the data directory; 0 disables watching
+        """
+        self.doc_processor = doc_processor
+        self.vector_manager = vector_manager
+        self.poll_interval = poll_interval
+        self._queue: "queue.Queue[Optional[IngestionJob]]" = queue.Queue()
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._lock = threading.RLock()
+        # Only one run at a time, whether started by the worker thread or by run_now()
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._job_counter = REGISTRY.counter("ingestion_jobs_total", "Ingestion jobs by final status")
+        self._job_duration = REGISTRY.histogram(
+            "ingestion_job_duration_seconds", "Duration of ingestion jobs",
+            buckets=(1, 5, 15, 60, 300, 900, 3600)
+        )
+
+    def _remember(self, job: IngestionJob) -> None:
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [j for j in self._jobs.values() if j.finished]
+            for old in sorted(finished, key=lambda j: j.created_at)[:max(0, len(self._jobs) - MAX_JOB_HISTORY)]:
+                del self._jobs[old.id]
+
+    def submit(self, trigger: str = "manual") -> IngestionJob:
+        """Queue an ingestion job, or return the job that is already waiting to run."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == QUEUED:
+                    job.log(f"Also requested by '{trigger}'")
+                    return job
+            job = IngestionJob(trigger)
+            self._remember(job)
+            job.log(f"Queued by '{trigger}'")
+            self._queue.put(job)
+            return job
+
+    def run_now(self, trigger: str = "startup") -> IngestionJob:
+        """Run an ingestion job in the calling thread."""
+        job = IngestionJob(trigger)
+        self._remember(job)
+        self._run(job)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[IngestionJob]:
+        """Return the known jobs, most recent first."""
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def _run(self, job: IngestionJob) -> None:
+        with self._run_lock:
+            job.set_status(RUNNING)
+            version = self.vector_manager.begin_ingest()
+            job.ingest_version = version
+            try:
+                success = self.doc_processor.process_documents(progress=job.log)
+            except Exception as e:
+                success = False
+                job.log(f"Ingestion failed: {e}")
+            finally:
+                job.published = self.vector_manager.end_ingest(version)
+            if job.published:
+                job.log(f"Published ingestion version {version}")
+                # Only now are the new points visible and the replaced ones gone
+                for listener in self.doc_processor.ingest_listeners:
+                    try:
+                        listener()
+                    except Exception as e:
+                        job.log(f"Error notifying ingest listener: {e}")
+            job.set_status(SUCCEEDED if success else FAILED,
+                           error=None if success else "Some documents failed to process")
+        self._job_counter.inc(labels={'status': job.status})
+        self._job_duration.observe(job.finished_at - job.started_at)
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                self._run(job)
+            except Exception as e:
+                print(f"Error running ingestion job {job.id}: {e}")
+                job.set_status(FAILED, error=str(e))
+
+    def _snapshot_data_dir(self) -> Dict[str, Tuple[float, int]]:
+        files = {}
+        for path in Path(self.doc_processor.data_dir).glob("**/*.pdf"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files[str(path.absolute())] = (stat.st_mtime, stat.st_size)
+        return files
+
+    def _watch(self) -> None:
+        """Poll the data directory and submit a job once new or changed files stop changing."""
+        known = self._snapshot_data_dir()
+        pending: Optional[Dict[str, Tuple[float, int]]] = None
+        while not self._stop.wait(self.poll_interval):
+            current = self._snapshot_data_dir()
+            if pending is not None:
+                if current == pending:
+                    # Unchanged for a full interval, so files are no longer being copied
+                    changed = sorted(path for path, entry in current.items() if known.get(path) != entry)
+                    job = self.submit(trigger="watcher")
+                    job.log(f"Detected {len(changed)} new or changed files")
+                    known, pending = current, None
+                else:
+                    pending = current
+            elif current != known:
+                if any(known.get(path) != entry for path, entry in current.items()):
+                    pending = current
+                else:
+                    # Only deletions, which ingestion does not act on
+                    known = current
+
+    def start(self) -> None:
+        """Start the worker thread and, with a poll interval, the data directory watcher."""
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._work, name="ingestion-worker", daemon=True)]
+        if self.poll_interval > 0:
+            self._threads.append(threading.Thread(target=self._watch, name="ingestion-watcher", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
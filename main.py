@@ -37,7 +37,14 @@ def main():
     print("Initializing agent and processing documents...")
     get_agent()
     print("Agent initialization complete")
-    
+
+    # Anonymised request log for traffic_replay.py
+    capture_path = os.getenv("TRAFFIC_CAPTURE_PATH")
+    if capture_path:
+        print(f"Capturing anonymised traffic to {capture_path}")
+        if int(os.getenv("WARMUP_TOP_N", "0")) > 0:
+            print("Query log disabled while traffic is captured; warm-up uses the logged questions so far")
+
     # Get configuration from environment variables
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "8080"))  # Changed default port to 8080 to avoid conflicts
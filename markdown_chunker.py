@@ -0,0 +1,335 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import re
+from llama_index.core import Document
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import TextNode
+from llama_index.core.utils import get_tokenizer
+
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+LIST_ITEM_PATTERN = re.compile(r'^\s*(?:[-*+•]|\d+[.)]|[a-zA-Z][.)])\s+')
+TABLE_ROW_PATTERN = re.compile(r'^\s*\|')
+FENCE_PATTERN = re.compile(r'^\s*(```|~~~)')
+HEADING_PATH_SEPARATOR = ' > '
+
+
+class MarkdownChunker:
+    """Split LlamaParse markdown along its heading structure.
+
+    Every heading opens a section. Sections are emitted whole when they fit in
+    ``chunk_size`` tokens, subsections and sibling sections are merged into the
+    preceding chunk while they fit, and only oversize sections are
+    broken up. Tables and bullet lists are kept as atomic blocks; a block is only
+    split (by rows, by items, and finally by sentences) when it alone exceeds
+    the chunk size. The full heading path is recorded on every chunk.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 1024,
+        chunk_overlap: int = 32,
+        tokenizer: Optional[Callable[[str], List[Any]]] = None
+    ):
+        """Initialize the chunker.
+
+        Args:
+            chunk_size: Maximum number of tokens per chunk
+            chunk_overlap: Token overlap used only when an oversize block falls back to sentence splitting
+            tokenizer: Optional tokenizer callable, defaults to the LlamaIndex tokenizer
+        """
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._tokenizer = tokenizer or get_tokenizer()
+
+    def count_tokens(self, text: str) -> int:
+        """Return the number of tokens in text."""
+        return len(self._tokenizer(text))
+
+    def _parse_blocks(self, text: str) -> List[Tuple[str, str, int]]:
+        """Parse markdown text into (kind, text, heading_level) blocks.
+
+        Kinds are 'heading', 'table', 'list', 'code' and 'paragraph'.
+        """
+        blocks = []
+        lines = text.split('\n')
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            if not line.strip():
+                i += 1
+                continue
+
+            heading = HEADING_PATTERN.match(line)
+            if heading:
+                blocks.append(('heading', heading.group(2).strip(), len(heading.group(1))))
+                i += 1
+                continue
+
+            if FENCE_PATTERN.match(line):
+                fence = FENCE_PATTERN.match(line).group(1)
+                block_lines = [line]
+                i += 1
+                while i < len(lines):
+                    block_lines.append(lines[i])
+                    i += 1
+                    if lines[i - 1].strip().startswith(fence):
+                        break
+                blocks.append(('code', '\n'.join(block_lines), 0))
+                continue
+
+            if TABLE_ROW_PATTERN.match(line):
+                block_lines = []
+                while i < len(lines) and TABLE_ROW_PATTERN.match(lines[i]):
+                    block_lines.append(lines[i])
+                    i += 1
+                blocks.append(('table', '\n'.join(block_lines), 0))
+                continue
+
+            if LIST_ITEM_PATTERN.match(line):
+                block_lines = []
+                while i < len(lines):
+                    current = lines[i]
+                    if LIST_ITEM_PATTERN.match(current) or (current.strip() and current[:1].isspace()):
+                        block_lines.append(current)
+                        i += 1
+                    elif not current.strip():
+                        # A blank line only ends the list if no further item follows
+                        j = i
+                        while j < len(lines) and not lines[j].strip():
+                            j += 1
+                        if j < len(lines) and LIST_ITEM_PATTERN.match(lines[j]):
+                            i = j
+                        else:
+                            break
+                    else:
+                        break
+                blocks.append(('list', '\n'.join(block_lines), 0))
+                continue
+
+            block_lines = []
+            while i < len(lines) and lines[i].strip():
+                if block_lines and (
+                    HEADING_PATTERN.match(lines[i])
+                    or TABLE_ROW_PATTERN.match(lines[i])
+                    or LIST_ITEM_PATTERN.match(lines[i])
+                    or FENCE_PATTERN.match(lines[i])
+                ):
+                    break
+                block_lines.append(lines[i])
+                i += 1
+            blocks.append(('paragraph', '\n'.join(block_lines), 0))
+        return blocks
+
+    def _sentence_split(self, text: str, budget: int) -> List[str]:
+        """Fall back to sentence splitting for text without usable structure."""
+        splitter = SentenceSplitter(
+            chunk_size=budget,
+            chunk_overlap=min(self.chunk_overlap, budget // 4)
+        )
+        return splitter.split_text(text)
+
+    def _split_block(self, kind: str, text: str, budget: int) -> List[str]:
+        """Split a single block that exceeds the token budget."""
+        if kind == 'table':
+            rows = text.split('\n')
+            # Repeat the header and separator rows on every piece of the table
+            header = rows[:2] if len(rows) > 2 and set(rows[1].replace('|', '').strip()) <= set('-: ') else rows[:1]
+            return self._pack_units(rows[len(header):], '\n', budget, prefix='\n'.join(header))
+        if kind == 'list':
+            items = []
+            for line in text.split('\n'):
+                if LIST_ITEM_PATTERN.match(line) or not items:
+                    items.append(line)
+                else:
+                    items[-1] += '\n' + line
+            return self._pack_units(items, '\n', budget)
+        return self._sentence_split(text, budget)
+
+    def _pack_units(self, units: List[str], separator: str, budget: int, prefix: str = '') -> List[str]:
+        """Greedily pack units into pieces no larger than the token budget."""
+        pieces = []
+        current = []
+        current_tokens = self.count_tokens(prefix) if prefix else 0
+        base_tokens = current_tokens
+        for unit in units:
+            # Count the separator with the unit so joined pieces stay within budget
+            unit_tokens = self.count_tokens(unit + separator)
+            if unit_tokens + base_tokens > budget:
+                # A single row or item that is still too large is sentence split
+                if current:
+                    pieces.append(separator.join(([prefix] if prefix else []) + current))
+                    current, current_tokens = [], base_tokens
+                pieces.extend(self._sentence_split(unit, budget))
+                continue
+            if current and current_tokens + unit_tokens > budget:
+                pieces.append(separator.join(([prefix] if prefix else []) + current))
+                current, current_tokens = [], base_tokens
+            current.append(unit)
+            current_tokens += unit_tokens
+        if current:
+            pieces.append(separator.join(([prefix] if prefix else []) + current))
+        return pieces
+
+    def _split_section(self, heading_line: str, blocks: List[Tuple[str, str]]) -> List[str]:
+        """Pack the blocks of an oversize section into chunks, never splitting a block unless it is oversize."""
+        heading_tokens = self.count_tokens(heading_line + '\n\n') if heading_line else 0
+        budget = self.chunk_size - heading_tokens
+        pieces = []
+        current = [heading_line] if heading_line else []
+        current_tokens = heading_tokens
+        for kind, text in blocks:
+            block_tokens = self.count_tokens(text + '\n\n')
+            if block_tokens > budget:
+                if len(current) > (1 if heading_line else 0):
+                    pieces.append('\n\n'.join(current))
+                for part in self._split_block(kind, text, budget):
+                    pieces.append('\n\n'.join(([heading_line] if heading_line else []) + [part]))
+                current = [heading_line] if heading_line else []
+                current_tokens = heading_tokens
+                continue
+            if current_tokens + block_tokens > self.chunk_size and len(current) > (1 if heading_line else 0):
+                pieces.append('\n\n'.join(current))
+                current = [heading_line] if heading_line else []
+                current_tokens = heading_tokens
+            current.append(text)
+            current_tokens += block_tokens
+        if len(current) > (1 if heading_line else 0) or (not pieces and current):
+            pieces.append('\n\n'.join(current))
+        return pieces
+
+    def split_text(self, text: str, heading_stack: Optional[List[Tuple[int, str]]] = None) -> List[Dict[str, Any]]:
+        """Split markdown text into structure-aware chunks.
+
+        Args:
+            text: Markdown text to split
+            heading_stack: Optional list of (level, title) headings that are still open from a
+                previous page of the same document; it is updated in place
+
+        Returns:
+            List of dicts with 'text' and 'heading_path' (list of heading titles)
+        """
+        heading_stack = heading_stack if heading_stack is not None else []
+
+        # Group blocks into sections, each opened by a heading
+        sections = []
+        current_heading = ''
+        current_blocks = []
+        current_path = [title for _, title in heading_stack]
+        for kind, block_text, level in self._parse_blocks(text):
+            if kind == 'heading':
+                if current_heading or current_blocks:
+                    sections.append((current_path, current_heading, current_blocks))
+                while heading_stack and heading_stack[-1][0] >= level:
+                    heading_stack.pop()
+                heading_stack.append((level, block_text))
+                current_path = [title for _, title in heading_stack]
+                current_heading = f"{'#' * level} {block_text}"
+                current_blocks = []
+            else:
+                current_blocks.append((kind, block_text))
+        if current_heading or current_blocks:
+            sections.append((current_path, current_heading, current_blocks))
+
+        # Emit whole sections, merging small ones into their parent branch
+        chunks = []
+        for path, heading_line, blocks in sections:
+            section_text = '\n\n'.join(([heading_line] if heading_line else []) + [b for _, b in blocks])
+            section_tokens = self.count_tokens(section_text)
+            if section_tokens > self.chunk_size:
+                for piece in self._split_section(heading_line, blocks):
+                    chunks.append({'text': piece, 'heading_path': list(path), 'tokens': self.count_tokens(piece)})
+                continue
+
+            if chunks:
+                previous = chunks[-1]
+                previous_path = previous['heading_path']
+                # Subsections join their parent and siblings join each other, never unrelated branches
+                is_descendant = path[:len(previous_path)] == previous_path
+                is_sibling = len(path) == len(previous_path) > 1 and path[:-1] == previous_path[:-1]
+                merged_text = previous['text'] + '\n\n' + section_text
+                if (is_descendant or is_sibling) and previous['tokens'] + section_tokens <= self.chunk_size \
+                        and self.count_tokens(merged_text) <= self.chunk_size:
+                    common = []
+                    for a, b in zip(previous_path, path):
+                        if a != b:
+                            break
+                        common.append(a)
+                    previous['text'] = merged_text
+                    previous['heading_path'] = common
+                    previous['tokens'] = self.count_tokens(merged_text)
+                    continue
+            chunks.append({'text': section_text, 'heading_path': list(path), 'tokens': section_tokens})
+
+        return [{'text': c['text'], 'heading_path': c['heading_path']} for c in chunks if c['text'].strip()]
+
+    def get_nodes_from_documents(
+        self,
+        documents: List[Document],
+        heading_stack: Optional[List[Tuple[int, str]]] = None
+    ) -> List[TextNode]:
+        """Split documents into nodes, carrying the open headings across consecutive
+        documents (pages) of the same file.
+
+        Args:
+            documents: List of Document objects, in page order
+            heading_stack: Optional headings still open at the end of the previous page window
+                of the same file; it is updated in place
+
+        Returns:
+            List of TextNode objects with 'heading_path' and 'section' metadata
+        """
+        nodes = []
+        heading_stack = heading_stack if heading_stack is not None else []
+        current_file = None
+        for doc in documents:
+            metadata = doc.metadata.copy() if doc.metadata else {}
+            file_name = metadata.get('file_name') or metadata.get('file_path')
+            if current_file is not None and file_name != current_file:
+                heading_stack.clear()
+            current_file = file_name
+            for chunk in self.split_text(doc.text, heading_stack):
+                chunk_metadata = metadata.copy()
+                chunk_metadata.update({
+                    'heading_path': HEADING_PATH_SEPARATOR.join(chunk['heading_path']),
+                    'section': chunk['heading_path'][-1] if chunk['heading_path'] else ''
+                })
+                nodes.append(TextNode(text=chunk['text'], metadata=chunk_metadata))
+        return nodes
+
+
+def chunk_stats(texts: List[str], tokenizer: Optional[Callable[[str], List[Any]]] = None) -> Dict[str, int]:
+    """Return chunk count and token totals for a list of chunk texts."""
+    tokenizer = tokenizer or get_tokenizer()
+    token_counts = [len(tokenizer(text)) for text in texts]
+    return {
+        'chunks': len(token_counts),
+        'total_tokens': sum(token_counts),
+        'avg_tokens': sum(token_counts) // len(token_counts) if token_counts else 0,
+        'max_tokens': max(token_counts) if token_counts else 0
+    }
+
+
+def compare_chunking(
+    documents: List[Document],
+    chunker: Optional[MarkdownChunker] = None,
+    legacy_chunk_size: int = 512,
+    legacy_chunk_overlap: int = 150
+) -> Dict[str, Dict[str, int]]:
+    """Compare the markdown chunker against the legacy SentenceSplitter configuration.
+
+    Args:
+        documents: Parsed markdown documents
+        chunker: MarkdownChunker to evaluate, defaults to a new instance
+        legacy_chunk_size: Chunk size of the legacy splitter
+        legacy_chunk_overlap: Chunk overlap of the legacy splitter
+
+    Returns:
+        Dict with 'before' and 'after' chunk statistics
+    """
+    chunker = chunker or MarkdownChunker()
+    legacy_splitter = SentenceSplitter(chunk_size=legacy_chunk_size, chunk_overlap=legacy_chunk_overlap)
+    legacy_nodes = legacy_splitter.get_nodes_from_documents(documents)
+    markdown_nodes = chunker.get_nodes_from_documents(documents)
+    return {
+        'before': chunk_stats([n.text for n in legacy_nodes], chunker._tokenizer),
+        'after': chunk_stats([n.text for n in markdown_nodes], chunker._tokenizer)
+    }
@@ -0,0 +1,150 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class _Metric:
+    """Base class of a metric family with optional labels."""
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels: Optional[Dict[str, str]]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(sorted((labels or {}).items()))
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. rejected requests."""
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1.0, labels: Optional[Dict[str, str]] = None) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, labels: Optional[Dict[str, str]] = None) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. current queue depth."""
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def set(self, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, labels: Optional[Dict[str, str]] = None) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, e.g. queue wait time in seconds."""
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[Tuple[str, str], ...], Dict[str, object]] = {}
+
+    def observe(self, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def count(self, labels: Optional[Dict[str, str]] = None) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return series['count'] if series else 0
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, series['counts']):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', str(bound)),))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide collection of metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError(f"Metric {metric.name} is already registered as {existing.metric_type}")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._register(Counter(name, description))
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self._register(Gauge(name, description))
+
+    def histogram(self, name: str, description: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,105 @@
+"""Stand-ins for the OpenAI LLM and embedding model, for load tests and traffic replay.
+
+With ``MOCK_MODELS=true`` the server runs its full request path (admission,
+deadlines, caches, retrieval, agent loop) without any OpenAI call. The LLM
+follows the ReAct format: it calls the first tool with the user's question,
+then answers once it has an observation, so every agent request costs two
+LLM calls plus one synthesis call inside the tool, as a typical live request
+does. Each call sleeps for a configurable latency.
+"""
+from typing import Any, List, Sequence
+import json
+import re
+import time
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    CompletionResponse,
+    CompletionResponseGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.llms import CustomLLM
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from retrieval_eval import HashingEmbedding
+
+TOOL_NAME_PATTERN = re.compile(r"> Tool Name: (\S+)")
+
+
+class MockReActLLM(CustomLLM):
+    """Scripted LLM that drives the ReAct agent through one tool call."""
+
+    latency_seconds: float = 1.0
+    answer_words: int = 60
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MockReActLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=128000, num_output=2048, is_chat_model=True, model_name="mock-react")
+
+    def _answer(self, prompt: str) -> str:
+        # Words of the prompt, so answers vary with the retrieved context
+        words = re.findall(r"[A-Za-z]{4,}", prompt)[-self.answer_words:]
+        return " ".join(words) or "No information found."
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        time.sleep(self.latency_seconds)
+        question = next((message.content for message in messages if message.role == MessageRole.USER), "") or ""
+        system = "\n".join(message.content or "" for message in messages if message.role == MessageRole.SYSTEM)
+        tool = TOOL_NAME_PATTERN.search(system)
+        # The ReAct format instructions in the system message mention observations as well
+        observed = any("Observation:" in (message.content or "") for message in messages if message.role != MessageRole.SYSTEM)
+        if tool is None or observed:
+            text = f"Thought: I can answer without using any more tools.\nAnswer: {self._answer(str(messages[-1].content))}"
+        else:
+            text = (
+                "Thought: I need to use a tool to help me answer the question.\n"
+                f"Action: {tool.group(1)}\n"
+                f"Action Input: {json.dumps({'input': question})}"
+            )
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=text))
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        # Response synthesis of the query engines
+        time.sleep(self.latency_seconds)
+        return CompletionResponse(text=self._answer(prompt))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        response = self.complete(prompt, formatted=formatted, **kwargs)
+
+        def gen() -> CompletionResponseGen:
+            yield CompletionResponse(text=response.text, delta=response.text)
+
+        return gen()
+
+
+class MockEmbedding(HashingEmbedding):
+    """Hashing embedding that takes as long as a remote embedding call."""
+
+    latency_seconds: float = 0.05
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MockEmbedding"
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        time.sleep(self.latency_seconds)
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        time.sleep(self.latency_seconds)
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        # One request per batch, as with the OpenAI API
+        time.sleep(self.latency_seconds)
+        return [self._embed(text) for text in texts]
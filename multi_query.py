@@ -0,0 +1,169 @@
+"""Multi-query retrieval in a single tool call.
+
+The agent context asks for several variations of the search terms. Issued
+as separate ``fblDocQuery`` calls, every variation costs a full ReAct round
+trip (Thought, Action, Observation) through the LLM. MultiQueryRetriever
+instead takes all variants of one tool input, embeds them as queries and
+searches them concurrently, and merges the rankings with reciprocal rank
+fusion, so the response is synthesized once over the fused nodes.
+
+Variants are separated by ``|`` or new lines in the tool input. A single
+question also gets cheap rule-based variants (quoted phrases and a keyword
+form) without an extra LLM call.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import contextvars
+import os
+import re
+import threading
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from answer_cache import normalize_question
+from metrics import REGISTRY
+from tracing import trace_span
+
+# Separates the variants of one tool input
+VARIANT_SEPARATOR_PATTERN = re.compile(r"\s*(?:\||\n)\s*")
+# Phrases the agent quotes because they appear verbatim in the documentation
+QUOTED_PHRASE_PATTERN = re.compile(r"""(?:^|(?<=\s))["'“‘]([^"'”’\n]{4,}?)["'”’](?=[\s.,;:?!]|$)""")
+# Constant of reciprocal rank fusion; 60 is the value of the original paper
+DEFAULT_RRF_K = 60
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "can", "could", "describe", "did", "do", "does", "explain", "for", "from", "give",
+    "how", "i", "in", "is", "it", "me", "of", "on", "or", "please", "should", "tell", "the", "there", "to", "what",
+    "what's", "when", "where", "which", "who", "why", "with", "would", "you",
+}
+
+
+def _search_pool() -> ThreadPoolExecutor:
+    """Threads shared by all multi-query retrievers, including those of swapped-out index states."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=int(os.getenv("MULTI_QUERY_WORKERS", "8")),
+                thread_name_prefix="multi-query"
+            )
+        return _pool
+
+
+def split_query_variants(query_str: str) -> List[str]:
+    """Split a tool input into its variants, dropping empty and duplicate ones."""
+    variants = {}
+    for variant in VARIANT_SEPARATOR_PATTERN.split(query_str):
+        if variant.strip():
+            variants.setdefault(normalize_question(variant), variant.strip())
+    return list(variants.values())
+
+
+def keyword_variant(query_str: str) -> str:
+    """Return the query without question words and stopwords."""
+    words = re.findall(r"[\w.\-/]+(?:'\w+)?", query_str)
+    return " ".join(word for word in words if word.lower() not in _STOPWORDS).strip(" .")
+
+
+def generate_query_variants(query_str: str, max_variants: int = 4) -> List[str]:
+    """Return the variants to search for a tool input.
+
+    Explicit variants are used as given. A single question is complemented
+    by the phrases quoted in it and by its keyword form.
+
+    Args:
+        query_str: Tool input, optionally with variants separated by ``|`` or new lines
+        max_variants: Maximum number of variants to search
+
+    Returns:
+        Variants, the first one being the first part of the input
+    """
+    variants = split_query_variants(query_str)
+    if len(variants) == 1:
+        variants += QUOTED_PHRASE_PATTERN.findall(variants[0]) + [keyword_variant(variants[0])]
+    unique = {}
+    for variant in variants:
+        if variant:
+            unique.setdefault(normalize_question(variant), variant)
+    return list(unique.values())[:max(1, max_variants)]
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[NodeWithScore]],
+    k: int = DEFAULT_RRF_K,
+    top_n: Optional[int] = None
+) -> List[NodeWithScore]:
+    """Merge rankings by summing 1 / (k + rank) per node.
+
+    Nodes are matched by ID, so a chunk found by several variants ranks
+    above chunks found by only one of them.
+
+    Args:
+        rankings: Result lists, best match first
+        k: Fusion constant; larger values flatten the weight of the top ranks
+        top_n: Number of nodes to return, all by default
+
+    Returns:
+        Fused nodes with the fusion score, best first
+    """
+    scores: Dict[str, float] = {}
+    nodes: Dict[str, NodeWithScore] = {}
+    for ranking in rankings:
+        for rank, node in enumerate(ranking, start=1):
+            node_id = node.node.node_id
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (k + rank)
+            nodes.setdefault(node_id, node)
+    fused = sorted(scores, key=lambda node_id: scores[node_id], reverse=True)[:top_n]
+    return [NodeWithScore(node=nodes[node_id].node, score=scores[node_id]) for node_id in fused]
+
+
+class MultiQueryRetriever(BaseRetriever):
+    """Searches several variants of a query concurrently and fuses the results."""
+
+    def __init__(
+        self,
+        retriever: BaseRetriever,
+        embed_model: BaseEmbedding,
+        similarity_top_k: int = 8,
+        max_variants: int = 4,
+        rrf_k: int = DEFAULT_RRF_K,
+        callback_manager: Optional[CallbackManager] = None
+    ):
+        """Initialize the retriever.
+
+        Args:
+            retriever: Retriever searched for each variant; it must use the embedding of the query bundle
+            embed_model: Embedding model of the collection
+            similarity_top_k: Number of fused nodes to return
+            max_variants: Maximum number of variants searched per query
+            rrf_k: Reciprocal rank fusion constant
+            callback_manager: Optional callback manager for retrieval events
+        """
+        super().__init__(callback_manager=callback_manager)
+        self.retriever = retriever
+        self.embed_model = embed_model
+        self.similarity_top_k = similarity_top_k
+        self.max_variants = max_variants
+        self.rrf_k = rrf_k
+        self._variant_counts = REGISTRY.histogram(
+            "multi_query_variants", "Query variants searched per tool call", buckets=(1, 2, 3, 4, 6, 8)
+        )
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        variants = generate_query_variants(query_bundle.query_str, self.max_variants)
+        self._variant_counts.observe(len(variants))
+        with trace_span("multi_query", variants=variants):
+            # Copy the context into each worker so deadlines and trace spans carry over
+            pool = _search_pool()
+            futures = [pool.submit(contextvars.copy_context().run, self._search_variant, variant) for variant in variants]
+            rankings = [future.result() for future in futures]
+        return reciprocal_rank_fusion(rankings, k=self.rrf_k, top_n=self.similarity_top_k)
+
+    def _search_variant(self, variant: str) -> List[NodeWithScore]:
+        # Query embedding, as for a single query; the embeddings of all variants are requested concurrently
+        embedding = self.embed_model.get_query_embedding(variant)
+        return self.retriever.retrieve(QueryBundle(query_str=variant, embedding=embedding))
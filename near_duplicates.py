@@ -0,0 +1,238 @@
+"""Near-duplicate chunk detection with MinHash and LSH banding.
+
+The manuals share boilerplate: copyright pages, safety notes and identical
+interface tables. Each chunk gets a MinHash signature over its word shingles.
+Signatures are split into bands, and chunks that share a band bucket are
+compared; a chunk whose estimated Jaccard similarity with an already stored
+chunk reaches the threshold is not embedded again. Instead, its location is
+added to the ``sources`` of the stored chunk.
+
+Signatures and band buckets are kept in the SQLite database, so duplicates
+are also found across files ingested in different runs.
+"""
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import hashlib
+import re
+import zlib
+import numpy as np
+from llama_index.core import Document
+from sqlite_store import SQLiteDatabase
+
+# Metadata written by the detector
+DEDUP_ID_METADATA_KEY = "dedup_id"
+SOURCES_METADATA_KEY = "sources"
+# Location fields copied from a chunk's metadata into its sources entry
+SOURCE_FIELDS = ["file_name", "page_label", "section"]
+
+_PRIME = (1 << 31) - 1
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+class MinHasher:
+    """MinHash signatures over word shingles with universal hashing."""
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        # Fixed seed: signatures are stored and compared across runs
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        words = _WORD_PATTERN.findall(text.lower())
+        size = min(self.shingle_size, len(words)) or 1
+        grams = {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+        return np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.uint64, count=len(grams))
+
+    def signature(self, text: str) -> np.ndarray:
+        """Return the signature of a text as num_perm uint32 values."""
+        shingles = self.shingles(text)
+        # (a * x + b) mod p stays below 2**63 for 32-bit shingles and 31-bit a and b
+        hashes = (np.outer(shingles, self._a) + self._b) % _PRIME
+        return hashes.min(axis=0).astype(np.uint32)
+
+    @staticmethod
+    def similarity(first: np.ndarray, second: np.ndarray) -> float:
+        """Estimated Jaccard similarity of the shingle sets."""
+        return float(np.mean(first == second))
+
+
+def lsh_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """Choose (bands, rows) so that pairs at the threshold are very likely to collide.
+
+    The collision curve of b bands with r rows rises at about (1/b)**(1/r);
+    the band count whose rise point is highest but still below the threshold
+    keeps the number of candidates low without missing duplicates.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1.0 / bands) ** (1.0 / rows) <= threshold * 0.9:
+            best = (bands, rows)
+    return best
+
+
+def forget_signatures(database: SQLiteDatabase, dedup_ids: Set[str]) -> None:
+    """Remove the signatures of stored chunks that were deleted."""
+    if not dedup_ids:
+        return
+    placeholders = ", ".join("?" * len(dedup_ids))
+    with database.transaction() as conn:
+        conn.execute(f"DELETE FROM chunk_signature_bands WHERE dedup_id IN ({placeholders})", tuple(dedup_ids))
+        conn.execute(f"DELETE FROM chunk_signatures WHERE dedup_id IN ({placeholders})", tuple(dedup_ids))
+
+
+class NearDuplicateDetector:
+    """Collapses near-duplicate chunks into one stored chunk with a list of sources."""
+
+    def __init__(
+        self,
+        database: SQLiteDatabase,
+        threshold: float = 0.85,
+        num_perm: int = 128,
+        min_words: int = 8
+    ):
+        """Initialize the detector.
+
+        Args:
+            database: Database holding the signatures of stored chunks
+            threshold: Estimated Jaccard similarity from which chunks count as duplicates;
+                1.0 only collapses identical chunks, lower values are more aggressive
+            num_perm: Number of MinHash permutations
+            min_words: Shorter chunks (headings, single bullets) are never collapsed
+        """
+        self.database = database
+        self.threshold = threshold
+        self.min_words = min_words
+        self.hasher = MinHasher(num_perm=num_perm)
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        # Chunks kept by the last deduplicate() call, stored by register()
+        self._pending: List[Tuple[str, str, np.ndarray, int]] = []
+
+    def _buckets(self, signature: np.ndarray) -> List[str]:
+        return [
+            hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8).hexdigest()
+            for band in range(self.bands)
+        ]
+
+    def _stored_match(
+        self,
+        collection: str,
+        signature: np.ndarray,
+        buckets: List[str],
+        ignored_ids: Set[str]
+    ) -> Optional[str]:
+        """Return the dedup_id of the most similar stored chunk above the threshold, except ignored_ids."""
+        rows = self.database.query(
+            "SELECT DISTINCT s.dedup_id, s.signature FROM chunk_signature_bands b "
+            "JOIN chunk_signatures s ON s.dedup_id = b.dedup_id "
+            f"WHERE s.collection = ? AND (b.band, b.bucket) IN (VALUES {', '.join(['(?, ?)'] * len(buckets))})",
+            (collection, *[value for band, bucket in enumerate(buckets) for value in (band, bucket)])
+        )
+        best_id, best_score = None, self.threshold
+        for dedup_id, blob in rows:
+            if dedup_id in ignored_ids:
+                continue
+            score = self.hasher.similarity(signature, np.frombuffer(blob, dtype=np.uint32))
+            if score >= best_score:
+                best_id, best_score = dedup_id, score
+        return best_id
+
+    @staticmethod
+    def source_of(document: Document) -> Dict[str, Any]:
+        metadata = document.metadata or {}
+        return {field: metadata[field] for field in SOURCE_FIELDS if metadata.get(field) not in (None, "")}
+
+    def deduplicate(
+        self,
+        documents: List[Document],
+        collection_for: Callable[[Dict[str, Any]], str],
+        ignored_ids: Optional[Set[str]] = None
+    ) -> Tuple[List[Document], Dict[Tuple[str, str], List[Dict[str, Any]]], Dict[str, Any]]:
+        """Drop chunks that duplicate an earlier chunk of the batch or a stored chunk.
+
+        Kept chunks get a ``dedup_id`` and a ``sources`` list in their metadata;
+        duplicates of kept chunks are added to those sources right away.
+        Call register() once the kept chunks are stored.
+
+        Args:
+            documents: Chunk documents of one file
+            collection_for: Returns the collection a chunk is stored in, given its metadata;
+                only chunks of the same collection are collapsed
+            ignored_ids: dedup_ids of stored chunks that are about to be deleted, e.g. the
+                previous version of a re-ingested file
+
+        Returns:
+            Kept documents, new sources for stored chunks keyed by (collection, dedup_id),
+            and statistics
+        """
+        kept: List[Document] = []
+        stored_sources: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        batch_buckets: Dict[Tuple[str, int, str], List[int]] = {}
+        self._pending = []
+        collapsed_chunks, collapsed_chars = 0, 0
+
+        for doc in documents:
+            metadata = doc.metadata if doc.metadata is not None else {}
+            collection = collection_for(metadata)
+            if len(_WORD_PATTERN.findall(doc.text)) < self.min_words:
+                kept.append(doc)
+                continue
+            signature = self.hasher.signature(doc.text)
+            buckets = self._buckets(signature)
+
+            # Earlier chunk of this batch
+            candidates = {i for band, bucket in enumerate(buckets) for i in batch_buckets.get((collection, band, bucket), [])}
+            match = max(
+                ((self.hasher.similarity(signature, self._pending[i][2]), i) for i in candidates),
+                default=(0.0, None)
+            )
+            if match[1] is not None and match[0] >= self.threshold:
+                kept_doc = kept[self._pending[match[1]][3]]
+                kept_doc.metadata[SOURCES_METADATA_KEY].append(self.source_of(doc))
+                collapsed_chunks += 1
+                collapsed_chars += len(doc.text)
+                continue
+
+            # Chunk stored by an earlier ingestion
+            stored_id = self._stored_match(collection, signature, buckets, ignored_ids or set())
+            if stored_id is not None:
+                stored_sources.setdefault((collection, stored_id), []).append(self.source_of(doc))
+                collapsed_chunks += 1
+                collapsed_chars += len(doc.text)
+                continue
+
+            dedup_id = hashlib.sha1(f"{metadata.get('file_name', '')}:{doc.text}".encode("utf-8")).hexdigest()
+            metadata[DEDUP_ID_METADATA_KEY] = dedup_id
+            metadata[SOURCES_METADATA_KEY] = [self.source_of(doc)]
+            doc.metadata = metadata
+            for band, bucket in enumerate(buckets):
+                batch_buckets.setdefault((collection, band, bucket), []).append(len(self._pending))
+            self._pending.append((dedup_id, collection, signature, len(kept)))
+            kept.append(doc)
+
+        stats = {
+            'chunks': len(documents),
+            'collapsed_chunks': collapsed_chunks,
+            'collapsed_chars': collapsed_chars,
+            'collapsed_ratio': round(collapsed_chunks / len(documents), 3) if documents else 0.0
+        }
+        return kept, stored_sources, stats
+
+    def register(self) -> None:
+        """Store the signatures of the chunks kept by the last deduplicate() call."""
+        pending, self._pending = self._pending, []
+        with self.database.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunk_signatures (dedup_id, collection, signature) VALUES (?, ?, ?)",
+                [(dedup_id, collection, signature.tobytes()) for dedup_id, collection, signature, _ in pending]
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO chunk_signature_bands (band, bucket, dedup_id) VALUES (?, ?, ?)",
+                [(band, bucket, dedup_id)
+                 for dedup_id, _, signature, _ in pending
+                 for band, bucket in enumerate(self._buckets(signature))]
+            )
@@ -0,0 +1,119 @@
+"""Agent prompt layout with a byte-identical static prefix.
+
+Providers cache the longest prompt prefix they have already processed
+(OpenAI from 1024 tokens on, in 128-token steps) and bill cached tokens at a
+discount. Every agent prompt therefore starts with one system message that
+only contains static text: the instructions, the domain context and the tool
+descriptions in a fixed order. The user question and the ReAct scratchpad
+follow it and only ever grow at the end.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+import hashlib
+import textwrap
+from llama_index.core.agent.react.formatter import ReActChatFormatter
+from llama_index.core.agent.react.prompts import CONTEXT_REACT_CHAT_SYSTEM_HEADER
+from llama_index.core.agent.react.types import BaseReasoningStep
+from llama_index.core.llms import ChatMessage
+from llama_index.core.tools import BaseTool
+from pydantic import PrivateAttr
+
+# OpenAI only caches prompts of at least this many tokens
+MIN_CACHEABLE_TOKENS = 1024
+CACHE_INCREMENT_TOKENS = 128
+
+
+def _escape(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def build_system_header(system_prompt: str, context: str) -> str:
+    """Return the static system header template.
+
+    The agent instructions come first, then the ReAct format with the tool
+    descriptions and the domain context. Only ``{tool_desc}`` and
+    ``{tool_names}`` are filled in, and both are static for a tool set.
+
+    Args:
+        system_prompt: Agent instructions (prompts.system_prompt)
+        context: Domain context (prompts.context)
+
+    Returns:
+        Header template for ReActChatFormatter
+    """
+    return (
+        _escape(system_prompt.strip())
+        + "\n\n"
+        + CONTEXT_REACT_CHAT_SYSTEM_HEADER.replace("{context}", _escape(textwrap.dedent(context).strip()))
+    )
+
+
+class StablePrefixReActChatFormatter(ReActChatFormatter):
+    """ReAct formatter whose system message is identical for every request.
+
+    Tools are described in name order so the header does not depend on the
+    order tools are passed in, and the formatted header is cached per tool
+    set, so all agents built from it send exactly the same bytes.
+    """
+
+    _headers: Dict[Tuple[Tuple[str, str], ...], str] = PrivateAttr(default_factory=dict)
+
+    @classmethod
+    def from_prompts(cls, system_prompt: str, context: str) -> "StablePrefixReActChatFormatter":
+        return cls(system_header=build_system_header(system_prompt, context))
+
+    def system_message(self, tools: Sequence[BaseTool]) -> str:
+        """Return the formatted system message for a tool set."""
+        tools = sorted(tools, key=lambda tool: tool.metadata.get_name())
+        key = tuple((tool.metadata.get_name(), tool.metadata.description) for tool in tools)
+        if key not in self._headers:
+            self._headers[key] = super().format(tools, [])[0].content
+        return self._headers[key]
+
+    def prefix_fingerprint(self, tools: Sequence[BaseTool]) -> str:
+        """Short hash of the static prefix, recorded in traces to confirm it never changes."""
+        return hashlib.sha256(self.system_message(tools).encode("utf-8")).hexdigest()[:16]
+
+    def format(
+        self,
+        tools: Sequence[BaseTool],
+        chat_history: List[ChatMessage],
+        current_reasoning: Optional[List[BaseReasoningStep]] = None,
+    ) -> List[ChatMessage]:
+        messages = super().format([], chat_history, current_reasoning)
+        messages[0] = ChatMessage(role=messages[0].role, content=self.system_message(tools))
+        return messages
+
+
+def estimate_cached_tokens(
+    prompts: List[List[int]],
+    min_tokens: int = MIN_CACHEABLE_TOKENS,
+    increment: int = CACHE_INCREMENT_TOKENS
+) -> List[int]:
+    """Estimate provider cache hits for a sequence of prompts.
+
+    Each prompt can reuse the longest prefix it shares with an earlier prompt
+    of at least ``min_tokens`` tokens, rounded down to ``increment`` tokens.
+
+    Args:
+        prompts: Token ids of each prompt in the order they are sent
+        min_tokens: Shortest prompt the provider caches
+        increment: Granularity of cache hits
+
+    Returns:
+        Cached tokens per prompt
+    """
+    cached = []
+    seen: List[List[int]] = []
+    for prompt in prompts:
+        best = 0
+        for earlier in seen:
+            shared = 0
+            for a, b in zip(prompt, earlier):
+                if a != b:
+                    break
+                shared += 1
+            best = max(best, shared)
+        cached.append(best // increment * increment if best >= min_tokens else 0)
+        if len(prompt) >= min_tokens:
+            seen.append(prompt)
+    return cached
@@ -29,7 +29,8 @@ context = """You are a technical assistant specialized in Flash Bootloader and O
             
             For each search:
             1. Use the exact phrases from the documentation in your query
-            2. Try multiple variations of the search terms
+            2. Try multiple variations of the search terms in ONE fblDocQuery call, separated by ' | '
+               (e.g. 'Scope of Delivery | The Flash Bootloader delivery includes:'); they are searched together
             3. Look for bullet points and lists
             4. Pay attention to any notes about licensing or requirements
             
@@ -55,4 +56,15 @@ context = """You are a technical assistant specialized in Flash Bootloader and O
 fblDocQuery_discription = """A specialized query engine designed to search and retrieve flashbootloader documentation from the vector store. 
                             This tool leverages embedding-based retrieval to provide context-aware,
                           technically accurate responses by integrating relevant details from curated flashbootloader resources.
-                          """
\ No newline at end of file
+                          Several variations of the search terms can be passed in one call, separated by ' | ';
+                          they are searched together and the results merged.
+                          """
+
+# Frequently asked questions whose answers are precomputed at startup and after ingestion
+warmup_questions = [
+    "What are the exact items included in the Flash Bootloader delivery?",
+    "What is Boot Sequence without Boot Manager?",
+    "What are limiting factors of OTA?",
+    "How does the bootloader work?",
+    "Explain the boot sequence"
+]
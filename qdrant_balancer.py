@@ -0,0 +1,314 @@
+"""Client-side load balancing of Qdrant reads across several nodes.
+
+A single Qdrant node is both the throughput ceiling and a single point of
+failure for search. With ``QDRANT_READ_URLS`` the searches, scrolls, counts
+and retrievals are spread over the nodes of a Qdrant cluster (or over
+read replicas of the collection), while every write and collection change
+goes to the primary ``QDRANT_URL``.
+
+Each read goes to the better of two randomly picked healthy endpoints,
+judged by their recent latency and their requests in flight. A small share
+of reads goes to a random endpoint instead, and a latency estimate that has
+not been renewed for a while no longer counts against its endpoint, so an
+endpoint that lost out is measured again and a node that went down is
+noticed even without health checks. An endpoint
+whose request fails with a connection error, a timeout or a 5xx/429 response
+is taken out of rotation and the request is retried on the next endpoint.
+A background health check (and, between checks, one trial request after a
+cooldown) brings it back once it answers again.
+"""
+from typing import Any, Callable, Dict, List, Optional
+import random
+import threading
+import time
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+from metrics import REGISTRY
+
+# Client methods that only read points and can be served by any node
+READ_METHODS = {
+    "search", "search_batch", "search_groups", "query_points", "query_batch_points", "query_points_groups",
+    "recommend", "recommend_batch", "discover", "discover_batch", "scroll", "count", "retrieve", "facet",
+}
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """True for errors of the endpoint (unreachable, overloaded, failing), False for errors of the request."""
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code is None or error.status_code >= 500 or error.status_code == 429
+    if isinstance(error, (ResponseHandlingException, OSError)):
+        return True
+    # httpx transport errors and gRPC errors, without importing either
+    return type(error).__name__ in ("ConnectError", "ReadTimeout", "WriteTimeout", "PoolTimeout", "RemoteProtocolError",
+                                    "TransportError", "_InactiveRpcError", "RpcError")
+
+
+class QdrantEndpoint:
+    """One Qdrant node with its latency estimate and health state."""
+
+    def __init__(self, name: str, client: Any, cooldown_seconds: float = 5.0, stale_seconds: float = 30.0):
+        self.name = name
+        self.client = client
+        self.cooldown_seconds = cooldown_seconds
+        # Age from which the latency estimate is outdated
+        self.stale_seconds = stale_seconds
+        self.healthy = True
+        self.latency: Optional[float] = None
+        # When the latency estimate was last renewed
+        self.measured_at = 0.0
+        self.in_flight = 0
+        self.failures = 0
+        # While unhealthy, one trial request is allowed after this time
+        self.retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def _stale(self) -> bool:
+        return time.monotonic() - self.measured_at > self.stale_seconds
+
+    def cost(self) -> float:
+        """Expected wait of the next request: latency estimate scaled by the requests in flight."""
+        with self._lock:
+            # Unmeasured endpoints and idle endpoints with an outdated estimate are tried first,
+            # so every endpoint keeps a current estimate
+            if self.latency is None or (self.in_flight == 0 and self._stale()):
+                return 0.0
+            return self.latency * (self.in_flight + 1)
+
+    def available(self, now: float) -> bool:
+        with self._lock:
+            return self.healthy or now >= self.retry_at
+
+    def begin(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+            if not self.healthy:
+                # Only one trial request per cooldown
+                self.retry_at = time.monotonic() + self.cooldown_seconds * min(2 ** self.failures, 32)
+
+    def succeeded(self, seconds: float) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            # An outdated estimate is replaced rather than averaged with the new sample
+            self.latency = seconds if self.latency is None or self._stale() else 0.8 * self.latency + 0.2 * seconds
+            self.measured_at = time.monotonic()
+            self.healthy = True
+            self.failures = 0
+
+    def released(self) -> None:
+        """End a request that says nothing about the node, e.g. a rejected bad request."""
+        with self._lock:
+            self.in_flight -= 1
+
+    def failed(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.healthy = False
+            self.failures += 1
+            self.retry_at = time.monotonic() + self.cooldown_seconds * min(2 ** (self.failures - 1), 32)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'name': self.name,
+                'healthy': self.healthy,
+                'latency_ms': round(self.latency * 1000, 3) if self.latency is not None else None,
+                'in_flight': self.in_flight,
+                'failures': self.failures,
+            }
+
+
+class LoadBalancedQdrantClient:
+    """QdrantClient stand-in that sends reads to the best healthy endpoint and writes to the primary.
+
+    Every attribute that is not a read method is taken from the primary
+    client, so it can be passed wherever a QdrantClient is expected.
+    """
+
+    def __init__(
+        self,
+        primary: Any,
+        replicas: Dict[str, Any],
+        read_from_primary: bool = True,
+        cooldown_seconds: float = 5.0,
+        primary_name: str = "primary",
+        explore_probability: float = 0.02,
+        stale_seconds: float = 30.0,
+        seed: Optional[int] = None
+    ):
+        """Initialize the client.
+
+        Args:
+            primary: Client of the node that receives all writes
+            replicas: Clients of further nodes serving reads, by name (e.g. URL)
+            read_from_primary: Also balance reads onto the primary
+            cooldown_seconds: Time before a failed endpoint gets a trial request; doubles per failure
+            primary_name: Name of the primary in metrics and stats
+            explore_probability: Share of reads sent to a random available endpoint
+            stale_seconds: Age from which a latency estimate no longer keeps an idle endpoint from reads
+            seed: Seed of the endpoint choices, for reproducible tests
+        """
+        self.primary = primary
+        self.endpoints = [
+            QdrantEndpoint(name, client, cooldown_seconds, stale_seconds) for name, client in replicas.items()
+        ]
+        self.primary_endpoint = QdrantEndpoint(primary_name, primary, cooldown_seconds, stale_seconds)
+        if read_from_primary or not self.endpoints:
+            self.endpoints.insert(0, self.primary_endpoint)
+        self.explore_probability = explore_probability
+        self._random = random.Random(seed)
+        self._health_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._requests = REGISTRY.counter("qdrant_read_requests_total", "Qdrant reads by endpoint and result")
+        self._latency = REGISTRY.histogram(
+            "qdrant_read_seconds", "Qdrant read latency by endpoint",
+            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+        )
+        self._failovers = REGISTRY.counter("qdrant_read_failovers_total", "Qdrant reads retried on another endpoint")
+        self._healthy = REGISTRY.gauge("qdrant_endpoint_healthy", "1 if the Qdrant endpoint is in the read rotation")
+        for endpoint in self.endpoints:
+            self._healthy.set(1, labels={'endpoint': endpoint.name})
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes not defined here: writes and collection management
+        if name in READ_METHODS:
+            method_name = name
+            return lambda *args, **kwargs: self._read(method_name, *args, **kwargs)
+        return getattr(self.primary, name)
+
+    def _candidates(self) -> List[QdrantEndpoint]:
+        """Endpoints in the order they are tried: power of two choices (or a random one) first, then by cost."""
+        now = time.monotonic()
+        available = [endpoint for endpoint in self.endpoints if endpoint.available(now)]
+        if not available:
+            # Everything is down: try them all rather than failing without a request
+            available = list(self.endpoints)
+        if len(available) > 1:
+            costs = {endpoint.name: endpoint.cost() for endpoint in available}
+            if self._random.random() < self.explore_probability:
+                best = self._random.choice(available)
+            else:
+                first, second = self._random.sample(available, 2)
+                best = first if costs[first.name] <= costs[second.name] else second
+            rest = sorted((endpoint for endpoint in available if endpoint is not best), key=lambda e: costs[e.name])
+            return [best] + rest
+        return available
+
+    def _read(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        last_error: Optional[Exception] = None
+        for attempt, endpoint in enumerate(self._candidates()):
+            if attempt:
+                self._failovers.inc()
+            endpoint.begin()
+            start = time.perf_counter()
+            try:
+                result = getattr(endpoint.client, method)(*args, **kwargs)
+            except Exception as e:
+                if not is_endpoint_failure(e):
+                    # A bad request fails on every node; do not take the endpoint out of rotation,
+                    # and do not count how fast it was rejected as a latency sample
+                    endpoint.released()
+                    raise
+                endpoint.failed()
+                self._requests.inc(labels={'endpoint': endpoint.name, 'result': "error"})
+                self._healthy.set(0, labels={'endpoint': endpoint.name})
+                print(f"Qdrant endpoint {endpoint.name} failed ({type(e).__name__}: {e}), trying the next one")
+                last_error = e
+                continue
+            elapsed = time.perf_counter() - start
+            endpoint.succeeded(elapsed)
+            self._requests.inc(labels={'endpoint': endpoint.name, 'result': "ok"})
+            self._latency.observe(elapsed, labels={'endpoint': endpoint.name})
+            self._healthy.set(1, labels={'endpoint': endpoint.name})
+            return result
+        raise last_error
+
+    def check_health(self) -> Dict[str, bool]:
+        """Ping every endpoint, update its health and latency estimate, and return the health by name."""
+        for endpoint in self.endpoints:
+            endpoint.begin()
+            start = time.perf_counter()
+            try:
+                endpoint.client.get_collections()
+            except Exception as e:
+                endpoint.failed()
+                if endpoint.failures == 1:
+                    print(f"Qdrant endpoint {endpoint.name} is unhealthy: {e}")
+            else:
+                endpoint.succeeded(time.perf_counter() - start)
+            self._healthy.set(1 if endpoint.healthy else 0, labels={'endpoint': endpoint.name})
+        return {endpoint.name: endpoint.healthy for endpoint in self.endpoints}
+
+    def start_health_checks(self, interval: float = 5.0) -> None:
+        """Check the endpoints every ``interval`` seconds in a daemon thread."""
+        if interval <= 0 or self._health_thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.check_health()
+                except Exception as e:
+                    print(f"Error checking Qdrant endpoints: {e}")
+
+        self._health_thread = threading.Thread(target=run, name="qdrant-health", daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self) -> None:
+        self._stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [endpoint.to_dict() for endpoint in self.endpoints]
+
+    def close(self, **kwargs: Any) -> None:
+        self.stop_health_checks()
+        for endpoint in self.endpoints:
+            if endpoint.client is not self.primary:
+                endpoint.client.close(**kwargs)
+        self.primary.close(**kwargs)
+
+
+def build_balanced_client(
+    primary_url: str,
+    api_key: Optional[str],
+    read_urls: List[str],
+    client_factory: Optional[Callable[..., Any]] = None,
+    read_from_primary: bool = True,
+    cooldown_seconds: float = 5.0,
+    health_check_interval: float = 5.0,
+    explore_probability: float = 0.02,
+    stale_seconds: float = 30.0
+) -> LoadBalancedQdrantClient:
+    """Create clients for the primary and the read endpoints and start the health checks.
+
+    Args:
+        primary_url: URL of the node receiving writes
+        api_key: API key shared by the nodes
+        read_urls: URLs of further nodes serving reads
+        client_factory: Creates a client from url and api_key, QdrantClient by default
+        read_from_primary: Also balance reads onto the primary
+        cooldown_seconds: Time before a failed endpoint gets a trial request
+        health_check_interval: Seconds between health checks, 0 disables them
+        explore_probability: Share of reads sent to a random available endpoint
+        stale_seconds: Age from which a latency estimate no longer keeps an idle endpoint from reads
+
+    Returns:
+        Load-balanced client
+    """
+    if client_factory is None:
+        from qdrant_client import QdrantClient
+        client_factory = QdrantClient
+    primary = client_factory(url=primary_url, api_key=api_key)
+    replicas = {url: client_factory(url=url, api_key=api_key) for url in read_urls if url != primary_url}
+    client = LoadBalancedQdrantClient(
+        primary,
+        replicas,
+        read_from_primary=read_from_primary,
+        cooldown_seconds=cooldown_seconds,
+        primary_name=primary_url,
+        explore_probability=explore_probability,
+        stale_seconds=stale_seconds
+    )
+    client.start_health_checks(health_check_interval)
+    return client
@@ -0,0 +1,339 @@
+"""Offline retrieval quality vs. latency evaluation.
+
+Sweeps chunking and retrieval parameters over a golden question -> expected
+passage set and reports recall@k, MRR, prompt tokens and retrieval latency per
+configuration. Embeddings come from a hashing stub (no network) or from a
+real embedding model behind an on-disk cache, so a sweep only pays for each
+distinct text once.
+
+Usage:
+    python retrieval_eval.py --corpus eval/corpus.jsonl --recall-target 0.9
+    python retrieval_eval.py --parse-data ./data --corpus eval/corpus.jsonl --embedder openai
+"""
+from itertools import product
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+import argparse
+import hashlib
+import json
+import math
+import re
+import statistics
+import time
+from llama_index.core import Document
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.postprocessor import MetadataReplacementPostProcessor
+from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.utils import get_tokenizer
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+from document_processor import get_text_splitter
+from sentence_window import ParentDeduplicationPostprocessor, WINDOW_METADATA_KEY, build_sentence_window_documents
+from sqlite_store import SQLiteDatabase, SQLiteKVStore
+
+DEFAULT_GOLDEN_SET_PATH = "eval/golden_set.json"
+DEFAULT_CORPUS_PATH = "eval/corpus.jsonl"
+DEFAULT_EMBEDDING_CACHE_PATH = "eval/embedding_cache.db"
+
+# Parameters swept by default; the current defaults are included in every dimension
+DEFAULT_GRID = {
+    'chunking_strategy': ["markdown", "sentence"],
+    'chunk_size': [256, 512, 1024],
+    'chunk_overlap': [32, 150],
+    'indexing_mode': ["chunk", "sentence_window"],
+    'top_k': [2, 4, 8, 16],
+}
+
+
+class HashingEmbedding(BaseEmbedding):
+    """Deterministic bag-of-words embedding for offline sweeps.
+
+    Far weaker than a real embedding model, but it ranks passages that share
+    the question's words first, which is enough to compare chunking settings.
+    """
+
+    dimensions: int = 512
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashingEmbedding"
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r'[a-z0-9]+', text.lower()):
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dimensions] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class CachedEmbedding(BaseEmbedding):
+    """Wraps an embedding model and stores every embedding in SQLite, keyed by model and text."""
+
+    hits: int = 0
+    misses: int = 0
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _kvstore: SQLiteKVStore = PrivateAttr()
+    _collection: str = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, cache_path: str = DEFAULT_EMBEDDING_CACHE_PATH, **kwargs: Any):
+        super().__init__(model_name=embed_model.model_name, **kwargs)
+        self._embed_model = embed_model
+        self._kvstore = SQLiteKVStore(SQLiteDatabase(cache_path))
+        self._collection = f"embeddings/{embed_model.model_name}"
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _cached(self, text: str, embed_fn) -> List[float]:
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        cached = self._kvstore.get(key, collection=self._collection)
+        if cached is not None:
+            self.hits += 1
+            return cached['embedding']
+        self.misses += 1
+        embedding = embed_fn(text)
+        self._kvstore.put(key, {'embedding': embedding}, collection=self._collection)
+        return embedding
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._cached(query, self._embed_model.get_query_embedding)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._cached(text, self._embed_model.get_text_embedding)
+
+
+def load_golden_set(path: str = DEFAULT_GOLDEN_SET_PATH) -> List[Dict[str, Any]]:
+    """Load the golden set: a JSON list of {"question": str, "expected": [passage, ...]}."""
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_corpus(documents: List[Document], path: str = DEFAULT_CORPUS_PATH) -> None:
+    """Store parsed documents as JSONL so sweeps run without parsing again."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        for doc in documents:
+            f.write(json.dumps({'text': doc.text, 'metadata': doc.metadata}) + "\n")
+
+
+def load_corpus(path: str = DEFAULT_CORPUS_PATH) -> List[Document]:
+    """Load parsed documents written by save_corpus."""
+    with open(path, "r") as f:
+        return [Document(text=record['text'], metadata=record['metadata'])
+                for record in (json.loads(line) for line in f if line.strip())]
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def _first_relevant_rank(contexts: List[str], expected: List[str]) -> Optional[int]:
+    expected = [_normalize(passage) for passage in expected]
+    for rank, context in enumerate(contexts, start=1):
+        context = _normalize(context)
+        if any(passage in context for passage in expected):
+            return rank
+    return None
+
+
+def build_units(documents: List[Document], config: Dict[str, Any]) -> List[TextNode]:
+    """Chunk the corpus the way DocumentProcessor would for a configuration."""
+    splitter = get_text_splitter(config['chunking_strategy'], config['chunk_size'], config['chunk_overlap'])
+    chunks = [Document(text=node.text, metadata=node.metadata) for node in splitter.get_nodes_from_documents(documents)]
+    if config['indexing_mode'] == "sentence_window":
+        chunks = build_sentence_window_documents(chunks)
+    return [TextNode(text=doc.text, metadata=doc.metadata,
+                     excluded_embed_metadata_keys=doc.excluded_embed_metadata_keys,
+                     excluded_llm_metadata_keys=doc.excluded_llm_metadata_keys) for doc in chunks]
+
+
+class _IndexedCorpus:
+    """Chunks of one chunking configuration in an in-memory Qdrant collection."""
+
+    def __init__(self, units: List[TextNode], embed_model: BaseEmbedding):
+        self.units = units
+        embeddings = embed_model.get_text_embedding_batch([unit.get_content() for unit in units])
+        self.client = QdrantClient(location=":memory:")
+        self.client.create_collection(
+            collection_name="eval",
+            vectors_config=VectorParams(size=len(embeddings[0]), distance=Distance.COSINE)
+        )
+        self.client.upsert(
+            collection_name="eval",
+            points=[PointStruct(id=i, vector=vector) for i, vector in enumerate(embeddings)]
+        )
+
+    def search(self, query_embedding: List[float], top_k: int) -> List[NodeWithScore]:
+        results = self.client.search(collection_name="eval", query_vector=query_embedding, limit=top_k)
+        return [NodeWithScore(node=self.units[result.id], score=result.score) for result in results]
+
+
+def evaluate_configuration(
+    index: _IndexedCorpus,
+    golden_set: List[Dict[str, Any]],
+    config: Dict[str, Any],
+    embed_model: BaseEmbedding,
+    tokenizer=None
+) -> Dict[str, Any]:
+    """Retrieve for every golden question and score the retrieved contexts.
+
+    Args:
+        index: Chunks of the configuration's chunking settings
+        golden_set: Golden questions with expected passages
+        config: Configuration including top_k and indexing_mode
+        embed_model: Embedding model for the questions
+        tokenizer: Tokenizer for prompt token counts
+
+    Returns:
+        Configuration with recall@k, MRR, mean prompt tokens and retrieval latency
+    """
+    tokenizer = tokenizer or get_tokenizer()
+    postprocessors = []
+    if config['indexing_mode'] == "sentence_window":
+        postprocessors = [
+            ParentDeduplicationPostprocessor(),
+            MetadataReplacementPostProcessor(target_metadata_key=WINDOW_METADATA_KEY)
+        ]
+
+    ranks, prompt_tokens, latencies = [], [], []
+    for item in golden_set:
+        start = time.perf_counter()
+        query_embedding = embed_model.get_query_embedding(item['question'])
+        results = index.search(query_embedding, config['top_k'])
+        for postprocessor in postprocessors:
+            results = postprocessor.postprocess_nodes(results)
+        latencies.append(time.perf_counter() - start)
+
+        contexts = [result.node.get_content() for result in results]
+        ranks.append(_first_relevant_rank(contexts, item['expected']))
+        prompt_tokens.append(len(tokenizer('\n\n'.join(contexts))) + len(tokenizer(item['question'])))
+
+    return {
+        **config,
+        'chunks': len(index.units),
+        'recall_at_k': round(sum(rank is not None for rank in ranks) / len(ranks), 3),
+        'mrr': round(sum(1.0 / rank for rank in ranks if rank) / len(ranks), 3),
+        'prompt_tokens': round(statistics.mean(prompt_tokens), 1),
+        'latency_ms_p50': round(statistics.median(latencies) * 1000, 2),
+        'latency_ms_max': round(max(latencies) * 1000, 2)
+    }
+
+
+def sweep(
+    documents: List[Document],
+    golden_set: List[Dict[str, Any]],
+    embed_model: BaseEmbedding,
+    grid: Optional[Dict[str, Sequence[Any]]] = None
+) -> List[Dict[str, Any]]:
+    """Evaluate every combination of the grid.
+
+    Chunks are built and embedded once per chunking configuration and reused
+    for every top_k.
+
+    Returns:
+        One result per configuration
+    """
+    grid = {**DEFAULT_GRID, **(grid or {})}
+    tokenizer = get_tokenizer()
+    results = []
+    for strategy, chunk_size, chunk_overlap, mode in product(
+        grid['chunking_strategy'], grid['chunk_size'], grid['chunk_overlap'], grid['indexing_mode']
+    ):
+        if chunk_overlap >= chunk_size:
+            continue
+        chunk_config = {
+            'chunking_strategy': strategy,
+            'chunk_size': chunk_size,
+            'chunk_overlap': chunk_overlap,
+            'indexing_mode': mode
+        }
+        index = _IndexedCorpus(build_units(documents, chunk_config), embed_model)
+        for top_k in grid['top_k']:
+            results.append(evaluate_configuration(
+                index, golden_set, {**chunk_config, 'top_k': top_k}, embed_model, tokenizer
+            ))
+    return results
+
+
+def select_configuration(results: List[Dict[str, Any]], recall_target: float) -> Optional[Dict[str, Any]]:
+    """Return the configuration with the fewest prompt tokens that meets the recall target."""
+    candidates = [result for result in results if result['recall_at_k'] >= recall_target]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda r: (r['prompt_tokens'], r['latency_ms_p50'], -r['mrr']))
+
+
+def format_report(results: List[Dict[str, Any]]) -> str:
+    """Render the results as a table, best recall first."""
+    columns = ['chunking_strategy', 'chunk_size', 'chunk_overlap', 'indexing_mode', 'top_k', 'chunks',
+               'recall_at_k', 'mrr', 'prompt_tokens', 'latency_ms_p50']
+    rows = [[str(result[column]) for column in columns]
+            for result in sorted(results, key=lambda r: (-r['recall_at_k'], r['prompt_tokens']))]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(columns)]
+    lines = ['  '.join(column.ljust(width) for column, width in zip(columns, widths))]
+    lines += ['  '.join(value.ljust(width) for value, width in zip(row, widths)) for row in rows]
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep retrieval settings against a golden set")
+    parser.add_argument("--golden-set", default=DEFAULT_GOLDEN_SET_PATH)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_PATH, help="Parsed corpus (JSONL)")
+    parser.add_argument("--parse-data", help="Parse the PDFs in this directory with LlamaParse and write --corpus")
+    parser.add_argument("--embedder", choices=["stub", "openai"], default="stub")
+    parser.add_argument("--embedding-cache", default=DEFAULT_EMBEDDING_CACHE_PATH)
+    parser.add_argument("--recall-target", type=float, default=0.9)
+    parser.add_argument("--top-k", type=int, nargs="+", help="Override the swept top_k values")
+    parser.add_argument("--output", help="Write all results as JSON")
+    args = parser.parse_args()
+
+    if args.parse_data:
+        from dotenv import load_dotenv
+        from llama_index.core import SimpleDirectoryReader
+        from llama_parse import LlamaParse
+        load_dotenv()
+        reader = SimpleDirectoryReader(
+            args.parse_data,
+            file_extractor={".pdf": LlamaParse(result_type="markdown")},
+            filename_as_id=True
+        )
+        save_corpus(reader.load_data(), args.corpus)
+        print(f"Wrote parsed corpus to {args.corpus}")
+
+    if args.embedder == "openai":
+        from llama_index.embeddings.openai import OpenAIEmbedding
+        embed_model = CachedEmbedding(OpenAIEmbedding(), args.embedding_cache)
+    else:
+        embed_model = HashingEmbedding()
+
+    grid = {'top_k': args.top_k} if args.top_k else None
+    results = sweep(load_corpus(args.corpus), load_golden_set(args.golden_set), embed_model, grid)
+    print(format_report(results))
+
+    best = select_configuration(results, args.recall_target)
+    if best is None:
+        print(f"\nNo configuration reaches recall@k >= {args.recall_target}")
+    else:
+        print(f"\nCheapest configuration with recall@k >= {args.recall_target}: {json.dumps(best)}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+from typing import List, Optional
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from vector_store_manager import VectorStoreManager
+
+
+class VectorStoreRetriever(BaseRetriever):
+    """Retriever over the VectorStoreManager collection with optional tag filters.
+
+    The filter is applied by Qdrant before the vector search, so a query can be
+    narrowed to e.g. ``security_class_definition`` chunks without losing top-k
+    slots to unrelated content.
+    """
+
+    def __init__(
+        self,
+        vector_store_manager: VectorStoreManager,
+        similarity_top_k: int = 8,
+        content_types: Optional[List[str]] = None,
+        tags: Optional[List[str]] = None,
+        max_ingest_version: Optional[int] = None,
+        callback_manager: Optional[CallbackManager] = None
+    ):
+        """Initialize the retriever.
+
+        Args:
+            vector_store_manager: Instance of VectorStoreManager
+            similarity_top_k: Number of nodes to retrieve
+            content_types: Optional content types to restrict retrieval to
+            tags: Optional tags to restrict retrieval to
+            max_ingest_version: Optional ingestion version; chunks written by later runs are not retrieved
+            callback_manager: Optional callback manager for retrieval events
+        """
+        super().__init__(callback_manager=callback_manager)
+        self.vector_store_manager = vector_store_manager
+        self.similarity_top_k = similarity_top_k
+        self.content_types = content_types
+        self.tags = tags
+        self.max_ingest_version = max_ingest_version
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        """Embed the query and search the collection."""
+        query_embedding = query_bundle.embedding
+        if query_embedding is None:
+            query_embedding = self.vector_store_manager.embed_model.get_query_embedding(query_bundle.query_str)
+        return self.vector_store_manager.search_nodes(
+            query_embedding,
+            top_k=self.similarity_top_k,
+            content_types=self.content_types,
+            tags=self.tags,
+            query_str=query_bundle.query_str,
+            max_ingest_version=self.max_ingest_version
+        )
@@ -0,0 +1,124 @@
+from typing import List, Optional
+import hashlib
+import re
+from llama_index.core import Document
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from markdown_chunker import LIST_ITEM_PATTERN, TABLE_ROW_PATTERN
+
+# Metadata key holding the parent context that replaces a matched unit at query time
+WINDOW_METADATA_KEY = "window"
+PARENT_ID_METADATA_KEY = "parent_id"
+SENTENCE_BOUNDARY_PATTERN = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"(])')
+
+
+def split_units(text: str, min_unit_chars: int = 40) -> List[str]:
+    """Split a chunk into small retrieval units.
+
+    Bullet items and table rows become one unit each, paragraphs are split into
+    sentences. Units shorter than ``min_unit_chars`` are merged into the following
+    unit so that headings and one-word bullets still embed with some context.
+
+    Args:
+        text: Chunk text
+        min_unit_chars: Minimum number of characters per unit
+
+    Returns:
+        List of unit texts
+    """
+    units = []
+    paragraph = []
+
+    def flush_paragraph():
+        if paragraph:
+            units.extend(s.strip() for s in SENTENCE_BOUNDARY_PATTERN.split(' '.join(paragraph)) if s.strip())
+            paragraph.clear()
+
+    for line in text.split('\n'):
+        if not line.strip():
+            flush_paragraph()
+        elif LIST_ITEM_PATTERN.match(line) or TABLE_ROW_PATTERN.match(line) or line.lstrip().startswith('#'):
+            flush_paragraph()
+            units.append(line.strip())
+        else:
+            paragraph.append(line.strip())
+    flush_paragraph()
+
+    merged = []
+    pending = ''
+    for unit in units:
+        pending = f"{pending}\n{unit}" if pending else unit
+        if len(pending) >= min_unit_chars:
+            merged.append(pending)
+            pending = ''
+    if pending:
+        if merged:
+            merged[-1] = f"{merged[-1]}\n{pending}"
+        else:
+            merged.append(pending)
+    return merged
+
+
+def build_sentence_window_documents(documents: List[Document], min_unit_chars: int = 40) -> List[Document]:
+    """Turn chunk documents into small unit documents that point to their parent chunk.
+
+    Only the unit text is embedded. The parent chunk text is stored in the
+    ``window`` metadata and a stable ``parent_id`` lets the query side
+    de-duplicate units that expand to the same parent.
+
+    Args:
+        documents: Chunk documents (the parents), e.g. markdown sections
+        min_unit_chars: Minimum number of characters per unit
+
+    Returns:
+        List of unit Document objects
+    """
+    unit_documents = []
+    for doc in documents:
+        metadata = doc.metadata.copy() if doc.metadata else {}
+        parent_key = f"{metadata.get('file_name', '')}:{doc.text}"
+        parent_id = hashlib.sha1(parent_key.encode('utf-8')).hexdigest()
+        for unit in split_units(doc.text, min_unit_chars):
+            unit_metadata = metadata.copy()
+            unit_metadata.update({
+                WINDOW_METADATA_KEY: doc.text,
+                PARENT_ID_METADATA_KEY: parent_id
+            })
+            unit_documents.append(Document(
+                text=unit,
+                metadata=unit_metadata,
+                excluded_embed_metadata_keys=[WINDOW_METADATA_KEY, PARENT_ID_METADATA_KEY],
+                excluded_llm_metadata_keys=[WINDOW_METADATA_KEY, PARENT_ID_METADATA_KEY]
+            ))
+    return unit_documents
+
+
+class ParentDeduplicationPostprocessor(BaseNodePostprocessor):
+    """Keep only the best scoring unit per parent.
+
+    Run before ``MetadataReplacementPostProcessor`` so every parent context is
+    expanded into the prompt once, no matter how many of its units matched.
+    """
+
+    max_parents: Optional[int] = None
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ParentDeduplicationPostprocessor"
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        seen_parents = set()
+        deduplicated = []
+        for node in sorted(nodes, key=lambda n: n.score or 0.0, reverse=True):
+            parent_id = node.node.metadata.get(PARENT_ID_METADATA_KEY, node.node.node_id)
+            if parent_id in seen_parents:
+                continue
+            seen_parents.add(parent_id)
+            deduplicated.append(node)
+            if self.max_parents and len(deduplicated) >= self.max_parents:
+                break
+        return deduplicated
@@ -0,0 +1,183 @@
+"""Per-document shards and a lightweight query router.
+
+With ``SHARDING_MODE=document`` every source document (or document family)
+gets its own Qdrant collection. The router keeps a centroid vector and a set
+of keyword hints per shard and sends each query to the few shards that match
+it best, so the cost of a search depends on the number of shards searched,
+not on the number of manuals ingested.
+"""
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import fnmatch
+import json
+import os
+import re
+import threading
+import numpy as np
+from sqlite_store import SQLiteDatabase
+
+# Words that appear in most file names and carry no routing information
+_HINT_STOPWORDS = {"pdf", "the", "and", "for", "with", "doc", "manual", "user", "guide", "technical", "reference"}
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase alphanumeric tokens, splitting CamelCase and snake_case."""
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def load_shard_families(path: Optional[str] = None) -> Dict[str, Dict[str, List[str]]]:
+    """Load the document family configuration.
+
+    The file maps a family name to file name ``patterns`` (glob) and optional
+    routing ``keywords``, e.g. ``{"ota": {"patterns": ["*OTA*"], "keywords": ["campaign"]}}``.
+    Documents that match no family get a shard of their own.
+
+    Args:
+        path: JSON file, defaults to SHARD_FAMILIES_PATH
+
+    Returns:
+        The family configuration, empty when no file is configured
+    """
+    path = path or os.getenv("SHARD_FAMILIES_PATH")
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def shard_for_file(file_name: Optional[str], families: Optional[Dict[str, Dict[str, List[str]]]] = None) -> str:
+    """Return the shard name of a source document.
+
+    Args:
+        file_name: Source file name from the chunk metadata
+        families: Document family configuration
+
+    Returns:
+        Family name, or the sanitized file stem
+    """
+    if not file_name:
+        return "misc"
+    for family, config in (families or {}).items():
+        if any(fnmatch.fnmatch(file_name, pattern) for pattern in config.get("patterns", [])):
+            return family
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", Path(file_name).stem).strip("_") or "misc"
+
+
+class ShardRouter:
+    """Picks the shards a query is sent to from centroids and keyword hints.
+
+    Centroids are kept as running sums of unit-normalized chunk vectors, so new
+    documents update them without re-reading the shard. The state is stored in
+    the meta table of the SQLite database.
+    """
+
+    META_KEY = "shard_router"
+
+    def __init__(
+        self,
+        database: Optional[SQLiteDatabase] = None,
+        families: Optional[Dict[str, Dict[str, List[str]]]] = None,
+        max_shards: int = 3,
+        keyword_weight: float = 0.15
+    ):
+        """Initialize the router and load its saved state.
+
+        Args:
+            database: Database the router state is persisted in (in-memory only if None)
+            families: Document family configuration, see load_shard_families
+            max_shards: Maximum number of shards a query is sent to
+            keyword_weight: Score added for a query that mentions all hints of a shard
+        """
+        self.database = database
+        self.families = families or {}
+        self.max_shards = max_shards
+        self.keyword_weight = keyword_weight
+        self._lock = threading.Lock()
+        self._shards: Dict[str, Dict[str, Any]] = {}
+        saved = database.get_meta(self.META_KEY) if database else None
+        if saved:
+            for shard, state in json.loads(saved).items():
+                self._shards[shard] = {
+                    'sum': np.asarray(state['sum'], dtype=np.float64),
+                    'count': state['count'],
+                    'hints': set(state['hints'])
+                }
+
+    @property
+    def shards(self) -> List[str]:
+        return sorted(self._shards)
+
+    def shard_for_file(self, file_name: Optional[str]) -> str:
+        return shard_for_file(file_name, self.families)
+
+    def hints_for(self, shard: str, file_names: Iterable[str] = ()) -> set:
+        """Keyword hints of a shard: file name tokens plus configured family keywords."""
+        hints = set(self.families.get(shard, {}).get("keywords", []))
+        for name in list(file_names) + [shard]:
+            hints.update(t for t in tokenize(Path(name).stem) if len(t) >= 3 and t not in _HINT_STOPWORDS)
+        return {hint.lower() for hint in hints}
+
+    def add_vectors(self, shard: str, vectors: List[List[float]], file_names: Iterable[str] = ()) -> None:
+        """Add the vectors of newly ingested chunks to a shard's centroid and save the state."""
+        if not vectors:
+            return
+        matrix = np.asarray(vectors, dtype=np.float64)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1.0, norms)
+        with self._lock:
+            state = self._shards.setdefault(shard, {'sum': np.zeros(matrix.shape[1]), 'count': 0, 'hints': set()})
+            state['sum'] = state['sum'] + matrix.sum(axis=0)
+            state['count'] += len(matrix)
+            state['hints'] |= self.hints_for(shard, file_names)
+        self.save()
+
+    def save(self) -> None:
+        if self.database is None:
+            return
+        with self._lock:
+            state = {
+                shard: {'sum': s['sum'].tolist(), 'count': s['count'], 'hints': sorted(s['hints'])}
+                for shard, s in self._shards.items()
+            }
+        self.database.set_meta(self.META_KEY, json.dumps(state))
+
+    def route(
+        self,
+        query_embedding: List[float],
+        query_str: Optional[str] = None,
+        max_shards: Optional[int] = None
+    ) -> List[Tuple[str, float]]:
+        """Rank the shards for a query.
+
+        The score is the cosine similarity between the query and the shard
+        centroid plus a bonus for the fraction of the shard's keyword hints the
+        query mentions, so a query that names a document is pulled towards it.
+
+        Args:
+            query_embedding: Embedding of the query
+            query_str: Query text used for keyword hints
+            max_shards: Number of shards to return, defaults to the router's max_shards
+
+        Returns:
+            (shard, score) pairs, best first
+        """
+        with self._lock:
+            shards = list(self._shards.items())
+        if not shards:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float64)
+        query = query / (np.linalg.norm(query) or 1.0)
+        query_tokens = set(tokenize(query_str)) if query_str else set()
+        scored = []
+        for shard, state in shards:
+            centroid = state['sum'] / max(state['count'], 1)
+            score = float(centroid @ query) / (float(np.linalg.norm(centroid)) or 1.0)
+            if query_tokens and state['hints']:
+                matched = len(state['hints'] & query_tokens)
+                score += self.keyword_weight * min(1.0, matched / min(len(state['hints']), 3))
+            scored.append((shard, score))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:max_shards or self.max_shards]
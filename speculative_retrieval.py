@@ -0,0 +1,226 @@
+"""Speculative retrieval for the agent's first tool call.
+
+Almost every agent run starts with an fblDocQuery call whose input is the
+user's question, more or less verbatim, but retrieval only starts after the
+first LLM call has planned it. SpeculativeRetrieval starts embedding and
+searching the raw question when the agent starts planning, on its own
+threads. When the first retrieval of the run asks for something close to
+the question (by content words), it takes the speculative result, waiting
+only for what is left of it; otherwise the speculation is dropped and the
+tool retrieves as usual.
+
+SpeculativeRetriever sits above the retrieval cache: the speculation is
+cached under the question, never under a tool input that was merely close
+to it, and a tool call that took the result of a different input is kept
+out of the observation cache.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+import contextvars
+import threading
+import time
+import weakref
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from extractive_answer import content_terms
+from metrics import REGISTRY
+from tool_cache import mark_uncacheable, normalize_tool_input
+from tracing import get_current_trace, trace_span
+
+HIT = "hit"
+MISS = "miss"
+QUEUED = "queued"
+FAILED = "failed"
+UNUSED = "unused"
+
+_current_speculation: contextvars.ContextVar[Optional["Speculation"]] = contextvars.ContextVar(
+    "current_speculation", default=None
+)
+
+
+def input_similarity(query_str: str, question: str) -> float:
+    """Share of content words the tool input and the question have in common (Jaccard)."""
+    if normalize_tool_input(query_str) == normalize_tool_input(question):
+        return 1.0
+    query_terms, question_terms = set(content_terms(query_str)), set(content_terms(question))
+    if not query_terms or not question_terms:
+        return 0.0
+    return len(query_terms & question_terms) / len(query_terms | question_terms)
+
+
+class Speculation:
+    """Retrieval of one question, started ahead of the agent's tool call."""
+
+    def __init__(self, question: str, version: int):
+        self.question = question
+        self.version = version
+        self.future: Optional[Future] = None
+        # Time the retrieval took, set when it finishes
+        self.duration: Optional[float] = None
+        self.resolved = False
+        self._lock = threading.Lock()
+
+    def resolve(self) -> bool:
+        """Claim the speculation; only the first caller gets True."""
+        with self._lock:
+            if self.resolved:
+                return False
+            self.resolved = True
+            return True
+
+
+class SpeculativeRetrieval:
+    """Starts speculative retrievals and decides whether tool calls can use them."""
+
+    def __init__(self, min_similarity: float = 0.7, max_workers: int = 8):
+        """Initialize the speculation.
+
+        Args:
+            min_similarity: Content word overlap from which a tool input is close enough to the question
+            max_workers: Threads running speculative retrievals
+        """
+        self.min_similarity = min_similarity
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative-retrieval")
+        # Retriever of each ingestion version; swapped-out index states are garbage collected
+        self._retrievers: "weakref.WeakValueDictionary[int, SpeculativeRetriever]" = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._counts = {result: 0 for result in (HIT, MISS, QUEUED, FAILED, UNUSED)}
+        self._saved_seconds = 0.0
+        self._results = REGISTRY.counter(
+            "speculative_retrievals_total", "Speculative retrievals by result (hit, miss, queued, failed, unused)"
+        )
+        self._hit_ratio = REGISTRY.gauge("speculative_retrieval_hit_ratio", "Share of speculative retrievals used by the agent")
+        self._saved = REGISTRY.counter(
+            "speculative_latency_saved_seconds_total", "Retrieval time overlapped with the agent's first LLM call"
+        )
+
+    def register(self, retriever: "SpeculativeRetriever") -> None:
+        with self._lock:
+            self._retrievers[retriever.version] = retriever
+
+    def start(self, question: str, version: int) -> Optional[Speculation]:
+        """Start retrieving a question in the background, if a retriever of the version exists."""
+        with self._lock:
+            retriever = self._retrievers.get(version)
+        if retriever is None:
+            return None
+        speculation = Speculation(question, version)
+        # Copy the context so the deadline and the trace of the request carry over
+        speculation.future = self._pool.submit(contextvars.copy_context().run, self._run, speculation, retriever.retriever)
+        return speculation
+
+    @staticmethod
+    def _run(speculation: Speculation, retriever: BaseRetriever) -> List[NodeWithScore]:
+        start = time.perf_counter()
+        with trace_span("speculative_retrieval", question=speculation.question):
+            nodes = retriever.retrieve(QueryBundle(query_str=speculation.question))
+        speculation.duration = time.perf_counter() - start
+        return nodes
+
+    def take(self, speculation: Speculation, query_str: str) -> Optional[List[NodeWithScore]]:
+        """Return the speculative nodes for a tool input close to the question, or None.
+
+        Only the first retrieval of a run is matched; the speculation is
+        dropped when it does not match, has not started yet or failed.
+        """
+        if not speculation.resolve():
+            return None
+        if input_similarity(query_str, speculation.question) < self.min_similarity:
+            speculation.future.cancel()
+            self._record(MISS)
+            return None
+        if speculation.future.cancel():
+            # Still waiting for a thread: retrieving now is not slower
+            self._record(QUEUED)
+            return None
+        waited_from = time.perf_counter()
+        try:
+            nodes = speculation.future.result()
+        except Exception as e:
+            print(f"Speculative retrieval failed: {e}")
+            self._record(FAILED)
+            return None
+        waited = time.perf_counter() - waited_from
+        # The part of the retrieval that ran while the agent was planning
+        self._record(HIT, max(speculation.duration - waited, 0.0))
+        return nodes
+
+    def finish(self, speculation: Optional[Speculation]) -> None:
+        """Drop a speculation the agent never used."""
+        if speculation is None or not speculation.resolve():
+            return
+        speculation.future.cancel()
+        self._record(UNUSED)
+
+    @contextmanager
+    def speculate(self, question: str, version: int) -> Iterator[Optional[Speculation]]:
+        """Speculatively retrieve a question while the block (the agent run) executes."""
+        speculation = self.start(question, version)
+        token = _current_speculation.set(speculation)
+        try:
+            yield speculation
+        finally:
+            _current_speculation.reset(token)
+            self.finish(speculation)
+
+    def _record(self, result: str, saved: float = 0.0) -> None:
+        with self._lock:
+            self._counts[result] += 1
+            self._saved_seconds += saved
+            hit_ratio = self._counts[HIT] / sum(self._counts.values())
+        self._results.inc(labels={'result': result})
+        self._hit_ratio.set(round(hit_ratio, 4))
+        if saved:
+            self._saved.inc(saved)
+        trace = get_current_trace()
+        if trace is not None:
+            trace.root.attributes['speculative_retrieval'] = result
+            trace.root.attributes['speculation_saved_ms'] = round(saved * 1000, 2)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(self._counts.values())
+            return {
+                **self._counts,
+                'hit_ratio': round(self._counts[HIT] / total, 3) if total else 0.0,
+                'latency_saved_seconds': round(self._saved_seconds, 3),
+                'saved_per_hit_ms': round(self._saved_seconds / self._counts[HIT] * 1000, 1) if self._counts[HIT] else 0.0,
+            }
+
+
+class SpeculativeRetriever(BaseRetriever):
+    """Serves the first retrieval of an agent run from the speculation of its question."""
+
+    def __init__(
+        self,
+        retriever: BaseRetriever,
+        speculation: SpeculativeRetrieval,
+        version: int,
+        callback_manager: Optional[CallbackManager] = None
+    ):
+        """Initialize the retriever.
+
+        Args:
+            retriever: Retriever used for the speculation and for every other retrieval
+            speculation: Shared speculation manager
+            version: Ingestion version the retriever searches
+            callback_manager: Optional callback manager for retrieval events
+        """
+        super().__init__(callback_manager=callback_manager)
+        self.retriever = retriever
+        self.speculation = speculation
+        self.version = version
+        speculation.register(self)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        speculation = _current_speculation.get()
+        if speculation is not None and speculation.version == self.version:
+            nodes = self.speculation.take(speculation, query_bundle.query_str)
+            if nodes is not None:
+                # The nodes were retrieved for the question, not for this input
+                if normalize_tool_input(query_bundle.query_str) != normalize_tool_input(speculation.question):
+                    mark_uncacheable()
+                return nodes
+        return self.retriever.retrieve(query_bundle)
@@ -0,0 +1,320 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import json
+import sqlite3
+import threading
+import time
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.index_store import SimpleIndexStore
+from llama_index.core.storage.index_store.keyval_index_store import KVIndexStore
+from llama_index.core.storage.kvstore.types import DEFAULT_BATCH_SIZE, DEFAULT_COLLECTION, BaseKVStore
+
+DEFAULT_DB_PATH = "storage/fbl_rag.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    collection TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (collection, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS kv_doc_hash ON kv (json_extract(value, '$.doc_hash'))
+    WHERE json_extract(value, '$.doc_hash') IS NOT NULL;
+CREATE TABLE IF NOT EXISTS ingested_files (
+    path TEXT PRIMARY KEY,
+    file_hash TEXT,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    ingested_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ingested_files_hash ON ingested_files (file_hash);
+CREATE TABLE IF NOT EXISTS chunk_signatures (
+    dedup_id TEXT PRIMARY KEY,
+    collection TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunk_signature_bands (
+    band INTEGER NOT NULL,
+    bucket TEXT NOT NULL,
+    dedup_id TEXT NOT NULL,
+    UNIQUE (dedup_id, band, bucket)
+);
+CREATE INDEX IF NOT EXISTS chunk_signature_bands_bucket ON chunk_signature_bands (band, bucket);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SQLiteDatabase:
+    """Shared SQLite connection in WAL mode.
+
+    Every write runs in its own transaction, so a crash never leaves a
+    half-written store behind, and readers are not blocked by writers.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        """Open (and create if needed) the database.
+
+        Args:
+            db_path: Path of the SQLite database file
+        """
+        self.db_path = db_path
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._lock = threading.RLock()
+
+    def _migrate(self) -> None:
+        """Bring databases created by older versions up to the current schema."""
+        bands_sql = self._conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'chunk_signature_bands'"
+        ).fetchone()[0]
+        if "UNIQUE" not in bands_sql:
+            # Re-registered chunks used to add their band rows again: keep one row each, then enforce it
+            self._conn.executescript("""
+                BEGIN IMMEDIATE;
+                DELETE FROM chunk_signature_bands WHERE rowid NOT IN (
+                    SELECT MIN(rowid) FROM chunk_signature_bands GROUP BY dedup_id, band, bucket
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS chunk_signature_bands_unique
+                    ON chunk_signature_bands (dedup_id, band, bucket);
+                COMMIT;
+            """)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run the statements of the block in one transaction."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def query(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        """Run a read-only query and return all rows."""
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def dump_kv(self) -> List[Tuple[str, str, str]]:
+        """Return all docstore and index store rows as (collection, key, JSON value)."""
+        return self.query("SELECT collection, key, value FROM kv ORDER BY collection, key")
+
+    def load_kv(self, rows: List[Tuple[str, str, str]]) -> None:
+        """Insert docstore and index store rows produced by dump_kv in one transaction."""
+        with self.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO kv (collection, key, value) VALUES (?, ?, ?)", rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SQLiteKVStore(BaseKVStore):
+    """Key-value store for the llama-index docstore and index store backed by SQLite."""
+
+    def __init__(self, database: SQLiteDatabase):
+        self.database = database
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put_all([(key, val)], collection=collection)
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection)
+
+    def put_all(
+        self,
+        kv_pairs: List[Tuple[str, dict]],
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> None:
+        # All pairs are written in a single transaction regardless of batch_size
+        with self.database.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO kv (collection, key, value) VALUES (?, ?, ?)",
+                [(collection, key, json.dumps(val)) for key, val in kv_pairs]
+            )
+
+    async def aput_all(
+        self,
+        kv_pairs: List[Tuple[str, dict]],
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> None:
+        self.put_all(kv_pairs, collection, batch_size)
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        rows = self.database.query("SELECT value FROM kv WHERE collection = ? AND key = ?", (collection, key))
+        return json.loads(rows[0][0]) if rows else None
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return self.get(key, collection)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        rows = self.database.query("SELECT key, value FROM kv WHERE collection = ?", (collection,))
+        return {key: json.loads(value) for key, value in rows}
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return self.get_all(collection)
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        with self.database.transaction() as conn:
+            cursor = conn.execute("DELETE FROM kv WHERE collection = ? AND key = ?", (collection, key))
+            return cursor.rowcount > 0
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection)
+
+    def find_keys_by_doc_hash(self, doc_hash: str, collection: str) -> List[str]:
+        """Return the keys of a collection whose value has the given doc_hash (uses the doc hash index)."""
+        rows = self.database.query(
+            "SELECT key FROM kv WHERE json_extract(value, '$.doc_hash') = ? AND collection = ?",
+            (doc_hash, collection)
+        )
+        return [row[0] for row in rows]
+
+
+class SQLiteDocumentStore(KVDocumentStore):
+    """Docstore persisted incrementally in SQLite instead of docstore.json."""
+
+    def __init__(self, database: SQLiteDatabase, namespace: Optional[str] = None):
+        super().__init__(SQLiteKVStore(database), namespace=namespace)
+
+    def find_doc_ids_by_hash(self, doc_hash: str) -> List[str]:
+        """Return the ids of ingested documents with the given content hash."""
+        return self._kvstore.find_keys_by_doc_hash(doc_hash, self._metadata_collection)
+
+    def persist(self, persist_path: str = "", fs=None) -> None:
+        """No-op: every change is already committed."""
+
+
+class SQLiteIndexStore(KVIndexStore):
+    """Index store persisted incrementally in SQLite instead of index_store.json."""
+
+    def __init__(self, database: SQLiteDatabase, namespace: Optional[str] = None):
+        super().__init__(SQLiteKVStore(database), namespace=namespace)
+
+    def persist(self, persist_path: str = "", fs=None) -> None:
+        """No-op: every change is already committed."""
+
+
+class IngestionLedger:
+    """Files ingested into the vector store, replacing processed_files.json.
+
+    Each file is recorded in its own transaction as soon as its chunks were
+    inserted, with the hash of its content so identical files can be found.
+    """
+
+    def __init__(self, database: SQLiteDatabase):
+        self.database = database
+
+    def get_processed_files(self) -> Set[str]:
+        """Return the paths of all ingested files."""
+        return {row[0] for row in self.database.query("SELECT path FROM ingested_files")}
+
+    def record(self, path: str, file_hash: Optional[str] = None, chunks: int = 0) -> None:
+        """Mark a file as ingested."""
+        with self.database.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ingested_files (path, file_hash, chunks, ingested_at) VALUES (?, ?, ?, ?)",
+                (path, file_hash, chunks, time.time())
+            )
+
+    def record_many(self, entries: List[Dict[str, object]]) -> None:
+        """Mark several files as ingested in one transaction (entries as returned by entries())."""
+        with self.database.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO ingested_files (path, file_hash, chunks, ingested_at) VALUES (?, ?, ?, ?)",
+                [(e['path'], e.get('file_hash'), e.get('chunks', 0), e.get('ingested_at') or time.time())
+                 for e in entries]
+            )
+
+    def remove(self, path: str) -> bool:
+        """Forget an ingested file so it is processed again."""
+        with self.database.transaction() as conn:
+            return conn.execute("DELETE FROM ingested_files WHERE path = ?", (path,)).rowcount > 0
+
+    def find_by_hash(self, file_hash: str) -> List[str]:
+        """Return the paths of ingested files with the given content hash."""
+        return [row[0] for row in self.database.query(
+            "SELECT path FROM ingested_files WHERE file_hash = ?", (file_hash,)
+        )]
+
+    def entries(self) -> List[Dict[str, object]]:
+        """Return all ledger entries."""
+        rows = self.database.query("SELECT path, file_hash, chunks, ingested_at FROM ingested_files ORDER BY path")
+        return [{'path': p, 'file_hash': h, 'chunks': c, 'ingested_at': t} for p, h, c, t in rows]
+
+
+def migrate_json_storage(
+    database: SQLiteDatabase,
+    persist_dir: str = "./storage",
+    processed_files_path: str = "processed_files.json"
+) -> Dict[str, int]:
+    """Import the JSON docstore, index store and processed_files.json once.
+
+    The JSON files are left in place; a marker in the database makes sure the
+    import only runs once.
+
+    Args:
+        database: Target database
+        persist_dir: Directory of the legacy docstore.json / index_store.json
+        processed_files_path: Path of the legacy processed_files.json
+
+    Returns:
+        Number of imported documents, index structs and ledger entries
+    """
+    stats = {'documents': 0, 'index_structs': 0, 'ledger_entries': 0}
+    if database.get_meta("json_migrated"):
+        return stats
+
+    docstore_path = Path(persist_dir) / "docstore.json"
+    if docstore_path.exists():
+        legacy_docstore = SimpleDocumentStore.from_persist_path(str(docstore_path))
+        kvstore = SQLiteKVStore(database)
+        legacy_kvstore = legacy_docstore._kvstore
+        for collection in (legacy_docstore._node_collection, legacy_docstore._ref_doc_collection,
+                           legacy_docstore._metadata_collection):
+            pairs = list(legacy_kvstore.get_all(collection=collection).items())
+            if pairs:
+                kvstore.put_all(pairs, collection=collection)
+            if collection == legacy_docstore._metadata_collection:
+                stats['documents'] = len(pairs)
+
+    index_store_path = Path(persist_dir) / "index_store.json"
+    if index_store_path.exists():
+        index_store = SQLiteIndexStore(database)
+        for index_struct in SimpleIndexStore.from_persist_path(str(index_store_path)).index_structs():
+            index_store.add_index_struct(index_struct)
+            stats['index_structs'] += 1
+
+    if Path(processed_files_path).exists():
+        with open(processed_files_path, "r") as f:
+            processed_files = json.load(f)
+        with database.transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO ingested_files (path, file_hash, chunks, ingested_at) VALUES (?, NULL, 0, ?)",
+                [(path, time.time()) for path in processed_files]
+            )
+        stats['ledger_entries'] = len(processed_files)
+
+    database.set_meta("json_migrated", json.dumps({'timestamp': time.time(), **stats}))
+    if any(stats.values()):
+        print(f"Migrated JSON storage to {database.db_path}: {stats}")
+    return stats
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from admission import AdmissionController, AdmissionRejected, PRIORITY_LANE, STANDARD_LANE
+from metrics import MetricsRegistry
+
+
+async def _request(controller, lane, service_seconds, results):
+    start = time.monotonic()
+    try:
+        async with controller.admit(lane):
+            await asyncio.sleep(service_seconds)
+        results.append((lane, 'ok', time.monotonic() - start))
+    except AdmissionRejected as e:
+        assert e.retry_after >= 1
+        results.append((lane, e.reason, time.monotonic() - start))
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def test_overload_is_shed_and_latency_stays_bounded():
+    async def run():
+        registry = MetricsRegistry()
+        controller = AdmissionController(
+            max_concurrency=4, max_queue_depth=8, max_wait_seconds=0.3, registry=registry
+        )
+        results = []
+        # 200 requests arrive within 0.2s; the agent handles 4 at a time at 50ms each
+        tasks = []
+        for _ in range(200):
+            tasks.append(asyncio.create_task(_request(controller, STANDARD_LANE, 0.05, results)))
+            await asyncio.sleep(0.001)
+        await asyncio.gather(*tasks)
+        return controller, registry, results
+
+    controller, registry, results = asyncio.run(run())
+    served = [latency for _, outcome, latency in results if outcome == 'ok']
+    shed = [latency for _, outcome, latency in results if outcome != 'ok']
+    print(f"\nServed {len(served)}, shed {len(shed)}; served p50 {_percentile(served, 0.5) * 1000:.0f}ms "
+          f"p99 {_percentile(served, 0.99) * 1000:.0f}ms; shed p99 {_percentile(shed, 0.99) * 1000:.0f}ms")
+
+    assert served and shed
+    # Served requests never wait longer than max_wait_seconds plus their own service time
+    assert _percentile(served, 0.99) < 0.3 + 0.05 + 0.1
+    # Shed requests get their answer immediately or after at most max_wait_seconds
+    assert max(shed) < 0.3 + 0.1
+    assert controller.active == 0 and controller.queue_depth() == 0
+    text = registry.render()
+    assert 'admission_rejected_total{lane="standard",reason="queue_full"}' in text
+    assert 'admission_wait_seconds_count{lane="standard"}' in text
+
+
+def test_priority_lane_goes_first():
+    async def run():
+        controller = AdmissionController(max_concurrency=1, max_queue_depth=8, max_wait_seconds=5,
+                                         registry=MetricsRegistry())
+        order = []
+
+        async def request(name, lane):
+            async with controller.admit(lane):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        blocker = asyncio.create_task(request('running', STANDARD_LANE))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(request('standard-1', STANDARD_LANE)),
+                   asyncio.create_task(request('standard-2', STANDARD_LANE))]
+        await asyncio.sleep(0)
+        cached = asyncio.create_task(request('cached', PRIORITY_LANE))
+        await asyncio.gather(blocker, cached, *waiting)
+        return order
+
+    assert asyncio.run(run()) == ['running', 'cached', 'standard-1', 'standard-2']
+
+
+if __name__ == "__main__":
+    test_overload_is_shed_and_latency_stays_bounded()
+    test_priority_lane_goes_first()
@@ -0,0 +1,58 @@
+import os
+import tempfile
+from answer_cache import AnswerCache, log_query, top_logged_questions
+
+
+def test_warm_answers_are_served_until_the_corpus_changes():
+    corpus = {'version': 'v1'}
+    calls = []
+
+    def answer(question):
+        calls.append(question)
+        return f"{question} @ {corpus['version']}"
+
+    cache = AnswerCache(
+        answer_fn=answer,
+        corpus_version_fn=lambda: corpus['version'],
+        questions_fn=lambda: ["What is Boot Sequence without Boot Manager?"]
+    )
+    assert cache.warm() == 1
+    assert cache.get("what is boot sequence  without boot manager") == \
+        "What is Boot Sequence without Boot Manager? @ v1"
+    assert cache.get("Something else?") is None
+
+    # Answers computed against an old corpus version are never stored
+    assert not cache.put("Stale question", "stale", "v0")
+
+    corpus['version'] = 'v2'
+    cache.on_corpus_changed()
+    cache._warmup_thread.join(timeout=5)
+    assert cache.get("What is Boot Sequence without Boot Manager?").endswith("@ v2")
+    assert len(calls) == 2
+    assert cache.stats()['entries'] == 1
+
+
+def test_top_logged_questions():
+    log_path = os.path.join(tempfile.mkdtemp(), "query_log.jsonl")
+    for question in ["What are limiting factors of OTA?"] * 3 + ["Explain the boot sequence"] * 2 + ["rare"]:
+        log_query(question, log_path)
+    log_query("what are limiting factors of OTA", log_path)
+
+    assert top_logged_questions(2, log_path) == [
+        "what are limiting factors of OTA",
+        "Explain the boot sequence"
+    ]
+    assert top_logged_questions(0, log_path) == []
+
+    # Rotated files still count towards the most recent entries
+    rotated_path = os.path.join(tempfile.mkdtemp(), "query_log.jsonl")
+    for i in range(40):
+        log_query("Explain the boot sequence" if i < 30 else "What are limiting factors of OTA?", rotated_path, max_bytes=1000)
+    assert os.path.exists(rotated_path + ".1")
+    assert top_logged_questions(1, rotated_path, window=12) == ["What are limiting factors of OTA?"]
+    assert top_logged_questions(1, rotated_path, window=25) == ["Explain the boot sequence"]
+
+
+if __name__ == "__main__":
+    test_warm_answers_are_served_until_the_corpus_changes()
+    test_top_logged_questions()
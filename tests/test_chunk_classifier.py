@@ -0,0 +1,141 @@
+import json
+import os
+import random
+import tempfile
+import time
+from qdrant_client.models import PointStruct
+from chunk_classifier import DEFAULT_RULES_PATH, ChunkClassifier
+from vector_store_manager import VectorStoreManager
+
+
+def _legacy_content_type(text):
+    """The previous hard-coded classification, used as the benchmark baseline."""
+    text_lower = text.lower()
+    if 'security class' in text_lower:
+        return 'security_class_definition'
+    elif any(word in text_lower for word in ['example', 'usage']):
+        return 'example'
+    elif any(word in text_lower for word in ['warning', 'caution', 'note']):
+        return 'notice'
+    return 'general'
+
+
+def _legacy_labels(text, rules):
+    """The legacy substring checks applied to every rule of a taxonomy."""
+    text_lower = text.lower()
+    return [rule['label'] for rule in rules['rules'] if any(keyword in text_lower for keyword in rule['keywords'])]
+
+
+def _best_seconds(run, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _synthetic_corpus(num_chunks, words_per_chunk=300, seed=0):
+    random.seed(seed)
+    vocabulary = ("the bootloader shall verify each block before erasing it and the application valid flag "
+                  "is checked after reset by the flash driver in the ecu memory").split()
+    phrases = ['security class', 'for example', 'usage', 'warning', 'note', 'scope of delivery', 'signature']
+    corpus = []
+    for _ in range(num_chunks):
+        words = [random.choice(vocabulary) for _ in range(words_per_chunk)]
+        if random.random() < 0.5:
+            words.insert(random.randrange(len(words)), random.choice(phrases))
+        corpus.append(' '.join(words))
+    return corpus
+
+
+def test_priority_and_hierarchical_tags():
+    classifier = ChunkClassifier()
+    result = classifier.classify("The security class CCC requires a signature. For example, RSA.")
+    assert result['content_type'] == 'security_class_definition'
+    assert result['tags'] == ['example', 'security', 'security_class_definition', 'security_mechanism']
+
+    assert classifier.classify("Erasing the flash memory takes time.")['content_type'] == 'general'
+
+
+def test_sections_carry_forward_within_a_document():
+    classifier = ChunkClassifier()
+    texts = [
+        "1 Introduction\nThis manual describes the bootloader.",
+        "1.5 Scope of Delivery\nThe Flash Bootloader delivery includes:",
+        "- HexView for preparing flash data and containers",
+        "Another file without a header",
+    ]
+    metadatas = [{'file_name': 'a.pdf'}] * 3 + [{'file_name': 'b.pdf'}]
+    results = classifier.classify_batch(texts, metadatas)
+
+    assert results[1]['section_path'] == '1 Introduction > 1.5 Scope of Delivery'
+    # The list chunk has no header of its own and inherits the open section
+    assert results[2]['section'] == '1.5 Scope of Delivery'
+    assert results[2]['content_type'] == 'general'
+    # Section context never leaks into the next document
+    assert results[3]['section'] == ''
+
+
+def test_rules_are_configurable():
+    classifier = ChunkClassifier.from_rules({
+        'default_content_type': 'other',
+        'rules': [{'label': 'uds_service', 'keywords': ['routine control'], 'patterns': [r'\b0x3[14]\b']}]
+    })
+    assert classifier.classify("Send routine  control 0x31 to erase")['content_type'] == 'uds_service'
+    assert classifier.classify("Nothing here")['content_type'] == 'other'
+
+
+def test_filtered_search_only_returns_tagged_chunks():
+    vm = VectorStoreManager(local_path=tempfile.mkdtemp(), storage_db_path=os.path.join(tempfile.mkdtemp(), "fbl_rag.db"))
+    vector = [1.0] + [0.0] * 1535
+    vm.client.upsert(
+        collection_name=vm.collection_name,
+        points=[
+            PointStruct(id=i, vector=vector, payload={'text': f"chunk {i}", 'metadata': {
+                'content_type': 'security_class_definition' if i % 3 == 0 else 'general',
+                'tags': ['security', 'security_class_definition'] if i % 3 == 0 else []
+            }})
+            for i in range(12)
+        ]
+    )
+    nodes = vm.search_nodes(vector, top_k=10, content_types=['security_class_definition'])
+    assert len(nodes) == 4
+    assert all(n.node.metadata['content_type'] == 'security_class_definition' for n in nodes)
+    assert len(vm.search_nodes(vector, top_k=10, tags=['security'])) == 4
+
+
+def test_classification_throughput():
+    corpus = _synthetic_corpus(10000)
+    with open(DEFAULT_RULES_PATH) as f:
+        default_rules = json.load(f)
+    classifier = ChunkClassifier.from_rules(default_rules)
+
+    # The legacy substring checks need one scan per keyword; the automaton scans each chunk once
+    legacy_seconds = _best_seconds(lambda: [_legacy_labels(text, default_rules) for text in corpus])
+    compiled_seconds = _best_seconds(lambda: classifier.classify_batch(corpus))
+    assert compiled_seconds <= legacy_seconds
+
+    # A larger taxonomy: the legacy approach rescans every chunk once per keyword
+    random.seed(1)
+    keywords = [''.join(random.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(8)) for _ in range(200)]
+    large_rules = {'rules': [{'label': f"label_{i}", 'keywords': keywords[i * 5:(i + 1) * 5]} for i in range(40)]}
+    large = ChunkClassifier.from_rules(large_rules)
+    legacy_large_seconds = _best_seconds(lambda: [_legacy_labels(text, large_rules) for text in corpus])
+    compiled_large_seconds = _best_seconds(lambda: large.classify_batch(corpus))
+    assert compiled_large_seconds * 2 <= legacy_large_seconds
+
+    results = classifier.classify_batch(corpus)
+    legacy = [_legacy_content_type(text) for text in corpus]
+    # The default rules agree with the legacy labels wherever the legacy rules fired on whole words
+    for text, old, new in zip(corpus, legacy, results):
+        if old == 'security_class_definition':
+            assert new['content_type'] == old
+
+
+if __name__ == "__main__":
+    test_priority_and_hierarchical_tags()
+    test_sections_carry_forward_within_a_document()
+    test_rules_are_configurable()
+    test_filtered_search_only_returns_tagged_chunks()
+    test_classification_throughput()
@@ -0,0 +1,116 @@
+import time
+from typing import Any
+from llama_index.core.agent import ReActAgent
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.llms import CompletionResponse, CustomLLM, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.tools import FunctionTool
+from deadline import (
+    Deadline,
+    DeadlineCallbackHandler,
+    DeadlineExceeded,
+    StepTimeEstimator,
+    deadline_scope,
+    run_agent_with_deadline,
+)
+
+ACTION = """Thought: I need to use a tool to help me answer the question.
+Action: fblDocQuery
+Action Input: {"input": "boot sequence"}"""
+
+ANSWER = """Thought: I can answer without using any more tools.
+Answer: The bootloader checks the application valid flag."""
+
+
+class ScriptedLLM(CustomLLM):
+    """LLM that searches forever (or answers) and takes a fixed time per call."""
+
+    delay: float = 0.0
+    answer_after: int = 1000
+    calls: int = 0
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(is_chat_model=False)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        time.sleep(self.delay)
+        self.calls += 1
+        return CompletionResponse(text=ANSWER if self.calls > self.answer_after else ACTION)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError
+
+
+def _agent(llm):
+    callback_manager = CallbackManager([DeadlineCallbackHandler()])
+    llm.callback_manager = callback_manager
+    tool = FunctionTool.from_defaults(
+        fn=lambda input: "After reset the bootloader checks the application valid flag.",
+        name="fblDocQuery",
+        description="Search the Flash Bootloader documentation"
+    )
+    return ReActAgent.from_tools([tool], llm=llm, max_iterations=10, callback_manager=callback_manager)
+
+
+def test_cancel_runs_callbacks_once():
+    deadline = Deadline(10)
+    closed = []
+    deadline.on_cancel(lambda: closed.append(1))
+    deadline.cancel()
+    deadline.cancel()
+    assert closed == [1]
+    assert deadline.expired()
+    # Resources registered after cancellation are released immediately
+    deadline.on_cancel(lambda: closed.append(2))
+    assert closed == [1, 2]
+    try:
+        deadline.check("tool call")
+        assert False, "cancelled deadline must raise"
+    except DeadlineExceeded as e:
+        assert "tool call" in str(e)
+
+
+def test_finished_agent_returns_full_answer():
+    llm = ScriptedLLM(answer_after=1)
+    deadline = Deadline(10)
+    with deadline_scope(deadline):
+        response = run_agent_with_deadline(_agent(llm), "Explain the boot sequence", deadline, StepTimeEstimator())
+    assert response.response == "The bootloader checks the application valid flag."
+    assert not (response.metadata or {}).get('partial')
+
+
+def test_slow_agent_returns_partial_answer_before_deadline():
+    llm = ScriptedLLM(delay=0.2)
+    deadline = Deadline(1.0, reserve_seconds=0.2)
+    start = time.monotonic()
+    with deadline_scope(deadline):
+        response = run_agent_with_deadline(_agent(llm), "Explain the boot sequence", deadline, StepTimeEstimator(0.2))
+    elapsed = time.monotonic() - start
+    print(f"\nPartial answer after {elapsed:.2f}s and {llm.calls} LLM calls: {response.response}")
+    assert response.metadata['partial']
+    assert "application valid flag" in response.response
+    assert elapsed < 1.0
+    assert llm.calls < 10
+
+
+def test_cancelled_request_stops_llm_calls():
+    llm = ScriptedLLM()
+    deadline = Deadline(10)
+    deadline.cancel()
+    with deadline_scope(deadline):
+        try:
+            run_agent_with_deadline(_agent(llm), "Explain the boot sequence", deadline, StepTimeEstimator())
+            assert False, "cancelled request must not return an answer"
+        except DeadlineExceeded:
+            pass
+    assert llm.calls == 0
+
+
+if __name__ == "__main__":
+    test_cancel_runs_callbacks_once()
+    test_finished_agent_returns_full_answer()
+    test_slow_agent_returns_partial_answer_before_deadline()
+    test_cancelled_request_stops_llm_calls()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import time
+from llama_index.core import Document
+from extractive_answer import ExtractiveAnswerer, passage_candidates
+from retrieval_eval import HashingEmbedding
+from vector_store_manager import VectorStoreManager
+
+SCOPE_OF_DELIVERY = """# Scope of Delivery
+The Flash Bootloader delivery includes:
+- Bootloader as configurable C source code
+- HexView tool for the post-processing of download files
+- Demo application for the target ECU
+
+Please note that the DaVinci Configurator Pro tool requires a separate license."""
+OTA_LIMITS = """# Limiting Factors of OTA
+The following factors limit over-the-air updates:
+1. Available flash memory for a second application bank
+2. Bandwidth and cost of the cellular connection
+3. Battery state of the vehicle during the update"""
+BOOT_SEQUENCE = """# Boot Sequence without Boot Manager
+After reset the bootloader checks the validity of the application. If the application is valid,
+the bootloader jumps to it; otherwise it stays in the bootloader and waits for a download request."""
+FILLER = [f"# Diagnostic Service {i}\nService {i} reads the data identifier {i} of the ECU during programming." for i in range(20)]
+
+QUESTIONS = [
+    # Served extractively
+    "What are the exact items included in the Flash Bootloader delivery?",
+    "List the limiting factors of OTA",
+    "What does the 'Scope of Delivery' section contain?",
+    # The agent answers these
+    "Explain the boot sequence",
+    "How does the bootloader work?",
+    "Which items are needed for a secure download over CAN FD?",
+]
+
+
+def _manager():
+    vm = VectorStoreManager(local_path=tempfile.mkdtemp(), storage_db_path=os.path.join(tempfile.mkdtemp(), "fbl_rag.db"))
+    vm.embed_model = HashingEmbedding(dimensions=1536)
+    chunks = [SCOPE_OF_DELIVERY, OTA_LIMITS, BOOT_SEQUENCE] + FILLER
+    vm.insert_documents([
+        Document(text=text, metadata={'file_name': "FBL_Manual.pdf", 'page_label': str(page),
+                                      'section': text.splitlines()[0].lstrip("# ")})
+        for page, text in enumerate(chunks, start=10)
+    ])
+    return vm
+
+
+def test_passage_keeps_list_and_notes():
+    candidates = passage_candidates(SCOPE_OF_DELIVERY, "Scope of Delivery")
+    heading, passage, is_list = candidates[0]
+    assert is_list and heading == "Scope of Delivery\nThe Flash Bootloader delivery includes:"
+    assert passage.startswith("The Flash Bootloader delivery includes:")
+    assert passage.endswith("requires a separate license.")
+    # The whole chunk is one section, so it is a candidate as well
+    assert candidates[1] == ("Scope of Delivery\nScope of Delivery", SCOPE_OF_DELIVERY, False)
+
+
+def test_extractive_answers_skip_the_agent():
+    vm = _manager()
+    answerer = ExtractiveAnswerer(vm, min_confidence=0.8)
+    agent_calls = []
+
+    def agent(question):
+        # Simulated agent run: a few ReAct steps with LLM calls
+        time.sleep(0.3)
+        agent_calls.append(question)
+        return f"agent answer to {question}"
+
+    def answer(question):
+        response = answerer.answer(question)
+        if response is not None:
+            return response
+        start = time.perf_counter()
+        result = agent(question)
+        answerer.record_agent_latency(time.perf_counter() - start)
+        return result
+
+    # Warm the agent latency estimate the way live traffic does
+    answer("Explain the boot sequence")
+    agent_calls.clear()
+
+    start = time.perf_counter()
+    answers = {question: answer(question) for question in QUESTIONS}
+    elapsed = time.perf_counter() - start
+
+    delivery = answers[QUESTIONS[0]]
+    assert delivery.metadata['extractive'] and delivery.metadata['confidence'] >= 0.8
+    assert "- HexView tool for the post-processing of download files" in str(delivery)
+    assert "Please note that the DaVinci Configurator Pro tool requires a separate license." in str(delivery)
+    assert str(delivery).endswith('Source: FBL_Manual.pdf, page 10, section "Scope of Delivery"')
+    assert "2. Bandwidth and cost of the cellular connection" in str(answers[QUESTIONS[1]])
+    assert "Scope of Delivery" in str(answers[QUESTIONS[2]])
+    assert agent_calls == QUESTIONS[3:]
+
+    stats = answerer.stats()
+    # The warm-up question and the two explanations are not list questions, the CAN FD question falls back
+    assert stats['served'] == 3 and stats['fallback'] == 1 and stats['skipped'] == 3
+    assert stats['latency_saved_seconds'] > 0.8
+    print(f"Extractive answers: {stats['served']} of {len(QUESTIONS)} questions "
+          f"({stats['served'] / len(QUESTIONS):.0%}), {stats['latency_saved_seconds']:.2f}s of agent time saved; "
+          f"all questions answered in {elapsed:.2f}s instead of {0.3 * len(QUESTIONS):.2f}s")
+
+
+if __name__ == "__main__":
+    test_passage_keeps_list_and_notes()
+    test_extractive_answers_skip_the_agent()
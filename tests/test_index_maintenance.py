@@ -0,0 +1,140 @@
+import os
+import tempfile
+import uuid
+from llama_index.core import Document
+from qdrant_client.models import PointStruct
+from index_maintenance import run_maintenance, format_report
+from retrieval_eval import HashingEmbedding
+from sqlite_store import IngestionLedger
+from vector_store_manager import VectorStoreManager, chunk_point_id
+
+
+def _chunks(file_name, count=20):
+    return [
+        Document(
+            text=f"{file_name} page {page} describes how the flash bootloader erases and programs logical block {page} "
+                 f"of the {file_name.split('.')[0]} ECU",
+            metadata={'file_name': file_name, 'page_label': str(page)}
+        )
+        for page in range(1, count + 1)
+    ]
+
+
+def _setup():
+    data_dir = tempfile.mkdtemp()
+    for name in ("manual.pdf", "partial.pdf"):
+        open(os.path.join(data_dir, name), "wb").close()
+    vm = VectorStoreManager(local_path=tempfile.mkdtemp(), storage_db_path=os.path.join(tempfile.mkdtemp(), "fbl_rag.db"))
+    vm.embed_model = HashingEmbedding(dimensions=1536)
+    ledger = IngestionLedger(vm.database)
+    ledger.record(os.path.join(data_dir, "manual.pdf"), chunks=20)
+    ledger.record(os.path.join(data_dir, "removed.pdf"), chunks=20)
+    # removed.pdf was deleted from data/, partial.pdf failed before it reached the ledger
+    vm.insert_documents(_chunks("manual.pdf") + _chunks("removed.pdf") + _chunks("partial.pdf", 5))
+    return vm, data_dir
+
+
+def test_reingestion_overwrites_points():
+    vm, _ = _setup()
+    before = vm.get_document_count()
+    assert before == 45
+    vm.insert_documents(_chunks("manual.pdf"))
+    assert vm.get_document_count() == before
+    doc = _chunks("manual.pdf")[0]
+    assert chunk_point_id(doc.text, doc.metadata) == chunk_point_id(doc.text, dict(doc.metadata))
+    assert chunk_point_id(doc.text, doc.metadata) != chunk_point_id(doc.text, {**doc.metadata, 'page_label': "2"})
+
+
+def test_report_and_delete_orphans_and_duplicates():
+    vm, data_dir = _setup()
+    # Copies of manual.pdf left over from runs with random point IDs
+    copies = _chunks("manual.pdf")[:10]
+    vm.client.upsert(vm.collection_name, points=[
+        PointStruct(id=str(uuid.uuid4()), vector=vm.embed_model.get_text_embedding(doc.text),
+                    payload={'text': doc.text, 'metadata': doc.metadata})
+        for doc in copies
+    ])
+    assert vm.get_document_count() == 55
+
+    report = run_maintenance(vm, data_dir=data_dir, latency_queries=20)
+    counts = report['collections'][0]['counts']
+    assert counts == {'deleted_file': 20, 'incomplete_file': 5, 'exact_duplicate': 10, 'near_duplicate': 0}
+    assert [os.path.basename(path) for path in report['ledger']['deleted_files']] == ["removed.pdf"]
+    # Report only
+    assert vm.get_document_count() == 55
+
+    report = run_maintenance(vm, data_dir=data_dir, delete=True, latency_queries=20)
+    collection = report['collections'][0]
+    assert collection['remaining_points'] == vm.get_document_count() == 20
+    # The points with the deterministic IDs were kept
+    kept = {str(record.id) for record in vm.client.scroll(vm.collection_name, limit=100)[0]}
+    assert kept == {chunk_point_id(doc.text, doc.metadata) for doc in _chunks("manual.pdf")}
+    assert IngestionLedger(vm.database).get_processed_files() == {os.path.join(data_dir, "manual.pdf")}
+    print(format_report(report))
+
+    report = run_maintenance(vm, data_dir=data_dir)
+    assert sum(report['collections'][0]['counts'].values()) == 0
+
+
+def test_near_duplicates_are_merged():
+    vm, data_dir = _setup()
+    doc = _chunks("manual.pdf")[3]
+    vm.insert_documents([Document(text=doc.text + " as well", metadata={'file_name': "manual.pdf", 'page_label': "90"})])
+
+    assert run_maintenance(vm, data_dir=data_dir)['collections'][0]['counts']['near_duplicate'] == 0
+    report = run_maintenance(vm, data_dir=data_dir, delete=True, near_duplicates=True, threshold=0.7)
+    assert report['collections'][0]['counts']['near_duplicate'] == 1
+    assert vm.get_document_count() == 20
+    sources = [record.payload['metadata'].get('sources') for record in vm.client.scroll(vm.collection_name, limit=100)[0]
+               if record.payload['text'].startswith(doc.text)]
+    assert len(sources) == 1
+    assert {'file_name': "manual.pdf", 'page_label': "90"} in sources[0] and doc.metadata in sources[0]
+
+
+def test_chunks_of_deleted_files_are_kept_for_their_other_sources():
+    vm, data_dir = _setup()
+    shared, orphan = _chunks("removed.pdf")[:2]
+    # manual.pdf was collapsed into the first chunk, only deleted files into the second
+    vm.client.set_payload(vm.collection_name, key="metadata", points=[chunk_point_id(shared.text, shared.metadata)], payload={
+        'sources': [{'file_name': "removed.pdf", 'page_label': "1"}, {'file_name': "manual.pdf", 'page_label': "7", 'section': "Safety"}]
+    })
+    vm.client.set_payload(vm.collection_name, key="metadata", points=[chunk_point_id(orphan.text, orphan.metadata)], payload={
+        'sources': [{'file_name': "removed.pdf", 'page_label': "2"}, {'file_name': "gone.pdf", 'page_label': "3"}]
+    })
+
+    report = run_maintenance(vm, data_dir=data_dir, delete=True, latency_queries=20)
+    collection = report['collections'][0]
+    assert collection['rehomed_points'] == 1 and collection['counts']['deleted_file'] == 19
+    records = vm.client.retrieve(vm.collection_name, ids=[chunk_point_id(shared.text, shared.metadata)])
+    metadata = records[0].payload['metadata']
+    assert metadata['sources'] == [{'file_name': "manual.pdf", 'page_label': "7", 'section': "Safety"}]
+    assert (metadata['file_name'], metadata['page_label'], metadata['section']) == ("manual.pdf", "7", "Safety")
+    assert vm.get_document_count() == 21
+    # The moved chunk now belongs to manual.pdf
+    assert sum(run_maintenance(vm, data_dir=data_dir)['collections'][0]['counts'].values()) == 0
+
+
+def test_run_in_progress_is_not_published():
+    local_path, db_path = tempfile.mkdtemp(), os.path.join(tempfile.mkdtemp(), "fbl_rag.db")
+    data_dir = tempfile.mkdtemp()
+    open(os.path.join(data_dir, "manual.pdf"), "wb").close()
+    worker_vm = VectorStoreManager(local_path=local_path, storage_db_path=db_path)
+    worker_vm.embed_model = HashingEmbedding(dimensions=1536)
+    worker_vm.begin_ingest()
+    # The worker is still ingesting manual.pdf, which is not in the ledger yet
+    worker_vm.insert_documents(_chunks("manual.pdf", 5))
+    worker_vm.client.close()
+
+    vm = VectorStoreManager(local_path=local_path, storage_db_path=db_path, publish_interrupted_run=False)
+    report = run_maintenance(vm, data_dir=data_dir, delete=True, latency_queries=5)
+    assert report['collections'][0]['in_progress'] == 5 and report['collections'][0]['removable_points'] == 0
+    assert vm.published_ingest_version == 0 and vm.database.get_meta("ingest_version") is None
+    assert vm.get_document_count() == 5
+
+
+if __name__ == "__main__":
+    test_reingestion_overwrites_points()
+    test_report_and_delete_orphans_and_duplicates()
+    test_near_duplicates_are_merged()
+    test_chunks_of_deleted_files_are_kept_for_their_other_sources()
+    test_run_in_progress_is_not_published()
@@ -0,0 +1,115 @@
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+from index_snapshot import SnapshotError, SnapshotReader, export_snapshot, import_snapshot, verify_snapshot
+from sqlite_store import IngestionLedger, SQLiteDatabase, SQLiteKVStore
+
+DIM = 64
+
+
+def _manager(tmp_dir, name, points=0):
+    client = QdrantClient(location=":memory:")
+    client.create_collection(name, vectors_config=VectorParams(size=DIM, distance=Distance.COSINE))
+    rng = np.random.default_rng(0)
+    if points:
+        client.upload_points(name, [
+            PointStruct(id=i, vector=rng.normal(size=DIM).tolist(),
+                        payload={'text': f"chunk {i}", 'file_name': f"doc{i % 7}.pdf"})
+            for i in range(points)
+        ], batch_size=1024)
+    return SimpleNamespace(
+        client=client,
+        collection_name=name,
+        database=SQLiteDatabase(os.path.join(tmp_dir, f"{name}.db")),
+        embed_model=SimpleNamespace(model_name="text-embedding-ada-002"),
+        using_cloud=False
+    )
+
+
+def _source(tmp_dir, points=500):
+    source = _manager(tmp_dir, "fbl_docs", points)
+    SQLiteKVStore(source.database).put("doc-1", {'doc_hash': "abc"}, collection="docstore/metadata")
+    data_dir = os.path.join(tmp_dir, "data")
+    IngestionLedger(source.database).record(os.path.join(data_dir, "manual.pdf"), "hash-1", points)
+    return source, data_dir
+
+
+def test_snapshot_round_trip():
+    tmp_dir = tempfile.mkdtemp()
+    source, data_dir = _source(tmp_dir)
+    path = os.path.join(tmp_dir, "snapshots", "fbl.fblsnap")
+    header = export_snapshot(source, path, data_dir=data_dir, metadata={'corpus_version': "v1"})
+    assert header['count'] == 500
+    assert header['corpus_version'] == "v1"
+
+    target = _manager(tmp_dir, "fbl_docs_copy")
+    new_data_dir = os.path.join(tmp_dir, "other_node", "data")
+    import_snapshot(target, path, data_dir=new_data_dir)
+
+    assert target.client.count("fbl_docs_copy", exact=True).count == 500
+    original = source.client.retrieve("fbl_docs", [42], with_vectors=True)[0]
+    copy = target.client.retrieve("fbl_docs_copy", [42], with_vectors=True)[0]
+    assert copy.payload == original.payload
+    assert np.allclose(copy.vector, original.vector, atol=1e-6)
+    assert SQLiteKVStore(target.database).get("doc-1", collection="docstore/metadata") == {'doc_hash': "abc"}
+    # Ledger paths are remapped to the data directory of the importing node
+    ledger = IngestionLedger(target.database).entries()
+    assert ledger[0]['path'] == os.path.join(new_data_dir, "manual.pdf")
+    assert ledger[0]['file_hash'] == "hash-1"
+
+
+def test_corrupt_snapshot_is_rejected():
+    tmp_dir = tempfile.mkdtemp()
+    source, data_dir = _source(tmp_dir, points=50)
+    path = os.path.join(tmp_dir, "fbl.fblsnap")
+    header = export_snapshot(source, path, data_dir=data_dir)
+    verify_snapshot(path)
+
+    with open(path, "r+b") as f:
+        f.seek(header['sections']['vectors']['offset'] + 10)
+        f.write(b"\xff\xff")
+    try:
+        verify_snapshot(path)
+        assert False, "tampered snapshot passed verification"
+    except SnapshotError as e:
+        assert "vectors" in str(e)
+
+    target = _manager(tmp_dir, "other")
+    target.embed_model = SimpleNamespace(model_name="text-embedding-3-large")
+    export_snapshot(source, path, data_dir=data_dir)
+    try:
+        import_snapshot(target, path)
+        assert False, "snapshot of a different embedding model was imported"
+    except SnapshotError as e:
+        assert "text-embedding-ada-002" in str(e)
+
+
+def test_memory_mapped_search_and_import_time():
+    tmp_dir = tempfile.mkdtemp()
+    source, data_dir = _source(tmp_dir, points=5000)
+    path = os.path.join(tmp_dir, "fbl.fblsnap")
+    export_snapshot(source, path, data_dir=data_dir)
+
+    reader = SnapshotReader(path)
+    assert isinstance(reader.vectors, np.memmap)
+    query = source.client.retrieve("fbl_docs", [1234], with_vectors=True)[0].vector
+    score, record = reader.search(query, top_k=3)[0]
+    assert record['id'] == 1234
+    assert score > 0.999
+
+    target = _manager(tmp_dir, "cold_start")
+    start = time.perf_counter()
+    import_snapshot(target, path, data_dir=data_dir)
+    elapsed = time.perf_counter() - start
+    assert target.client.count("cold_start", exact=True).count == 5000
+    print(f"Imported 5000 points in {elapsed:.2f}s ({os.path.getsize(path) / 1e6:.1f} MB snapshot)")
+
+
+if __name__ == "__main__":
+    test_snapshot_round_trip()
+    test_corrupt_snapshot_is_rejected()
+    test_memory_mapped_search_and_import_time()
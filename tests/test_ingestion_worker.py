@@ -0,0 +1,285 @@
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from llama_index.core import Document
+from llama_index.core.vector_stores import VectorStoreQuery
+from document_processor import DocumentProcessor
+from ingestion_worker import FAILED, SUCCEEDED, IndexState, IngestionWorker, LiveIndex
+from retrieval_eval import HashingEmbedding
+from vector_store_manager import VectorStoreManager, ingest_version_filters
+
+
+def _manager():
+    vm = VectorStoreManager(local_path=tempfile.mkdtemp(), storage_db_path=os.path.join(tempfile.mkdtemp(), "fbl_rag.db"))
+    vm.embed_model = HashingEmbedding(dimensions=1536)
+    return vm
+
+
+def _search(vm, text, max_ingest_version):
+    query_embedding = vm.embed_model.get_query_embedding(text)
+    return [n.node.text for n in vm.search_nodes(query_embedding, top_k=10, max_ingest_version=max_ingest_version)]
+
+
+class FakeDocumentProcessor:
+    """Inserts one chunk per call, optionally blocking until released."""
+
+    def __init__(self, vector_manager, data_dir, texts):
+        self.vector_manager = vector_manager
+        self.data_dir = Path(data_dir)
+        self.texts = list(texts)
+        self.release = threading.Event()
+        self.release.set()
+        self.ingest_listeners = []
+
+    def process_documents(self, progress=None):
+        text = self.texts.pop(0)
+        progress(f"Processing {text}")
+        self.vector_manager.insert_documents([Document(text=text, metadata={'file_name': f"{text}.pdf"})])
+        self.release.wait(5)
+        progress(f"Inserted {text}")
+        return not text.startswith("broken")
+
+
+def test_unpublished_points_are_invisible():
+    vm = _manager()
+    vm.insert_documents([Document(text="bootloader legacy chunk", metadata={'file_name': "old.pdf"})])
+
+    version = vm.begin_ingest()
+    vm.insert_documents([Document(text="bootloader new chunk", metadata={'file_name': "new.pdf"})])
+    # A request that started before the run only sees the published chunks
+    assert _search(vm, "bootloader", vm.published_ingest_version) == ["bootloader legacy chunk"]
+    assert vm.end_ingest(version)
+    assert sorted(_search(vm, "bootloader", vm.published_ingest_version)) == ["bootloader legacy chunk", "bootloader new chunk"]
+
+    # A run that writes nothing does not publish a new version
+    assert not vm.end_ingest(vm.begin_ingest())
+    assert vm.published_ingest_version == version
+
+
+def test_llama_index_filters_hide_unpublished_points():
+    vm = _manager()
+    version = vm.begin_ingest()
+    vm.insert_documents([Document(text="hexview chunk", metadata={'file_name': "hexview.pdf"})])
+    embedding = vm.embed_model.get_query_embedding("hexview chunk")
+    for max_version, expected in ((version - 1, 0), (version, 1)):
+        result = vm.vector_store.query(VectorStoreQuery(
+            query_embedding=embedding, similarity_top_k=5, filters=ingest_version_filters(max_version)
+        ))
+        assert len(result.ids) == expected
+    vm.end_ingest(version)
+
+
+def test_interrupted_run_is_published_on_restart():
+    local_path, db_path = tempfile.mkdtemp(), os.path.join(tempfile.mkdtemp(), "fbl_rag.db")
+    vm = VectorStoreManager(local_path=local_path, storage_db_path=db_path)
+    vm.embed_model = HashingEmbedding(dimensions=1536)
+    version = vm.begin_ingest()
+    vm.insert_documents([Document(text="flash driver chunk", metadata={'file_name': "driver.pdf"})])
+    vm.client.close()
+
+    restarted = VectorStoreManager(local_path=local_path, storage_db_path=db_path)
+    assert restarted.published_ingest_version == version
+
+
+def test_worker_runs_jobs_and_streams_progress():
+    vm = _manager()
+    processor = FakeDocumentProcessor(vm, tempfile.mkdtemp(), ["first", "broken"])
+    # Listeners build the new index state, so they run once the version is published
+    notified = []
+    processor.ingest_listeners.append(lambda: notified.append((vm.published_ingest_version, vm.pending_ingest_version)))
+    worker = IngestionWorker(processor, vm, poll_interval=0)
+    worker.start()
+    try:
+        processor.release.clear()
+        job = worker.submit(trigger="admin")
+        deadline = time.time() + 5
+        while vm.client.count(vm.collection_name, exact=True).count == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        # The chunk is written but the run is not published yet
+        assert _search(vm, "first", vm.published_ingest_version) == []
+        processor.release.set()
+
+        cursor, messages, finished = 0, [], False
+        while not finished:
+            events, finished = job.wait_for_events(cursor, timeout=5)
+            cursor += len(events)
+            messages += [event.get('message') or event.get('status') for event in events]
+        assert job.status == SUCCEEDED and job.published
+        assert messages[-1] == SUCCEEDED
+        assert "Inserted first" in messages
+        assert _search(vm, "first", vm.published_ingest_version) == ["first"]
+        assert notified == [(job.ingest_version, None)]
+
+        queued = worker.submit(trigger="admin")
+        # Submissions while a job is queued are coalesced into it
+        assert worker.submit(trigger="watcher") is queued
+        deadline = time.time() + 5
+        while not queued.finished and time.time() < deadline:
+            time.sleep(0.01)
+        assert queued.status == FAILED
+        assert [j.id for j in worker.jobs()] == [queued.id, job.id]
+    finally:
+        worker.stop()
+
+
+def test_watcher_detects_new_files():
+    vm = _manager()
+    data_dir = tempfile.mkdtemp()
+    processor = FakeDocumentProcessor(vm, data_dir, ["watched"])
+    worker = IngestionWorker(processor, vm, poll_interval=0.05)
+    worker.start()
+    try:
+        time.sleep(0.1)
+        Path(data_dir, "new_manual.pdf").write_bytes(b"%PDF-1.4")
+        deadline = time.time() + 5
+        while not worker.jobs() and time.time() < deadline:
+            time.sleep(0.02)
+        job = worker.jobs()[0]
+        assert job.trigger == "watcher"
+        while not job.finished and time.time() < deadline:
+            time.sleep(0.02)
+        assert job.status == SUCCEEDED
+    finally:
+        worker.stop()
+
+
+def test_in_flight_requests_keep_their_state():
+    live_index = LiveIndex(IndexState(1, tools=["old tool"]))
+    state = live_index.current
+    previous = live_index.swap(IndexState(2, tools=["new tool"]))
+    assert previous is state
+    assert state.tools == ["old tool"]
+    assert live_index.current.version == 2
+
+
+def test_changed_file_replaces_its_points_on_publish():
+    local_path, db_path = tempfile.mkdtemp(), os.path.join(tempfile.mkdtemp(), "fbl_rag.db")
+    vm = VectorStoreManager(local_path=local_path, storage_db_path=db_path, llama_cloud_api_key="llx-test")
+    vm.embed_model = HashingEmbedding(dimensions=1536)
+    processor = DocumentProcessor(vm)
+    processor.data_dir = Path(tempfile.mkdtemp())
+    manual = processor.data_dir / "UserManual_FBL.pdf"
+    pages = {'texts': []}
+    processor.parse_pages = lambda path, first_page=0, count=None: [
+        Document(text=text, metadata={'file_name': os.path.basename(path)}) for text in pages['texts'][first_page:]
+    ][:count]
+    processor.get_page_count = lambda path: len(pages['texts'])
+    shared = "The bootloader erases every logical block before it writes the new application data to flash."
+
+    def ingest(content, texts):
+        manual.write_bytes(content)
+        pages['texts'] = texts
+        version = vm.begin_ingest()
+        assert processor.process_documents()
+        assert vm.end_ingest(version)
+
+    ingest(b"%PDF-1.7 first", [shared, "Security class C uses a seed and key exchange with 16 byte seeds."])
+    assert processor.get_new_documents() == []
+    old_points = vm.client.count(vm.collection_name, exact=True).count
+    corpus_version = processor.get_corpus_version()
+    # The index state of the first version adds a llama-index node per chunk
+    vm.create_index(processor.get_all_documents())
+
+    # Same path, new content
+    ingest(b"%PDF-1.7 second", [shared, "Security class CCC verifies an RSA signature of the downloaded data."])
+    texts = [n.node.text for n in vm.search_nodes(vm.embed_model.get_query_embedding("security class"), top_k=10)]
+    assert any("RSA signature" in text for text in texts)
+    assert not any("seed and key" in text for text in texts)
+    assert vm.client.count(vm.collection_name, exact=True).count == old_points
+    # Only the signatures of the current chunks are left, each with one row per band
+    signatures = {row[0] for row in vm.database.query("SELECT dedup_id FROM chunk_signatures")}
+    assert signatures == vm.file_dedup_ids("UserManual_FBL.pdf") and len(signatures) == old_points
+    bands = processor.deduplicator.bands
+    assert vm.database.query("SELECT COUNT(*) FROM chunk_signature_bands")[0][0] == bands * len(signatures)
+    assert processor.ledger.entries()[0]['file_hash'] == processor.get_file_hash(str(manual))
+    # Cached answers of the old content are dropped
+    assert processor.get_corpus_version() != corpus_version
+    assert processor.get_new_documents() == []
+
+    # Queries through the llama-index retriever of the new index state only see the new content
+    index = vm.create_index(processor.get_all_documents())
+    retriever = index.as_retriever(similarity_top_k=10, filters=ingest_version_filters(vm.published_ingest_version))
+    texts = [n.node.text for n in retriever.retrieve("security class")]
+    assert any("RSA signature" in text for text in texts)
+    assert not any("seed and key" in text for text in texts)
+    # One node per current chunk; building the index state again adds none
+    assert vm.client.count(vm.collection_name, exact=True).count == 2 * old_points
+    vm.create_index(processor.get_all_documents())
+    assert vm.client.count(vm.collection_name, exact=True).count == 2 * old_points
+
+
+def test_file_that_failed_part_way_is_not_published():
+    vm = VectorStoreManager(local_path=tempfile.mkdtemp(), storage_db_path=os.path.join(tempfile.mkdtemp(), "fbl_rag.db"),
+                            llama_cloud_api_key="llx-test")
+    vm.embed_model = HashingEmbedding(dimensions=1536)
+    processor = DocumentProcessor(vm)
+    processor.data_dir = Path(tempfile.mkdtemp())
+    (processor.data_dir / "UserManual_FBL.pdf").write_bytes(b"%PDF-1.7")
+    processor.window_pages = 1
+    processor.get_page_count = lambda path: 2
+
+    def parse_pages(path, first_page=0, count=None):
+        if first_page == 1:
+            raise ConnectionError("LlamaParse timed out")
+        return [Document(text="The first page of the manual is stored before the second one fails.",
+                         metadata={'file_name': os.path.basename(path)})]
+    processor.parse_pages = parse_pages
+
+    version = vm.begin_ingest()
+    assert not processor.process_documents()
+    # The first window was written, but the run does not publish half a file
+    assert not vm.end_ingest(version)
+    assert vm.client.count(vm.collection_name, exact=True).count == 0
+    assert processor.get_new_documents() == [str((processor.data_dir / "UserManual_FBL.pdf").absolute())]
+
+
+def test_replacing_a_file_keeps_chunks_of_other_files():
+    vm = VectorStoreManager(local_path=tempfile.mkdtemp(), storage_db_path=os.path.join(tempfile.mkdtemp(), "fbl_rag.db"),
+                            llama_cloud_api_key="llx-test")
+    vm.embed_model = HashingEmbedding(dimensions=1536)
+    processor = DocumentProcessor(vm)
+    processor.data_dir = Path(tempfile.mkdtemp())
+    contents = {}
+    processor.parse_pages = lambda path, first_page=0, count=None: [
+        Document(text=text, metadata={'file_name': os.path.basename(path)}) for text in contents[path][first_page:]
+    ][:count]
+    processor.get_page_count = lambda path: len(contents[path])
+    safety = ("Caution: erasing the flash memory while the ECU is powered by an unstable supply "
+              "can leave the device without a valid application.")
+
+    def ingest(name, content, texts):
+        path = processor.data_dir / name
+        path.write_bytes(content)
+        contents[str(path.absolute())] = texts
+        version = vm.begin_ingest()
+        assert processor.process_documents()
+        assert vm.end_ingest(version)
+
+    ingest("UserManual_FBL.pdf", b"%PDF-1.7 first", [safety, "Security class C uses a seed and key exchange."])
+    # The safety note of the second manual is collapsed into the chunk of the first one
+    ingest("HexView.pdf", b"%PDF-1.7 hexview", [safety, "HexView merges the segments of a download file."])
+    assert vm.client.count(vm.collection_name, exact=True).count == 3
+
+    # The new version of the first manual drops the safety note
+    ingest("UserManual_FBL.pdf", b"%PDF-1.7 second", ["Security class CCC verifies an RSA signature."])
+    nodes = vm.search_nodes(vm.embed_model.get_query_embedding(safety), top_k=10)
+    safety_nodes = [n for n in nodes if n.node.text == safety]
+    assert len(safety_nodes) == 1
+    metadata = safety_nodes[0].node.metadata
+    assert metadata['file_name'] == "HexView.pdf"
+    assert [source['file_name'] for source in metadata['sources']] == ["HexView.pdf"]
+    assert not any("seed and key" in n.node.text for n in nodes)
+
+
+if __name__ == "__main__":
+    test_unpublished_points_are_invisible()
+    test_llama_index_filters_hide_unpublished_points()
+    test_interrupted_run_is_published_on_restart()
+    test_worker_runs_jobs_and_streams_progress()
+    test_watcher_detects_new_files()
+    test_in_flight_requests_keep_their_state()
+    test_changed_file_replaces_its_points_on_publish()
+    test_file_that_failed_part_way_is_not_published()
+    test_replacing_a_file_keeps_chunks_of_other_files()
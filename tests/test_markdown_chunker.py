@@ -0,0 +1,104 @@
+from llama_index.core import Document
+from markdown_chunker import MarkdownChunker, compare_chunking
+
+SAMPLE_PAGE_1 = """# Flash Bootloader User Manual
+
+## 1 Introduction
+
+This document describes the Flash Bootloader. It explains the installation and configuration of the bootloader
+and its integration into the ECU software.
+
+### 1.5 Scope of Delivery
+
+The Flash Bootloader delivery includes:
+
+- Bootloader as configurable C source code
+- Flash driver for the used microcontroller
+- HexView for preparing flash data and containers
+- Vector DaVinci Configurator Pro configuration files
+
+Please note that the DaVinci Configurator Pro tool is not part of the delivery and must be licensed separately.
+"""
+
+SAMPLE_PAGE_2 = """| Security Class | Checksum | Signature | Encryption |
+|---|---|---|---|
+| DDD | CRC | - | optional |
+| C | - | HMAC | optional |
+| CCC | - | RSA | optional |
+
+## 2 Boot Sequence
+
+### 2.1 Boot Sequence without Boot Manager
+
+After reset the bootloader checks the application valid flag. If the flag is set the application is started,
+otherwise the bootloader stays active and waits for a reprogramming request.
+"""
+
+
+def _documents():
+    metadata = {'file_name': 'Understanding_Flashbootloader.pdf'}
+    return [
+        Document(text=SAMPLE_PAGE_1, metadata={**metadata, 'page_label': '1'}),
+        Document(text=SAMPLE_PAGE_2, metadata={**metadata, 'page_label': '2'})
+    ]
+
+
+def test_lists_and_tables_stay_intact():
+    chunker = MarkdownChunker(chunk_size=1024)
+    nodes = chunker.get_nodes_from_documents(_documents())
+
+    delivery = [n for n in nodes if 'delivery includes:' in n.text]
+    assert len(delivery) == 1
+    assert 'Bootloader as configurable C source code' in delivery[0].text
+    assert 'Vector DaVinci Configurator Pro configuration files' in delivery[0].text
+
+    table = [n for n in nodes if '| Security Class |' in n.text]
+    assert len(table) == 1
+    assert '| CCC | - | RSA | optional |' in table[0].text
+
+
+def test_heading_path_carries_across_pages():
+    chunker = MarkdownChunker(chunk_size=1024)
+    nodes = chunker.get_nodes_from_documents(_documents())
+
+    table = [n for n in nodes if '| Security Class |' in n.text][0]
+    # The table on page 2 continues the section opened on page 1
+    assert table.metadata['heading_path'].endswith('1.5 Scope of Delivery')
+    assert table.metadata['page_label'] == '2'
+
+    boot = [n for n in nodes if 'application valid flag' in n.text][0]
+    assert boot.metadata['heading_path'] == 'Flash Bootloader User Manual > 2 Boot Sequence'
+    assert boot.metadata['section'] == '2 Boot Sequence'
+
+
+def test_oversize_sections_fall_back_to_splitting():
+    items = '\n'.join(f"- Requirement {i}: the bootloader shall verify block {i} before erasing it" for i in range(200))
+    text = f"# Requirements\n\n{items}\n"
+    chunker = MarkdownChunker(chunk_size=256, chunk_overlap=16)
+    chunks = chunker.split_text(text)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunker.count_tokens(chunk['text']) <= 256
+        assert chunk['heading_path'] == ['Requirements']
+        # Items are never cut in half
+        for line in chunk['text'].split('\n')[1:]:
+            assert not line or line.startswith('- Requirement')
+
+
+def test_fewer_chunks_and_tokens_than_sentence_splitter():
+    # A longer manual as one document: legacy 512/150 chunks overlap heavily
+    text = '\n'.join(SAMPLE_PAGE_1.replace('1.5', f'1.{i}') + SAMPLE_PAGE_2 for i in range(20))
+    documents = [Document(text=text, metadata={'file_name': 'Understanding_Flashbootloader.pdf'})]
+    report = compare_chunking(documents)
+    print(f"Before (SentenceSplitter 512/150): {report['before']}")
+    print(f"After (MarkdownChunker 1024/32): {report['after']}")
+    assert report['after']['chunks'] < report['before']['chunks']
+    assert report['after']['total_tokens'] < report['before']['total_tokens']
+
+
+if __name__ == "__main__":
+    test_lists_and_tables_stay_intact()
+    test_heading_path_carries_across_pages()
+    test_oversize_sections_fall_back_to_splitting()
+    test_fewer_chunks_and_tokens_than_sentence_splitter()
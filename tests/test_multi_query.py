@@ -0,0 +1,133 @@
+import json
+import os
+import tempfile
+import time
+from typing import Any, List
+from llama_index.core import Document
+from llama_index.core.agent import ReActAgent
+from llama_index.core.llms import CompletionResponse, CustomLLM, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.tools import FunctionTool
+from multi_query import MultiQueryRetriever, generate_query_variants, reciprocal_rank_fusion
+from retrieval_eval import HashingEmbedding
+from retrievers import VectorStoreRetriever
+from vector_store_manager import VectorStoreManager
+
+SECTIONS = {
+    "Scope of Delivery": "Scope of Delivery lists the bootloader as configurable C source code",
+    "The Flash Bootloader delivery includes:": "The Flash Bootloader delivery includes the HexView tool and a demo application",
+    "Please note that the DaVinci Configurator Pro tool": "Please note that the DaVinci Configurator Pro tool requires a separate license",
+}
+FILLER = [f"Chapter {i} describes diagnostic service {i} of the ECU programming sequence" for i in range(30)]
+
+
+class CountingEmbedding(HashingEmbedding):
+    queries: List[str] = []
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        self.queries.append(query)
+        return super()._get_query_embedding(query)
+
+
+class StepLLM(CustomLLM):
+    """LLM that searches once per given tool input, then answers; each call takes ``delay`` seconds."""
+
+    inputs: List[str] = []
+    delay: float = 0.0
+    calls: int = 0
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(is_chat_model=False)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        time.sleep(self.delay)
+        self.calls += 1
+        if self.calls <= len(self.inputs):
+            return CompletionResponse(text=(
+                "Thought: I need to use a tool to help me answer the question.\nAction: fblDocQuery\n"
+                f"Action Input: {json.dumps({'input': self.inputs[self.calls - 1]})}"
+            ))
+        return CompletionResponse(text="Thought: I can answer without using any more tools.\nAnswer: done")
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError
+
+
+def _manager():
+    vm = VectorStoreManager(local_path=tempfile.mkdtemp(), storage_db_path=os.path.join(tempfile.mkdtemp(), "fbl_rag.db"))
+    vm.embed_model = CountingEmbedding(dimensions=1536)
+    vm.insert_documents([Document(text=text, metadata={'file_name': "manual.pdf"})
+                         for text in list(SECTIONS.values()) + FILLER])
+    return vm
+
+
+def test_query_variants():
+    assert generate_query_variants("Scope of Delivery | scope of delivery?\nHexView") == ["Scope of Delivery", "HexView"]
+    variants = generate_query_variants("What are the items in the 'Scope of Delivery'?")
+    assert variants == ["What are the items in the 'Scope of Delivery'?", "Scope of Delivery", "items Scope Delivery"]
+    assert len(generate_query_variants(" | ".join(f"term {i}" for i in range(10)), max_variants=4)) == 4
+
+
+def test_reciprocal_rank_fusion_prefers_consensus():
+    a, b, c = (NodeWithScore(node=TextNode(id_=name, text=name), score=1.0) for name in "abc")
+    fused = reciprocal_rank_fusion([[a, b], [c, b], [b]], top_n=2)
+    assert [node.node.node_id for node in fused] == ["b", "a"]
+
+
+def test_one_call_covers_all_variants():
+    vm = _manager()
+    retriever = MultiQueryRetriever(
+        VectorStoreRetriever(vm, similarity_top_k=3), vm.embed_model, similarity_top_k=3
+    )
+    nodes = retriever.retrieve(" | ".join(SECTIONS))
+    assert sorted(node.node.text for node in nodes) == sorted(SECTIONS.values())
+    # Every variant was embedded as a query, like a single query
+    assert sorted(vm.embed_model.queries) == sorted(SECTIONS)
+
+
+def _run_agent(tool_fn, inputs, delay):
+    llm = StepLLM(inputs=inputs, delay=delay)
+    tool = FunctionTool.from_defaults(fn=tool_fn, name="fblDocQuery", description="Search the documentation")
+    agent = ReActAgent.from_tools([tool], llm=llm, max_iterations=10)
+    start = time.perf_counter()
+    agent.query("What are the exact items included in the Flash Bootloader delivery?")
+    return llm.calls, time.perf_counter() - start
+
+
+def test_multi_query_saves_agent_iterations():
+    vm = _manager()
+    single = VectorStoreRetriever(vm, similarity_top_k=3)
+    multi = MultiQueryRetriever(VectorStoreRetriever(vm, similarity_top_k=3), vm.embed_model, similarity_top_k=3)
+    found = {'single': set(), 'multi': set()}
+
+    def single_search(input: str) -> str:
+        nodes = single.retrieve(input)
+        found['single'].update(node.node.text for node in nodes)
+        return "\n".join(node.node.text for node in nodes)
+
+    def multi_search(input: str) -> str:
+        nodes = multi.retrieve(input)
+        found['multi'].update(node.node.text for node in nodes)
+        return "\n".join(node.node.text for node in nodes)
+
+    # Simulated LLM latency per ReAct step
+    delay = 0.2
+    before = _run_agent(single_search, list(SECTIONS), delay)
+    after = _run_agent(multi_search, [" | ".join(SECTIONS)], delay)
+
+    assert set(SECTIONS.values()) <= found['single'] and set(SECTIONS.values()) <= found['multi']
+    assert after[0] < before[0]
+    assert after[1] < before[1]
+    print(f"Sequential variants: {before[0]} LLM calls in {before[1]:.2f}s; "
+          f"one multi-query call: {after[0]} LLM calls in {after[1]:.2f}s")
+
+
+if __name__ == "__main__":
+    test_query_variants()
+    test_reciprocal_rank_fusion_prefers_consensus()
+    test_one_call_covers_all_variants()
+    test_multi_query_saves_agent_iterations()
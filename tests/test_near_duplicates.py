@@ -0,0 +1,120 @@
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from llama_index.core import Document
+from near_duplicates import MinHasher, NearDuplicateDetector
+from retrieval_eval import HashingEmbedding
+from sqlite_store import SQLiteDatabase
+from vector_store_manager import VectorStoreManager
+
+COPYRIGHT = ("Copyright 2023 Vector Informatik GmbH. All rights reserved. No part of this document may be "
+             "reproduced, transmitted or translated in any form without prior written permission. Page {page}")
+SAFETY_NOTE = ("Caution: erasing the flash memory while the ECU is powered by an unstable supply can leave the "
+               "device without a valid application. Always verify the supply voltage before starting a download.")
+INTERFACE_TABLE = ("| Service | ID | Description |\n| DiagnosticSessionControl | 0x10 | Switch to programming session |\n"
+                   "| RoutineControl | 0x31 | Erase memory and check dependencies |\n"
+                   "| RequestDownload | 0x34 | Start the transfer of a logical block |")
+
+
+def _manual(file_name, unique_chunks=30, seed=0):
+    """A manual with its own content plus the boilerplate shared by all manuals."""
+    rng = random.Random(f"{file_name}{seed}")
+    vocabulary = [f"{file_name[:4].lower()}word{i}" for i in range(300)]
+    chunks = [" ".join(rng.choice(vocabulary) for _ in range(80)) for _ in range(unique_chunks)]
+    chunks += [COPYRIGHT.format(page=page) for page in (2, 40)] + [SAFETY_NOTE, INTERFACE_TABLE]
+    return [
+        Document(text=text, metadata={'file_name': file_name, 'page_label': str(page)})
+        for page, text in enumerate(chunks, start=1)
+    ]
+
+
+def _detector(threshold=0.85):
+    return NearDuplicateDetector(SQLiteDatabase(os.path.join(tempfile.mkdtemp(), "fbl_rag.db")), threshold=threshold)
+
+
+def test_minhash_estimates_similarity():
+    hasher = MinHasher()
+    text = SAFETY_NOTE * 3
+    assert hasher.similarity(hasher.signature(text), hasher.signature(text)) == 1.0
+    edited = hasher.similarity(hasher.signature(text), hasher.signature(text.replace("Always", "Please")))
+    assert 0.7 < edited < 1.0
+    assert hasher.similarity(hasher.signature(SAFETY_NOTE), hasher.signature(INTERFACE_TABLE)) < 0.1
+
+
+def test_duplicates_within_a_file_share_one_chunk():
+    detector = _detector()
+    documents = _manual("Interface_APPL.pdf") + [Document(text=SAFETY_NOTE, metadata={'file_name': "Interface_APPL.pdf", 'page_label': "77"})]
+    kept, stored_sources, stats = detector.deduplicate(documents, lambda metadata: "FBL_RAG")
+
+    assert stats['collapsed_chunks'] == 2
+    assert not stored_sources
+    safety = [doc for doc in kept if doc.text == SAFETY_NOTE][0]
+    assert [source['page_label'] for source in safety.metadata['sources']] == ["33", "77"]
+    # Copyright pages that only differ in the page number are collapsed as well
+    copyright = [doc for doc in kept if doc.text.startswith("Copyright")]
+    assert [source['page_label'] for source in copyright[0].metadata['sources']] == ["31", "32"]
+
+
+def test_threshold_controls_aggressiveness():
+    text = " ".join(f"word{i}" for i in range(200))
+    edited = text.replace("word100", "changed").replace("word150", "changed")
+    documents = [Document(text=text, metadata={'file_name': "a.pdf"}), Document(text=edited, metadata={'file_name': "b.pdf"})]
+    assert _detector(threshold=1.0).deduplicate(documents, lambda m: "FBL_RAG")[2]['collapsed_chunks'] == 0
+    assert _detector(threshold=0.85).deduplicate(documents, lambda m: "FBL_RAG")[2]['collapsed_chunks'] == 1
+
+
+def test_boilerplate_across_manuals_is_stored_once():
+    vm = VectorStoreManager(local_path=tempfile.mkdtemp(), storage_db_path=os.path.join(tempfile.mkdtemp(), "fbl_rag.db"))
+    vm.embed_model = HashingEmbedding(dimensions=1536)
+    detector = NearDuplicateDetector(vm.database)
+    manuals = ["Interface_APPL.pdf", "UserManual_FBL.pdf", "HexView.pdf", "OTA_Manual.pdf", "Security.pdf"]
+
+    total_chunks, start = 0, time.perf_counter()
+    for file_name in manuals:
+        documents = _manual(file_name)
+        total_chunks += len(documents)
+        kept, stored_sources, _ = detector.deduplicate(documents, vm.collection_for_metadata)
+        assert vm.insert_documents(kept)['failed_insertions'] == 0
+        detector.register()
+        for (collection_name, dedup_id), sources in stored_sources.items():
+            vm.add_chunk_sources(collection_name, dedup_id, sources)
+    elapsed = time.perf_counter() - start
+
+    stored = vm.client.count(vm.collection_name, exact=True).count
+    # Each manual repeats the copyright page; the first stores the boilerplate once, the others not at all
+    assert stored == total_chunks - 1 - 4 * 4
+    table = vm.hybrid_search("RoutineControl 0x31 Erase memory and check dependencies", top_k=1)[0]
+    assert [source['file_name'] for source in table.metadata['sources']] == manuals
+    print(f"Stored {stored} of {total_chunks} chunks ({1 - stored / total_chunks:.1%} smaller) in {elapsed:.2f}s")
+
+
+def test_signatures_are_stored_once():
+    detector = _detector()
+    for _ in range(2):
+        detector.deduplicate(_manual("Interface_APPL.pdf"), lambda metadata: "FBL_RAG", ignored_ids={"all"})
+        detector.register()
+    signatures = detector.database.query("SELECT COUNT(*) FROM chunk_signatures")[0][0]
+    assert detector.database.query("SELECT COUNT(*) FROM chunk_signature_bands")[0][0] == signatures * detector.bands
+
+    # Databases whose band rows were written twice are cleaned up when opened
+    db_path = os.path.join(tempfile.mkdtemp(), "fbl_rag.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE chunk_signature_bands (band INTEGER NOT NULL, bucket TEXT NOT NULL, dedup_id TEXT NOT NULL)")
+    conn.executemany("INSERT INTO chunk_signature_bands VALUES (?, ?, ?)", [(0, "a", "x"), (0, "a", "x"), (1, "b", "x")])
+    conn.commit()
+    conn.close()
+    database = SQLiteDatabase(db_path)
+    assert database.query("SELECT band, bucket, dedup_id FROM chunk_signature_bands ORDER BY band") == [(0, "a", "x"), (1, "b", "x")]
+    with database.transaction() as conn:
+        conn.execute("INSERT OR IGNORE INTO chunk_signature_bands VALUES (0, 'a', 'x')")
+    assert database.query("SELECT COUNT(*) FROM chunk_signature_bands")[0][0] == 2
+
+
+if __name__ == "__main__":
+    test_minhash_estimates_similarity()
+    test_duplicates_within_a_file_share_one_chunk()
+    test_threshold_controls_aggressiveness()
+    test_boilerplate_across_manuals_is_stored_once()
+    test_signatures_are_stored_once()
@@ -0,0 +1,85 @@
+from llama_index.core.agent import ReActAgent
+from llama_index.core.callbacks.schema import CBEventType, EventPayload
+from llama_index.core.llms import ChatMessage, ChatResponse, MessageRole
+from llama_index.core.tools import FunctionTool
+from llama_index.core.utils import get_tokenizer
+from prompt_layout import MIN_CACHEABLE_TOKENS, StablePrefixReActChatFormatter, estimate_cached_tokens
+from prompts import context, system_prompt, warmup_questions
+from test_deadline import ScriptedLLM
+from token_report import layout_report, summarize_usage
+from tracing import RequestTrace, TraceCallbackHandler, new_request_id, trace_scope
+
+
+def _tools():
+    def search(input: str) -> str:
+        """Search the documentation"""
+        return ""
+
+    def lookup(input: str) -> str:
+        """Look up a term"""
+        return ""
+
+    return [FunctionTool.from_defaults(fn=search, name="fblDocQuery"), FunctionTool.from_defaults(fn=lookup, name="glossary")]
+
+
+def test_static_prefix_is_identical_and_comes_first():
+    formatter = StablePrefixReActChatFormatter.from_prompts(system_prompt, context)
+    tools = _tools()
+    first = formatter.format(tools, [ChatMessage(role=MessageRole.USER, content="Explain the boot sequence")])
+    second = formatter.format(list(reversed(tools)), [ChatMessage(role=MessageRole.USER, content="What is HexView?")])
+
+    assert first[0].role == MessageRole.SYSTEM
+    assert first[0].content == second[0].content
+    assert system_prompt.strip() in first[0].content
+    assert "Scope of Delivery" in first[0].content
+    # The question is never part of the static prefix
+    assert "boot sequence" not in first[0].content
+    assert first[-1].content == "Explain the boot sequence"
+    assert len(get_tokenizer()(first[0].content)) >= MIN_CACHEABLE_TOKENS
+
+    # Agents built per request with the shared formatter send the same prefix
+    llm = ScriptedLLM(answer_after=0)
+    agents = [ReActAgent.from_tools(tools, llm=llm, react_chat_formatter=formatter) for _ in range(2)]
+    assert all(agent.agent_worker._react_chat_formatter is formatter for agent in agents)
+
+
+def test_cache_estimate_follows_provider_rules():
+    prefix = list(range(1100))
+    prompts = [prefix + [1, 2, 3], prefix + [4, 5], list(range(500)), prefix[:1000] + [9]]
+    # 1100 shared tokens are cached in 128-token steps; prompts under 1024 tokens never hit
+    assert estimate_cached_tokens(prompts) == [0, 1024, 0, 0]
+
+
+def test_token_usage_is_accumulated_per_request():
+    handler = TraceCallbackHandler()
+    trace = RequestTrace(new_request_id())
+    usage = {'prompt_tokens': 1500, 'completion_tokens': 40, 'prompt_tokens_details': {'cached_tokens': 1024}}
+    with trace_scope(trace):
+        for i in range(2):
+            handler.on_event_start(CBEventType.LLM, {}, event_id=f"llm-{i}")
+            response = ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content="ok"), raw={'usage': usage})
+            handler.on_event_end(CBEventType.LLM, {EventPayload.RESPONSE: response}, event_id=f"llm-{i}")
+    trace.finish(status="ok")
+
+    assert trace.usage == {'llm_calls': 2, 'prompt_tokens': 3000, 'cached_tokens': 2048, 'completion_tokens': 80}
+    summary = summarize_usage([trace.to_dict()])
+    assert summary['per_query']['cached_tokens'] == 2048
+    assert summary['cache_hit_ratio'] == round(2048 / 3000, 3)
+
+
+def test_layout_report_shows_savings():
+    report = layout_report(warmup_questions)
+    assert not report['previous']['cacheable_prefix']
+    assert report['stable_prefix']['cacheable_prefix']
+    assert report['saved_input_tokens_per_query'] > 0
+    print(f"Static prefix: {report['previous']['static_prefix_tokens']} -> "
+          f"{report['stable_prefix']['static_prefix_tokens']} tokens, "
+          f"cached per query: {report['stable_prefix']['cached_tokens_per_query']}, "
+          f"input tokens saved per query: {report['saved_input_tokens_per_query']}")
+
+
+if __name__ == "__main__":
+    test_static_prefix_is_identical_and_comes_first()
+    test_cache_estimate_follows_provider_rules()
+    test_token_usage_is_accumulated_per_request()
+    test_layout_report_shows_savings()
@@ -0,0 +1,201 @@
+import os
+import statistics
+import tempfile
+import time
+import uuid
+import pytest
+from llama_index.core import Document
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+from qdrant_balancer import LoadBalancedQdrantClient, build_balanced_client
+from retrieval_eval import HashingEmbedding
+from vector_store_manager import VECTOR_SIZE, VectorStoreManager
+
+COLLECTION = "FBL_RAG"
+TEXTS = [f"Section {i} describes how the bootloader validates logical block {i} before the jump" for i in range(200)]
+
+
+class Node:
+    """A Qdrant node that can be slowed down or taken offline."""
+
+    def __init__(self, client):
+        self.client = client
+        self.delay = 0.0
+        self.down = False
+        self.reads = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            if self.down:
+                raise ConnectionRefusedError("node is down")
+            time.sleep(self.delay)
+            if name in ("search", "query_points", "scroll", "count", "retrieve"):
+                self.reads += 1
+            return attribute(*args, **kwargs)
+        return call
+
+
+def _points(embed_model):
+    return [
+        PointStruct(id=str(uuid.uuid5(uuid.NAMESPACE_URL, text)), vector=embed_model.get_text_embedding(text),
+                    payload={'text': text, 'metadata': {'file_name': "manual.pdf"}})
+        for text in TEXTS
+    ]
+
+
+def _replicated_nodes(count=3):
+    """Local nodes holding the same collection, as the replicas of a Qdrant cluster would."""
+    embed_model = HashingEmbedding(dimensions=VECTOR_SIZE)
+    points = _points(embed_model)
+    nodes = []
+    for _ in range(count):
+        client = QdrantClient(path=tempfile.mkdtemp())
+        client.create_collection(COLLECTION, vectors_config=VectorParams(size=VECTOR_SIZE, distance=Distance.COSINE))
+        client.upsert(COLLECTION, points=points)
+        nodes.append(Node(client))
+    return nodes, embed_model
+
+
+def _search(client, embed_model, text):
+    return [hit.payload['text'] for hit in client.search(COLLECTION, query_vector=embed_model.get_query_embedding(text), limit=3)]
+
+
+def test_reads_prefer_fast_nodes():
+    nodes, embed_model = _replicated_nodes()
+    nodes[2].delay = 0.02
+    client = LoadBalancedQdrantClient(nodes[0], {'node-1': nodes[1], 'node-2': nodes[2]}, seed=0)
+    expected = _search(nodes[0].client, embed_model, TEXTS[7])
+    latencies = []
+    for _ in range(200):
+        start = time.perf_counter()
+        assert _search(client, embed_model, TEXTS[7]) == expected
+        latencies.append(time.perf_counter() - start)
+    reads = [node.reads for node in nodes]
+    # The slow node only gets the few reads that explore
+    assert reads[2] < 20 and reads[0] > 50 and reads[1] > 50
+    print(f"Reads per node {reads}, p50 {statistics.median(latencies) * 1000:.2f} ms "
+          f"(slow node alone: {nodes[2].delay * 1000:.0f} ms + search)")
+
+
+def test_failover_and_recovery():
+    nodes, embed_model = _replicated_nodes()
+    # node-1 is the fastest node, so it is picked whenever it is one of the two choices
+    nodes[0].delay = nodes[2].delay = 0.005
+    client = LoadBalancedQdrantClient(nodes[0], {'node-1': nodes[1], 'node-2': nodes[2]}, cooldown_seconds=0.05, seed=0)
+    for _ in range(10):
+        expected = _search(client, embed_model, TEXTS[3])
+
+    nodes[1].down = True
+    # Every search succeeds while node-1 is down
+    for _ in range(50):
+        assert _search(client, embed_model, TEXTS[3]) == expected
+    stats = {endpoint['name']: endpoint for endpoint in client.stats()}
+    assert not stats['node-1']['healthy'] and stats['primary']['healthy'] and stats['node-2']['healthy']
+    # After the first failure node-1 only gets a trial request per cooldown
+    assert stats['node-1']['failures'] < 10
+
+    nodes[1].down = False
+    time.sleep(0.1)
+    assert client.check_health() == {'primary': True, 'node-1': True, 'node-2': True}
+    reads = nodes[1].reads
+    for _ in range(50):
+        _search(client, embed_model, TEXTS[3])
+    assert nodes[1].reads > reads
+
+    # With every node down the error reaches the caller
+    for node in nodes:
+        node.down = True
+    with pytest.raises(ConnectionRefusedError):
+        _search(client, embed_model, TEXTS[3])
+
+
+def test_stale_estimates_are_measured_again():
+    nodes, embed_model = _replicated_nodes()
+    # node-2 is slow only for its first reads
+    nodes[2].delay = 0.05
+    client = LoadBalancedQdrantClient(
+        nodes[0], {'node-1': nodes[1], 'node-2': nodes[2]}, explore_probability=0.0, stale_seconds=0.2, seed=0
+    )
+    for _ in range(20):
+        _search(client, embed_model, TEXTS[9])
+    nodes[2].delay = 0.0
+    time.sleep(0.3)
+    reads = nodes[2].reads
+    for _ in range(50):
+        _search(client, embed_model, TEXTS[9])
+    # The outdated estimate no longer counts, so node-2 is measured again and replaces it
+    stats = {endpoint['name']: endpoint for endpoint in client.stats()}
+    assert nodes[2].reads > reads and stats['node-2']['latency_ms'] < 10
+
+    # A node that went down is noticed by reads once its estimate is outdated, without health checks
+    nodes[0].down = True
+    time.sleep(0.3)
+    for _ in range(5):
+        _search(client, embed_model, TEXTS[9])
+    stats = {endpoint['name']: endpoint for endpoint in client.stats()}
+    assert not stats['primary']['healthy'] and stats['node-1']['healthy'] and stats['node-2']['healthy']
+
+
+def test_bad_requests_do_not_fail_over():
+    nodes, embed_model = _replicated_nodes(2)
+    client = LoadBalancedQdrantClient(nodes[0], {'node-1': nodes[1]})
+    with pytest.raises(ValueError):
+        client.search("missing_collection", query_vector=embed_model.get_query_embedding("x"), limit=3)
+    stats = client.stats()
+    assert all(endpoint['healthy'] for endpoint in stats)
+    # The rejection is no latency sample
+    assert all(endpoint['latency_ms'] is None and endpoint['in_flight'] == 0 for endpoint in stats)
+
+
+def test_writes_go_to_the_primary():
+    nodes, embed_model = _replicated_nodes(2)
+    client = LoadBalancedQdrantClient(nodes[0], {'node-1': nodes[1]}, read_from_primary=False)
+    vm = VectorStoreManager(client=client, storage_db_path=os.path.join(tempfile.mkdtemp(), "fbl_rag.db"))
+    vm.embed_model = embed_model
+    vm.insert_documents([Document(text="Only on the primary until replicated", metadata={'file_name': "new.pdf"})])
+    assert nodes[0].client.count(COLLECTION).count == len(TEXTS) + 1
+    assert nodes[1].client.count(COLLECTION).count == len(TEXTS)
+    # Reads are served by node-1 only
+    reads = nodes[0].reads
+    nodes_found = vm.search_nodes(embed_model.get_query_embedding(TEXTS[5]), top_k=3)
+    assert nodes_found[0].node.text == TEXTS[5]
+    assert nodes[0].reads == reads and nodes[1].reads > 0
+
+
+def test_qdrant_servers():
+    """Run against real Qdrant processes, e.g. QDRANT_TEST_URLS=http://localhost:6333,http://localhost:6343"""
+    urls = [url for url in os.getenv("QDRANT_TEST_URLS", "").split(",") if url]
+    if len(urls) < 2:
+        pytest.skip("set QDRANT_TEST_URLS to two or three Qdrant servers")
+    embed_model = HashingEmbedding(dimensions=VECTOR_SIZE)
+    points = _points(embed_model)
+    collection = f"balancer_test_{uuid.uuid4().hex[:8]}"
+    for url in urls:
+        # Independent servers: write the same points to each, as cluster replication would
+        server = QdrantClient(url=url)
+        server.create_collection(collection, vectors_config=VectorParams(size=VECTOR_SIZE, distance=Distance.COSINE))
+        server.upsert(collection, points=points)
+    # The last endpoint is not listening and must be taken out of rotation
+    client = build_balanced_client(urls[0], None, urls[1:] + ["http://127.0.0.1:9"], health_check_interval=0)
+    try:
+        query = embed_model.get_query_embedding(TEXTS[11])
+        for _ in range(100):
+            assert client.search(collection, query_vector=query, limit=1)[0].payload['text'] == TEXTS[11]
+        stats = {endpoint['name']: endpoint for endpoint in client.stats()}
+        assert not stats["http://127.0.0.1:9"]['healthy']
+        print(client.stats())
+    finally:
+        for url in urls:
+            QdrantClient(url=url).delete_collection(collection)
+
+
+if __name__ == "__main__":
+    test_reads_prefer_fast_nodes()
+    test_failover_and_recovery()
+    test_stale_estimates_are_measured_again()
+    test_bad_requests_do_not_fail_over()
+    test_writes_go_to_the_primary()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+from llama_index.core import Document
+from retrieval_eval import (
+    CachedEmbedding,
+    HashingEmbedding,
+    format_report,
+    load_corpus,
+    load_golden_set,
+    save_corpus,
+    select_configuration,
+    sweep,
+)
+from test_sentence_window import MANUAL
+
+GOLDEN_SET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "eval", "golden_set.json")
+
+
+def test_sweep_reports_recall_tokens_and_latency():
+    corpus_path = os.path.join(tempfile.mkdtemp(), "corpus.jsonl")
+    save_corpus([Document(text=MANUAL, metadata={'file_name': 'Understanding_Flashbootloader.pdf'})], corpus_path)
+    grid = {
+        'chunking_strategy': ["markdown", "sentence"],
+        'chunk_size': [128, 512],
+        'chunk_overlap': [32],
+        'indexing_mode': ["chunk", "sentence_window"],
+        'top_k': [1, 4],
+    }
+    results = sweep(load_corpus(corpus_path), load_golden_set(GOLDEN_SET), HashingEmbedding(), grid)
+    print("\n" + format_report(results))
+
+    assert len(results) == 16
+    for result in results:
+        assert 0.0 <= result['mrr'] <= result['recall_at_k'] <= 1.0
+        assert result['prompt_tokens'] > 0 and result['latency_ms_p50'] > 0
+    # More retrieved chunks never lose recall and always cost prompt tokens
+    by_config = {(r['chunking_strategy'], r['chunk_size'], r['indexing_mode'], r['top_k']): r for r in results}
+    for (strategy, size, mode, top_k), result in by_config.items():
+        if top_k == 4:
+            smaller = by_config[(strategy, size, mode, 1)]
+            assert result['recall_at_k'] >= smaller['recall_at_k']
+            assert result['prompt_tokens'] >= smaller['prompt_tokens']
+
+    best = select_configuration(results, recall_target=1.0)
+    assert best is not None and best['recall_at_k'] == 1.0
+    assert all(best['prompt_tokens'] <= r['prompt_tokens'] for r in results if r['recall_at_k'] == 1.0)
+    assert select_configuration(results, recall_target=1.1) is None
+
+
+def test_cached_embedding_reuses_vectors():
+    cache_path = os.path.join(tempfile.mkdtemp(), "embedding_cache.db")
+    embedder = CachedEmbedding(HashingEmbedding(), cache_path)
+    first = embedder.get_text_embedding("Bootloader as configurable C source code")
+    assert embedder.get_text_embedding("Bootloader as configurable C source code") == first
+    assert (embedder.hits, embedder.misses) == (1, 1)
+
+    reopened = CachedEmbedding(HashingEmbedding(), cache_path)
+    assert reopened.get_text_embedding("Bootloader as configurable C source code") == first
+    assert reopened.misses == 0
+
+
+if __name__ == "__main__":
+    test_sweep_reports_recall_tokens_and_latency()
+    test_cached_embedding_reuses_vectors()
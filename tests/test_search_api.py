@@ -0,0 +1,85 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from llama_index.core import Document
+import api
+from ingestion_worker import IndexState, LiveIndex
+from retrieval_eval import HashingEmbedding
+from vector_store_manager import VectorStoreManager
+
+MANUALS = ["UserManual_FBL.pdf", "TechnicalReference_HexView.pdf", "Security.pdf", "OTA_Manual.pdf"]
+
+
+def _client(chunks):
+    vm = VectorStoreManager(local_path=tempfile.mkdtemp(), storage_db_path=os.path.join(tempfile.mkdtemp(), "fbl_rag.db"))
+    vm.embed_model = HashingEmbedding(dimensions=1536)
+    rng = random.Random(0)
+    vocabulary = [f"term{i}" for i in range(500)]
+    documents = [
+        Document(
+            text=" ".join(rng.choice(vocabulary) for _ in range(60)),
+            metadata={'file_name': MANUALS[i % len(MANUALS)], 'page_label': str(i // 8 + 1),
+                      'content_type': "security_class_definition" if i % 10 == 0 else "text",
+                      'sources': [{'file_name': MANUALS[i % len(MANUALS)], 'page_label': str(i // 8 + 1)}]}
+        )
+        for i in range(chunks)
+    ]
+    documents.append(Document(
+        text="The boot sequence starts with the Boot Manager checking the application valid flag",
+        metadata={'file_name': "UserManual_FBL.pdf", 'page_label': "42", 'section': "Boot Sequence"}
+    ))
+    vm.insert_documents(documents)
+    api._agent = SimpleNamespace(doc_processor=SimpleNamespace(vector_store_manager=vm), live_index=LiveIndex(IndexState(0, [])))
+    app = FastAPI()
+    app.include_router(api.app)
+    return TestClient(app)
+
+
+def test_search_returns_passages_with_sources_and_pages():
+    client = _client(chunks=200)
+    response = client.post("/api/v1/search", json={'query': "boot sequence application valid flag", 'page_size': 5})
+    assert response.status_code == 200
+    body = response.json()
+    top = body['results'][0]
+    assert top['file_name'] == "UserManual_FBL.pdf" and top['page_label'] == "42" and top['section'] == "Boot Sequence"
+    assert top['score'] > body['results'][1]['score']
+    assert body['has_more'] and "Server-Timing" in response.headers
+
+    # Pages continue where the previous page ended
+    first = client.post("/api/v1/search", json={'query': "term1 term2", 'page_size': 10}).json()['results']
+    second = client.post("/api/v1/search", json={'query': "term1 term2", 'page_size': 10, 'page': 2}).json()['results']
+    both = client.post("/api/v1/search", json={'query': "term1 term2", 'page_size': 20}).json()['results']
+    assert [r['id'] for r in first + second] == [r['id'] for r in both]
+
+    filtered = client.post("/api/v1/search", json={
+        'query': "term1", 'file_names': ["Security.pdf"], 'content_types': ["security_class_definition"]
+    }).json()['results']
+    assert filtered and all(r['file_name'] == "Security.pdf" and r['metadata']['content_type'] == "security_class_definition"
+                            for r in filtered)
+    assert client.post("/api/v1/search", json={'query': ""}).status_code == 422
+
+
+def test_search_latency_benchmark():
+    # Local mode searches by brute force, so this is an upper bound for a Qdrant server with HNSW
+    client = _client(chunks=1000)
+    rng = random.Random(1)
+    for _ in range(5):
+        client.post("/api/v1/search", json={'query': "term1"})
+
+    search_ms, request_ms = [], []
+    for _ in range(100):
+        query = " ".join(f"term{rng.randrange(500)}" for _ in range(4))
+        start = time.perf_counter()
+        response = client.post("/api/v1/search", json={'query': query, 'page_size': 10})
+        request_ms.append((time.perf_counter() - start) * 1000 - response.json()['timings']['embedding_ms'])
+        search_ms.append(response.json()['timings']['search_ms'])
+
+    p50, p95 = statistics.median(search_ms), statistics.quantiles(search_ms, n=20)[-1]
+    print(f"Search over 1001 chunks: p50 {p50:.2f} ms, p95 {p95:.2f} ms; "
+          f"full request without embedding: p50 {statistics.median(request_ms):.2f} ms")
+    assert p50 < 10
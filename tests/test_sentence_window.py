@@ -0,0 +1,140 @@
+import hashlib
+import math
+import re
+from llama_index.core import Document
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.postprocessor import MetadataReplacementPostProcessor
+from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.utils import get_tokenizer
+from markdown_chunker import MarkdownChunker
+from sentence_window import (
+    ParentDeduplicationPostprocessor,
+    WINDOW_METADATA_KEY,
+    build_sentence_window_documents,
+    split_units,
+)
+
+MANUAL = """# Flash Bootloader User Manual
+
+## 1.5 Scope of Delivery
+
+The Flash Bootloader delivery includes:
+
+- Bootloader as configurable C source code
+- Flash driver for the used microcontroller
+- HexView for preparing flash data and containers
+
+Please note that the DaVinci Configurator Pro tool must be licensed separately.
+
+## 2.1 Boot Sequence without Boot Manager
+
+After reset the bootloader checks the application valid flag. If the flag is set the application is started.
+Otherwise the bootloader stays active and waits for a reprogramming request from the tester.
+
+## 3.2 Security Classes
+
+Security class DDD uses a CRC checksum. Security class C uses a HMAC signature with a symmetric key.
+Security class CCC uses an asymmetric RSA signature that is verified before the application is started.
+
+## 4.1 Memory Layout
+
+The bootloader occupies the first flash sector. The application starts at the address configured in the
+logical block table. Each logical block is erased and programmed independently.
+
+## 5.3 Error Handling
+
+If programming fails the bootloader sends a negative response code and keeps the application invalid.
+A following reprogramming attempt erases the logical block again before writing new data.
+"""
+
+GOLDEN = [
+    ("What does the Flash Bootloader delivery include?", "HexView for preparing flash data"),
+    ("Which signature does security class CCC use?", "asymmetric RSA signature"),
+    ("What happens after reset without boot manager?", "checks the application valid flag"),
+    ("Where does the application start in flash?", "logical block table"),
+]
+
+
+def _embed(text, dimensions=512):
+    """Deterministic bag-of-words embedding so the comparison runs offline."""
+    vector = [0.0] * dimensions
+    for word in re.findall(r'[a-z0-9]+', text.lower()):
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % dimensions] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _search(nodes, query, top_k):
+    query_vector = _embed(query)
+    scored = [NodeWithScore(node=n, score=sum(a * b for a, b in zip(query_vector, _embed(n.text)))) for n in nodes]
+    return sorted(scored, key=lambda n: n.score, reverse=True)[:top_k]
+
+
+def _evaluate(nodes, top_k, postprocessors=()):
+    tokenizer = get_tokenizer()
+    hits = 0
+    prompt_tokens = 0
+    for question, expected in GOLDEN:
+        results = _search(nodes, question, top_k)
+        for postprocessor in postprocessors:
+            results = postprocessor.postprocess_nodes(results)
+        context = '\n\n'.join(n.node.get_content() for n in results)
+        hits += expected in context
+        prompt_tokens += len(tokenizer(context))
+    return hits / len(GOLDEN), prompt_tokens / len(GOLDEN)
+
+
+def _unit_nodes():
+    document = Document(text=MANUAL, metadata={'file_name': 'Understanding_Flashbootloader.pdf'})
+    parents = MarkdownChunker(chunk_size=128).get_nodes_from_documents([document])
+    units = build_sentence_window_documents([Document(text=p.text, metadata=p.metadata) for p in parents])
+    return [TextNode(text=u.text, metadata=u.metadata, excluded_llm_metadata_keys=u.excluded_llm_metadata_keys)
+            for u in units]
+
+
+def test_units_split_bullets_and_sentences():
+    units = split_units(MANUAL.split('## 2.1')[0].split('## 1.5 Scope of Delivery')[1])
+    assert "- HexView for preparing flash data and containers" in units
+    assert any(u.startswith("Please note that the DaVinci Configurator Pro") for u in units)
+
+
+def test_units_point_to_their_parent():
+    nodes = _unit_nodes()
+    hexview = [n for n in nodes if 'HexView' in n.text][0]
+    assert 'The Flash Bootloader delivery includes:' in hexview.metadata[WINDOW_METADATA_KEY]
+    siblings = [n for n in nodes if n.metadata['parent_id'] == hexview.metadata['parent_id']]
+    assert len(siblings) > 1
+
+
+def test_parents_are_expanded_once():
+    nodes = _unit_nodes()
+    results = _search(nodes, "bootloader delivery HexView flash driver", top_k=6)
+    results = ParentDeduplicationPostprocessor().postprocess_nodes(results)
+    results = MetadataReplacementPostProcessor(target_metadata_key=WINDOW_METADATA_KEY).postprocess_nodes(results)
+    contents = [n.node.get_content() for n in results]
+    assert len(contents) == len(set(contents))
+    assert any('Bootloader as configurable C source code' in c for c in contents)
+
+
+def test_compare_with_current_chunking():
+    document = Document(text=MANUAL, metadata={'file_name': 'Understanding_Flashbootloader.pdf'})
+    chunks = SentenceSplitter(chunk_size=128, chunk_overlap=40).get_nodes_from_documents([document])
+    chunk_recall, chunk_tokens = _evaluate(chunks, top_k=2)
+
+    window_postprocessors = [
+        ParentDeduplicationPostprocessor(max_parents=2),
+        MetadataReplacementPostProcessor(target_metadata_key=WINDOW_METADATA_KEY)
+    ]
+    window_recall, window_tokens = _evaluate(_unit_nodes(), top_k=8, postprocessors=window_postprocessors)
+
+    print(f"\nChunks (128/40, top 2): recall {chunk_recall:.2f}, {chunk_tokens:.0f} context tokens/query")
+    print(f"Sentence window (top 8 units, 2 parents): recall {window_recall:.2f}, "
+          f"{window_tokens:.0f} context tokens/query")
+    assert window_recall >= chunk_recall
+
+
+if __name__ == "__main__":
+    test_units_split_bullets_and_sentences()
+    test_units_point_to_their_parent()
+    test_parents_are_expanded_once()
+    test_compare_with_current_chunking()
@@ -0,0 +1,113 @@
+import os
+import random
+import re
+import tempfile
+import time
+import numpy as np
+from llama_index.core import Document
+from retrieval_eval import HashingEmbedding
+from shard_router import ShardRouter, shard_for_file
+from vector_store_manager import VectorStoreManager
+
+MANUALS = [
+    "Interface_APPL_Flashbootloader.pdf",
+    "UserManual_FBL_Security.pdf",
+    "TechnicalReference_HexView.pdf",
+    "OTA_Campaign_Management.pdf",
+    "Diagnostics_UDS_Services.pdf",
+    "Flash_Driver_Integration.pdf",
+]
+
+
+def _manual_chunks(file_name, chunks=40, seed=0):
+    """Chunks whose vocabulary is mostly specific to one manual."""
+    rng = random.Random(f"{file_name}{seed}")
+    shared = "the bootloader shall verify each block before the ecu restarts".split()
+    prefix = re.sub(r"[^a-z0-9]", "", file_name.lower().replace(".pdf", ""))
+    topic = [f"{prefix}term{i}" for i in range(40)]
+    return [
+        Document(
+            text=" ".join(rng.choice(topic) if rng.random() < 0.7 else rng.choice(shared) for _ in range(60)),
+            metadata={'file_name': file_name}
+        )
+        for _ in range(chunks)
+    ]
+
+
+def _sharded_manager(manuals, chunks=40):
+    os.environ["SHARDING_MODE"] = "document"
+    try:
+        vm = VectorStoreManager(
+            local_path=tempfile.mkdtemp(),
+            storage_db_path=os.path.join(tempfile.mkdtemp(), "fbl_rag.db")
+        )
+    finally:
+        del os.environ["SHARDING_MODE"]
+    vm.embed_model = HashingEmbedding(dimensions=1536)
+    for file_name in manuals:
+        result = vm.insert_documents(_manual_chunks(file_name, chunks))
+        assert result['failed_insertions'] == 0
+    return vm
+
+
+def test_router_prefers_centroid_and_keyword_hints():
+    rng = np.random.default_rng(1)
+    router = ShardRouter(max_shards=2)
+    centers = {}
+    for file_name in MANUALS:
+        shard = shard_for_file(file_name)
+        centers[shard] = rng.normal(size=64)
+        router.add_vectors(shard, (centers[shard] + rng.normal(scale=0.3, size=(20, 64))).tolist(), [file_name])
+
+    for shard, center in centers.items():
+        assert router.route(center.tolist())[0][0] == shard
+
+    # An embedding halfway between all manuals is decided by the document the question names
+    ambiguous = np.mean(list(centers.values()), axis=0).tolist()
+    routed = router.route(ambiguous, "What does Interface_APPL_Flashbootloader.pdf say about the valid flag?")
+    assert routed[0][0] == "Interface_APPL_Flashbootloader"
+    assert len(routed) == 2
+
+    families = {"security": {"patterns": ["*Security*", "*Crypto*"], "keywords": ["signature"]}}
+    assert shard_for_file("UserManual_FBL_Security.pdf", families) == "security"
+    assert shard_for_file("FBL_Crypto_Library.pdf", families) == "security"
+    assert shard_for_file("Flash Driver (v2).pdf", families) == "Flash_Driver_v2"
+
+
+def test_sharded_search_routes_to_the_right_manual():
+    vm = _sharded_manager(MANUALS)
+    assert len(vm.collection_names()) == len(MANUALS) + 1
+    assert sum(vm.client.count(name, exact=True).count for name in vm.collection_names()) == 40 * len(MANUALS)
+
+    query = " ".join(f"otacampaignmanagementterm{i}" for i in range(5))
+    nodes = vm.search_nodes(vm.embed_model.get_query_embedding(query), top_k=5, query_str=query)
+    assert len(nodes) == 5
+    assert all(n.node.metadata['file_name'] == "OTA_Campaign_Management.pdf" for n in nodes)
+
+    # The router state survives a restart
+    restarted = ShardRouter(vm.database)
+    assert restarted.shards == vm.router.shards
+
+
+def test_search_cost_stays_flat_as_manuals_are_added():
+    query = " ".join(f"interfaceapplflashbootloaderterm{i}" for i in range(5))
+    latencies = {}
+    for manuals in (4, 16):
+        names = MANUALS[:1] + [f"Product_{i}_Manual.pdf" for i in range(manuals - 1)]
+        vm = _sharded_manager(names, chunks=200)
+        embedding = vm.embed_model.get_query_embedding(query)
+        vm.search_nodes(embedding, top_k=5, query_str=query)
+        start = time.perf_counter()
+        for _ in range(20):
+            nodes = vm.search_nodes(embedding, top_k=5, query_str=query)
+        latencies[manuals] = (time.perf_counter() - start) / 20 * 1000
+        assert nodes[0].node.metadata['file_name'] == MANUALS[0]
+        assert len(vm.router.route(embedding, query)) == 3
+    print(f"Routed search latency: {latencies[4]:.1f} ms with 4 manuals, {latencies[16]:.1f} ms with 16 manuals")
+    assert latencies[16] < latencies[4] * 2.5
+
+
+if __name__ == "__main__":
+    test_router_prefers_centroid_and_keyword_hints()
+    test_sharded_search_routes_to_the_right_manual()
+    test_search_cost_stays_flat_as_manuals_are_added()
@@ -0,0 +1,134 @@
+import time
+from typing import List
+from llama_index.core.agent import ReActAgent
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from llama_index.core.tools import ToolMetadata
+from deadline import Deadline, StepTimeEstimator, run_agent_with_deadline
+from mock_models import MockReActLLM
+from speculative_retrieval import SpeculativeRetrieval, SpeculativeRetriever
+from tool_cache import CachedRetriever, MemoizedQueryEngineTool, TTLCache
+
+QUESTION = "What is the Boot Sequence without Boot Manager?"
+
+
+class SlowRetriever(BaseRetriever):
+    """Embedding and Qdrant search of a remote deployment."""
+
+    def __init__(self, seconds):
+        super().__init__()
+        self.seconds = seconds
+        self.queries = []
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        self.queries.append(query_bundle.query_str)
+        time.sleep(self.seconds)
+        return [NodeWithScore(node=TextNode(text=f"Passage about {query_bundle.query_str}"), score=0.9)]
+
+
+def test_first_tool_call_takes_the_speculation():
+    speculation = SpeculativeRetrieval(min_similarity=0.7)
+    slow = SlowRetriever(0.2)
+    retriever = SpeculativeRetriever(slow, speculation, version=3)
+
+    with speculation.speculate(QUESTION, 3):
+        # The agent's first LLM call
+        time.sleep(0.15)
+        start = time.perf_counter()
+        nodes = retriever.retrieve("boot sequence without Boot Manager")
+        waited = time.perf_counter() - start
+        # Later tool calls retrieve as usual
+        retriever.retrieve("application valid flag")
+    assert nodes[0].node.text == f"Passage about {QUESTION}" and waited < 0.15
+    assert slow.queries == [QUESTION, "application valid flag"]
+
+    # A different tool input drops the speculation
+    with speculation.speculate("How is the checksum of a logical block computed?", 3):
+        nodes = retriever.retrieve("Which security access levels exist?")
+    assert nodes[0].node.text == "Passage about Which security access levels exist?"
+
+    # The agent answered without the tool
+    with speculation.speculate(QUESTION, 3):
+        pass
+    # No retriever of that ingestion version
+    with speculation.speculate(QUESTION, 4) as started:
+        assert started is None
+
+    stats = speculation.stats()
+    assert stats['hit'] == 1 and stats['miss'] == 1 and stats['unused'] == 1
+    assert 0.1 < stats['latency_saved_seconds'] < 0.2
+
+
+def test_similar_input_is_not_cached_with_the_speculation():
+    speculation = SpeculativeRetrieval(min_similarity=0.7)
+    slow = SlowRetriever(0.05)
+    retrieval_cache, observation_cache = TTLCache("retrieval"), TTLCache("observation")
+    retriever = SpeculativeRetriever(CachedRetriever(slow, retrieval_cache, version=1), speculation, version=1)
+    tool = MemoizedQueryEngineTool(
+        RetrieverQueryEngine.from_args(retriever, llm=MockReActLLM(latency_seconds=0.0)),
+        ToolMetadata(name="fblDocQuery", description="Flash Bootloader documentation"),
+        observation_cache,
+        version=1
+    )
+
+    similar = "boot sequence without Boot Manager"
+    with speculation.speculate(QUESTION, 1):
+        time.sleep(0.1)
+        assert tool.call(similar).raw_output.source_nodes[0].node.text == f"Passage about {QUESTION}"
+    # The speculation is cached under the question only, the observation not at all
+    assert retrieval_cache.contains((1, "what is the boot sequence without boot manager"))
+    assert not retrieval_cache.contains((1, "boot sequence without boot manager"))
+    assert not observation_cache.contains((1, "boot sequence without boot manager"))
+    # Asked on its own, the similar input is retrieved for itself
+    assert tool.call(similar).raw_output.source_nodes[0].node.text == f"Passage about {similar}"
+    assert slow.queries == [QUESTION, similar]
+
+    # The question itself is cached as usual
+    with speculation.speculate(QUESTION, 1):
+        tool.call(QUESTION)
+    assert observation_cache.contains((1, "what is the boot sequence without boot manager"))
+    assert slow.queries == [QUESTION, similar]
+
+
+def _agent_run_seconds(questions, speculation):
+    """Run the ReAct agent over a tool with 0.2s retrievals and 0.15s LLM calls."""
+    llm = MockReActLLM(latency_seconds=0.15)
+    retriever = CachedRetriever(SlowRetriever(0.2), TTLCache("retrieval"), version=1)
+    if speculation is not None:
+        retriever = SpeculativeRetriever(retriever, speculation, version=1)
+    tool = MemoizedQueryEngineTool(
+        RetrieverQueryEngine.from_args(retriever, llm=llm),
+        ToolMetadata(name="fblDocQuery", description="Flash Bootloader documentation"),
+        TTLCache("observation"),
+        version=1
+    )
+    start = time.perf_counter()
+    for question in questions:
+        agent = ReActAgent.from_tools([tool], llm=llm, max_iterations=10)
+        if speculation is not None:
+            with speculation.speculate(question, 1):
+                response = run_agent_with_deadline(agent, question, Deadline(25, 2), StepTimeEstimator())
+        else:
+            response = run_agent_with_deadline(agent, question, Deadline(25, 2), StepTimeEstimator())
+        assert "Passage" in str(response)
+    return (time.perf_counter() - start) / len(questions)
+
+
+def test_speculation_shortens_agent_runs():
+    questions = [f"How is logical block {i} validated before the jump?" for i in range(6)]
+    baseline = _agent_run_seconds(questions, None)
+    speculation = SpeculativeRetrieval()
+    speculative = _agent_run_seconds(questions, speculation)
+    stats = speculation.stats()
+    assert stats['hit_ratio'] == 1.0
+    # The retrieval overlaps the first LLM call: up to 0.15s per question
+    assert baseline - speculative > 0.1
+    print(f"Agent run {baseline * 1000:.0f} ms -> {speculative * 1000:.0f} ms with speculative retrieval; "
+          f"hit ratio {stats['hit_ratio']:.0%}, {stats['saved_per_hit_ms']} ms saved per hit")
+
+
+if __name__ == "__main__":
+    test_first_tool_call_takes_the_speculation()
+    test_similar_input_is_not_cached_with_the_speculation()
+    test_speculation_shortens_agent_runs()
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from sqlite_store import (
+    IngestionLedger,
+    SQLiteDatabase,
+    SQLiteDocumentStore,
+    SQLiteIndexStore,
+    migrate_json_storage,
+)
+
+REPO_STORAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "storage")
+
+
+def _doc_hash(i):
+    return hashlib.sha256(f"chunk {i}".encode()).hexdigest()
+
+
+def test_migration_from_json_files():
+    workdir = tempfile.mkdtemp()
+    # Only the JSON files: a local storage/fbl_rag.db would already hold the migrated data
+    os.makedirs(os.path.join(workdir, "storage"))
+    for name in ("docstore.json", "index_store.json"):
+        shutil.copy(os.path.join(REPO_STORAGE, name), os.path.join(workdir, "storage", name))
+    processed_files_path = os.path.join(workdir, "processed_files.json")
+    with open(processed_files_path, "w") as f:
+        json.dump(["/app/data/OTA_Basics.pdf", "/app/data/FBL_Product_Information.pdf"], f)
+
+    database = SQLiteDatabase(os.path.join(workdir, "storage", "fbl_rag.db"))
+    stats = migrate_json_storage(database, os.path.join(workdir, "storage"), processed_files_path)
+    legacy = SimpleDocumentStore.from_persist_dir(os.path.join(workdir, "storage"))
+    docstore = SQLiteDocumentStore(database)
+
+    assert stats['documents'] == len(legacy.get_all_document_hashes()) > 0
+    for doc_hash, doc_id in legacy.get_all_document_hashes().items():
+        assert docstore.get_document_hash(doc_id) == doc_hash
+        assert docstore.find_doc_ids_by_hash(doc_hash) == [doc_id]
+    assert len(SQLiteIndexStore(database).index_structs()) == stats['index_structs'] == 1
+    assert IngestionLedger(database).get_processed_files() == {
+        "/app/data/OTA_Basics.pdf", "/app/data/FBL_Product_Information.pdf"
+    }
+
+    # The migration runs once
+    assert migrate_json_storage(database, os.path.join(workdir, "storage"), processed_files_path) == \
+        {'documents': 0, 'index_structs': 0, 'ledger_entries': 0}
+
+    plan = database.query(
+        "EXPLAIN QUERY PLAN SELECT key FROM kv WHERE json_extract(value, '$.doc_hash') = ? AND collection = ?",
+        ("x", "docstore/metadata")
+    )
+    assert any("kv_doc_hash" in row[-1] for row in plan)
+
+
+def test_writes_are_incremental_and_survive_reopen():
+    db_path = os.path.join(tempfile.mkdtemp(), "fbl_rag.db")
+    database = SQLiteDatabase(db_path)
+    SQLiteDocumentStore(database).set_document_hashes({f"doc-{i}": _doc_hash(i) for i in range(3)})
+    IngestionLedger(database).record("/data/a.pdf", "abc", 3)
+    database.close()
+
+    reopened = SQLiteDatabase(db_path)
+    assert SQLiteDocumentStore(reopened).get_document_hash("doc-1") == _doc_hash(1)
+    assert IngestionLedger(reopened).find_by_hash("abc") == ["/data/a.pdf"]
+    assert IngestionLedger(reopened).entries()[0]['chunks'] == 3
+
+
+def test_benchmark_persist_and_load_at_10x_corpus():
+    # The current docstore holds 112 document hashes from 5 PDFs; 10x is about 1,150 documents in 50 files
+    files, docs_per_file = 50, 23
+    workdir = tempfile.mkdtemp()
+
+    # Before: every ingested file rewrites docstore.json and processed_files.json in full
+    start = time.perf_counter()
+    legacy = SimpleDocumentStore()
+    processed = []
+    for f in range(files):
+        for d in range(docs_per_file):
+            legacy.set_document_hash(f"doc-{f}-{d}", _doc_hash(f * docs_per_file + d))
+        legacy.persist(os.path.join(workdir, "docstore.json"))
+        processed.append(f"/data/file-{f}.pdf")
+        with open(os.path.join(workdir, "processed_files.json"), "w") as fp:
+            json.dump(processed, fp)
+    json_persist = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy = SimpleDocumentStore.from_persist_path(os.path.join(workdir, "docstore.json"))
+    with open(os.path.join(workdir, "processed_files.json")) as fp:
+        set(json.load(fp))
+    known = set(legacy.get_all_document_hashes())
+    assert all(_doc_hash(i) in known for i in range(0, files * docs_per_file, 7))
+    json_load = time.perf_counter() - start
+
+    # After: one small transaction per file, indexed lookups by hash
+    start = time.perf_counter()
+    database = SQLiteDatabase(os.path.join(workdir, "fbl_rag.db"))
+    docstore = SQLiteDocumentStore(database)
+    ledger = IngestionLedger(database)
+    for f in range(files):
+        docstore.set_document_hashes(
+            {f"doc-{f}-{d}": _doc_hash(f * docs_per_file + d) for d in range(docs_per_file)}
+        )
+        ledger.record(f"/data/file-{f}.pdf", f"hash-{f}", docs_per_file)
+    database.close()
+    sqlite_persist = time.perf_counter() - start
+
+    start = time.perf_counter()
+    database = SQLiteDatabase(os.path.join(workdir, "fbl_rag.db"))
+    docstore = SQLiteDocumentStore(database)
+    IngestionLedger(database).get_processed_files()
+    assert all(docstore.find_doc_ids_by_hash(_doc_hash(i)) for i in range(0, files * docs_per_file, 7))
+    sqlite_load = time.perf_counter() - start
+
+    print(f"\n{files * docs_per_file} documents in {files} files")
+    print(f"JSON:   persist {json_persist * 1000:.0f}ms, load + lookups {json_load * 1000:.1f}ms")
+    print(f"SQLite: persist {sqlite_persist * 1000:.0f}ms, load + lookups {sqlite_load * 1000:.1f}ms")
+    assert sqlite_persist < json_persist
+
+
+if __name__ == "__main__":
+    test_migration_from_json_files()
+    test_writes_are_incremental_and_survive_reopen()
+    test_benchmark_persist_and_load_at_10x_corpus()
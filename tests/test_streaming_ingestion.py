@@ -0,0 +1,149 @@
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from llama_index.core import Document
+from document_processor import DocumentProcessor
+from retrieval_eval import HashingEmbedding
+from vector_store_manager import VectorStoreManager
+
+PAGES = 5000
+# Peak Python heap of a windowed ingestion, whatever the number of pages
+MEMORY_CAP_BYTES = 16 * 1024 * 1024
+
+
+def _page(number):
+    """Synthetic LlamaParse markdown of one page of a very long manual."""
+    lines = []
+    if number % 10 == 0:
+        lines.append(f"# Chapter {number // 10} Logical Block {number // 10}")
+    lines.append(f"## Page {number} programming sequence")
+    lines += [
+        f"Step {step} of page {number} erases sector {number * 8 + step} and writes block {number}-{step} "
+        f"after the security access for ECU variant {number % 97} succeeded." for step in range(6)
+    ]
+    lines += [f"- Item {item} of page {number}: checksum region {number * 4 + item}" for item in range(4)]
+    return "\n\n".join(lines)
+
+
+def _processor(page_count, window_pages):
+    data_dir = tempfile.mkdtemp()
+    file_path = os.path.join(data_dir, "Huge_Manual.pdf")
+    with open(file_path, "wb") as f:
+        f.write(b"%PDF-1.7 synthetic")
+    vm = VectorStoreManager(
+        local_path=tempfile.mkdtemp(),
+        storage_db_path=os.path.join(tempfile.mkdtemp(), "fbl_rag.db"),
+        llama_cloud_api_key="llx-test"
+    )
+    vm.embed_model = HashingEmbedding(dimensions=1536)
+    processor = DocumentProcessor(vm)
+    processor.data_dir = Path(data_dir)
+    processor.window_pages = window_pages
+    parsed = {'calls': 0, 'pages': 0}
+
+    def parse_pages(path, first_page=0, count=None):
+        # Stands in for LlamaParse with target_pages: only the requested pages are materialized
+        last_page = page_count if count is None else min(first_page + count, page_count)
+        parsed['calls'] += 1
+        parsed['pages'] += max(last_page - first_page, 0)
+        return [Document(text=_page(number), metadata={'file_name': os.path.basename(path)})
+                for number in range(first_page, last_page)]
+
+    processor.parse_pages = parse_pages
+    processor.get_page_count = lambda path: page_count
+    stored = {'points': 0}
+
+    def insert_documents(documents):
+        # Qdrant Cloud keeps the points outside the process; embed and count them here
+        vm.embed_model.get_text_embedding_batch([doc.text for doc in documents])
+        stored['points'] += len(documents)
+        return {'total_documents': len(documents), 'successful_insertions': len(documents), 'failed_insertions': 0}
+
+    vm.insert_documents = insert_documents
+    return processor, parsed, stored
+
+
+def _ingest(page_count, window_pages):
+    processor, parsed, stored = _processor(page_count, window_pages)
+    tracemalloc.start()
+    start = time.perf_counter()
+    assert processor.process_documents()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert parsed['pages'] == page_count
+    return peak, elapsed, parsed, stored, processor
+
+
+def test_headings_carry_across_windows():
+    processor, _, _ = _processor(30, 4)
+    windows = list(processor._chunk_windows("Huge_Manual.pdf", processor._get_text_splitter()))
+    assert [count for count, _ in windows] == [4] * 7 + [2]
+    # Page 12 starts a window but still belongs to chapter 1
+    page_12 = [doc for _, chunks in windows for doc in chunks if doc.metadata['page_label'] == "13"][0]
+    assert page_12.metadata['heading_path'].startswith("Chapter 1 Logical Block 1")
+    assert page_12.metadata['section'] == "Page 12 programming sequence"
+
+
+def test_windows_cover_the_page_count():
+    processor, parsed, _ = _processor(12, 5)
+    # A horizontal rule split a page in two, blank pages were dropped
+    returned = {0: [Document(text=text, metadata={}) for text in ("Page 0", "Page 1", "Page 2", "Page 3", "Part one", "Part two")],
+                5: [Document(text="Page 5", metadata={})] * 3,
+                10: [Document(text=f"Page {n}", metadata={}) for n in (10, 11)]}
+
+    def parse_pages(path, first_page=0, count=None):
+        parsed['calls'] += 1
+        return [Document(text=page.text, metadata=dict(page.metadata)) for page in returned[first_page]]
+
+    processor.parse_pages = parse_pages
+    windows = list(processor.read_page_windows("Huge_Manual.pdf"))
+    # A short window does not end the file
+    assert parsed['calls'] == 3
+    assert [page.metadata['page_label'] for page in windows[0]] == ["1-5"] * 6
+    assert [page.metadata['page_label'] for page in windows[1]] == ["6-10"] * 3
+    assert [page.metadata['page_label'] for page in windows[2]] == ["11", "12"]
+
+
+def test_page_count_is_read_from_the_pdf():
+    from pypdf import PdfWriter
+
+    path = os.path.join(tempfile.mkdtemp(), "blank.pdf")
+    writer = PdfWriter()
+    for _ in range(7):
+        writer.add_blank_page(width=595, height=842)
+    with open(path, "wb") as f:
+        writer.write(f)
+    assert DocumentProcessor.get_page_count(path) == 7
+
+
+def test_peak_memory_is_flat():
+    small_peak, _, _, _, _ = _ingest(PAGES // 5, 50)
+    peak, elapsed, parsed, stored, processor = _ingest(PAGES, 50)
+    assert parsed['calls'] == PAGES // 50
+    assert stored['points'] >= PAGES
+    assert processor.ledger.entries()[0]['chunks'] == stored['points']
+    assert peak < MEMORY_CAP_BYTES
+    # Five times the pages, about the same peak
+    assert peak < small_peak * 1.5
+    print(f"Streamed {PAGES} pages into {stored['points']} points in {elapsed:.1f}s, "
+          f"peak heap {peak / 1e6:.1f} MB ({PAGES // 5} pages: {small_peak / 1e6:.1f} MB)")
+
+
+def test_whole_file_parsing_grows_with_the_document():
+    pages = PAGES // 5
+    whole_peak, _, _, _, _ = _ingest(pages, 0)
+    windowed_peak, _, _, _, _ = _ingest(pages, 50)
+    assert windowed_peak * 3 < whole_peak
+    print(f"Peak heap for {pages} pages: {whole_peak / 1e6:.1f} MB parsed at once, "
+          f"{windowed_peak / 1e6:.1f} MB in 50-page windows")
+
+
+if __name__ == "__main__":
+    test_headings_carry_across_windows()
+    test_windows_cover_the_page_count()
+    test_page_count_is_read_from_the_pdf()
+    test_peak_memory_is_flat()
+    test_whole_file_parsing_grows_with_the_document()
@@ -0,0 +1,107 @@
+import time
+from typing import List
+from llama_index.core.agent import ReActAgent
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.response.schema import Response
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from llama_index.core.tools import ToolMetadata
+from metrics import REGISTRY
+from test_multi_query import StepLLM
+from tool_cache import CachedRetriever, MemoizedQueryEngineTool, TTLCache, normalize_tool_input
+
+
+class CountingQueryEngine(BaseQueryEngine):
+    def __init__(self):
+        super().__init__(callback_manager=None)
+        self.queries: List[str] = []
+
+    def _query(self, query_bundle: QueryBundle) -> Response:
+        self.queries.append(query_bundle.query_str)
+        return Response(response=f"Answer to {query_bundle.query_str}")
+
+    async def _aquery(self, query_bundle: QueryBundle) -> Response:
+        return self._query(query_bundle)
+
+    def _get_prompt_modules(self):
+        return {}
+
+
+class CountingRetriever(BaseRetriever):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        self.calls += 1
+        return [NodeWithScore(node=TextNode(id_="unit-1", text="boot sequence unit"), score=0.9)]
+
+
+def _tool(cache, version=1):
+    engine = CountingQueryEngine()
+    metadata = ToolMetadata(name="fblDocQuery", description="Search the documentation")
+    return engine, MemoizedQueryEngineTool(engine, metadata, cache, version)
+
+
+def test_trivially_different_inputs_share_an_entry():
+    assert normalize_tool_input("  Boot   Sequence? ") == normalize_tool_input("boot sequence")
+    assert normalize_tool_input("Scope of Delivery |HexView.") == "scope of delivery | hexview"
+    assert normalize_tool_input("boot sequence") != normalize_tool_input("boot manager")
+
+
+def test_cache_is_bounded_and_expires():
+    cache = TTLCache("test_bounded", max_entries=2, ttl_seconds=0.2)
+    for key in "abc":
+        cache.put(key, key.upper())
+    assert cache.get("a") is None and cache.get("c") == "C"
+    time.sleep(0.25)
+    assert cache.get("c") is None
+    assert cache.stats()['entries'] == 1
+
+
+def test_observations_are_keyed_by_ingestion_version():
+    cache = TTLCache("observation_test", ttl_seconds=60)
+    engine, tool = _tool(cache)
+    first = tool.call(input="Explain the boot sequence")
+    assert tool.call(input="explain the  boot sequence?").content == first.content
+    assert len(engine.queries) == 1
+
+    # After an ingestion the new index state misses and queries again
+    new_engine, new_tool = _tool(cache, version=2)
+    new_tool.call(input="Explain the boot sequence")
+    assert len(new_engine.queries) == 1
+    assert cache.stats()['hit_rate'] == round(1 / 3, 3)
+    rendered = REGISTRY.render()
+    assert 'tool_cache_requests_total{cache="observation_test",result="hit"} 1' in rendered
+    assert 'tool_cache_hit_ratio{cache="observation_test"}' in rendered
+
+
+def test_retrieval_cache_hands_out_copies():
+    cache = TTLCache("retrieval_test", ttl_seconds=60)
+    base = CountingRetriever()
+    retriever = CachedRetriever(base, cache, version=1)
+    nodes = retriever.retrieve("boot sequence")
+    # Postprocessors such as MetadataReplacementPostProcessor replace node content in place
+    nodes[0].node.set_content("parent window")
+    again = retriever.retrieve("Boot sequence?")
+    assert base.calls == 1
+    assert again[0].node.get_content() == "boot sequence unit"
+
+
+def test_repeated_tool_calls_in_one_run_are_served_from_cache():
+    cache = TTLCache("observation_agent_test", ttl_seconds=60)
+    engine, tool = _tool(cache)
+    llm = StepLLM(inputs=["Boot sequence", "boot sequence?", "Boot manager"])
+    agent = ReActAgent.from_tools([tool], llm=llm, max_iterations=10)
+    agent.query("Explain the boot sequence")
+    assert engine.queries == ["Boot sequence", "Boot manager"]
+    stats = cache.stats()
+    print(f"Tool calls: {llm.calls - 1}, query engine calls: {len(engine.queries)}, hit rate: {stats['hit_rate']:.0%}")
+
+
+if __name__ == "__main__":
+    test_trivially_different_inputs_share_an_entry()
+    test_cache_is_bounded_and_expires()
+    test_observations_are_keyed_by_ingestion_version()
+    test_retrieval_cache_hands_out_copies()
+    test_repeated_tool_calls_in_one_run_are_served_from_cache()
@@ -0,0 +1,151 @@
+import os
+import tempfile
+import time
+from llama_index.core.agent import ReActAgent
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.tools import FunctionTool
+from deadline import Deadline, DeadlineCallbackHandler, StepTimeEstimator, deadline_scope, run_agent_with_deadline
+from test_deadline import ScriptedLLM
+from tracing import (
+    RequestTrace,
+    TraceCallbackHandler,
+    TraceStore,
+    new_request_id,
+    profile_current_thread,
+    trace_scope,
+    trace_span,
+)
+
+
+def _search(input):
+    with trace_span("qdrant_search", top_k=8) as span:
+        time.sleep(0.01)
+        span.attributes['scores'] = [0.91, 0.87]
+    return "After reset the bootloader checks the application valid flag."
+
+
+def _find(span, name):
+    if span['name'] == name:
+        return span
+    for child in span['children']:
+        found = _find(child, name)
+        if found:
+            return found
+    return None
+
+
+def test_agent_run_is_recorded_as_span_tree():
+    callback_manager = CallbackManager([DeadlineCallbackHandler(), TraceCallbackHandler()])
+    llm = ScriptedLLM(answer_after=1)
+    llm.callback_manager = callback_manager
+    tool = FunctionTool.from_defaults(fn=_search, name="fblDocQuery", description="Search the documentation")
+    agent = ReActAgent.from_tools([tool], llm=llm, callback_manager=callback_manager)
+
+    trace = RequestTrace(new_request_id(), question="Explain the boot sequence")
+    deadline = Deadline(10)
+    with trace_scope(trace), deadline_scope(deadline):
+        run_agent_with_deadline(agent, "Explain the boot sequence", deadline, StepTimeEstimator())
+    trace.finish(status="ok")
+    spans = trace.to_dict()['spans']
+
+    steps = [child for child in spans['children'] if child['name'] == 'agent_step']
+    assert [step['attributes']['iteration'] for step in steps] == [1, 2]
+    first_step = steps[0]
+    llm_call = _find(first_step, 'llm_call')
+    assert llm_call['attributes']['prompt_tokens'] > 0
+    tool_call = _find(first_step, 'tool_call')
+    assert tool_call['attributes']['tool'] == 'fblDocQuery'
+    assert 'boot sequence' in tool_call['attributes']['input']
+    search = _find(tool_call, 'qdrant_search')
+    assert search['attributes']['scores'] == [0.91, 0.87]
+    assert search['duration_ms'] >= 10
+
+
+def test_traces_rotate_and_are_found_by_request_id():
+    path = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+    store = TraceStore(path, max_bytes=2000, backup_count=3)
+    request_ids = []
+    for i in range(60):
+        trace = RequestTrace(new_request_id(), question=f"question {i}")
+        trace.finish(status="ok")
+        store.write(trace)
+        request_ids.append(trace.request_id)
+
+    assert os.path.exists(f"{path}.1")
+    assert store.get(request_ids[-1])['spans']['attributes']['question'] == "question 59"
+    assert store.get(request_ids[-2]) is not None
+    # The oldest traces were rotated out
+    assert store.get(request_ids[0]) is None
+
+
+def test_profiler_report_is_attached():
+    def busy_wait(seconds):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            pass
+
+    trace = RequestTrace(new_request_id())
+    with profile_current_thread(trace, interval=0.002):
+        busy_wait(0.2)
+    assert trace.profile['samples'] > 10
+    assert any(entry['function'].startswith('busy_wait') for entry in trace.profile['cumulative'])
+    assert 'profile' in trace.to_dict()
+
+
+class BusyAgent:
+    request_timeout = 25
+    deadline_reserve = 2
+    answer_cache = None
+
+    def query(self, question, deadline=None):
+        end = time.monotonic() + 0.1
+        while time.monotonic() < end:
+            pass
+        return "The bootloader checks the application valid flag."
+
+
+def test_profiling_requires_the_admin_key():
+    import api
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    path = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+    api._agent = BusyAgent()
+    api._trace_store = TraceStore(path)
+    app = FastAPI()
+    app.include_router(api.app)
+    client = TestClient(app)
+    saved = {name: os.environ.get(name) for name in ("ADMIN_API_KEY", "QUERY_LOG_PATH")}
+    os.environ["ADMIN_API_KEY"] = "test-admin-key"
+    os.environ["QUERY_LOG_PATH"] = os.path.join(tempfile.mkdtemp(), "query_log.jsonl")
+    try:
+        question = {'question': "What is the boot sequence?"}
+        assert client.post("/api/v1/query", json=question, headers={'X-Profile': "true"}).status_code == 401
+        response = client.post("/api/v1/query", json=question, headers={'X-Profile': "true", 'X-Admin-Key': "test-admin-key"})
+        assert response.status_code == 200 and response.json()['profile']['samples'] > 0
+        assert client.post("/api/v1/query", json=question).json()['profile'] is None
+
+        # Traces are written on a worker thread after the response
+        request_id = response.headers["X-Request-ID"]
+        end = time.monotonic() + 5
+        while api._trace_store.get(request_id) is None and time.monotonic() < end:
+            time.sleep(0.01)
+        assert 'profile' in api._trace_store.get(request_id)
+        # Traces hold the question, so reading them needs the admin key as well
+        assert client.get(f"/api/v1/traces/{request_id}").status_code == 401
+        trace = client.get(f"/api/v1/traces/{request_id}", headers={'X-Admin-Key': "test-admin-key"})
+        assert trace.status_code == 200 and trace.json()['request_id'] == request_id
+    finally:
+        api._agent = api._trace_store = None
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+if __name__ == "__main__":
+    test_agent_run_is_recorded_as_span_tree()
+    test_traces_rotate_and_are_found_by_request_id()
+    test_profiler_report_is_attached()
+    test_profiling_requires_the_admin_key()
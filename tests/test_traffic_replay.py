@@ -0,0 +1,174 @@
+import json
+import os
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from llama_index.core import Document
+import api
+from traffic_capture import TrafficRecorder, load_capture
+from traffic_replay import build_schedule, replay_question, run_replay, start_server
+from tracing import TraceStore
+
+
+class FakeAgent:
+    request_timeout = 25
+    deadline_reserve = 2
+    answer_cache = None
+
+    def query(self, question, deadline=None):
+        return "The bootloader checks the application valid flag."
+
+
+def test_capture_is_anonymised():
+    capture_path = os.path.join(tempfile.mkdtemp(), "capture.jsonl")
+    query_log_path = os.path.join(tempfile.mkdtemp(), "query_log.jsonl")
+    saved = {name: os.environ.get(name) for name in ("QUERY_LOG_PATH", "WARMUP_TOP_N")}
+    os.environ.update({'QUERY_LOG_PATH': query_log_path, 'WARMUP_TOP_N': "5"})
+    api._agent = FakeAgent()
+    api._trace_store = TraceStore(os.path.join(tempfile.mkdtemp(), "traces.jsonl"))
+    api._traffic_recorder = TrafficRecorder(capture_path, salt="test-salt")
+    app = FastAPI()
+    app.include_router(api.app)
+    client = TestClient(app)
+    try:
+        client.post("/api/v1/query", json={'question': "What is the boot sequence?", 'conversation_id': "alice-1"})
+        client.post("/api/v1/query", json={'question': "what is the  boot sequence", 'conversation_id': "bob-7"})
+        client.post("/api/v1/query", json={'question': "List the items of the delivery", 'conversation_id': "alice-1"})
+    finally:
+        api._agent = api._trace_store = api._traffic_recorder = None
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    # Warm-up is on, but no plaintext question is logged next to the capture
+    assert not os.path.exists(query_log_path)
+    with open(capture_path) as f:
+        content = f.read()
+    for secret in ("boot", "delivery", "alice", "bob"):
+        assert secret not in content
+    first, second, third = load_capture([capture_path])
+    # The same question in another spelling has the same hash
+    assert first['h'] == second['h'] != third['h']
+    assert first['c'] == third['c'] != second['c'] and (first['n'], second['n'], third['n']) == (1, 1, 2)
+    assert third['k'] == "list" and first['w'] == 5 and first['st'] == 200 and first['o'] == "agent"
+    print(f"Capture record: {len(content.splitlines()[0])} bytes")
+
+
+def test_schedule_keeps_arrivals_and_think_time():
+    records = [
+        {'ts': 100.0, 'h': "a1", 'c': "c1", 'n': 1, 'ms': 4000.0, 'st': 200},
+        {'ts': 101.0, 'h': "b2", 'st': 200, 'ms': 500.0},
+        {'ts': 110.0, 'h': "c3", 'c': "c1", 'n': 2, 'ms': 3000.0, 'st': 200},
+        # Four hours without traffic
+        {'ts': 14510.0, 'h': "d4", 'st': 200, 'ms': 300.0},
+    ]
+    schedule = build_schedule(records, speedup=10, max_idle=60)
+    assert [round(item['offset'], 3) for item in schedule] == [0.0, 0.1, 1.0, 7.0]
+    # The follow-up was asked 6s after the answer to the first turn arrived
+    assert schedule[2]['previous'] == 0 and round(schedule[2]['think'], 3) == 0.6
+    assert schedule[1]['previous'] is None
+
+    warmup = ["What is Boot Sequence without Boot Manager?"]
+    question = replay_question({'h': "4f1c0a9b2d7e", 'w': 9, 'k': "list"}, warmup)
+    assert question.startswith("List the ") and len(question.split()) == 9
+    assert question == replay_question({'h': "4f1c0a9b2d7e", 'w': 9, 'k': "list"}, warmup)
+    assert replay_question({'h': "4f1c0a9b2d7e", 'w': 9, 'o': "cache"}, warmup) == warmup[0]
+
+
+def _synthetic_capture(path, requests=80, seconds=40.0):
+    """A capture with popular questions, conversations, list questions and searches."""
+    recorder = TrafficRecorder(path, salt="test-salt")
+    rng = random.Random(1)
+    popular = [f"How is logical block {i} validated before the jump" for i in range(5)]
+    start = time.time() - 3600
+    for i in range(requests):
+        roll = rng.random()
+        if roll < 0.1:
+            question, outcome = "What are limiting factors of OTA?", "cache"
+        elif roll < 0.5:
+            question, outcome = rng.choice(popular), "agent"
+        elif roll < 0.6:
+            question, outcome = f"List the checksum regions of sector {rng.randint(0, 3)}", "agent"
+        else:
+            question, outcome = f"Which service writes data identifier {rng.randint(0, 1000)}", "agent"
+        endpoint = "search" if rng.random() < 0.15 else "query"
+        recorder.record(
+            endpoint, question, start + seconds * i / requests, rng.uniform(2.0, 6.0), 200,
+            conversation_id=f"user-{rng.randint(0, 15)}" if endpoint == "query" else None,
+            outcome=outcome if endpoint == "query" else None,
+            lane="priority" if outcome == "cache" else "standard",
+            page=1 if endpoint == "search" else None, page_size=10 if endpoint == "search" else None
+        )
+
+
+def test_replay_against_mock_instance():
+    work_dir = tempfile.mkdtemp()
+    capture_path = os.path.join(work_dir, "traffic", "capture.jsonl")
+    _synthetic_capture(capture_path)
+
+    environment = {
+        'MOCK_MODELS': "true", 'MOCK_LLM_LATENCY_SECONDS': "0.05", 'MOCK_EMBEDDING_LATENCY_SECONDS': "0.01",
+        'INGESTION_WORKER_ENABLED': "false", 'LLAMA_CLOUD_API_KEY': "llx-test", 'WARMUP_TOP_N': "0",
+        'STORAGE_DB_PATH': os.path.join(work_dir, "storage", "fbl_rag.db"),
+        'QUERY_LOG_PATH': os.path.join(work_dir, "query_log.jsonl"),
+    }
+    saved = {name: os.environ.get(name) for name in list(environment) + ["QDRANT_URL", "QDRANT_API_KEY", "TRAFFIC_CAPTURE_PATH"]}
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    os.makedirs("data")
+    os.environ.update(environment)
+    for name in ("QDRANT_URL", "QDRANT_API_KEY", "TRAFFIC_CAPTURE_PATH"):
+        os.environ.pop(name, None)
+    server = None
+    try:
+        from mock_models import MockEmbedding
+        from vector_store_manager import VectorStoreManager
+        vm = VectorStoreManager(local_path="./qdrant_data", storage_db_path=environment['STORAGE_DB_PATH'])
+        vm.embed_model = MockEmbedding(dimensions=1536, latency_seconds=0.0)
+        vm.insert_documents([
+            Document(text=f"Logical block {i} is validated by checksum {i} before the jump to the application. "
+                          f"Service {i} writes data identifier {i}.", metadata={'file_name': "FBL_Manual.pdf", 'page_label': str(i)})
+            for i in range(50)
+        ])
+        vm.client.close()
+
+        base_url, server = start_server()
+        from agent_setup import get_warmup_questions
+        records = load_capture([capture_path])
+        schedule = build_schedule(records, speedup=10)
+        report = run_replay(base_url, schedule, get_warmup_questions())
+    finally:
+        if server is not None:
+            server.should_exit = True
+        api._agent = api._admission = api._trace_store = None
+        os.chdir(cwd)
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    assert report['requests'] == 80 and report['status'] == {'200': 80}
+    assert report['latency_ms']['p50'] > 0 and report['latency_ms']['p99'] >= report['latency_ms']['p95']
+    assert set(report['latency_ms_by_endpoint']) == {"query", "search"}
+    cache = report['cache']
+    queries = sum(1 for record in records if record['e'] == "q")
+    recorded_cached = report['recorded']['outcomes']['cache']
+    # Every request that hit the answer cache when recorded hits it again
+    assert cache['answer_cache']['hits'] == report['outcomes']['cache'] == recorded_cached
+    assert cache['answer_cache']['hits'] + cache['answer_cache']['misses'] == queries
+    # Popular questions repeat, so retrievals and observations are reused
+    assert cache['tool_cache_observation']['hits'] > 0
+    print(json.dumps({key: report[key] for key in ('duration_seconds', 'offered_rps', 'throughput_rps', 'latency_ms')}))
+    print(f"Cache effectiveness: {cache}")
+
+
+if __name__ == "__main__":
+    test_capture_is_anonymised()
+    test_schedule_keeps_arrivals_and_think_time()
+    test_replay_against_mock_instance()
@@ -0,0 +1,164 @@
+"""Report of prompt, cached and completion tokens per query.
+
+Reads the request traces written by the API and summarizes the LLM token
+usage per query, including how many prompt tokens the provider served from
+its prompt cache. ``--layout`` compares the static prompt prefix of the
+previous agent prompt layout with the current one and estimates the cache
+hits of both for a sample of questions.
+
+Usage:
+    python token_report.py --traces traces/traces.jsonl
+    python token_report.py --layout
+"""
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+import argparse
+import json
+import os
+from llama_index.core.agent.react.formatter import ReActChatFormatter
+from llama_index.core.agent.react.types import ActionReasoningStep, ObservationReasoningStep
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.tools import QueryEngineTool, ToolMetadata
+from llama_index.core.utils import get_tokenizer
+from prompt_layout import MIN_CACHEABLE_TOKENS, StablePrefixReActChatFormatter, estimate_cached_tokens
+from prompts import context, fblDocQuery_discription, system_prompt, warmup_questions
+
+# gpt-4o-mini bills cached prompt tokens at half the input price
+DEFAULT_CACHED_DISCOUNT = 0.5
+
+
+def iter_traces(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the traces of a trace file and its rotated backups, oldest first."""
+    backups = sorted(
+        (p for p in Path(path).parent.glob(f"{Path(path).name}.*") if p.suffix[1:].isdigit()),
+        key=lambda p: int(p.suffix[1:]),
+        reverse=True
+    )
+    for file_path in backups + [Path(path)]:
+        if not file_path.exists():
+            continue
+        with open(file_path, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def summarize_usage(traces: List[Dict[str, Any]], cached_discount: float = DEFAULT_CACHED_DISCOUNT) -> Dict[str, Any]:
+    """Summarize the token usage of the traced queries that called the LLM.
+
+    Args:
+        traces: Trace dicts as written by TraceStore
+        cached_discount: Fraction of the input price saved on a cached token
+
+    Returns:
+        Totals and per-query averages
+    """
+    usages = [t['usage'] for t in traces if t.get('usage', {}).get('llm_calls')]
+    queries = len(usages)
+    totals = {key: sum(u[key] for u in usages) for key in ('llm_calls', 'prompt_tokens', 'cached_tokens', 'completion_tokens')}
+    per_query = {key: round(value / queries, 1) if queries else 0.0 for key, value in totals.items()}
+    return {
+        'queries': queries,
+        'totals': totals,
+        'per_query': per_query,
+        'cache_hit_ratio': round(totals['cached_tokens'] / totals['prompt_tokens'], 3) if totals['prompt_tokens'] else 0.0,
+        # Input tokens saved per query, expressed as uncached input tokens
+        'saved_input_tokens_per_query': round(per_query['cached_tokens'] * cached_discount, 1)
+    }
+
+
+def _tool() -> QueryEngineTool:
+    return QueryEngineTool(
+        query_engine=None,
+        metadata=ToolMetadata(name="fblDocQuery", description=fblDocQuery_discription)
+    )
+
+
+def _serialize(messages: List[ChatMessage]) -> str:
+    return "".join(f"<|{message.role.value}|>{message.content}" for message in messages)
+
+
+def simulate_layout(
+    formatter: ReActChatFormatter,
+    questions: List[str],
+    observation_tokens: int = 300
+) -> Dict[str, Any]:
+    """Estimate prompt and cached tokens of two-step agent runs with a formatter.
+
+    Each question gets one tool call and a final answer step; the observation
+    is filler text of about ``observation_tokens`` tokens.
+
+    Args:
+        formatter: Chat formatter to lay out the prompts
+        questions: Questions to simulate, in order
+        observation_tokens: Approximate size of each tool observation
+
+    Returns:
+        Static prefix tokens, prompt tokens and estimated cached tokens
+    """
+    tokenizer = get_tokenizer()
+    tools = [_tool()]
+    prompts = []
+    for i, question in enumerate(questions):
+        history = [ChatMessage(role=MessageRole.USER, content=question)]
+        action = ActionReasoningStep(
+            thought="I need to use a tool to help me answer the question.",
+            action="fblDocQuery",
+            action_input={'input': question}
+        )
+        observation = ObservationReasoningStep(observation=" ".join(["bootloader"] * observation_tokens) + f" {i}")
+        for reasoning in ([], [action, observation]):
+            prompts.append(tokenizer(_serialize(formatter.format(tools, history, reasoning))))
+
+    cached = estimate_cached_tokens(prompts)
+    prefix_tokens = len(tokenizer(_serialize(formatter.format(tools, [])[:1])))
+    return {
+        'static_prefix_tokens': prefix_tokens,
+        'cacheable_prefix': prefix_tokens >= MIN_CACHEABLE_TOKENS,
+        'prompt_tokens_per_query': round(sum(len(p) for p in prompts) / len(questions), 1),
+        'cached_tokens_per_query': round(sum(cached) / len(questions), 1)
+    }
+
+
+def layout_report(questions: List[str], cached_discount: float = DEFAULT_CACHED_DISCOUNT) -> Dict[str, Any]:
+    """Compare the previous ReAct layout (context only) with the stable prefix layout."""
+    legacy = simulate_layout(ReActChatFormatter.from_defaults(context=context), questions)
+    stable = simulate_layout(StablePrefixReActChatFormatter.from_prompts(system_prompt, context), questions)
+    return {
+        'previous': legacy,
+        'stable_prefix': stable,
+        'saved_input_tokens_per_query': round(
+            (stable['cached_tokens_per_query'] * cached_discount)
+            - (legacy['cached_tokens_per_query'] * cached_discount)
+            - (stable['prompt_tokens_per_query'] - legacy['prompt_tokens_per_query']), 1
+        )
+    }
+
+
+def format_report(summary: Dict[str, Any]) -> str:
+    per_query = summary['per_query']
+    return "\n".join([
+        f"Queries with LLM calls: {summary['queries']}",
+        f"Per query: {per_query['llm_calls']} LLM calls, {per_query['prompt_tokens']} prompt tokens "
+        f"({per_query['cached_tokens']} cached), {per_query['completion_tokens']} completion tokens",
+        f"Cached share of prompt tokens: {summary['cache_hit_ratio']:.1%}",
+        f"Input tokens saved per query by the prompt cache: {summary['saved_input_tokens_per_query']}",
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report LLM token usage and prompt cache savings")
+    parser.add_argument("--traces", default=os.getenv("TRACE_PATH", "traces/traces.jsonl"))
+    parser.add_argument("--cached-discount", type=float, default=DEFAULT_CACHED_DISCOUNT,
+                        help="Fraction of the input price saved per cached token")
+    parser.add_argument("--layout", action="store_true", help="Estimate the cache hits of the prompt layouts")
+    args = parser.parse_args()
+
+    if args.layout:
+        print(json.dumps(layout_report(warmup_questions, args.cached_discount), indent=2))
+        return
+    print(format_report(summarize_usage(list(iter_traces(args.traces)), args.cached_discount)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Memoization of fblDocQuery tool calls.
+
+The agent often calls the tool with inputs that only differ in case,
+whitespace or punctuation, within one run and across users. Two bounded
+caches keyed on the normalized tool input and the ingestion version of the
+index state avoid the repeated work:
+
+- retrieval cache: fused nodes of a query (embedding and Qdrant searches)
+- observation cache: synthesized tool output (the LLM synthesis call)
+
+Observations get a shorter TTL than retrieval results, so a repeated query
+is synthesized again from time to time without searching again. Entries of
+an older ingestion version are never served and age out of the LRU order.
+A retriever that answers a tool call with the result of another query calls
+mark_uncacheable, so that observation is not cached under the call's input.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+import contextvars
+import threading
+import time
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.tools import QueryEngineTool, ToolMetadata
+from llama_index.core.tools.types import ToolOutput
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from answer_cache import normalize_question
+from metrics import REGISTRY
+from multi_query import split_query_variants
+
+RETRIEVAL_CACHE = "retrieval"
+OBSERVATION_CACHE = "observation"
+
+V = TypeVar("V")
+
+# Flags of the tool call in progress; a list so that threads and tasks started by the call share it
+_uncacheable_call: contextvars.ContextVar[Optional[List[bool]]] = contextvars.ContextVar(
+    "uncacheable_call", default=None
+)
+
+
+def normalize_tool_input(query_str: str) -> str:
+    """Normalize every variant of a tool input so trivially different inputs share an entry."""
+    return " | ".join(normalize_question(variant) for variant in split_query_variants(query_str))
+
+
+def mark_uncacheable() -> None:
+    """Keep the observation of the tool call in progress out of the observation cache."""
+    flags = _uncacheable_call.get()
+    if flags is not None:
+        flags.append(True)
+
+
+class TTLCache(Generic[V]):
+    """Thread-safe LRU cache with a maximum size and a time to live per entry."""
+
+    def __init__(self, name: str, max_entries: int = 256, ttl_seconds: float = 3600.0):
+        """Initialize the cache.
+
+        Args:
+            name: Cache name, used as the ``cache`` label of the metrics
+            max_entries: Entries kept; the least recently used entry is dropped first
+            ttl_seconds: Time after which an entry is no longer served
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._requests = REGISTRY.counter("tool_cache_requests_total", "Tool cache lookups by cache and result")
+        self._size = REGISTRY.gauge("tool_cache_entries", "Entries held by each tool cache")
+        self._hit_ratio = REGISTRY.gauge("tool_cache_hit_ratio", "Share of tool cache lookups served from the cache")
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """Return the entry for a key, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            size, hit_ratio = len(self._entries), self.hits / (self.hits + self.misses)
+        self._requests.inc(labels={'cache': self.name, 'result': "miss" if entry is None else "hit"})
+        self._size.set(size, labels={'cache': self.name})
+        self._hit_ratio.set(round(hit_ratio, 4), labels={'cache': self.name})
+        return None if entry is None else entry[1]
+
+    def contains(self, key: Hashable) -> bool:
+        """Return True if the key has an unexpired entry, without counting a lookup."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds
+
+    def put(self, key: Hashable, value: V) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            size = len(self._entries)
+        self._size.set(size, labels={'cache': self.name})
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        self._size.set(0, labels={'cache': self.name})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class CachedRetriever(BaseRetriever):
+    """Serves repeated queries of one ingestion version from a shared retrieval cache."""
+
+    def __init__(
+        self,
+        retriever: BaseRetriever,
+        cache: TTLCache,
+        version: int,
+        callback_manager: Optional[CallbackManager] = None
+    ):
+        """Initialize the retriever.
+
+        Args:
+            retriever: Retriever whose results are cached
+            cache: Retrieval cache, shared by the retrievers of all index states
+            version: Ingestion version the retriever searches
+            callback_manager: Optional callback manager for retrieval events
+        """
+        super().__init__(callback_manager=callback_manager)
+        self.retriever = retriever
+        self.cache = cache
+        self.version = version
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        key = (self.version, normalize_tool_input(query_bundle.query_str))
+        nodes = self.cache.get(key)
+        if nodes is None:
+            nodes = self.retriever.retrieve(query_bundle)
+            self.cache.put(key, nodes)
+        # Node postprocessors replace node content in place, so hand out copies
+        return [NodeWithScore(node=n.node.model_copy(deep=True), score=n.score) for n in nodes]
+
+
+class MemoizedQueryEngineTool(QueryEngineTool):
+    """QueryEngineTool that returns the cached observation for a repeated input."""
+
+    def __init__(
+        self,
+        query_engine: BaseQueryEngine,
+        metadata: ToolMetadata,
+        cache: TTLCache,
+        version: int,
+        resolve_input_errors: bool = True
+    ):
+        """Initialize the tool.
+
+        Args:
+            query_engine: Query engine answering the tool calls
+            metadata: Tool name and description
+            cache: Observation cache, shared by the tools of all index states
+            version: Ingestion version the query engine searches
+            resolve_input_errors: See QueryEngineTool
+        """
+        super().__init__(query_engine=query_engine, metadata=metadata, resolve_input_errors=resolve_input_errors)
+        self.cache = cache
+        self.version = version
+
+    def _key(self, query_str: str) -> Tuple[int, str]:
+        return self.version, normalize_tool_input(query_str)
+
+    def call(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        key = self._key(self._get_query_str(*args, **kwargs))
+        output = self.cache.get(key)
+        if output is None:
+            flags = []
+            token = _uncacheable_call.set(flags)
+            try:
+                output = super().call(*args, **kwargs)
+            finally:
+                _uncacheable_call.reset(token)
+            if not flags:
+                self.cache.put(key, output)
+        return output
+
+    async def acall(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        key = self._key(self._get_query_str(*args, **kwargs))
+        output = self.cache.get(key)
+        if output is None:
+            flags = []
+            token = _uncacheable_call.set(flags)
+            try:
+                output = await super().acall(*args, **kwargs)
+            finally:
+                _uncacheable_call.reset(token)
+            if not flags:
+                self.cache.put(key, output)
+        return output
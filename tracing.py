@@ -0,0 +1,402 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.callbacks.schema import CBEventType, EventPayload
+from llama_index.core.utils import get_tokenizer
+from metrics import REGISTRY
+
+_current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("request_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+
+# Names of the spans recorded for llama-index callback events
+EVENT_SPAN_NAMES = {
+    CBEventType.LLM: "llm_call",
+    CBEventType.FUNCTION_CALL: "tool_call",
+    CBEventType.RETRIEVE: "retrieval",
+    CBEventType.EMBEDDING: "embedding",
+    CBEventType.SYNTHESIZE: "synthesis",
+    CBEventType.QUERY: "query_engine",
+}
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+class Span:
+    """Timed operation within a request, e.g. an agent step or a Qdrant search."""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.parent = parent
+        self.attributes: Dict[str, Any] = attributes or {}
+        self.children: List["Span"] = []
+        self.start = time.monotonic()
+        self.end: Optional[float] = None
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def finished(self) -> bool:
+        return self.end is not None
+
+    def finish(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+        if self.end is None:
+            self.end = time.monotonic()
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        end = self.end if self.end is not None else time.monotonic()
+        return {
+            'name': self.name,
+            'start_ms': round((self.start - origin) * 1000, 2),
+            'duration_ms': round((end - self.start) * 1000, 2),
+            'attributes': self.attributes,
+            'children': [child.to_dict(origin) for child in self.children]
+        }
+
+
+class RequestTrace:
+    """Span tree of one API request."""
+
+    def __init__(self, request_id: str, name: str = "request", **attributes: Any):
+        self.request_id = request_id
+        self.timestamp = time.time()
+        self.root = Span(name, attributes=attributes)
+        self.profile: Optional[Dict[str, Any]] = None
+        # LLM token usage of the whole request; cached_tokens is the part of prompt_tokens
+        # served from the provider's prompt cache
+        self.usage: Dict[str, int] = {'llm_calls': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0}
+        self._usage_lock = threading.Lock()
+
+    def add_llm_usage(self, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> None:
+        with self._usage_lock:
+            self.usage['llm_calls'] += 1
+            self.usage['prompt_tokens'] += prompt_tokens
+            self.usage['cached_tokens'] += cached_tokens
+            self.usage['completion_tokens'] += completion_tokens
+
+    def finish(self, **attributes: Any) -> None:
+        self.root.finish(**attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        trace = {
+            'request_id': self.request_id,
+            'timestamp': self.timestamp,
+            'duration_ms': round(((self.root.end or time.monotonic()) - self.root.start) * 1000, 2),
+            'usage': dict(self.usage),
+            'spans': self.root.to_dict(self.root.start)
+        }
+        if self.profile is not None:
+            trace['profile'] = self.profile
+        return trace
+
+
+def get_current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def _open_parent(span: Optional[Span]) -> Optional[Span]:
+    # Skip spans that already ended, e.g. when an end event was never delivered
+    while span is not None and span.finished:
+        span = span.parent
+    return span
+
+
+@contextmanager
+def trace_scope(trace: Optional[RequestTrace]) -> Iterator[Optional[RequestTrace]]:
+    """Record spans of the block (and of worker threads started with its context) into trace."""
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root if trace is not None else None)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+def start_span(name: str, **attributes: Any) -> Optional[Span]:
+    """Start a child of the current span; returns None when no trace is active."""
+    if _current_trace.get() is None:
+        return None
+    return Span(name, parent=_open_parent(_current_span.get()), attributes=attributes)
+
+
+@contextmanager
+def trace_span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Record the block as a span of the current trace (no-op without a trace)."""
+    span = start_span(name, **attributes)
+    if span is None:
+        yield None
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.finish(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        span.finish()
+        _current_span.reset(token)
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """Records LLM calls, tool calls, retrievals and embeddings as spans of the current trace."""
+
+    def __init__(self):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self._open: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._tokenizer = None
+        self._prompt_tokens = REGISTRY.counter("llm_prompt_tokens_total", "Prompt tokens sent to the LLM")
+        self._cached_tokens = REGISTRY.counter(
+            "llm_cached_prompt_tokens_total", "Prompt tokens served from the provider's prompt cache"
+        )
+        self._completion_tokens = REGISTRY.counter("llm_completion_tokens_total", "Completion tokens generated by the LLM")
+
+    def _count_tokens(self, text: str) -> int:
+        if self._tokenizer is None:
+            self._tokenizer = get_tokenizer()
+        return len(self._tokenizer(text))
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any
+    ) -> str:
+        if event_type not in EVENT_SPAN_NAMES:
+            return event_id
+        span = start_span(EVENT_SPAN_NAMES[event_type], **self._start_attributes(event_type, payload or {}))
+        if span is not None:
+            token = _current_span.set(span)
+            with self._lock:
+                self._open[event_id] = (span, token)
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any
+    ) -> None:
+        with self._lock:
+            entry = self._open.pop(event_id, None)
+        if entry is None:
+            return
+        span, token = entry
+        attributes = self._end_attributes(event_type, payload or {})
+        span.finish(**attributes)
+        if event_type == CBEventType.LLM and 'error' not in attributes:
+            self._record_usage(attributes)
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Ended in a different context than it started in; parent lookup skips finished spans
+            pass
+
+    def _start_attributes(self, event_type: CBEventType, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if event_type == CBEventType.FUNCTION_CALL:
+            tool = payload.get(EventPayload.TOOL)
+            return {
+                'tool': getattr(tool, 'name', None),
+                'input': str(payload.get(EventPayload.FUNCTION_CALL, ''))[:500]
+            }
+        if event_type in (CBEventType.RETRIEVE, CBEventType.QUERY, CBEventType.SYNTHESIZE):
+            return {'query': str(payload.get(EventPayload.QUERY_STR, ''))[:500]}
+        if event_type == CBEventType.EMBEDDING:
+            return {'model': str((payload.get(EventPayload.SERIALIZED) or {}).get('model_name', ''))}
+        return {}
+
+    def _end_attributes(self, event_type: CBEventType, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if EventPayload.EXCEPTION in payload:
+            return {'error': str(payload[EventPayload.EXCEPTION])}
+        if event_type == CBEventType.LLM:
+            return self._llm_usage(payload)
+        if event_type == CBEventType.RETRIEVE:
+            nodes = payload.get(EventPayload.NODES) or []
+            return {'top_k': len(nodes), 'scores': [round(n.score, 4) for n in nodes if n.score is not None]}
+        if event_type == CBEventType.EMBEDDING:
+            return {'texts': len(payload.get(EventPayload.CHUNKS) or [])}
+        if event_type == CBEventType.FUNCTION_CALL:
+            return {'output_chars': len(str(payload.get(EventPayload.FUNCTION_OUTPUT, '')))}
+        return {}
+
+    def _llm_usage(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = payload.get(EventPayload.RESPONSE) or payload.get(EventPayload.COMPLETION)
+        usage = getattr(getattr(response, 'raw', None), 'usage', None)
+        if usage is None and isinstance(getattr(response, 'raw', None), dict):
+            usage = response.raw.get('usage')
+        if usage is not None:
+            get = usage.get if isinstance(usage, dict) else lambda key: getattr(usage, key, None)
+            details = get('prompt_tokens_details')
+            cached = (details.get('cached_tokens') if isinstance(details, dict)
+                      else getattr(details, 'cached_tokens', None)) if details is not None else None
+            return {
+                'prompt_tokens': get('prompt_tokens'),
+                'cached_tokens': cached or 0,
+                'completion_tokens': get('completion_tokens')
+            }
+        # No usage reported (e.g. streaming or a local model): estimate with the tokenizer
+        messages = payload.get(EventPayload.MESSAGES)
+        prompt = '\n'.join(str(m.content) for m in messages) if messages else str(payload.get(EventPayload.PROMPT, ''))
+        return {
+            'prompt_tokens': self._count_tokens(prompt),
+            'completion_tokens': self._count_tokens(str(response or '')),
+            'estimated': True
+        }
+
+    def _record_usage(self, attributes: Dict[str, Any]) -> None:
+        prompt_tokens = attributes.get('prompt_tokens') or 0
+        cached_tokens = attributes.get('cached_tokens') or 0
+        completion_tokens = attributes.get('completion_tokens') or 0
+        trace = get_current_trace()
+        if trace is not None:
+            trace.add_llm_usage(prompt_tokens, cached_tokens, completion_tokens)
+        self._prompt_tokens.inc(prompt_tokens)
+        self._cached_tokens.inc(cached_tokens)
+        self._completion_tokens.inc(completion_tokens)
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[Dict[str, List[str]]] = None
+    ) -> None:
+        pass
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread at a fixed interval.
+
+    Only the profiled thread is inspected, so the overhead is limited to the
+    sampling thread waking up every ``interval`` seconds.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._self_counts: Counter = Counter()
+        self._total_counts: Counter = Counter()
+        self._stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _frame_label(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self, thread_id: int) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(self._frame_label(frame))
+                frame = frame.f_back
+            self.samples += 1
+            self._self_counts[stack[0]] += 1
+            for label in set(stack):
+                self._total_counts[label] += 1
+            self._stacks[';'.join(reversed(stack))] += 1
+
+    def start(self, thread_id: Optional[int] = None) -> None:
+        """Start sampling the given thread (default: the calling thread)."""
+        target = thread_id if thread_id is not None else threading.get_ident()
+        self._thread = threading.Thread(target=self._sample, args=(target,), name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def report(self, top_n: int = 25) -> Dict[str, Any]:
+        """Return the hottest functions by own and cumulative samples and the most frequent stacks."""
+        def share(count):
+            return round(100.0 * count / self.samples, 1) if self.samples else 0.0
+
+        return {
+            'samples': self.samples,
+            'interval_ms': self.interval * 1000,
+            'self': [{'function': f, 'samples': c, 'percent': share(c)} for f, c in self._self_counts.most_common(top_n)],
+            'cumulative': [{'function': f, 'samples': c, 'percent': share(c)}
+                           for f, c in self._total_counts.most_common(top_n)],
+            'stacks': [{'stack': s, 'samples': c} for s, c in self._stacks.most_common(10)]
+        }
+
+
+@contextmanager
+def profile_current_thread(trace: Optional[RequestTrace], interval: float = 0.005) -> Iterator[None]:
+    """Profile the calling thread for the duration of the block and attach the report to trace."""
+    if trace is None:
+        yield
+        return
+    profiler = SamplingProfiler(interval)
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        trace.profile = profiler.report()
+
+
+class TraceStore:
+    """Traces as JSON lines in a size-rotated local file."""
+
+    def __init__(self, path: str = "traces/traces.jsonl", max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5):
+        """Initialize the store.
+
+        Args:
+            path: Path of the current trace file
+            max_bytes: Size at which the file is rotated
+            backup_count: Number of rotated files to keep
+        """
+        self.path = path
+        self.backup_count = backup_count
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._logger = logging.getLogger(f"trace_store.{os.path.abspath(path)}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if not self._logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    def write(self, trace: RequestTrace) -> None:
+        try:
+            self._logger.info(json.dumps(trace.to_dict(), default=str))
+        except Exception as e:
+            print(f"Error writing trace {trace.request_id}: {e}")
+
+    def get(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """Find a trace by request ID, newest file first."""
+        paths = [self.path] + [f"{self.path}.{i}" for i in range(1, self.backup_count + 1)]
+        needle = f'"request_id": "{request_id}"'
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, "r") as f:
+                for line in f:
+                    if needle in line:
+                        return json.loads(line)
+        return None
@@ -0,0 +1,172 @@
+"""Anonymised capture of the request stream, for replay and capacity planning.
+
+With ``TRAFFIC_CAPTURE_PATH`` set, every /query and /search request is
+appended to a size-rotated JSON lines file: arrival time, endpoint, status,
+latency, how it was answered, and the conversation it belongs to. Question
+text and conversation IDs are never written; they are replaced by keyed
+hashes (HMAC-SHA256 with ``TRAFFIC_CAPTURE_SALT``), so repeated questions
+and follow-up turns stay recognisable without revealing their content.
+
+Each record uses short keys to keep the file small (about 150 bytes per
+request)::
+
+    {"ts": 1760000000.123, "e": "q", "h": "4f1c0a9b2d7e", "w": 9, "k": "list",
+     "c": "a1b2c3d4", "n": 2, "st": 200, "ms": 5230.1, "o": "agent", "l": "standard"}
+
+``ts`` arrival time, ``e`` endpoint (``q`` query, ``s`` search), ``h`` hash of
+the normalised question, ``w`` question length in words, ``k`` question kind
+(``list``, ``security`` or ``other``), ``c``/``n`` conversation hash and turn,
+``st`` HTTP status, ``ms`` latency, ``o`` how the answer was produced
+(``cache``, ``extractive``, ``agent``, ``partial``), ``l`` admission lane,
+``pg``/``ps`` page and page size of a search.
+"""
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+from answer_cache import normalize_question
+from extractive_answer import ExtractiveAnswerer
+
+QUESTION_HASH_CHARS = 12
+CONVERSATION_HASH_CHARS = 8
+# Conversations whose turn count is remembered
+MAX_CONVERSATIONS = 10000
+
+
+def question_kind(question: str) -> str:
+    """Coarse class of a question that decides its path through the server."""
+    if "security class" in question.lower():
+        return "security"
+    if ExtractiveAnswerer.is_candidate(question):
+        return "list"
+    return "other"
+
+
+class TrafficRecorder:
+    """Appends anonymised request records to a size-rotated JSON lines file."""
+
+    def __init__(
+        self,
+        path: str = "traffic/capture.jsonl",
+        salt: Optional[str] = None,
+        max_bytes: int = 50 * 1024 * 1024,
+        backup_count: int = 10
+    ):
+        """Initialize the recorder.
+
+        Args:
+            path: Path of the current capture file
+            salt: Secret key of the hashes; a random one is used when not set, so hashes only
+                match within the lifetime of the process
+            max_bytes: Size at which the file is rotated
+            backup_count: Number of rotated files to keep
+        """
+        self.path = path
+        if not salt:
+            print("TRAFFIC_CAPTURE_SALT is not set, question hashes will not match across restarts")
+            salt = secrets.token_hex(16)
+        self._key = salt.encode()
+        self._turns: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._logger = logging.getLogger(f"traffic_capture.{os.path.abspath(path)}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if not self._logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    def _hash(self, value: str, chars: int) -> str:
+        return hmac.new(self._key, value.encode(), hashlib.sha256).hexdigest()[:chars]
+
+    def _turn(self, conversation: str) -> int:
+        with self._lock:
+            turn = self._turns.pop(conversation, 0) + 1
+            self._turns[conversation] = turn
+            if len(self._turns) > MAX_CONVERSATIONS:
+                self._turns.popitem(last=False)
+            return turn
+
+    def record(
+        self,
+        endpoint: str,
+        question: str,
+        arrival: float,
+        latency_seconds: float,
+        status: int,
+        conversation_id: Optional[str] = None,
+        outcome: Optional[str] = None,
+        lane: Optional[str] = None,
+        page: Optional[int] = None,
+        page_size: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Write the record of one request.
+
+        Args:
+            endpoint: ``query`` or ``search``
+            question: Question or search query; only its hash and length are written
+            arrival: Arrival time (epoch seconds)
+            latency_seconds: Time until the response was ready
+            status: HTTP status returned
+            conversation_id: Conversation the request belongs to; only its hash is written
+            outcome: How the answer was produced (cache, extractive, agent, partial)
+            lane: Admission lane
+            page: Result page of a search
+            page_size: Page size of a search
+
+        Returns:
+            The record written
+        """
+        record = {
+            'ts': round(arrival, 3),
+            'e': endpoint[0],
+            'h': self._hash(normalize_question(question), QUESTION_HASH_CHARS),
+            'w': len(question.split()),
+            'k': question_kind(question),
+            'st': status,
+            'ms': round(latency_seconds * 1000, 1),
+        }
+        if conversation_id:
+            conversation = self._hash(conversation_id, CONVERSATION_HASH_CHARS)
+            record['c'] = conversation
+            record['n'] = self._turn(conversation)
+        optional = {'o': outcome, 'l': lane, 'pg': page, 'ps': page_size}
+        record.update({key: value for key, value in optional.items() if value is not None})
+        try:
+            self._logger.info(json.dumps(record, separators=(",", ":")))
+        except Exception as e:
+            print(f"Error writing traffic capture: {e}")
+        return record
+
+
+def capture_files(path: str) -> List[str]:
+    """Return the capture file and its rotated backups, oldest first."""
+    rotated = sorted(
+        (candidate for candidate in Path(path).parent.glob(f"{Path(path).name}.*") if candidate.suffix[1:].isdigit()),
+        key=lambda candidate: int(candidate.suffix[1:]),
+        reverse=True
+    )
+    return [str(candidate) for candidate in rotated] + ([path] if os.path.exists(path) else [])
+
+
+def load_capture(paths: Iterable[str]) -> List[Dict[str, Any]]:
+    """Read capture records from files (rotated backups included), sorted by arrival time."""
+    records = []
+    for path in paths:
+        for file_path in capture_files(path):
+            with open(file_path, "r") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+    records.sort(key=lambda record: record['ts'])
+    return records
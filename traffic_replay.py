@@ -0,0 +1,404 @@
+"""Replay a traffic capture against a server instance for capacity planning.
+
+The recorded arrival process is replayed open-loop: every request is sent
+at its recorded offset (divided by ``--speedup``), whether or not earlier
+requests have completed, so queueing and load shedding show up as they
+would in production. Follow-up turns of a conversation wait for the
+previous turn's response plus the recorded think time, as a user would.
+
+Questions are not in the capture, so each question hash is replaced by a
+synthetic question of the same length and kind; repeated hashes get the
+same text, which keeps the repeat pattern the caches see. Requests that
+were served by the answer cache are replayed with a warm-up question.
+
+Without ``--target`` the server is started in-process with the mock LLM
+and embedding model (``MOCK_MODELS``), on the index of the current
+directory. Usage::
+
+    python traffic_replay.py traffic/capture.jsonl --speedup 10
+    python traffic_replay.py traffic/capture.jsonl --target http://staging:8080 --json
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import threading
+import time
+import httpx
+from traffic_capture import load_capture
+
+# Vocabulary of the synthetic questions
+DOMAIN_WORDS = [
+    "bootloader", "flash", "download", "application", "validation", "checksum", "signature", "security",
+    "access", "seed", "key", "memory", "block", "sector", "erase", "programming", "session", "diagnostic",
+    "routine", "ecu", "gateway", "hexview", "configuration", "callback", "watchdog", "nvm", "fingerprint",
+    "compression", "encryption", "timeout", "reset", "jump", "bank", "ota", "update", "logical", "segment",
+    "request", "response", "tester",
+]
+KIND_TEMPLATES = {
+    'list': "List the {words}",
+    'security': "Which security class applies to {words}?",
+    'other': "How does the {words} work?",
+}
+METRIC_LINE_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+LABEL_PATTERN = re.compile(r'(\w+)="([^"]*)"')
+
+
+def replay_question(record: Dict[str, Any], warmup_questions: List[str]) -> str:
+    """Synthetic question standing in for a recorded question hash."""
+    if warmup_questions and (record.get('o') == "cache" or record.get('l') == "priority"):
+        return warmup_questions[int(record['h'], 16) % len(warmup_questions)]
+    rng = random.Random(record['h'])
+    template = KIND_TEMPLATES.get(record.get('k'), KIND_TEMPLATES['other'])
+    # Template words count towards the recorded length
+    count = max(record.get('w', 8) - len(template.split()) + 1, 2)
+    return template.format(words=" ".join(rng.choice(DOMAIN_WORDS) for _ in range(count)))
+
+
+def build_schedule(records: List[Dict[str, Any]], speedup: float = 1.0, max_idle: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Turn capture records into send offsets.
+
+    Args:
+        records: Capture records sorted by arrival time
+        speedup: Time compression factor, 10 replays an hour in six minutes
+        max_idle: Longest gap between arrivals kept, in recorded seconds (e.g. nights and restarts)
+
+    Returns:
+        Items with the record, its ``offset`` in seconds and, for follow-up turns, the index
+        of the ``previous`` turn and the ``think`` time after its response
+    """
+    schedule = []
+    last_turn: Dict[str, int] = {}
+    offset, previous_ts = 0.0, None
+    for index, record in enumerate(records):
+        if previous_ts is not None:
+            gap = record['ts'] - previous_ts
+            offset += min(gap, max_idle) if max_idle is not None else gap
+        previous_ts = record['ts']
+        item = {'record': record, 'offset': offset / speedup, 'previous': None, 'think': 0.0}
+        conversation = record.get('c')
+        if conversation is not None and conversation in last_turn:
+            previous = records[last_turn[conversation]]
+            think = max(record['ts'] - previous['ts'] - previous.get('ms', 0.0) / 1000, 0.0)
+            item['previous'] = last_turn[conversation]
+            item['think'] = (min(think, max_idle) if max_idle is not None else think) / speedup
+        if conversation is not None:
+            last_turn[conversation] = index
+        schedule.append(item)
+    return schedule
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    if len(values) == 1:
+        cuts = values * 99
+    else:
+        cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {
+        'p50': round(cuts[49], 1),
+        'p90': round(cuts[89], 1),
+        'p95': round(cuts[94], 1),
+        'p99': round(cuts[98], 1),
+        'max': round(max(values), 1),
+    }
+
+
+def response_outcome(body: Dict[str, Any]) -> str:
+    """How the server produced a /query answer, judged from the response."""
+    if body.get('extractive'):
+        return "extractive"
+    if body.get('partial'):
+        return "partial"
+    if (body.get('usage') or {}).get('llm_calls') == 0:
+        return "cache"
+    return "agent"
+
+
+async def _send(client: httpx.AsyncClient, item: Dict[str, Any], question: str) -> Dict[str, Any]:
+    record = item['record']
+    if record.get('e') == "s":
+        path, payload = "/api/v1/search", {'query': question, 'page': record.get('pg', 1), 'page_size': record.get('ps', 10)}
+    else:
+        path, payload = "/api/v1/query", {'question': question, 'conversation_id': record.get('c')}
+    start = time.perf_counter()
+    result = {'endpoint': "search" if record.get('e') == "s" else "query", 'outcome': None}
+    try:
+        response = await client.post(path, json=payload)
+        result['status'] = response.status_code
+        if response.status_code == 200 and result['endpoint'] == "query":
+            result['outcome'] = response_outcome(response.json())
+    except httpx.HTTPError as e:
+        result['status'] = 0
+        result['error'] = type(e).__name__
+    result['latency_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+async def replay(
+    base_url: str,
+    schedule: List[Dict[str, Any]],
+    warmup_questions: List[str],
+    timeout: float = 60.0
+) -> Tuple[List[Dict[str, Any]], float]:
+    """Send the scheduled requests to a server.
+
+    Args:
+        base_url: URL of the server, e.g. http://localhost:8080
+        schedule: Output of build_schedule
+        warmup_questions: Questions the server's answer cache is warmed with
+        timeout: Client timeout per request in seconds
+
+    Returns:
+        Result per request (status, latency, outcome, send lag) and the wall time of the replay
+    """
+    loop = asyncio.get_running_loop()
+    finished: Dict[int, float] = {}
+    done = [asyncio.Event() for _ in schedule]
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=256)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        start = loop.time()
+
+        async def run(index: int, item: Dict[str, Any]) -> Dict[str, Any]:
+            due = start + item['offset']
+            if item['previous'] is not None:
+                await done[item['previous']].wait()
+                due = max(due, finished[item['previous']] + item['think'])
+                await asyncio.sleep(max(due - loop.time(), 0.0))
+            lag = loop.time() - due
+            try:
+                result = await _send(client, item, replay_question(item['record'], warmup_questions))
+            finally:
+                finished[index] = loop.time()
+                done[index].set()
+            result['lag_ms'] = max(lag, 0.0) * 1000
+            return result
+
+        tasks = []
+        for index, item in enumerate(schedule):
+            # Open loop: send on schedule, whatever is still in flight
+            await asyncio.sleep(max(start + item['offset'] - loop.time(), 0.0))
+            tasks.append(asyncio.create_task(run(index, item)))
+        results = await asyncio.gather(*tasks)
+        return list(results), loop.time() - start
+
+
+def parse_metrics(text: str) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    """Parse the Prometheus text format into values by metric name and labels."""
+    values = {}
+    for line in text.splitlines():
+        match = METRIC_LINE_PATTERN.match(line.strip())
+        if match is None or line.startswith("#"):
+            continue
+        name, labels, value = match.groups()
+        try:
+            values[(name, tuple(sorted(LABEL_PATTERN.findall(labels or ""))))] = float(value)
+        except ValueError:
+            continue
+    return values
+
+
+def _ratio(hits: float, total: float) -> Optional[float]:
+    return round(hits / total, 3) if total else None
+
+
+def cache_effectiveness(before: Dict, after: Dict) -> Dict[str, Any]:
+    """Cache hit ratios of the replay, from the server's metrics before and after it."""
+    def delta(name: str, **labels: str) -> float:
+        key = (name, tuple(sorted(labels.items())))
+        return after.get(key, 0.0) - before.get(key, 0.0)
+
+    report = {}
+    hits, misses = delta("answer_cache_requests_total", result="hit"), delta("answer_cache_requests_total", result="miss")
+    report['answer_cache'] = {'hits': int(hits), 'misses': int(misses), 'hit_ratio': _ratio(hits, hits + misses)}
+    caches = sorted({dict(labels).get('cache') for name, labels in after if name == "tool_cache_requests_total"} - {None})
+    for cache in caches:
+        hits = delta("tool_cache_requests_total", cache=cache, result="hit")
+        misses = delta("tool_cache_requests_total", cache=cache, result="miss")
+        report[f"tool_cache_{cache}"] = {'hits': int(hits), 'misses': int(misses), 'hit_ratio': _ratio(hits, hits + misses)}
+    served = delta("extractive_answers_total", result="served")
+    fallback, skipped = delta("extractive_answers_total", result="fallback"), delta("extractive_answers_total", result="skipped")
+    report['extractive'] = {
+        'served': int(served), 'fallback': int(fallback), 'skipped': int(skipped),
+        'served_ratio': _ratio(served, served + fallback + skipped),
+    }
+    prompt_tokens, cached_tokens = delta("llm_prompt_tokens_total"), delta("llm_cached_prompt_tokens_total")
+    report['prompt_cache'] = {
+        'prompt_tokens': int(prompt_tokens), 'cached_tokens': int(cached_tokens),
+        'cached_ratio': _ratio(cached_tokens, prompt_tokens),
+    }
+    return report
+
+
+def _count(values: List[Any]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for value in values:
+        if value is not None:
+            counts[str(value)] = counts.get(str(value), 0) + 1
+    return dict(sorted(counts.items()))
+
+
+def summarize(
+    schedule: List[Dict[str, Any]],
+    results: List[Dict[str, Any]],
+    duration: float,
+    cache: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Build the replay report: throughput, latency percentiles, outcomes and cache effectiveness."""
+    records = [item['record'] for item in schedule]
+    succeeded = [result for result in results if result['status'] == 200]
+    span = schedule[-1]['offset'] if schedule else 0.0
+    report = {
+        'requests': len(results),
+        'duration_seconds': round(duration, 2),
+        'offered_rps': round(len(results) / span, 2) if span else None,
+        'throughput_rps': round(len(succeeded) / duration, 2) if duration else None,
+        'status': _count([result['status'] for result in results]),
+        'latency_ms': percentiles([result['latency_ms'] for result in succeeded]),
+        'latency_ms_by_endpoint': {
+            endpoint: percentiles([result['latency_ms'] for result in succeeded if result['endpoint'] == endpoint])
+            for endpoint in sorted({result['endpoint'] for result in succeeded})
+        },
+        # How late requests were sent; large values mean the replay client itself was the bottleneck
+        'send_lag_ms': percentiles([result['lag_ms'] for result in results]),
+        'outcomes': _count([result['outcome'] for result in results]),
+        'recorded': {
+            'status': _count([record.get('st') for record in records]),
+            'latency_ms': percentiles([record['ms'] for record in records if record.get('st') == 200 and 'ms' in record]),
+            'outcomes': _count([record.get('o') for record in records]),
+            'distinct_questions': len({record['h'] for record in records}),
+            'conversations': len({record['c'] for record in records if 'c' in record}),
+        },
+    }
+    if cache is not None:
+        report['cache'] = cache
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    latency = report['latency_ms']
+    recorded = report['recorded']
+    lines = [
+        f"Replayed {report['requests']} requests in {report['duration_seconds']}s "
+        f"(offered {report['offered_rps']} req/s, completed {report['throughput_rps']} req/s)",
+        f"Status: {report['status']} (recorded {recorded['status']})",
+        f"Latency ms: p50 {latency.get('p50')}, p90 {latency.get('p90')}, p95 {latency.get('p95')}, "
+        f"p99 {latency.get('p99')}, max {latency.get('max')}",
+    ]
+    for endpoint, values in report['latency_ms_by_endpoint'].items():
+        lines.append(f"  {endpoint}: p50 {values.get('p50')}, p95 {values.get('p95')}, p99 {values.get('p99')}")
+    lines.append(f"Recorded latency ms: p50 {recorded['latency_ms'].get('p50')}, p95 {recorded['latency_ms'].get('p95')}, "
+                 f"p99 {recorded['latency_ms'].get('p99')}")
+    lines.append(f"Outcomes: {report['outcomes']} (recorded {recorded['outcomes']})")
+    lines.append(f"Send lag ms: p95 {report['send_lag_ms'].get('p95')}")
+    for name, values in report.get('cache', {}).items():
+        lines.append(f"Cache {name}: {values}")
+    return "\n".join(lines)
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0):
+    """Start the API in a background thread and return its base URL and the uvicorn server.
+
+    The agent is set up before the server accepts requests, as main.py does,
+    and the answer cache warm-up is awaited so the replay starts warm.
+    """
+    import uvicorn
+    import main
+    from api import get_agent
+
+    agent = get_agent()
+    if getattr(agent, "answer_cache", None) is not None:
+        agent.answer_cache.wait_for_warmup()
+    server = uvicorn.Server(uvicorn.Config(main.app, host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="replay-server", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("Replay server failed to start")
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return f"http://{host}:{port}", server
+
+
+async def _scrape_metrics(base_url: str) -> Dict:
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=10) as client:
+            response = await client.get("/api/v1/metrics")
+            response.raise_for_status()
+            return parse_metrics(response.text)
+    except httpx.HTTPError as e:
+        print(f"Could not read metrics from {base_url}: {e}")
+        return {}
+
+
+def run_replay(
+    base_url: str,
+    schedule: List[Dict[str, Any]],
+    warmup_questions: List[str],
+    timeout: float = 60.0
+) -> Dict[str, Any]:
+    """Replay a schedule against a server and return the report."""
+    before = asyncio.run(_scrape_metrics(base_url))
+    results, duration = asyncio.run(replay(base_url, schedule, warmup_questions, timeout=timeout))
+    after = asyncio.run(_scrape_metrics(base_url))
+    return summarize(schedule, results, duration, cache_effectiveness(before, after) if after else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic against a server instance")
+    parser.add_argument("capture", nargs="+", help="Capture files (rotated backups are read as well)")
+    parser.add_argument("--target", help="Server URL; without it the server runs in-process with mock models")
+    parser.add_argument("--speedup", type=float, default=1.0, help="Time compression factor")
+    parser.add_argument("--max-idle", type=float, default=60.0, help="Longest recorded gap kept, in seconds")
+    parser.add_argument("--limit", type=int, help="Replay only the first N requests")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Client timeout per request in seconds")
+    parser.add_argument("--warmup-questions", help="JSON list of the target's warm-up questions")
+    parser.add_argument("--llm-latency", type=float, help="Seconds per mock LLM call (in-process only)")
+    parser.add_argument("--embedding-latency", type=float, help="Seconds per mock embedding call (in-process only)")
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    args = parser.parse_args()
+
+    records = load_capture(args.capture)[:args.limit]
+    if not records:
+        parser.error("No records in the capture")
+    schedule = build_schedule(records, speedup=args.speedup, max_idle=args.max_idle)
+
+    server = None
+    if args.target:
+        base_url = args.target.rstrip("/")
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+        os.environ["MOCK_MODELS"] = "true"
+        if args.llm_latency is not None:
+            os.environ["MOCK_LLM_LATENCY_SECONDS"] = str(args.llm_latency)
+        if args.embedding_latency is not None:
+            os.environ["MOCK_EMBEDDING_LATENCY_SECONDS"] = str(args.embedding_latency)
+        # The replay must not be captured again
+        os.environ.pop("TRAFFIC_CAPTURE_PATH", None)
+        base_url, server = start_server()
+
+    if args.warmup_questions:
+        with open(args.warmup_questions, "r") as f:
+            warmup_questions = json.load(f)
+    elif server is not None:
+        from agent_setup import get_warmup_questions
+        warmup_questions = get_warmup_questions()
+    else:
+        from prompts import warmup_questions
+
+    print(f"Replaying {len(records)} requests against {base_url} at {args.speedup}x")
+    try:
+        report = run_replay(base_url, schedule, warmup_questions, timeout=args.timeout)
+    finally:
+        if server is not None:
+            server.should_exit = True
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,80 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Set, Union
 from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.core import Document, VectorStoreIndex, StorageContext
+from llama_index.core import Document, VectorStoreIndex, StorageContext, load_index_from_storage
 from llama_index.vector_stores.qdrant import QdrantVectorStore
 from llama_parse import LlamaParse
 from llama_index.core import SimpleDirectoryReader
+from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.vector_stores import FilterCondition, FilterOperator, MetadataFilter, MetadataFilters
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance
+from qdrant_client.models import (
+    VectorParams, Distance, Filter, FieldCondition, FilterSelector, IsEmptyCondition, MatchAny, MatchValue,
+    PayloadField, PayloadSchemaType, PointStruct, Range
+)
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import json
+import threading
 import uuid
 import os
+from tracing import trace_span
+from near_duplicates import SOURCE_FIELDS, forget_signatures
+from qdrant_balancer import build_balanced_client
+from shard_router import ShardRouter, load_shard_families
+from sqlite_store import DEFAULT_DB_PATH, SQLiteDatabase, SQLiteDocumentStore, SQLiteIndexStore, migrate_json_storage
+
+# Payload fields used for filtered retrieval; indexed so filters are applied inside the HNSW search
+FILTERABLE_PAYLOAD_FIELDS = ["metadata.content_type", "metadata.tags", "metadata.file_name", "metadata.dedup_id"]
+# Metadata that is stored for retrieval bookkeeping and must not be embedded or sent to the LLM
+NON_CONTENT_METADATA_KEYS = ["window", "parent_id", "dedup_id", "sources", "ingest_version"]
+# OpenAI embedding dimension
+VECTOR_SIZE = 1536
+# Ingestion run that wrote a point; queries only see points of published runs
+INGEST_VERSION_METADATA_KEY = "ingest_version"
+
+
+# Namespace of the deterministic point IDs
+POINT_ID_NAMESPACE = uuid.UUID("6f1d3c2a-8b4e-5d7f-9a0b-1c2d3e4f5a6b")
+
+
+def chunk_identity(text: str, metadata: Dict[str, Any]) -> str:
+    """Return what identifies a chunk: its file, page, parent window and text."""
+    return "\x1f".join([
+        str(metadata.get('file_name') or ""),
+        str(metadata.get('page_label') or ""),
+        str(metadata.get('parent_id') or ""),
+        text
+    ])
+
+
+def chunk_point_id(text: str, metadata: Dict[str, Any]) -> str:
+    """Deterministic point ID of a chunk, so ingesting the same chunk again overwrites its point."""
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, chunk_identity(text, metadata)))
+
+
+def ingest_version_filters(max_ingest_version: int) -> MetadataFilters:
+    """Return llama-index filters for points written up to an ingestion version.
+
+    Points written before versioning have no version and are always visible.
+    The llama-index vector store keeps metadata at the top level of the payload,
+    VectorStoreManager.insert_documents nests it under ``metadata``.
+    """
+    return MetadataFilters(
+        filters=[
+            MetadataFilter(key=INGEST_VERSION_METADATA_KEY, value=max_ingest_version, operator=FilterOperator.LTE),
+            MetadataFilter(key=f"metadata.{INGEST_VERSION_METADATA_KEY}", value=max_ingest_version,
+                           operator=FilterOperator.LTE),
+            MetadataFilters(
+                filters=[
+                    MetadataFilter(key=INGEST_VERSION_METADATA_KEY, value=None, operator=FilterOperator.IS_EMPTY),
+                    MetadataFilter(key=f"metadata.{INGEST_VERSION_METADATA_KEY}", value=None,
+                                   operator=FilterOperator.IS_EMPTY),
+                ],
+                condition=FilterCondition.AND
+            ),
+        ],
+        condition=FilterCondition.OR
+    )
 
 class VectorStoreManager:
     def __init__(
@@ -16,7 +83,11 @@ class VectorStoreManager:
         qdrant_api_key: Optional[str] = None,
         collection_name: str = "FBL_RAG",  # Changed default collection name as requested
         local_path: Optional[str] = None,
-        llama_cloud_api_key: Optional[str] = None
+        llama_cloud_api_key: Optional[str] = None,
+        storage_db_path: Optional[str] = None,
+        qdrant_read_urls: Optional[List[str]] = None,
+        client: Optional[Any] = None,
+        publish_interrupted_run: bool = True
     ):
         """Initialize the VectorStoreManager with necessary credentials.
 
@@ -26,9 +97,33 @@ class VectorStoreManager:
             collection_name: Name of the collection in Qdrant
             local_path: Path to store Qdrant data locally (if not using cloud)
             llama_cloud_api_key: Optional API key for LlamaParse
+            storage_db_path: SQLite database for the docstore, index store and ingestion ledger
+            qdrant_read_urls: Further Qdrant nodes that serve reads, defaults to QDRANT_READ_URLS
+            client: Optional prebuilt Qdrant client, e.g. a LoadBalancedQdrantClient
+            publish_interrupted_run: Publish a run that wrote points but never finished; tools that
+                may run next to the ingestion worker pass False, so a run in progress is left alone
         """
+        if qdrant_read_urls is None:
+            qdrant_read_urls = [url.strip() for url in os.getenv("QDRANT_READ_URLS", "").split(",") if url.strip()]
+
         # Set up Qdrant client based on whether we're using cloud or local
-        if qdrant_url and qdrant_api_key:
+        if client is not None:
+            self.client = client
+            self.using_cloud = qdrant_url is not None
+        elif qdrant_url and qdrant_api_key and qdrant_read_urls:
+            # Reads are balanced over the nodes, writes go to qdrant_url
+            self.client = build_balanced_client(
+                qdrant_url,
+                qdrant_api_key,
+                qdrant_read_urls,
+                read_from_primary=os.getenv("QDRANT_READ_FROM_PRIMARY", "true").lower() == "true",
+                cooldown_seconds=float(os.getenv("QDRANT_FAILURE_COOLDOWN_SECONDS", "5")),
+                health_check_interval=float(os.getenv("QDRANT_HEALTH_CHECK_INTERVAL", "5")),
+                explore_probability=float(os.getenv("QDRANT_READ_EXPLORE_PROBABILITY", "0.02")),
+                stale_seconds=float(os.getenv("QDRANT_LATENCY_STALE_SECONDS", "30"))
+            )
+            self.using_cloud = True
+        elif qdrant_url and qdrant_api_key:
             # Cloud Qdrant
             self.client = QdrantClient(
                 url=qdrant_url,
@@ -45,6 +140,10 @@ class VectorStoreManager:
         
         # Ensure the collection exists before proceeding
         self._ensure_collection_exists()
+
+        # 'document' stores each source document (or family) in its own collection and routes
+        # queries to the best matching shards; 'none' keeps everything in one collection
+        self.sharding_mode = os.getenv("SHARDING_MODE", "none").lower()
         
         # Initialize vector store with the client
         self.vector_store = QdrantVectorStore(
@@ -52,9 +151,49 @@ class VectorStoreManager:
             collection_name=collection_name
         )
         
-        self.storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
+        # Docstore, index store and ingestion ledger live in one SQLite database with
+        # incremental, transactional writes; the legacy JSON files are imported once
+        self.database = SQLiteDatabase(storage_db_path or os.getenv("STORAGE_DB_PATH", DEFAULT_DB_PATH))
+        migrate_json_storage(self.database)
+        self.docstore = SQLiteDocumentStore(self.database)
+        self.storage_context = StorageContext.from_defaults(
+            vector_store=self.vector_store,
+            docstore=self.docstore,
+            index_store=SQLiteIndexStore(self.database)
+        )
         self.embed_model = OpenAIEmbedding()
+
+        self.router = None
+        if self.sharding_mode == "document":
+            self.router = ShardRouter(
+                self.database,
+                families=load_shard_families(),
+                max_shards=int(os.getenv("ROUTER_MAX_SHARDS", "3"))
+            )
+            self._search_pool = ThreadPoolExecutor(
+                max_workers=int(os.getenv("SHARD_SEARCH_WORKERS", "8")),
+                thread_name_prefix="shard-search"
+            )
         
+        # Points written by an ingestion run carry its version and stay invisible to queries
+        # until the run is published, so in-flight requests keep a consistent view
+        self._ingest_lock = threading.Lock()
+        self.pending_ingest_version: Optional[int] = None
+        self._pending_writes = 0
+        written = int(self.database.get_meta("ingest_version_written") or 0)
+        self.published_ingest_version = int(self.database.get_meta("ingest_version") or 0)
+        # Highest version any point carries; searches up to it need no version filter
+        self.written_ingest_version = max(written, self.published_ingest_version)
+        # Changed files re-ingested by the pending run; their older points are deleted when it is published
+        self._replaced_files: Set[str] = set()
+        if publish_interrupted_run and written > self.published_ingest_version:
+            # A run that wrote points but stopped before publishing; its files are not in the
+            # ledger and will be ingested again, so publishing only re-exposes complete chunks
+            self.published_ingest_version = written
+            self.database.set_meta("ingest_version", str(written))
+            self._delete_replaced_points(json.loads(self.database.get_meta("ingest_replaced_files") or "[]"), written)
+            self.database.set_meta("ingest_replaced_files", "[]")
+
         # Initialize LlamaParse if API key is provided
         if llama_cloud_api_key:
             self.parser = LlamaParse(
@@ -63,27 +202,53 @@ class VectorStoreManager:
                 verbose=True
             )
 
-    def _ensure_collection_exists(self):
-        """Ensure the Qdrant collection exists, create it if it doesn't."""
+    def _ensure_collection_exists(self, collection_name: Optional[str] = None):
+        """Ensure the Qdrant collection exists, create it if it doesn't.
+
+        Args:
+            collection_name: Collection to check, defaults to the main collection
+        """
+        collection_name = collection_name or self.collection_name
         try:
             # Check if the collection exists by getting all collections
             collections = self.client.get_collections().collections
-            collection_exists = any(c.name == self.collection_name for c in collections)
+            collection_exists = any(c.name == collection_name for c in collections)
             
             if not collection_exists:
-                print(f"Collection '{self.collection_name}' not found. Creating now...")
+                print(f"Collection '{collection_name}' not found. Creating now...")
+                # On a Qdrant cluster the collection can be split into shards and replicated across nodes
+                cluster_config = {}
+                if self.using_cloud:
+                    for option in ("shard_number", "replication_factor", "write_consistency_factor"):
+                        value = os.getenv(f"QDRANT_{option.upper()}")
+                        if value:
+                            cluster_config[option] = int(value)
                 # Create the collection with appropriate settings for OpenAI embeddings
-                vector_size = 1536  # OpenAI embedding dimension
                 self.client.create_collection(
-                    collection_name=self.collection_name,
+                    collection_name=collection_name,
                     vectors_config=VectorParams(
-                        size=vector_size,
+                        size=VECTOR_SIZE,
                         distance=Distance.COSINE
-                    )
+                    ),
+                    **cluster_config
                 )
-                print(f"Successfully created collection '{self.collection_name}'")
+                print(f"Successfully created collection '{collection_name}'")
             else:
-                print(f"Using existing collection '{self.collection_name}'")
+                print(f"Using existing collection '{collection_name}'")
+
+            # Payload indexes only take effect on a Qdrant server
+            if self.using_cloud:
+                for field_name in FILTERABLE_PAYLOAD_FIELDS:
+                    self.client.create_payload_index(
+                        collection_name=collection_name,
+                        field_name=field_name,
+                        field_schema=PayloadSchemaType.KEYWORD
+                    )
+                self.client.create_payload_index(
+                    collection_name=collection_name,
+                    field_name=f"metadata.{INGEST_VERSION_METADATA_KEY}",
+                    field_schema=PayloadSchemaType.INTEGER
+                )
         except Exception as e:
             print(f"Error checking/creating collection: {e}")
             raise
@@ -106,9 +271,212 @@ class VectorStoreManager:
             file_extractor=file_extractor
         ).load_data()
 
+    def begin_ingest(self) -> int:
+        """Start an ingestion run; points inserted until end_ingest() are tagged with its version.
+
+        Returns:
+            Version of the run
+        """
+        with self._ingest_lock:
+            if self.pending_ingest_version is not None:
+                raise RuntimeError(f"Ingestion run {self.pending_ingest_version} is still in progress")
+            self.pending_ingest_version = self.published_ingest_version + 1
+            self._pending_writes = 0
+            self._replaced_files = set()
+            self.database.set_meta("ingest_replaced_files", "[]")
+            return self.pending_ingest_version
+
+    def end_ingest(self, version: int) -> bool:
+        """Finish an ingestion run and publish its version if it wrote any points.
+
+        Args:
+            version: Version returned by begin_ingest()
+
+        Returns:
+            True if the version was published
+        """
+        with self._ingest_lock:
+            if self.pending_ingest_version != version:
+                raise RuntimeError(f"Ingestion run {version} is not in progress")
+            published = self._pending_writes > 0
+            if published:
+                self.database.set_meta("ingest_version", str(version))
+                self.published_ingest_version = version
+            replaced_files, self._replaced_files = sorted(self._replaced_files), set()
+            self.pending_ingest_version = None
+            self._pending_writes = 0
+        if published:
+            self._delete_replaced_points(replaced_files, version)
+        self.database.set_meta("ingest_replaced_files", "[]")
+        return published
+
+    def replace_file_on_publish(self, file_name: str) -> None:
+        """Delete the points older ingestion runs wrote for a file once the pending run is published.
+
+        Call it after the pending run has completely ingested the new content of the file.
+
+        Args:
+            file_name: file_name metadata of the file's chunks
+        """
+        with self._ingest_lock:
+            if self.pending_ingest_version is None:
+                raise RuntimeError("No ingestion run is in progress")
+            self._replaced_files.add(file_name)
+            # Kept in the database so a restart that publishes an interrupted run still deletes them
+            self.database.set_meta("ingest_replaced_files", json.dumps(sorted(self._replaced_files)))
+
+    def discard_file_points(self, file_name: str) -> int:
+        """Delete the points the pending ingestion run wrote for a file, so publishing it leaves the file out.
+
+        Call it when the file failed part-way; it is ingested again by the next run.
+
+        Args:
+            file_name: file_name metadata of the file's chunks
+
+        Returns:
+            Number of deleted points
+        """
+        version = self.pending_ingest_version
+        if version is None:
+            raise RuntimeError("No ingestion run is in progress")
+        pending_filter = Filter(must=[
+            FieldCondition(key="metadata.file_name", match=MatchValue(value=file_name)),
+            FieldCondition(key=f"metadata.{INGEST_VERSION_METADATA_KEY}", match=MatchValue(value=version))
+        ])
+        deleted, dedup_ids = 0, set()
+        for collection_name in self.collection_names():
+            dedup_ids |= self._scroll_dedup_ids(collection_name, pending_filter)
+            deleted += self.client.count(collection_name, count_filter=pending_filter, exact=True).count
+            self.client.delete(collection_name, points_selector=FilterSelector(filter=pending_filter), wait=True)
+        forget_signatures(self.database, dedup_ids)
+        with self._ingest_lock:
+            self._pending_writes = max(self._pending_writes - deleted, 0)
+        return deleted
+
+    def _scroll_dedup_ids(self, collection_name: str, scroll_filter: Filter) -> Set[str]:
+        """Return the dedup_ids of the points matching a filter."""
+        dedup_ids, offset = set(), None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name, scroll_filter=scroll_filter, limit=1000, offset=offset, with_payload=True
+            )
+            dedup_ids.update(
+                record.payload['metadata']['dedup_id'] for record in records
+                if (record.payload or {}).get('metadata', {}).get('dedup_id')
+            )
+            if offset is None:
+                return dedup_ids
+
+    def file_dedup_ids(self, file_name: str) -> Set[str]:
+        """Return the dedup_ids of the stored chunks of a file."""
+        file_filter = Filter(must=[FieldCondition(key="metadata.file_name", match=MatchValue(value=file_name))])
+        dedup_ids = set()
+        for collection_name in self.collection_names():
+            dedup_ids |= self._scroll_dedup_ids(collection_name, file_filter)
+        return dedup_ids
+
+    def _delete_replaced_points(self, file_names: List[str], version: int) -> None:
+        """Delete the points of re-ingested files written before an ingestion version."""
+        version_condition = FieldCondition(key=f"metadata.{INGEST_VERSION_METADATA_KEY}", range=Range(gte=version))
+        for file_name in file_names:
+            file_condition = FieldCondition(key="metadata.file_name", match=MatchValue(value=file_name))
+            old_filter = Filter(must=[file_condition], must_not=[version_condition])
+            try:
+                removed_dedup_ids = set()
+                for collection_name in self.collection_names():
+                    # Chunks other files were collapsed into are kept for them
+                    rehomed = self.rehome_shared_chunks(collection_name, old_filter, {file_name})
+                    if rehomed:
+                        print(f"Moved {rehomed} points of the previous version of {file_name} to the other files they stand for")
+                    old_ids = self._scroll_dedup_ids(collection_name, old_filter)
+                    # Unchanged chunks were stored again under the same dedup_id
+                    current_ids = self._scroll_dedup_ids(collection_name, Filter(must=[file_condition, version_condition]))
+                    deleted = self.client.count(collection_name, count_filter=old_filter, exact=True).count
+                    self.client.delete(collection_name, points_selector=FilterSelector(filter=old_filter), wait=True)
+                    removed_dedup_ids |= old_ids - current_ids
+                    if deleted:
+                        print(f"Deleted {deleted} points of the previous version of {file_name} from '{collection_name}'")
+                # Otherwise new chunks would be collapsed into chunks that no longer exist
+                forget_signatures(self.database, removed_dedup_ids)
+                self._delete_replaced_index_nodes(file_name, version)
+            except Exception as e:
+                print(f"Error deleting old points of {file_name}: {e}")
+
+    def rehome_shared_chunks(self, collection_name: str, chunk_filter: Filter, file_names: Set[str]) -> int:
+        """Remove files from the sources of the matching chunks, so the chunks survive their deletion.
+
+        A chunk that near-duplicate detection collapsed other files into is stored under
+        the first file only. Each matching chunk whose sources name other files gets
+        those sources and takes the file, page and section of the first of them.
+
+        Args:
+            collection_name: Collection of the chunks
+            chunk_filter: Chunk points about to be deleted
+            file_names: Files whose chunks are deleted
+
+        Returns:
+            Number of points that were moved to another file and no longer match the filter
+        """
+        updates: Dict[str, Dict[str, Any]] = {}
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name, scroll_filter=chunk_filter, limit=1000, offset=offset, with_payload=True
+            )
+            for record in records:
+                sources = ((record.payload or {}).get('metadata') or {}).get('sources') or []
+                remaining = [source for source in sources if source.get('file_name') not in file_names]
+                if remaining:
+                    update = updates.setdefault(json.dumps(remaining, sort_keys=True), {'sources': remaining, 'ids': []})
+                    update['ids'].append(record.id)
+            if offset is None:
+                break
+        for update in updates.values():
+            remaining = update['sources']
+            payload = {field: remaining[0].get(field, "") for field in SOURCE_FIELDS}
+            payload['sources'] = remaining
+            self.client.set_payload(collection_name, payload=payload, points=update['ids'], key="metadata")
+        return sum(len(update['ids']) for update in updates.values())
+
+    def _delete_replaced_index_nodes(self, file_name: str, version: int) -> None:
+        """Delete the llama-index nodes of a re-ingested file's chunks written before an ingestion version.
+
+        create_index() stores a node per chunk in the main collection, with the chunk's
+        metadata at the top level of the payload, and the chunk's hash in the docstore.
+        """
+        old_filter = Filter(
+            must=[FieldCondition(key="file_name", match=MatchValue(value=file_name))],
+            must_not=[FieldCondition(key=INGEST_VERSION_METADATA_KEY, range=Range(gte=version))]
+        )
+        ref_doc_ids, offset = set(), None
+        while True:
+            records, offset = self.client.scroll(
+                self.collection_name, scroll_filter=old_filter, limit=1000, offset=offset, with_payload=["doc_id"]
+            )
+            ref_doc_ids.update(record.payload['doc_id'] for record in records if (record.payload or {}).get('doc_id'))
+            if offset is None:
+                break
+        if not ref_doc_ids:
+            return
+        self.client.delete(self.collection_name, points_selector=FilterSelector(filter=old_filter), wait=True)
+        for ref_doc_id in ref_doc_ids:
+            # Without its hash, create_index() adds the chunk again should it come back
+            self.docstore.delete_document(ref_doc_id, raise_error=False)
+        print(f"Deleted the index nodes of {len(ref_doc_ids)} chunks of the previous version of {file_name}")
+
+    def publish_ingest_version(self, version: int) -> None:
+        """Make points written up to an ingestion version visible, e.g. after a snapshot import."""
+        with self._ingest_lock:
+            if version > self.published_ingest_version:
+                self.database.set_meta("ingest_version", str(version))
+                self.published_ingest_version = version
+                self.written_ingest_version = max(self.written_ingest_version, version)
+
     def insert_documents(self, documents: List[Document]) -> Dict[str, Any]:
         """Insert documents into Qdrant vector store.
 
+        During an ingestion run the points are tagged with its version.
+
         Args:
             documents: List of Document objects to insert
 
@@ -117,6 +485,13 @@ class VectorStoreManager:
         """
         success_count = 0
         error_count = 0
+        # Vectors and file names of the inserted chunks per shard, for the router's centroids
+        shard_vectors: Dict[str, List[List[float]]] = {}
+        shard_files: Dict[str, set] = {}
+        ingest_version = self.pending_ingest_version
+        if ingest_version is not None:
+            self.database.set_meta("ingest_version_written", str(ingest_version))
+            self.written_ingest_version = ingest_version
 
         try:
             # Prepare documents with embeddings
@@ -130,15 +505,26 @@ class VectorStoreManager:
                         'text': doc.text, 
                         'metadata': doc.metadata if doc.metadata else {}
                     }
+                    if ingest_version is not None:
+                        payload['metadata'] = {**payload['metadata'], INGEST_VERSION_METADATA_KEY: ingest_version}
+
+                    collection_name = self.collection_for_metadata(payload['metadata'])
+                    if self.router is not None:
+                        file_name = payload['metadata'].get('file_name')
+                        shard = self.router.shard_for_file(file_name)
+                        if shard not in shard_vectors:
+                            self._ensure_collection_exists(collection_name)
+                        shard_vectors.setdefault(shard, []).append(embedding)
+                        shard_files.setdefault(shard, set()).update([file_name] if file_name else [])
                     
                     # Insert into Qdrant
                     self.client.upsert(
-                        collection_name=self.collection_name,
-                        points=[{
-                            'id': str(uuid.uuid4()),
-                            'vector': embedding,
-                            'payload': payload
-                        }]
+                        collection_name=collection_name,
+                        points=[PointStruct(
+                            id=chunk_point_id(doc.text, payload['metadata']),
+                            vector=embedding,
+                            payload=payload
+                        )]
                     )
                     success_count += 1
                 except Exception as e:
@@ -148,6 +534,12 @@ class VectorStoreManager:
             print(f"Batch insertion error: {e}")
             error_count += len(documents) - success_count
 
+        for shard, vectors in shard_vectors.items():
+            self.router.add_vectors(shard, vectors, shard_files[shard])
+        if ingest_version is not None:
+            with self._ingest_lock:
+                self._pending_writes += success_count
+
         return {
             'total_documents': len(documents),
             'successful_insertions': success_count,
@@ -155,7 +547,11 @@ class VectorStoreManager:
         }
 
     def create_index(self, documents: List[Document]) -> VectorStoreIndex:
-        """Create a vector store index from documents.
+        """Load the vector store index and add the documents it does not contain yet.
+
+        Documents are matched by content hash against the docstore, so only new
+        or changed documents are embedded and written. Every write is committed
+        to SQLite right away; there is no separate persist step.
 
         Args:
             documents: List of Document objects
@@ -163,28 +559,65 @@ class VectorStoreManager:
         Returns:
             VectorStoreIndex object
         """
-        # Use the existing storage context to maintain persistence
-        index = VectorStoreIndex.from_documents(
-            documents,
-            storage_context=self.storage_context,
-            embed_model=self.embed_model
-        )
-        
-        # Persist the storage context
-        self.storage_context.persist()
-        
+        index_structs = self.storage_context.index_store.index_structs()
+        if index_structs:
+            index = load_index_from_storage(
+                self.storage_context,
+                index_id=index_structs[-1].index_id,
+                embed_model=self.embed_model
+            )
+        else:
+            index = VectorStoreIndex([], storage_context=self.storage_context, embed_model=self.embed_model)
+
+        new_documents = [doc for doc in documents if not self.docstore.find_doc_ids_by_hash(doc.hash)]
+        print(f"Index has {len(documents) - len(new_documents)} of {len(documents)} documents, "
+              f"adding {len(new_documents)}")
+        for doc in new_documents:
+            index.insert(doc)
         return index
 
+    def shard_collection_name(self, shard: str) -> str:
+        """Return the Qdrant collection of a shard."""
+        return f"{self.collection_name}__{shard}"
+
+    def collection_for_metadata(self, metadata: Dict[str, Any]) -> str:
+        """Return the collection a chunk with this metadata is stored in."""
+        if self.router is None:
+            return self.collection_name
+        return self.shard_collection_name(self.router.shard_for_file(metadata.get('file_name')))
+
+    def add_chunk_sources(self, collection_name: str, dedup_id: str, sources: List[Dict[str, Any]]) -> None:
+        """Add source locations to every point of a stored chunk collapsed by near-duplicate detection.
+
+        Args:
+            collection_name: Collection of the stored chunk
+            dedup_id: dedup_id of the stored chunk (shared by all its sentence window units)
+            sources: Locations of the collapsed duplicates
+        """
+        chunk_filter = Filter(must=[FieldCondition(key="metadata.dedup_id", match=MatchValue(value=dedup_id))])
+        records = self.client.scroll(collection_name, scroll_filter=chunk_filter, limit=1, with_payload=True)[0]
+        if not records:
+            return
+        existing = records[0].payload.get('metadata', {}).get('sources', [])
+        merged = existing + [source for source in sources if source not in existing]
+        self.client.set_payload(collection_name, payload={'sources': merged}, points=chunk_filter, key="metadata")
+
+    def collection_names(self) -> List[str]:
+        """Return the main collection and, with sharding enabled, every shard collection."""
+        names = [self.collection_name]
+        if self.router is not None:
+            names += [self.shard_collection_name(shard) for shard in self.router.shards]
+        return names
+
     def get_document_count(self) -> int:
         """Get the total number of documents in the vector store.
 
         Returns:
             Total number of documents
         """
-        # Get collection info from Qdrant to determine document count
+        # vectors_count is approximate and None in local mode, so count the points exactly
         try:
-            collection_info = self.client.get_collection(self.collection_name)
-            return collection_info.vectors_count
+            return sum(self.client.count(name, exact=True).count for name in self.collection_names())
         except Exception as e:
             print(f"Error getting document count: {e}")
             return 0
@@ -194,12 +627,14 @@ class VectorStoreManager:
         # Qdrant doesn't have a direct method to retrieve all documents
         # So we'll use a full scroll search with a high limit
         try:
-            records = self.client.scroll(
-                collection_name=self.collection_name,
-                limit=10000,  # Adjust this based on your expected collection size
-                with_payload=True,
-                with_vectors=False  # We don't need the vectors for document retrieval
-            )[0]  # The scroll method returns a tuple (records, next_page_offset)
+            records = []
+            for collection_name in self.collection_names():
+                records += self.client.scroll(
+                    collection_name=collection_name,
+                    limit=10000,  # Adjust this based on your expected collection size
+                    with_payload=True,
+                    with_vectors=False  # We don't need the vectors for document retrieval
+                )[0]  # The scroll method returns a tuple (records, next_page_offset)
             
             documents = []
             for record in records:
@@ -208,7 +643,9 @@ class VectorStoreManager:
                     # Convert Qdrant payload back to a Document object
                     documents.append(Document(
                         text=payload.get('text', ''), 
-                        metadata=payload.get('metadata', {})
+                        metadata=payload.get('metadata', {}),
+                        excluded_embed_metadata_keys=NON_CONTENT_METADATA_KEYS,
+                        excluded_llm_metadata_keys=NON_CONTENT_METADATA_KEYS
                     ))
             
             return documents
@@ -216,54 +653,158 @@ class VectorStoreManager:
             print(f"Error loading documents from store: {e}")
             return []
 
-    def hybrid_search(self, query: str, content_type: Optional[str] = None, top_k: int = 5) -> List[Document]:
+    def _build_filter(
+        self,
+        content_types: Optional[List[str]] = None,
+        tags: Optional[List[str]] = None,
+        max_ingest_version: Optional[int] = None,
+        file_names: Optional[List[str]] = None
+    ) -> Optional[Filter]:
+        """Build a Qdrant payload filter from classification tags.
+
+        Args:
+            content_types: Only match chunks whose content_type is one of these
+            tags: Only match chunks carrying at least one of these tags
+            max_ingest_version: Only match chunks written up to this ingestion version
+            file_names: Only match chunks of these source files
+
+        Returns:
+            Qdrant Filter, or None when no condition is given
+        """
+        conditions = []
+        if content_types:
+            conditions.append(FieldCondition(key="metadata.content_type", match=MatchAny(any=list(content_types))))
+        if tags:
+            conditions.append(FieldCondition(key="metadata.tags", match=MatchAny(any=list(tags))))
+        if file_names:
+            conditions.append(FieldCondition(key="metadata.file_name", match=MatchAny(any=list(file_names))))
+        # Without newer points the filter matches everything, and Qdrant answers faster without it
+        if max_ingest_version is not None and max_ingest_version < self.written_ingest_version:
+            version_key = f"metadata.{INGEST_VERSION_METADATA_KEY}"
+            conditions.append(Filter(should=[
+                FieldCondition(key=version_key, range=Range(lte=max_ingest_version)),
+                IsEmptyCondition(is_empty=PayloadField(key=version_key))
+            ]))
+        return Filter(must=conditions) if conditions else None
+
+    def _search_collection(
+        self,
+        collection_name: str,
+        query_embedding: List[float],
+        top_k: int,
+        query_filter: Optional[Filter],
+        offset: int = 0
+    ) -> List[Any]:
+        """Run one vector search and record it as a span of the current trace."""
+        with trace_span("qdrant_search", collection=collection_name, top_k=top_k) as span:
+            search_results = self.client.search(
+                collection_name=collection_name,
+                query_vector=query_embedding,
+                limit=top_k,
+                offset=offset,
+                query_filter=query_filter,
+                with_payload=True
+            )
+            if span is not None:
+                span.attributes['scores'] = [round(result.score, 4) for result in search_results]
+        return search_results
+
+    def search_nodes(
+        self,
+        query_embedding: List[float],
+        top_k: int = 5,
+        content_types: Optional[List[str]] = None,
+        tags: Optional[List[str]] = None,
+        query_str: Optional[str] = None,
+        max_ingest_version: Optional[int] = None,
+        file_names: Optional[List[str]] = None,
+        offset: int = 0
+    ) -> List[NodeWithScore]:
+        """Search the collection with an optional tag filter applied before the vector search.
+
+        With sharding enabled the router picks the best matching shards, they
+        are searched concurrently and the results are merged by score.
+
+        Args:
+            query_embedding: Embedding of the query
+            top_k: Number of results to return
+            content_types: Optional content types to restrict the search to
+            tags: Optional tags to restrict the search to
+            query_str: Optional query text, used by the router's keyword hints
+            max_ingest_version: Optional ingestion version; newer chunks are not matched
+            file_names: Optional source files to restrict the search to
+            offset: Number of best matches to skip, for pagination
+
+        Returns:
+            List of NodeWithScore objects, best match first
+        """
+        query_filter = self._build_filter(content_types, tags, max_ingest_version, file_names)
+        routed_shards = self.router.route(query_embedding, query_str) if self.router is not None else []
+        if not routed_shards:
+            search_results = self._search_collection(
+                self.collection_name, query_embedding, top_k, query_filter, offset=offset
+            )
+        else:
+            with trace_span("shard_fanout", shards=[shard for shard, _ in routed_shards],
+                            route_scores=[round(score, 4) for _, score in routed_shards]):
+                # Copy the context into each worker so the per-shard searches nest in the trace
+                futures = [
+                    self._search_pool.submit(
+                        contextvars.copy_context().run, self._search_collection,
+                        self.shard_collection_name(shard), query_embedding, offset + top_k, query_filter
+                    )
+                    for shard, _ in routed_shards
+                ]
+                # All shards hold the same embeddings, so cosine scores are directly comparable
+                search_results = sorted(
+                    (result for future in futures for result in future.result()),
+                    key=lambda result: result.score,
+                    reverse=True
+                )[offset:offset + top_k]
+
+        nodes = []
+        for result in search_results:
+            if result.payload and 'text' in result.payload:
+                node = TextNode(
+                    id_=str(result.id),
+                    text=result.payload.get('text', ''),
+                    metadata=result.payload.get('metadata', {}),
+                    excluded_embed_metadata_keys=NON_CONTENT_METADATA_KEYS,
+                    excluded_llm_metadata_keys=NON_CONTENT_METADATA_KEYS
+                )
+                nodes.append(NodeWithScore(node=node, score=result.score))
+        return nodes
+
+    def hybrid_search(
+        self,
+        query: str,
+        content_type: Optional[Union[str, List[str]]] = None,
+        top_k: int = 5,
+        tags: Optional[List[str]] = None
+    ) -> List[Document]:
         """Perform hybrid search combining semantic and keyword search with metadata filtering.
         
         Args:
             query: Search query
-            content_type: Optional filter for specific content types
+            content_type: Optional filter for one or more content types
             top_k: Number of results to return
+            tags: Optional filter for classification tags
             
         Returns:
             List of relevant Document objects
         """
         # Generate query embedding
         query_embedding = self.embed_model.get_text_embedding(query)
-        
-        # Set up metadata filter if content_type is specified
-        filter_conditions = None
-        if content_type:
-            filter_conditions = {
-                "must": [
-                    {
-                        "key": "metadata.content_type",
-                        "match": {
-                            "value": content_type
-                        }
-                    }
-                ]
-            }
+        content_types = [content_type] if isinstance(content_type, str) else content_type
         
         try:
-            # Perform vector search in Qdrant
-            search_results = self.client.search(
-                collection_name=self.collection_name,
-                query_vector=query_embedding,
-                limit=top_k,
-                filter=filter_conditions,
-                with_payload=True
+            # Perform filtered vector search in Qdrant
+            nodes = self.search_nodes(
+                query_embedding, top_k=top_k, content_types=content_types, tags=tags, query_str=query
             )
             
             # Convert search results to Document objects
-            documents = []
-            for result in search_results:
-                if result.payload and 'text' in result.payload:
-                    documents.append(Document(
-                        text=result.payload.get('text', ''),
-                        metadata=result.payload.get('metadata', {})
-                    ))
-            
-            return documents
+            return [Document(text=n.node.text, metadata=n.node.metadata) for n in nodes]
         except Exception as e:
             print(f"Error performing hybrid search: {e}")
-            return []
\ No newline at end of file
+            return []